@@ -0,0 +1,67 @@
+"""
+Benchmarks for L{twisted.enterprise.adbapi}: many small inserts into a
+sqlite3 database, one transaction each with L{ConnectionPool.runOperation}
+and batched with L{ConnectionPool.runBatchedOperation}.
+"""
+
+import os, sys, tempfile, time
+
+from twisted.enterprise import adbapi
+from twisted.internet import defer, reactor
+
+OPERATIONS = 5000
+
+INSERT = "INSERT INTO simple (x, y) VALUES (?, ?)"
+
+
+def makePool(path):
+    # Only one writer can hold a sqlite3 database at a time.  The pool
+    # closes its connections from the reactor thread, which sqlite3 refuses
+    # to do unless told otherwise.
+    return adbapi.ConnectionPool('sqlite3', path, cp_min=1, cp_max=1,
+                                 check_same_thread=False)
+
+
+@defer.inlineCallbacks
+def benchmark(label, submit):
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    pool = makePool(path)
+    pool.start()
+    try:
+        yield pool.runOperation(
+            "CREATE TABLE simple (x integer, y varchar(20))")
+        before = time.time()
+        yield defer.gatherResults([
+            submit(pool, INSERT, (i, 'row %d' % (i,)))
+            for i in xrange(OPERATIONS)])
+        after = time.time()
+        rows = yield pool.runQuery("SELECT COUNT(*) FROM simple")
+        assert rows[0][0] == OPERATIONS, rows
+        print '%-25s %8d operations/sec' % (
+            label, OPERATIONS / (after - before))
+    finally:
+        pool.close()
+        os.unlink(path)
+
+
+def runOperation(pool, sql, params):
+    return pool.runOperation(sql, params)
+
+
+def runBatchedOperation(pool, sql, params):
+    return pool.runBatchedOperation(sql, params)
+
+
+@defer.inlineCallbacks
+def main():
+    try:
+        yield benchmark('runOperation', runOperation)
+        yield benchmark('runBatchedOperation', runBatchedOperation)
+    except:
+        defer.fail().printTraceback(sys.stdout)
+    reactor.stop()
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
@@ -0,0 +1,89 @@
+"""
+Benchmarks for L{twisted.protocols.amp}: parsing boxes, and sending a large
+payload as an L{amp.Stream} argument over a local TCP connection.
+"""
+
+import sys, time
+
+from timer import timeit
+
+from twisted.internet import defer, protocol, reactor
+from twisted.protocols import amp, basic
+from twisted.test.proto_helpers import StringTransport
+
+BOXES = 2000
+ITERATIONS = 20
+PAYLOAD = 'x' * (32 * 1024 * 1024)
+
+
+class Discard(object):
+    def startReceivingBoxes(self, sender):
+        pass
+
+    def ampBoxReceived(self, box):
+        pass
+
+
+def parse(data):
+    proto = amp.BinaryBoxProtocol(Discard())
+    proto.makeConnection(StringTransport())
+    proto.dataReceived(data)
+
+
+def parseStrings(data):
+    # The previous parser: one string at a time through the state machine.
+    proto = amp.BinaryBoxProtocol(Discard())
+    proto.makeConnection(StringTransport())
+    basic.Int16StringReceiver.dataReceived(proto, data)
+
+
+def report(label, func, *args):
+    elapsed = timeit(func, ITERATIONS, *args)
+    print '%-30s %8d boxes/sec' % (label, ITERATIONS * BOXES / elapsed)
+
+
+class Upload(amp.Command):
+    arguments = [('data', amp.Stream())]
+    response = [('size', amp.Integer())]
+
+
+class Sink(amp.AMP):
+    def upload(self, data):
+        transport = StringTransport()
+        d = data.deliverTo(transport)
+        d.addCallback(lambda ignored: {'size': len(transport.value())})
+        return d
+    Upload.responder(upload)
+
+
+@defer.inlineCallbacks
+def stream():
+    factory = protocol.ServerFactory()
+    factory.protocol = Sink
+    port = reactor.listenTCP(0, factory, interface='127.0.0.1')
+    try:
+        client = yield protocol.ClientCreator(reactor, amp.AMP).connectTCP(
+            '127.0.0.1', port.getHost().port)
+        before = time.time()
+        result = yield client.callRemote(Upload, data=PAYLOAD)
+        after = time.time()
+        assert result['size'] == len(PAYLOAD), result
+        print '%-30s %8.1f MB/sec' % (
+            'Stream upload', len(PAYLOAD) / (after - before) / 2 ** 20)
+        client.transport.loseConnection()
+    except:
+        defer.fail().printTraceback(sys.stdout)
+    port.stopListening()
+    reactor.stop()
+
+
+def main():
+    box = amp.AmpBox(_command='Sum', _ask='1', a='13', b='81')
+    data = box.serialize() * BOXES
+    report('dataReceived', parse, data)
+    report('state machine', parseStrings, data)
+    reactor.callWhenRunning(stream)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
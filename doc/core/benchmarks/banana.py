@@ -1,10 +1,30 @@
 #!/usr/bin/python
 
 from timer import timeit
-from twisted.spread.banana import b1282int
+from twisted.spread.banana import b1282int, encode, decode
 
 ITERATIONS = 100000
 
 for length in (1, 5, 10, 50, 100):
     elapsed = timeit(b1282int, ITERATIONS, "\xff" * length)
     print "b1282int %3d byte string: %10d cps" % (length, ITERATIONS / elapsed)
+
+
+def nested(depth):
+    lst = []
+    for i in range(depth):
+        lst = [lst, i]
+    return lst
+
+
+DECODE_ITERATIONS = 10
+
+for label, obj in [
+    ("list of 10000 items", [i % 2 and "item" or i for i in range(10000)]),
+    ("list of 100000 items", [i % 2 and "item" or i for i in range(100000)]),
+    ("500 nested lists", nested(500)),
+    ("900 nested lists", nested(900))]:
+    data = encode(obj)
+    elapsed = timeit(decode, DECODE_ITERATIONS, data)
+    print "decode %-20s: %10d bytes/sec" % (
+        label, DECODE_ITERATIONS * len(data) / elapsed)
@@ -64,6 +64,13 @@ def instantiateShootErrback():
     d.addErrback(lambda x: None)
 instantiateShootErrback = benchmarkFunc(200)(instantiateShootErrback)
 
+def succeedAddCallback():
+    """
+    Create a deferred which already has a result and add a callback to it
+    """
+    defer.succeed(1).addCallback(lambda x: x)
+succeedAddCallback = benchmarkFunc(100000)(succeedAddCallback)
+
 ns = [10, 1000, 10000]
 
 def instantiateAddCallbacksNoResult(n):
@@ -133,6 +140,24 @@ def pauseUnpause(n):
     d.unpause()
 pauseUnpause = benchmarkNFunc(20, ns)(pauseUnpause)
 
+def inlineCallbacksYield(n):
+    """
+    Run an inlineCallbacks generator yielding the given number of deferreds
+    which already have a result and as many which get one later.
+    """
+    def gen():
+        for i in xrange(n):
+            yield defer.succeed(i)
+            d = defer.Deferred()
+            pending.append(d)
+            yield d
+    gen = defer.inlineCallbacks(gen)
+    pending = []
+    gen()
+    while pending:
+        pending.pop().callback(None)
+inlineCallbacksYield = benchmarkNFunc(20, ns)(inlineCallbacksYield)
+
 def benchmark():
     """
     Run all of the benchmarks registered in the benchmarkFuncs list
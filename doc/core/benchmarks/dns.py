@@ -0,0 +1,69 @@
+"""
+Benchmarks for encoding and decoding L{twisted.names.dns.Message}.
+"""
+
+from timer import timeit
+
+from twisted.names import dns
+
+ITERATIONS = 20000
+
+def buildResponse():
+    """
+    Build a typical referral-style response: one question, a few answers,
+    and an authority and additional section that a stub resolver ignores.
+    """
+    m = dns.Message(id=1234, answer=1, auth=1)
+    m.queries = [dns.Query('www.example.com', dns.A)]
+    for i in range(4):
+        m.answers.append(dns.RRHeader(
+                'www.example.com', dns.A, ttl=300,
+                payload=dns.Record_A('10.0.0.%d' % (i,), ttl=300)))
+    for i in range(2):
+        m.authority.append(dns.RRHeader(
+                'example.com', dns.NS, ttl=3600,
+                payload=dns.Record_NS('ns%d.example.com' % (i,), ttl=3600)))
+        m.additional.append(dns.RRHeader(
+                'ns%d.example.com' % (i,), dns.A, ttl=3600,
+                payload=dns.Record_A('10.1.0.%d' % (i,), ttl=3600)))
+    return m
+
+
+def encode(message):
+    message.toStr()
+
+
+def decode(data):
+    dns.Message().fromStr(data)
+
+
+def decodeAnswers(data):
+    m = dns.Message()
+    m.fromStr(data)
+    for rr in m.answers:
+        rr.payload
+
+
+def decodeAll(data):
+    m = dns.Message()
+    m.fromStr(data)
+    for section in m.answers, m.authority, m.additional:
+        for rr in section:
+            rr.payload
+
+
+def report(label, func, *args):
+    elapsed = timeit(func, ITERATIONS, *args)
+    print '%-40s %8d messages/sec' % (label, ITERATIONS / elapsed)
+
+
+def main():
+    message = buildResponse()
+    data = message.toStr()
+    report('encode', encode, message)
+    report('decode headers', decode, data)
+    report('decode answer payloads', decodeAnswers, data)
+    report('decode all payloads', decodeAll, data)
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ def pickVal():
     return random.choice([None, 1, 'Hello', [], {1: 1}, (1, 2, 3)])
 
 def makeLocals(n):
-    return ';'.join(['x%d = %s' % (i, pickVal()) for i in range(n)])
+    return ';'.join(['x%d = %r' % (i, pickVal()) for i in range(n)])
 
 for nLocals in O:
     for i in range(DEPTH):
@@ -21,7 +21,7 @@ def deepFailure%d_%d():
     %s
     deepFailure%d_%d()
 """ % (nLocals, i, makeLocals(nLocals), nLocals, i + 1)
-    exec s
+        exec s
 
     exec """
 def deepFailure%d_%d():
@@ -52,15 +52,31 @@ def fail_easy(n):
         except:
             pass
 
+def trap(n):
+    for i in R:
+        try:
+            eval('deepFailure%d_0' % n)()
+        except:
+            failure.Failure().trap(ZeroDivisionError)
+
+def getTraceback(n):
+    for i in R:
+        try:
+            eval('deepFailure%d_0' % n)()
+        except:
+            failure.Failure().getTraceback()
+
 from timer import timeit
 # for i in O:
 #     timeit(fail, 1, i)
 
-# for i in O:
-#     print 'easy failing', i, timeit(fail_easy, 1, i)
-
-for i in O:
-    print 'failing', i, timeit(fail, 1, i)
+for lazy in False, True:
+    failure.Failure.lazy = lazy
+    print 'lazy' if lazy else 'eager'
+    for name, func in [('failing', fail), ('easy failing', fail_easy),
+                       ('trapping', trap), ('getTraceback', getTraceback)]:
+        for i in 0, 40:
+            print '  %-14s %2d' % (name, i), timeit(func, 1, i)
 
 # for i in O:
 #     print 'string failing', i, timeit(fail_str, 1, i)
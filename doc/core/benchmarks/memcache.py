@@ -0,0 +1,80 @@
+"""
+Benchmarks for L{twisted.protocols.memcache}: reading a few hot keys from a
+local stand-in for memcached, directly with L{MemCacheProtocol} and through
+a L{NearCache}.
+"""
+
+import sys, time
+
+from twisted.internet import defer, protocol, reactor
+from twisted.protocols import basic, memcache
+
+GETS = 20000
+CONCURRENCY = 100
+KEYS = ['key%d' % (i,) for i in range(10)]
+
+
+class StandInServer(basic.LineReceiver):
+    """
+    Just enough of memcached to answer I{get} and I{set}.
+    """
+    def connectionMade(self):
+        self.values = self.factory.values
+        self.storing = None
+
+
+    def lineReceived(self, line):
+        if self.storing is not None:
+            self.values[self.storing] = line
+            self.storing = None
+            self.transport.write('STORED\r\n')
+            return
+        parts = line.split()
+        if parts[0] == 'get':
+            response = []
+            for key in parts[1:]:
+                if key in self.values:
+                    value = self.values[key]
+                    response.append('VALUE %s 0 %d\r\n%s\r\n' % (
+                            key, len(value), value))
+            response.append('END\r\n')
+            self.transport.write(''.join(response))
+        elif parts[0] == 'set':
+            self.storing = parts[1]
+
+
+@defer.inlineCallbacks
+def benchmark(label, client):
+    for key in KEYS:
+        yield client.set(key, 'value of ' + key)
+    before = time.time()
+    for i in xrange(GETS / CONCURRENCY):
+        yield defer.gatherResults([
+            client.get(KEYS[j % len(KEYS)]) for j in xrange(CONCURRENCY)])
+    after = time.time()
+    print '%-25s %8d gets/sec' % (label, GETS / (after - before))
+
+
+@defer.inlineCallbacks
+def main():
+    factory = protocol.ServerFactory()
+    factory.protocol = StandInServer
+    factory.values = {}
+    port = reactor.listenTCP(0, factory, interface='127.0.0.1')
+    try:
+        proto = yield protocol.ClientCreator(
+            reactor, memcache.MemCacheProtocol).connectTCP(
+            '127.0.0.1', port.getHost().port)
+        yield benchmark('MemCacheProtocol', proto)
+        near = memcache.NearCache(proto, timeToLive=60)
+        yield benchmark('NearCache', near)
+        print 'NearCache stats:', near.stats()
+        proto.transport.loseConnection()
+    except:
+        defer.fail().printTraceback(sys.stdout)
+    port.stopListening()
+    reactor.stop()
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
@@ -0,0 +1,81 @@
+"""
+Benchmarks for L{twisted.spread.jelly} and L{twisted.spread.pb}: jellying
+and unjellying a typical payload, and calling a remote method with it over
+a loopback connection.
+"""
+
+import sys, time
+
+from timer import timeit
+
+from twisted.internet import defer, reactor
+from twisted.spread import jelly, pb
+
+ITERATIONS = 200
+CALLS = 100
+
+
+def buildPayload(rows=100):
+    """
+    Build a result set like those returned by remote methods: a list of
+    dictionaries of simple values, some of them holding nested lists.
+    """
+    payload = []
+    for i in range(rows):
+        payload.append({
+                'id': i,
+                'name': 'row %d' % (i,),
+                'title': u'\N{SNOWMAN} %d' % (i,),
+                'score': i / 3.0,
+                'parent': None,
+                'active': bool(i % 2),
+                'tags': ['tag%d' % (j,) for j in range(i % 5)],
+                'matrix': [[j, j * 2] for j in range(3)]})
+    return payload
+
+
+def unjelly(sexp):
+    jelly.unjelly(sexp)
+
+
+def report(label, elapsed, count):
+    print '%-30s %8d /sec' % (label, count / elapsed)
+
+
+class Echo(pb.Root):
+    def remote_echo(self, payload):
+        return payload
+
+
+@defer.inlineCallbacks
+def roundTrips(payload):
+    port = reactor.listenTCP(0, pb.PBServerFactory(Echo()),
+                             interface='127.0.0.1')
+    factory = pb.PBClientFactory()
+    connector = reactor.connectTCP('127.0.0.1', port.getHost().port, factory)
+    try:
+        root = yield factory.getRootObject()
+        before = time.time()
+        for i in xrange(CALLS):
+            yield root.callRemote('echo', payload)
+        report('round trips', time.time() - before, CALLS)
+    finally:
+        connector.disconnect()
+        yield port.stopListening()
+
+
+@defer.inlineCallbacks
+def main():
+    payload = buildPayload()
+    report('jelly', timeit(jelly.jelly, ITERATIONS, payload), ITERATIONS)
+    report('unjelly', timeit(unjelly, ITERATIONS, jelly.jelly(payload)),
+           ITERATIONS)
+    try:
+        yield roundTrips(payload)
+    except:
+        defer.fail().printTraceback(sys.stdout)
+    reactor.stop()
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
@@ -0,0 +1,107 @@
+"""
+Benchmarks for starting processes with L{reactor.spawnProcess}, with fork()
+and with posix_spawn(), in a small and in a large parent process.
+
+Usage: spawn.py [processes [megabytes of ballast]]
+"""
+
+import sys, time
+
+from twisted.internet import reactor, defer, process
+from twisted.internet.protocol import ProcessProtocol
+
+
+def memory():
+    """
+    Return the resident size, its peak and the size of the page tables of
+    this process, in kB, as reported by Linux.
+    """
+    sizes = {}
+    for line in file('/proc/self/status'):
+        name, value = line.split(':', 1)
+        if name in ('VmRSS', 'VmHWM', 'VmPTE'):
+            sizes[name] = int(value.split()[0])
+    return sizes['VmRSS'], sizes['VmHWM'], sizes['VmPTE']
+
+
+
+class Exited(ProcessProtocol):
+    def __init__(self, d):
+        self.d = d
+
+
+    def processEnded(self, reason):
+        self.d.callback(None)
+
+
+
+def spawnMany(count, concurrency=8):
+    """
+    Start C{count} processes of I{true}, C{concurrency} at a time.
+    """
+    done = defer.Deferred()
+    state = {'started': 0, 'ended': 0}
+    def start():
+        state['started'] += 1
+        d = defer.Deferred()
+        d.addCallback(ended)
+        reactor.spawnProcess(Exited(d), '/bin/true', ['true'], env={})
+    def ended(ignored):
+        state['ended'] += 1
+        if state['started'] < count:
+            start()
+        elif state['ended'] == count:
+            done.callback(None)
+    for i in range(min(concurrency, count)):
+        start()
+    return done
+
+
+
+def measure(label, count):
+    before = memory()
+    start = time.time()
+    d = spawnMany(count)
+    def report(ignored):
+        elapsed = time.time() - start
+        after = memory()
+        print '%-28s %8.1f processes/sec  RSS %+6d kB  peak %+6d kB' % (
+            label, count / elapsed, after[0] - before[0],
+            after[1] - before[1])
+    return d.addCallback(report)
+
+
+
+def main(count=500, ballastSize=1024):
+    ballast = []
+
+    def run(ignored):
+        print 'Parent RSS %d kB, page tables %d kB:' % (
+            memory()[0], memory()[2])
+        d = defer.succeed(None)
+        for useSpawn in (False, True):
+            if useSpawn and process._posixspawn is None:
+                print 'posix_spawn() is not available'
+                continue
+            def setAndMeasure(ignored, useSpawn=useSpawn):
+                process.Process.usePosixSpawn = useSpawn
+                label = useSpawn and 'posix_spawn' or 'fork'
+                return measure(label, count)
+            d.addCallback(setAndMeasure)
+        return d
+
+    def grow(ignored):
+        # Strings are written when created, so the pages are all mapped.
+        ballast.append('x' * (ballastSize << 20))
+
+    d = defer.succeed(None)
+    d.addCallback(run)
+    d.addCallback(grow)
+    d.addCallback(run)
+    d.addErrback(lambda reason: reason.printTraceback())
+    d.addBoth(lambda ignored: reactor.stop())
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
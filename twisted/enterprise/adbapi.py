@@ -6,10 +6,12 @@
 An asynchronous mapping to U{DB-API 2.0<http://www.python.org/topics/database/DatabaseAPI-2.0.html>}.
 """
 
-import sys
+import sys, re, time
+from bisect import bisect_left
 
-from twisted.internet import threads
-from twisted.python import reflect, log
+from twisted.internet import threads, defer
+from twisted.python import reflect, log, failure
+from twisted.python.hashlib import md5
 from twisted.python.deprecate import deprecated
 from twisted.python.versions import Version
 
@@ -23,6 +25,186 @@ class ConnectionLost(Exception):
 
 
 
+class PoolClosed(Exception):
+    """
+    This exception means that a L{ConnectionPool} was closed before it could
+    execute an operation.
+    """
+
+
+
+class Histogram(object):
+    """
+    A summary of durations, counted in buckets.
+
+    @cvar bounds: The upper bounds, in seconds, of every bucket but the last,
+        which counts the durations longer than C{bounds[-1]}.
+    @ivar counts: The number of durations in each bucket.
+    @ivar count: The number of durations added.
+    @ivar total: The sum of the durations added.
+    @ivar max: The longest duration added.
+    """
+    bounds = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+              0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def add(self, duration):
+        """
+        Count a duration, in seconds.
+        """
+        self.counts[bisect_left(self.bounds, duration)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+
+    def snapshot(self):
+        """
+        Return a C{dict} with the C{count}, C{total}, C{mean} and C{max} of
+        the durations, and their C{buckets}: a C{list} of C{(bound, count)}
+        tuples, where the bound of the last bucket is C{None}.
+        """
+        if self.count:
+            mean = self.total / self.count
+        else:
+            mean = 0.0
+        return {'count': self.count,
+                'total': self.total,
+                'mean': mean,
+                'max': self.max,
+                'buckets': zip(self.bounds + (None,), self.counts)}
+
+
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_whitespace = re.compile(r"\s+")
+
+def fingerprint(sql):
+    """
+    Reduce an SQL statement to its shape, by replacing literal strings and
+    numbers with C{?} and collapsing whitespace, so that statements which
+    differ only by their values are counted together.
+    """
+    return _whitespace.sub(' ', _literals.sub('?', sql)).strip()
+
+
+
+class PoolStatistics(object):
+    """
+    Measurements of the use of a L{ConnectionPool}, updated from its worker
+    threads.
+
+    @ivar active: The number of interactions in progress.
+    @ivar wait: A L{Histogram} of the time interactions waited for a worker
+        thread.
+    @ivar checkout: A L{Histogram} of the time interactions held a
+        connection.
+    @ivar queries: A C{dict} mapping the L{fingerprint} of statements to a
+        L{Histogram} of their execution time.  At most C{maxFingerprints}
+        statements are tracked; the rest are counted under C{None}.
+    @ivar recycled: The number of connections closed because they reached
+        their maximum lifetime.
+    @ivar invalidated: The number of idle connections closed because they
+        failed validation.
+    """
+    maxFingerprints = 1000
+
+    def __init__(self):
+        import thread
+        self._lock = thread.allocate_lock()
+        self._fingerprints = {}
+        self.active = 0
+        self.wait = Histogram()
+        self.checkout = Histogram()
+        self.queries = {}
+        self.recycled = 0
+        self.invalidated = 0
+
+
+    def started(self, wait):
+        """
+        Record the start of an interaction which waited C{wait} seconds.
+        """
+        self._lock.acquire()
+        try:
+            self.active += 1
+            self.wait.add(wait)
+        finally:
+            self._lock.release()
+
+
+    def finished(self, held):
+        """
+        Record the end of an interaction which held its connection for
+        C{held} seconds.
+        """
+        self._lock.acquire()
+        try:
+            self.active -= 1
+            self.checkout.add(held)
+        finally:
+            self._lock.release()
+
+
+    def executed(self, sql, duration):
+        """
+        Record the execution of a statement which took C{duration} seconds.
+        """
+        self._lock.acquire()
+        try:
+            key = self._fingerprints.get(sql)
+            if key is None:
+                key = fingerprint(sql)
+                if len(self._fingerprints) < self.maxFingerprints:
+                    self._fingerprints[sql] = key
+            histogram = self.queries.get(key)
+            if histogram is None:
+                if len(self.queries) >= self.maxFingerprints:
+                    key = None
+                histogram = self.queries.setdefault(key, Histogram())
+            histogram.add(duration)
+        finally:
+            self._lock.release()
+
+
+    def increment(self, name):
+        """
+        Add one to the counter C{name}.
+        """
+        self._lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + 1)
+        finally:
+            self._lock.release()
+
+
+    def snapshot(self):
+        """
+        Return a C{dict} of the current measurements, with L{Histogram}s
+        replaced by their snapshots.
+        """
+        self._lock.acquire()
+        try:
+            return {'active': self.active,
+                    'wait': self.wait.snapshot(),
+                    'checkout': self.checkout.snapshot(),
+                    'queries': dict([(key, histogram.snapshot())
+                                     for (key, histogram)
+                                     in self.queries.iteritems()]),
+                    'recycled': self.recycled,
+                    'invalidated': self.invalidated}
+        finally:
+            self._lock.release()
+
+
+
 class Connection(object):
     """
     A wrapper for a DB-API connection instance.
@@ -85,8 +267,12 @@ class Transaction:
     execute(), fetchall(), etc., and they will be called on the
     underlying DB-API cursor object. Attributes will also be
     retrieved from there.
+
+    If the pool caches statements, a statement is executed with the cached
+    cursor for it, and the results are then fetched from that cursor.
     """
     _cursor = None
+    _current = None
 
     def __init__(self, pool, connection):
         self._pool = pool
@@ -121,7 +307,37 @@ class Transaction:
         self._connection.reconnect()
         self._cursor = None
 
+    def execute(self, *args, **kw):
+        return self._execute('execute', args, kw)
+
+    def executemany(self, *args, **kw):
+        return self._execute('executemany', args, kw)
+
+    def _execute(self, method, args, kw):
+        """
+        Execute a statement with the pool's cached cursor for it, if there is
+        one, or with this transaction's cursor, and time it.
+        """
+        if not args:
+            self._current = None
+            return getattr(self._cursor, method)(*args, **kw)
+        sql = args[0]
+        cursor = self._pool.cachedCursor(self._connection, sql)
+        self._current = cursor
+        if cursor is None:
+            cursor = self._cursor
+        stats = self._pool.statistics
+        if stats is None:
+            return getattr(cursor, method)(*args, **kw)
+        start = time.time()
+        try:
+            return getattr(cursor, method)(*args, **kw)
+        finally:
+            stats.executed(sql, time.time() - start)
+
     def __getattr__(self, name):
+        if self._current is not None:
+            return getattr(self._current, name)
         return getattr(self._cursor, name)
 
 
@@ -140,12 +356,47 @@ class ConnectionPool:
         which will be used to stop the connection pool workers when the
         reactor stops.
 
+    @ivar batch_size: The number of operations submitted with
+        L{runBatchedOperation} after which they are executed without waiting
+        any longer.
+    @ivar batch_delay: The number of seconds L{runBatchedOperation} waits
+        for more operations to batch with the first one.
+
+    @ivar statement_cache: The number of cursors kept open for reuse by
+        each connection, one for each of the statements executed most
+        recently.  A driver which prepares statements (or whose cursors have
+        a C{prepare} method, which is called) then prepares each statement
+        once per connection.  C{0} disables the cache.
+    @ivar max_lifetime: The number of seconds after which a connection is
+        closed and replaced when it is next used, or C{None}.
+    @ivar validate_idle: The number of seconds a connection may stay unused
+        before it is checked with C{good_sql} when it is next used, and
+        replaced if that fails, or C{None}.
+
+    @ivar statistics: The L{PoolStatistics} of this pool, or C{None} to not
+        collect any.  See L{getStatistics}.
+
+    @ivar _statements: A C{dict} mapping thread ids to C{[connection,
+        cursors, uses]} lists, where C{cursors} maps statements to C{[cursor,
+        lastUse]} lists.
+    @ivar _connectionTimes: A C{dict} mapping thread ids to C{[created,
+        lastUsed]} lists for their connections.
+
+    @ivar _batch: A C{list} of C{(sql, params, deferreds)} tuples for the
+        pending batched operations, where consecutive operations with the
+        same SQL share a tuple.
+    @ivar _batchCount: The number of pending batched operations.
+    @ivar _batchCall: The L{IDelayedCall} which will execute the pending
+        batched operations, or C{None}.
+
     @ivar _reactor: The reactor which will be used to schedule startup and
         shutdown events.
     @type _reactor: L{IReactorCore} provider
     """
 
-    CP_ARGS = "min max name noisy openfun reconnect good_sql".split()
+    CP_ARGS = ("min max name noisy openfun reconnect good_sql "
+               "batch_size batch_delay statement_cache max_lifetime "
+               "validate_idle").split()
 
     noisy = False # if true, generate informational log messages
     min = 3 # minimum number of connections in pool
@@ -154,6 +405,11 @@ class ConnectionPool:
     openfun = None # A function to call on new connections
     reconnect = False # reconnect when connections fail
     good_sql = 'select 1' # a query which should always succeed
+    batch_size = 100 # most operations executed in one batch
+    batch_delay = 0.01 # seconds to wait for operations to batch
+    statement_cache = 0 # cursors to keep open per connection
+    max_lifetime = None # seconds after which connections are replaced
+    validate_idle = None # idle seconds after which connections are checked
 
     running = False # true when the pool is operating
     connectionFactory = Connection
@@ -162,6 +418,8 @@ class ConnectionPool:
     # Initialize this to None so it's available in close() even if start()
     # never runs.
     shutdownID = None
+    statistics = None
+    _batchCall = None
 
     def __init__(self, dbapiName, *connargs, **connkw):
         """Create a new ConnectionPool.
@@ -194,6 +452,23 @@ class ConnectionPool:
         @param cp_good_sql: an sql query which should always succeed and change
                             no state (default 'select 1')
 
+        @param cp_batch_size: the most operations L{runBatchedOperation}
+                              executes in one transaction (default 100)
+
+        @param cp_batch_delay: the number of seconds L{runBatchedOperation}
+                               waits for more operations before executing
+                               a batch (default 0.01)
+
+        @param cp_statement_cache: the number of cursors to keep open for
+                                   reuse, per connection (default 0)
+
+        @param cp_max_lifetime: replace connections older than this many
+                                seconds (default None)
+
+        @param cp_validate_idle: check connections left unused for this many
+                                 seconds with good_sql before using them
+                                 again (default None)
+
         @param cp_reactor: use this reactor instead of the global reactor
             (added in Twisted 10.2).
         @type cp_reactor: L{IReactorCore} provider
@@ -226,6 +501,11 @@ class ConnectionPool:
         self.max = max(self.min, self.max)
 
         self.connections = {}  # all connections, hashed on thread id
+        self._statements = {}
+        self._connectionTimes = {}
+        self.statistics = PoolStatistics()
+        self._batch = []
+        self._batchCount = 0
 
         # these are optional so import them here
         from twisted.python import threadpool
@@ -278,10 +558,27 @@ class ConnectionPool:
         """
         from twisted.internet import reactor
         return threads.deferToThreadPool(reactor, self.threadpool,
+                                         self._instrumented, time.time(),
                                          self._runWithConnection,
                                          func, *args, **kw)
 
 
+    def _instrumented(self, submitted, f, *args, **kw):
+        """
+        Call C{f} in a worker thread, recording how long the call waited
+        for the thread since C{submitted} and how long it took.
+        """
+        stats = self.statistics
+        if stats is None:
+            return f(*args, **kw)
+        start = time.time()
+        stats.started(start - submitted)
+        try:
+            return f(*args, **kw)
+        finally:
+            stats.finished(time.time() - start)
+
+
     def _runWithConnection(self, func, *args, **kw):
         conn = self.connectionFactory(self)
         try:
@@ -328,6 +625,7 @@ class ConnectionPool:
         """
         from twisted.internet import reactor
         return threads.deferToThreadPool(reactor, self.threadpool,
+                                         self._instrumented, time.time(),
                                          self._runInteraction,
                                          interaction, *args, **kw)
 
@@ -371,6 +669,131 @@ class ConnectionPool:
         return self.runInteraction(self._runOperation, *args, **kw)
 
 
+    def runBatchedOperation(self, sql, params):
+        """
+        Execute an SQL statement along with other statements submitted
+        shortly before or after it, and return None.
+
+        Operations are collected for up to C{batch_delay} seconds, or until
+        C{batch_size} of them are waiting, and are then executed in a single
+        transaction in one worker thread.  Consecutive operations with the
+        same SQL statement are executed by one call to the DB-API cursor's
+        'executemany' method, so a burst of similar inserts costs one thread
+        handoff and one commit rather than one of each per insert.
+        Operations are executed in the order they were submitted.
+
+        If a batch fails, its transaction is rolled back and each of its
+        operations is executed again on its own, as if by L{runOperation},
+        so that only the Deferreds of the operations which fail by
+        themselves receive a Failure.
+
+        @param sql: An SQL statement which returns no rows.
+
+        @param params: The parameters for C{sql}, as accepted by the DB-API
+            cursor's 'execute' method.
+
+        @return: a Deferred which will fire None or a Failure.
+        """
+        d = defer.Deferred()
+        if self._batch and self._batch[-1][0] == sql:
+            self._batch[-1][1].append(params)
+            self._batch[-1][2].append(d)
+        else:
+            self._batch.append((sql, [params], [d]))
+        self._batchCount += 1
+        if self._batchCount >= self.batch_size:
+            self.flushBatch()
+        elif self._batchCall is None:
+            self._batchCall = self._reactor.callLater(
+                self.batch_delay, self.flushBatch)
+        return d
+
+
+    def flushBatch(self):
+        """
+        Execute the pending operations submitted with L{runBatchedOperation}
+        now.
+
+        @return: a Deferred which fires when the operations have been
+            executed, successfully or not.
+        """
+        batch = self._takeBatch()
+        if not batch:
+            return defer.succeed(None)
+        d = self.runInteraction(self._runBatch, batch)
+        d.addCallbacks(self._batchSucceeded, self._batchFailed,
+                       callbackArgs=(batch,), errbackArgs=(batch,))
+        return d
+
+
+    def _takeBatch(self):
+        """
+        Return the pending batched operations, and forget about them.
+        """
+        if self._batchCall is not None:
+            if self._batchCall.active():
+                self._batchCall.cancel()
+            self._batchCall = None
+        batch, self._batch = self._batch, []
+        self._batchCount = 0
+        return batch
+
+
+    def _runBatch(self, trans, batch):
+        for sql, params, deferreds in batch:
+            trans.executemany(sql, params)
+
+
+    def _batchSucceeded(self, ignored, batch):
+        for sql, params, deferreds in batch:
+            for d in deferreds:
+                d.callback(None)
+
+
+    def _batchFailed(self, reason, batch):
+        """
+        Report the failure of a batch with a single operation, or execute
+        each operation of a larger batch on its own.
+        """
+        if len(batch) == 1 and len(batch[0][2]) == 1:
+            batch[0][2][0].errback(reason)
+            return
+        if self.noisy:
+            log.msg('adbapi batch failed, retrying its operations: %s' % (
+                    reason.getErrorMessage(),))
+        retries = []
+        for sql, params, deferreds in batch:
+            for p, d in zip(params, deferreds):
+                retry = self.runOperation(sql, p)
+                retry.chainDeferred(d)
+                retries.append(retry)
+        return defer.DeferredList(retries)
+
+
+    def getStatistics(self):
+        """
+        Describe the state and use of this pool.
+
+        @return: A C{dict} with the C{connections} open, how many of them are
+            C{active} and C{idle}, the number of interactions C{queued} for a
+            worker thread, and the measurements of L{PoolStatistics}: the
+            C{wait} for a worker, C{checkout} (the time a connection is
+            held) and C{queries} histograms, and the C{recycled} and
+            C{invalidated} connection counts.
+        """
+        if self.statistics is None:
+            result = {}
+        else:
+            result = self.statistics.snapshot()
+        connections = len(self.connections)
+        active = result.get('active', 0)
+        result['connections'] = connections
+        result['active'] = active
+        result['idle'] = max(0, connections - active)
+        result['queued'] = self.threadpool.q.qsize()
+        return result
+
+
     def close(self):
         """
         Close all pool connections and shutdown the pool.
@@ -387,11 +810,36 @@ class ConnectionPool:
         """This should only be called by the shutdown trigger."""
 
         self.shutdownID = None
+        batch = self._takeBatch()
+        outcome = []
+        if batch and self.running:
+            # The reactor may not run again: execute the batch in a worker
+            # before the threads are joined, without retrying its
+            # operations one by one.
+            def runFinalBatch():
+                try:
+                    self._runInteraction(self._runBatch, batch)
+                except:
+                    outcome.append(failure.Failure())
+                else:
+                    outcome.append(None)
+            self.threadpool.callInThread(runFinalBatch)
         self.threadpool.stop()
         self.running = False
+        if batch:
+            if not outcome:
+                outcome.append(failure.Failure(PoolClosed()))
+            if outcome[0] is None:
+                self._batchSucceeded(None, batch)
+            else:
+                for sql, params, deferreds in batch:
+                    for d in deferreds:
+                        d.errback(outcome[0])
         for conn in self.connections.values():
             self._close(conn)
         self.connections.clear()
+        self._statements.clear()
+        self._connectionTimes.clear()
 
     def connect(self):
         """Return a database connection when one becomes available.
@@ -406,6 +854,9 @@ class ConnectionPool:
 
         tid = self.threadID()
         conn = self.connections.get(tid)
+        now = time.time()
+        if conn is not None:
+            conn = self._checkConnection(tid, conn, now)
         if conn is None:
             if self.noisy:
                 log.msg('adbapi connecting: %s %s%s' % (self.dbapiName,
@@ -415,8 +866,98 @@ class ConnectionPool:
             if self.openfun != None:
                 self.openfun(conn)
             self.connections[tid] = conn
+            self._connectionTimes[tid] = [now, now]
+        else:
+            self._connectionTimes[tid][1] = now
         return conn
 
+
+    def _checkConnection(self, tid, conn, now):
+        """
+        Close the connection of the current thread if it is older than
+        C{max_lifetime}, or if it has been idle for longer than
+        C{validate_idle} and fails C{good_sql}.
+
+        Connections belong to their worker thread, so they are checked by
+        that thread when it next needs one rather than in the background.
+
+        @return: C{conn} if it may still be used, or C{None}.
+        """
+        times = self._connectionTimes.get(tid)
+        if times is None:
+            return conn
+        created, lastUsed = times
+        if (self.max_lifetime is not None
+            and now - created >= self.max_lifetime):
+            if self.noisy:
+                log.msg('adbapi recycling connection: %s' % (self.dbapiName,))
+            reason = 'recycled'
+        elif (self.validate_idle is not None
+              and now - lastUsed >= self.validate_idle
+              and not self._validate(conn)):
+            reason = 'invalidated'
+        else:
+            return conn
+        if self.statistics is not None:
+            self.statistics.increment(reason)
+        self.disconnect(conn)
+        return None
+
+
+    def _validate(self, conn):
+        """
+        Check a connection by executing C{good_sql} with it.
+        """
+        try:
+            curs = conn.cursor()
+            curs.execute(self.good_sql)
+            curs.close()
+            conn.commit()
+        except:
+            if self.noisy:
+                log.msg('adbapi connection failed validation: %s' % (
+                        sys.exc_info()[1],))
+            return False
+        return True
+
+
+    def cachedCursor(self, connection, sql):
+        """
+        Return the cursor of C{connection} kept open for C{sql}, opening
+        (and, if the driver supports it, preparing) one if there is none.
+
+        This method should only be called from the thread which uses
+        C{connection}.
+
+        @param connection: The L{Connection} in use by the current thread.
+
+        @return: A DB-API cursor, or C{None} if C{statement_cache} is C{0}.
+        """
+        if not self.statement_cache:
+            return None
+        raw = getattr(connection, '_connection', connection)
+        tid = self.threadID()
+        entry = self._statements.get(tid)
+        if entry is None or entry[0] is not raw:
+            entry = self._statements[tid] = [raw, {}, 0]
+        cursors = entry[1]
+        entry[2] += 1
+        cached = cursors.get(sql)
+        if cached is None:
+            if len(cursors) >= self.statement_cache:
+                oldest = min(cursors, key=lambda key: cursors[key][1])
+                try:
+                    cursors.pop(oldest)[0].close()
+                except:
+                    log.err(None, "Cursor close failed")
+            cursor = raw.cursor()
+            prepare = getattr(cursor, 'prepare', None)
+            if prepare is not None:
+                prepare(sql)
+            cached = cursors[sql] = [cursor, 0]
+        cached[1] = entry[2]
+        return cached[0]
+
     def disconnect(self, conn):
         """Disconnect a database connection associated with this pool.
 
@@ -430,6 +971,8 @@ class ConnectionPool:
         if conn is not None:
             self._close(conn)
             del self.connections[tid]
+            self._statements.pop(tid, None)
+            self._connectionTimes.pop(tid, None)
 
 
     def _close(self, conn):
@@ -472,6 +1015,11 @@ class ConnectionPool:
                 'noisy': self.noisy,
                 'reconnect': self.reconnect,
                 'good_sql': self.good_sql,
+                'batch_size': self.batch_size,
+                'batch_delay': self.batch_delay,
+                'statement_cache': self.statement_cache,
+                'max_lifetime': self.max_lifetime,
+                'validate_idle': self.validate_idle,
                 'connargs': self.connargs,
                 'connkw': self.connkw}
 
@@ -481,6 +1029,210 @@ class ConnectionPool:
 
 
 
+class RoutingConnectionPool(object):
+    """
+    A pool of connections to a primary database and its read replicas.
+
+    L{runQuery} is sent to a replica; every other kind of access goes to
+    the primary.  Replicas are chosen in turn, or, with C{leastLoaded}, the
+    one with the fewest interactions queued and in progress is chosen.  A
+    replica whose query fails with a connection error is taken out of
+    rotation for C{retryInterval} seconds and the query is sent to another
+    replica, or to the primary when none is left.  By default only
+    L{ConnectionLost} is a connection error, since the C{OperationalError}
+    of many DB-API modules is also raised for errors in a query, such as a
+    lock timeout, which another replica would raise too.
+
+    @ivar primary: The L{ConnectionPool} of the primary database.
+    @ivar replicas: A C{list} of the L{ConnectionPool}s of the replicas.
+    @ivar leastLoaded: Whether to choose the least loaded replica rather
+        than the next one.
+    @ivar retryInterval: The number of seconds a failed replica is left out
+        of rotation.
+    @ivar isConnectionError: A callable taking a replica and the L{Failure}
+        of a query it ran, and returning whether the replica should be
+        taken out of rotation.
+
+    @ivar _next: The index in C{replicas} at which to start looking for the
+        next replica.
+    @ivar _down: A C{dict} mapping replicas out of rotation to the
+        L{IDelayedCall} which will bring them back.
+    @ivar _reactor: An L{IReactorTime} provider.
+    """
+
+    def __init__(self, primary, replicas=(), leastLoaded=False,
+                 retryInterval=30, isConnectionError=None, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        if isConnectionError is not None:
+            self.isConnectionError = isConnectionError
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.leastLoaded = leastLoaded
+        self.retryInterval = retryInterval
+        self._next = 0
+        self._down = {}
+
+
+    def pickReplica(self):
+        """
+        Return the replica which should run the next query, or C{None} if
+        every replica is out of rotation.
+        """
+        available = [replica for replica in self.replicas
+                     if replica not in self._down]
+        if not available:
+            return None
+        if self.leastLoaded:
+            return min(available, key=self._load)
+        replica = available[self._next % len(available)]
+        self._next = (self._next + 1) % len(available)
+        return replica
+
+
+    def _load(self, pool):
+        """
+        Return the number of interactions queued and in progress in a pool.
+        """
+        stats = pool.getStatistics()
+        return stats['queued'] + stats['active']
+
+
+    def isConnectionError(self, replica, reason):
+        """
+        Return whether C{reason}, the failure of a query run by C{replica},
+        is a L{ConnectionLost}.
+        """
+        return reason.check(ConnectionLost) is not None
+
+
+    def markDown(self, replica):
+        """
+        Take a replica out of rotation for C{retryInterval} seconds.
+        """
+        if replica in self._down:
+            return
+        log.msg('adbapi replica out of rotation: %s' % (replica.dbapiName,))
+        self._down[replica] = self._reactor.callLater(
+            self.retryInterval, self.markUp, replica)
+
+
+    def markUp(self, replica):
+        """
+        Put a replica back into rotation.
+        """
+        call = self._down.pop(replica, None)
+        if call is not None and call.active():
+            call.cancel()
+
+
+    def runQuery(self, *args, **kw):
+        """
+        Run L{ConnectionPool.runQuery} on a replica, or on the primary if
+        no replica is available.
+        """
+        replica = self.pickReplica()
+        if replica is None:
+            return self.primary.runQuery(*args, **kw)
+        d = replica.runQuery(*args, **kw)
+        d.addErrback(self._queryFailed, replica, args, kw)
+        return d
+
+
+    def _queryFailed(self, reason, replica, args, kw):
+        if not self.isConnectionError(replica, reason):
+            return reason
+        self.markDown(replica)
+        return self.runQuery(*args, **kw)
+
+
+    def runOperation(self, *args, **kw):
+        return self.primary.runOperation(*args, **kw)
+
+
+    def runBatchedOperation(self, sql, params):
+        return self.primary.runBatchedOperation(sql, params)
+
+
+    def runInteraction(self, interaction, *args, **kw):
+        return self.primary.runInteraction(interaction, *args, **kw)
+
+
+    def runWithConnection(self, func, *args, **kw):
+        return self.primary.runWithConnection(func, *args, **kw)
+
+
+    def start(self):
+        for pool in [self.primary] + self.replicas:
+            pool.start()
+
+
+    def close(self):
+        for call in self._down.values():
+            call.cancel()
+        self._down.clear()
+        for pool in [self.primary] + self.replicas:
+            pool.close()
+
+
+
+class ShardedConnectionPool(object):
+    """
+    A set of pools, each holding a part of the data, chosen by a key.
+
+    Each method takes the sharding key (for example a user id) as its first
+    argument, followed by the arguments of the same method of
+    L{ConnectionPool}, and runs on the shard for that key.  The shard is
+    chosen by a hash of C{str(key)} which does not change between
+    processes.  A shard may be a L{RoutingConnectionPool}.
+
+    @ivar shards: A C{list} of pools.
+    """
+
+    def __init__(self, shards):
+        self.shards = list(shards)
+
+
+    def shardFor(self, key):
+        """
+        Return the pool which holds the data for C{key}.
+        """
+        digest = md5(str(key)).hexdigest()
+        return self.shards[int(digest[:8], 16) % len(self.shards)]
+
+
+    def runQuery(self, key, *args, **kw):
+        return self.shardFor(key).runQuery(*args, **kw)
+
+
+    def runOperation(self, key, *args, **kw):
+        return self.shardFor(key).runOperation(*args, **kw)
+
+
+    def runBatchedOperation(self, key, sql, params):
+        return self.shardFor(key).runBatchedOperation(sql, params)
+
+
+    def runInteraction(self, key, interaction, *args, **kw):
+        return self.shardFor(key).runInteraction(interaction, *args, **kw)
+
+
+    def runWithConnection(self, key, func, *args, **kw):
+        return self.shardFor(key).runWithConnection(func, *args, **kw)
+
+
+    def start(self):
+        for pool in self.shards:
+            pool.start()
+
+
+    def close(self):
+        for pool in self.shards:
+            pool.close()
+
+
+
 # Common deprecation decorator used for all deprecations.
 _unreleasedVersion = Version("Twisted", 8, 0, 0)
 _unreleasedDeprecation = deprecated(_unreleasedVersion)
@@ -504,4 +1256,5 @@ def safe(text):
 safe = _unreleasedDeprecation(safe)
 
 
-__all__ = ['Transaction', 'ConnectionPool', 'safe']
+__all__ = ['Transaction', 'ConnectionPool', 'RoutingConnectionPool',
+           'ShardedConnectionPool', 'PoolClosed', 'safe']
@@ -0,0 +1,199 @@
+# -*- test-case-name: twisted.test.test_process -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Very low-level ctypes-based interface to C{posix_spawn} of the GNU C library,
+used by L{twisted.internet.process.Process} to start processes without
+forking the interpreter.
+
+glibc starts the child with C{clone(CLONE_VM | CLONE_VFORK)}, which does not
+copy the page tables of the parent, so the cost of starting a process does
+not grow with the size of the parent.  ctypes and Linux are required.
+"""
+
+import os
+import sys
+import errno
+import ctypes
+
+if not sys.platform.startswith('linux'):
+    raise ImportError("posix_spawn is only used on Linux")
+
+POSIX_SPAWN_SETSIGDEF = 0x04
+POSIX_SPAWN_SETSIGMASK = 0x08
+
+# posix_spawn_file_actions_t, posix_spawnattr_t and sigset_t are opaque:
+# these buffers are larger than glibc's structures on any architecture.
+_FileActions = ctypes.c_long * 64
+_Attributes = ctypes.c_long * 128
+_SignalSet = ctypes.c_ulong * 32
+
+
+
+def initializeModule(libc):
+    """
+    Check that C{libc} has C{posix_spawn} and set the argtypes of the
+    functions used.
+
+    @return: A C{tuple} of whether C{libc} has
+        C{posix_spawn_file_actions_addclosefrom_np}, and whether it has
+        C{posix_spawn_file_actions_addchdir_np}.
+    """
+    if getattr(libc, 'posix_spawn', None) is None:
+        raise ImportError("posix_spawn not found")
+    p = ctypes.c_void_p
+    i = ctypes.c_int
+    for name, argtypes in [
+        ('posix_spawn', [ctypes.POINTER(i), ctypes.c_char_p, p, p, p, p]),
+        ('posix_spawn_file_actions_init', [p]),
+        ('posix_spawn_file_actions_destroy', [p]),
+        ('posix_spawn_file_actions_adddup2', [p, i, i]),
+        ('posix_spawn_file_actions_addclose', [p, i]),
+        ('posix_spawnattr_init', [p]),
+        ('posix_spawnattr_destroy', [p]),
+        ('posix_spawnattr_setflags', [p, ctypes.c_short]),
+        ('posix_spawnattr_setsigdefault', [p, p]),
+        ('posix_spawnattr_setsigmask', [p, p]),
+        ('sigemptyset', [p]),
+        ('sigaddset', [p, i])]:
+        getattr(libc, name).argtypes = argtypes
+    canCloseFrom = canChdir = False
+    if getattr(libc, 'posix_spawn_file_actions_addclosefrom_np', None):
+        libc.posix_spawn_file_actions_addclosefrom_np.argtypes = [p, i]
+        canCloseFrom = True
+    if getattr(libc, 'posix_spawn_file_actions_addchdir_np', None):
+        libc.posix_spawn_file_actions_addchdir_np.argtypes = [
+            p, ctypes.c_char_p]
+        canChdir = True
+    return canCloseFrom, canChdir
+
+
+
+def _check(result):
+    """
+    Raise L{OSError} if C{result}, an error number, is not 0.
+    """
+    if result:
+        raise OSError(result, os.strerror(result))
+
+
+
+def findExecutable(executable, environment):
+    """
+    Find C{executable} in the I{PATH} of C{environment} as C{os.execvpe}
+    does, unless it contains a slash.
+
+    @raise OSError: If it is not found.
+    """
+    if os.sep in executable:
+        return executable
+    if environment is None:
+        environment = os.environ
+    for directory in environment.get('PATH', os.defpath).split(os.pathsep):
+        candidate = os.path.join(directory, executable)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+
+
+
+def spawn(executable, args, environment, fdmap, path, defaultSignals,
+          listOpenFDs):
+    """
+    Start a process with C{posix_spawn}.
+
+    @param executable: The executable, found as C{os.execvpe} would.
+    @param args: The arguments of the process.
+    @param environment: The environment of the process, or C{None} for the
+        environment of this process.
+    @param fdmap: A C{dict} mapping descriptors of the child to descriptors
+        of this process; every other descriptor is closed in the child.
+    @param path: The directory to run the process in, or C{None}.
+    @param defaultSignals: The signals to reset to their default action in
+        the child.
+    @param listOpenFDs: A callable returning the descriptors open in this
+        process, used if descriptors cannot be closed in bulk.
+
+    @return: The pid of the process.
+    @raise OSError: If the process cannot be started.
+    """
+    if path and not canChdir:
+        raise OSError(errno.ENOSYS, "posix_spawn cannot change directory")
+    executable = findExecutable(executable, environment)
+    if path and not os.path.isabs(executable):
+        raise OSError(errno.EINVAL, "Relative executable and path")
+    if environment is None:
+        environment = os.environ
+
+    argv = (ctypes.c_char_p * (len(args) + 1))(*(list(args) + [None]))
+    env = ['%s=%s' % item for item in environment.iteritems()]
+    envp = (ctypes.c_char_p * (len(env) + 1))(*(env + [None]))
+
+    actions = _FileActions()
+    _check(libc.posix_spawn_file_actions_init(actions))
+    try:
+        # Move every source out of the way of the targets first, so that
+        # the order of the moves does not matter, then into place.
+        children = fdmap.keys()
+        sources = []
+        for source in fdmap.values():
+            if source not in sources:
+                sources.append(source)
+        spare = max(children + sources + [-1]) + 1
+        temporary = {}
+        for source in sources:
+            temporary[source] = spare
+            _check(libc.posix_spawn_file_actions_adddup2(
+                    actions, source, spare))
+            spare += 1
+        for child in children:
+            _check(libc.posix_spawn_file_actions_adddup2(
+                    actions, temporary[fdmap[child]], child))
+        if canCloseFrom:
+            bound = max(children + [-1]) + 1
+            toClose = range(bound)
+        else:
+            toClose = list(listOpenFDs()) + temporary.values()
+        for fd in toClose:
+            if fd not in fdmap:
+                # glibc ignores descriptors which are not open.
+                _check(libc.posix_spawn_file_actions_addclose(actions, fd))
+        if canCloseFrom:
+            _check(libc.posix_spawn_file_actions_addclosefrom_np(
+                    actions, bound))
+        if path:
+            _check(libc.posix_spawn_file_actions_addchdir_np(actions, path))
+
+        attributes = _Attributes()
+        _check(libc.posix_spawnattr_init(attributes))
+        try:
+            default = _SignalSet()
+            mask = _SignalSet()
+            libc.sigemptyset(default)
+            libc.sigemptyset(mask)
+            for signum in defaultSignals:
+                libc.sigaddset(default, signum)
+            _check(libc.posix_spawnattr_setsigdefault(attributes, default))
+            _check(libc.posix_spawnattr_setsigmask(attributes, mask))
+            _check(libc.posix_spawnattr_setflags(
+                    attributes,
+                    POSIX_SPAWN_SETSIGDEF | POSIX_SPAWN_SETSIGMASK))
+            pid = ctypes.c_int()
+            _check(libc.posix_spawn(ctypes.byref(pid), executable, actions,
+                                    attributes, argv, envp))
+            return pid.value
+        finally:
+            libc.posix_spawnattr_destroy(attributes)
+    finally:
+        libc.posix_spawn_file_actions_destroy(actions)
+
+
+
+# The interpreter is linked with the C library: look posix_spawn up there,
+# rather than with ctypes.util.find_library, which leaks a descriptor.
+try:
+    libc = ctypes.CDLL(None)
+    canCloseFrom, canChdir = initializeModule(libc)
+except (OSError, ImportError):
+    raise ImportError("Can't find posix_spawn.")
@@ -220,6 +220,11 @@ class Deferred:
 
     @ivar _chainedTo: If this Deferred is waiting for the result of another
         Deferred, this is a reference to the other Deferred.  Otherwise, C{None}.
+
+    @ivar callbacks: The callbacks and errbacks not run yet, as
+        C{(callback, callbackArgs, callbackKeywords, errback, errbackArgs,
+        errbackKeywords)} tuples whose arguments and keywords are C{None}
+        when there are none.
     """
 
     called = False
@@ -279,23 +284,31 @@ class Deferred:
         """
         assert callable(callback)
         assert errback == None or callable(errback)
-        cbs = ((callback, callbackArgs, callbackKeywords),
-               (errback or (passthru), errbackArgs, errbackKeywords))
-        self.callbacks.append(cbs)
+        self.callbacks.append((callback, callbackArgs or None,
+                               callbackKeywords or None,
+                               errback or passthru, errbackArgs or None,
+                               errbackKeywords or None))
 
         if self.called:
             self._runCallbacks()
         return self
 
 
+    # The methods below add their callbacks themselves rather than through
+    # addCallbacks, which is measurably slower.
+
     def addCallback(self, callback, *args, **kw):
         """
         Convenience method for adding just a callback.
 
         See L{addCallbacks}.
         """
-        return self.addCallbacks(callback, callbackArgs=args,
-                                 callbackKeywords=kw)
+        assert callable(callback)
+        self.callbacks.append((callback, args or None, kw or None,
+                               passthru, None, None))
+        if self.called:
+            self._runCallbacks()
+        return self
 
 
     def addErrback(self, errback, *args, **kw):
@@ -304,9 +317,12 @@ class Deferred:
 
         See L{addCallbacks}.
         """
-        return self.addCallbacks(passthru, errback,
-                                 errbackArgs=args,
-                                 errbackKeywords=kw)
+        assert callable(errback)
+        self.callbacks.append((passthru, None, None,
+                               errback, args or None, kw or None))
+        if self.called:
+            self._runCallbacks()
+        return self
 
 
     def addBoth(self, callback, *args, **kw):
@@ -316,9 +332,13 @@ class Deferred:
 
         See L{addCallbacks}.
         """
-        return self.addCallbacks(callback, callback,
-                                 callbackArgs=args, errbackArgs=args,
-                                 callbackKeywords=kw, errbackKeywords=kw)
+        assert callable(callback)
+        args = args or None
+        kw = kw or None
+        self.callbacks.append((callback, args, kw, callback, args, kw))
+        if self.called:
+            self._runCallbacks()
+        return self
 
 
     def chainDeferred(self, d):
@@ -463,8 +483,7 @@ class Deferred:
         Build a tuple of callback and errback with L{_continue} to be used by
         L{_addContinue} and L{_removeContinue} on another Deferred.
         """
-        return ((_CONTINUE, (self,), None),
-                (_CONTINUE, (self,), None))
+        return (_CONTINUE, (self,), None, _CONTINUE, (self,), None)
 
 
     def _runCallbacks(self):
@@ -497,6 +516,15 @@ class Deferred:
             # Don't recursively run callbacks
             return
 
+        Failure = failure.Failure
+        if (not self.callbacks and not self.paused
+            and self._debugInfo is None
+            and not isinstance(self.result, Failure)):
+            # Nothing to run and nothing to record: the common case of a
+            # Deferred fired before any callback is added.
+            self._chainedTo = None
+            return
+
         # Keep track of all the Deferreds encountered while propagating results
         # up a chain.  The way a Deferred gets onto this stack is by having
         # added its _continuation() to the callbacks list of a second Deferred
@@ -515,69 +543,89 @@ class Deferred:
 
             finished = True
             current._chainedTo = None
-            while current.callbacks:
-                item = current.callbacks.pop(0)
-                callback, args, kw = item[
-                    isinstance(current.result, failure.Failure)]
-                args = args or ()
-                kw = kw or {}
-
-                # Avoid recursion if we can.
-                if callback is _CONTINUE:
-                    # Give the waiting Deferred our current result and then
-                    # forget about that result ourselves.
-                    chainee = args[0]
-                    chainee.result = current.result
-                    current.result = None
-                    # Making sure to update _debugInfo
-                    if current._debugInfo is not None:
-                        current._debugInfo.failResult = None
-                    chainee.paused -= 1
-                    chain.append(chainee)
-                    # Delay cleaning this Deferred and popping it from the chain
-                    # until after we've dealt with chainee.
-                    finished = False
-                    break
+            # Callbacks are run in order and only removed from the list once
+            # the loop stops, rather than popped from its front one by one,
+            # which takes time proportional to the length of the list.
+            callbacks = current.callbacks
+            ran = 0
+            try:
+                while ran < len(callbacks):
+                    item = callbacks[ran]
+                    ran += 1
+                    if isinstance(current.result, Failure):
+                        callback, args, kw = item[3], item[4], item[5]
+                    else:
+                        callback, args, kw = item[0], item[1], item[2]
+
+                    # Avoid recursion if we can.
+                    if callback is _CONTINUE:
+                        # Give the waiting Deferred our current result and then
+                        # forget about that result ourselves.
+                        chainee = args[0]
+                        chainee.result = current.result
+                        current.result = None
+                        # Making sure to update _debugInfo
+                        if current._debugInfo is not None:
+                            current._debugInfo.failResult = None
+                        chainee.paused -= 1
+                        chain.append(chainee)
+                        # Delay cleaning this Deferred and popping it from the
+                        # chain until after we've dealt with chainee.
+                        finished = False
+                        break
 
-                try:
-                    current._runningCallbacks = True
                     try:
-                        current.result = callback(current.result, *args, **kw)
-                    finally:
-                        current._runningCallbacks = False
-                except:
-                    # Including full frame information in the Failure is quite
-                    # expensive, so we avoid it unless self.debug is set.
-                    current.result = failure.Failure(captureVars=self.debug)
-                else:
-                    if isinstance(current.result, Deferred):
-                        # The result is another Deferred.  If it has a result,
-                        # we can take it and keep going.
-                        resultResult = getattr(current.result, 'result', _NO_RESULT)
-                        if resultResult is _NO_RESULT or isinstance(resultResult, Deferred) or current.result.paused:
-                            # Nope, it didn't.  Pause and chain.
-                            current.pause()
-                            current._chainedTo = current.result
-                            # Note: current.result has no result, so it's not
-                            # running its callbacks right now.  Therefore we can
-                            # append to the callbacks list directly instead of
-                            # using addCallbacks.
-                            current.result.callbacks.append(current._continuation())
-                            break
-                        else:
-                            # Yep, it did.  Steal it.
-                            current.result.result = None
-                            # Make sure _debugInfo's failure state is updated.
-                            if current.result._debugInfo is not None:
-                                current.result._debugInfo.failResult = None
-                            current.result = resultResult
+                        current._runningCallbacks = True
+                        try:
+                            if args is None and kw is None:
+                                current.result = callback(current.result)
+                            else:
+                                current.result = callback(current.result,
+                                                          *(args or ()),
+                                                          **(kw or {}))
+                        finally:
+                            current._runningCallbacks = False
+                    except:
+                        # Including full frame information in the Failure is
+                        # quite expensive, so we avoid it unless self.debug is
+                        # set.
+                        current.result = Failure(captureVars=self.debug)
+                    else:
+                        if isinstance(current.result, Deferred):
+                            # The result is another Deferred.  If it has a
+                            # result, we can take it and keep going.
+                            resultResult = getattr(current.result, 'result',
+                                                   _NO_RESULT)
+                            if (resultResult is _NO_RESULT
+                                or isinstance(resultResult, Deferred)
+                                or current.result.paused):
+                                # Nope, it didn't.  Pause and chain.
+                                current.pause()
+                                current._chainedTo = current.result
+                                # Note: current.result has no result, so it's
+                                # not running its callbacks right now.
+                                # Therefore we can append to the callbacks list
+                                # directly instead of using addCallbacks.
+                                current.result.callbacks.append(
+                                    current._continuation())
+                                break
+                            else:
+                                # Yep, it did.  Steal it.
+                                current.result.result = None
+                                # Make sure _debugInfo's failure state is
+                                # updated.
+                                if current.result._debugInfo is not None:
+                                    current.result._debugInfo.failResult = None
+                                current.result = resultResult
+            finally:
+                del callbacks[:ran]
 
             if finished:
                 # As much of the callback chain - perhaps all of it - as can be
                 # processed right now has been.  The current Deferred is waiting on
                 # another Deferred or for more callbacks.  Before finishing with it,
                 # make sure its _debugInfo is in the proper state.
-                if isinstance(current.result, failure.Failure):
+                if isinstance(current.result, Failure):
                     # Stash the Failure in the _debugInfo for unhandled error
                     # reporting.
                     current.result.cleanFailure()
@@ -839,6 +887,158 @@ def gatherResults(deferredList, consumeErrors=False):
 
 
 
+class _ParallelMap(object):
+    """
+    The state of a L{parallelMap} call.
+
+    @ivar deferred: The L{Deferred} returned by L{parallelMap}.
+    @ivar running: A C{dict} mapping the index of each item whose result is
+        not known yet to the L{Deferred} of its result.
+    @ivar results: The C{(index, result)} pairs known so far, or C{None} if
+        they are given to C{consumer}.
+    @ivar _stopped: Whether no more items are to be mapped, because the
+        L{Deferred} returned was cancelled or is about to fail.
+    @ivar _filling: Whether L{_fill} is running, so that results known at
+        once are not followed by a recursive call to it.
+    """
+
+    def __init__(self, f, iterable, concurrency, consumer, fireOnOneErrback):
+        self.f = f
+        self.iterator = iter(iterable)
+        self.concurrency = concurrency
+        self.consumer = consumer
+        self.fireOnOneErrback = fireOnOneErrback
+        self.running = {}
+        if consumer is None:
+            self.results = []
+        else:
+            self.results = None
+        self.deferred = Deferred(self._cancel)
+        self._index = 0
+        self._exhausted = False
+        self._stopped = False
+        self._filling = False
+
+
+    def _fill(self):
+        """
+        Call C{f} with items of the iterable until C{concurrency} results
+        are awaited, and fire L{deferred} once every result is known.
+        """
+        if self._filling:
+            return
+        self._filling = True
+        try:
+            while (not self._exhausted and not self._stopped
+                   and len(self.running) < self.concurrency):
+                try:
+                    item = self.iterator.next()
+                except StopIteration:
+                    self._exhausted = True
+                    break
+                except:
+                    self._stop(failure.Failure())
+                    return
+                index = self._index
+                self._index += 1
+                d = self.running[index] = maybeDeferred(self.f, item)
+                d.addBoth(self._done, index)
+        finally:
+            self._filling = False
+        if self._exhausted and not self.running and not self._stopped:
+            self.deferred.callback(self.results)
+
+
+    def _done(self, result, index):
+        """
+        Give the result of an item to the consumer, or keep it, and map more
+        items.
+        """
+        del self.running[index]
+        if self._stopped:
+            return None
+        if self.fireOnOneErrback and isinstance(result, failure.Failure):
+            self._stop(failure.Failure(FirstError(result, index)))
+        elif self.consumer is None:
+            self.results.append((index, result))
+            self._fill()
+        else:
+            try:
+                self.consumer(index, result)
+            except:
+                self._stop(failure.Failure())
+            else:
+                self._fill()
+        return None
+
+
+    def _stop(self, reason):
+        """
+        Stop mapping, cancel the calls whose result is awaited and fail with
+        C{reason}.
+        """
+        self._cancel(self.deferred)
+        self.deferred.errback(reason)
+
+
+    def _cancel(self, deferred):
+        self._stopped = True
+        for d in self.running.values():
+            d.cancel()
+
+
+
+def parallelMap(f, iterable, concurrency, consumer=None,
+                fireOnOneErrback=False):
+    """
+    Call C{f} with each item of C{iterable}, with at most C{concurrency}
+    calls whose result is awaited at any time.
+
+    Items are only taken from C{iterable} when there is room for another
+    call, so it may be a generator of any length.  C{f} may return a
+    L{Deferred}, return a result or raise an exception, as with
+    L{maybeDeferred}.
+
+    Results are known in the order their calls complete.  Each result is
+    given, with the index of its item, to C{consumer} if it is given, and
+    only up to C{concurrency} results are ever kept.  Otherwise the
+    L{Deferred} returned fires with a list of C{(index, result)} pairs.
+    Unless C{fireOnOneErrback} is set, failures are results like any other.
+
+    Cancelling the L{Deferred} returned stops taking items and cancels the
+    calls whose result is awaited.
+
+    @param f: A callable taking one item.
+
+    @param iterable: The items.
+
+    @param concurrency: The largest number of calls whose result is awaited
+        at once.
+    @type concurrency: C{int}
+
+    @param consumer: A callable called with the index of an item and its
+        result, or C{None}.  If it raises an exception, mapping stops and
+        the L{Deferred} returned fails with it.
+
+    @param fireOnOneErrback: If set, the first failing call stops the
+        mapping, cancels the calls whose result is awaited and makes the
+        L{Deferred} returned fail with a L{FirstError} wrapping its
+        failure.
+    @type fireOnOneErrback: C{bool}
+
+    @return: A L{Deferred} which fires with the list of results, or C{None}
+        if C{consumer} is given, once every item is mapped.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1, not %r" % (
+                concurrency,))
+    state = _ParallelMap(f, iterable, concurrency, consumer,
+                         fireOnOneErrback)
+    state._fill()
+    return state.deferred
+
+
+
 # Constants for use with DeferredList
 
 SUCCESS = True
@@ -1029,6 +1229,13 @@ def _inlineCallbacks(result, g, deferred):
     waiting = [True, # waiting for result?
                None] # result
 
+    def gotResult(r):
+        if waiting[0]:
+            waiting[0] = False
+            waiting[1] = r
+        else:
+            _inlineCallbacks(r, g, deferred)
+
     while 1:
         try:
             # Send the last result back as the result of the yield expression.
@@ -1087,12 +1294,18 @@ def _inlineCallbacks(result, g, deferred):
 
         if isinstance(result, Deferred):
             # a deferred was yielded, get the result.
-            def gotResult(r):
-                if waiting[0]:
-                    waiting[0] = False
-                    waiting[1] = r
-                else:
-                    _inlineCallbacks(r, g, deferred)
+            resultResult = getattr(result, 'result', _NO_RESULT)
+            if (not result.callbacks and not result.paused
+                and not result._runningCallbacks
+                and resultResult is not _NO_RESULT
+                and not isinstance(resultResult, Deferred)):
+                # It already has one: take it as _runCallbacks would, without
+                # going through a callback.
+                result.result = None
+                if result._debugInfo is not None:
+                    result._debugInfo.failResult = None
+                result = resultResult
+                continue
 
             result.addBoth(gotResult)
             if waiting[0]:
@@ -1547,7 +1760,7 @@ class DeferredFilesystemLock(lockfile.FilesystemLock):
 
 __all__ = ["Deferred", "DeferredList", "succeed", "fail", "FAILURE", "SUCCESS",
            "AlreadyCalledError", "TimeoutError", "gatherResults",
-           "maybeDeferred",
+           "parallelMap", "maybeDeferred",
            "waitForDeferred", "deferredGenerator", "inlineCallbacks",
            "returnValue",
            "DeferredLock", "DeferredSemaphore", "DeferredQueue",
@@ -32,6 +32,11 @@ from twisted.internet.main import CONNECTION_LOST, CONNECTION_DONE
 from twisted.internet._baseprocess import BaseProcess
 from twisted.internet.interfaces import IProcessTransport
 
+try:
+    from twisted.internet import _posixspawn
+except ImportError:
+    _posixspawn = None
+
 # Some people were importing this, which is incorrect, just keeping it
 # here for backwards compatibility:
 ProcessExitedAlready = error.ProcessExitedAlready
@@ -601,11 +606,19 @@ class Process(_BaseProcess):
     and fcntl(). These calls may not exist elsewhere so this
     code is not cross-platform. (also, windows can only select
     on sockets...)
+
+    On Linux, processes which need no more than their descriptors, their
+    environment and their directory set up are started with posix_spawn()
+    instead of fork(), which is much faster in a large process.
+
+    @ivar usePosixSpawn: Whether to start processes with posix_spawn() when
+        possible.
     """
     implements(IProcessTransport)
 
     debug = False
     debug_child = False
+    usePosixSpawn = True
 
     status = -1
     pid = None
@@ -680,7 +693,7 @@ class Process(_BaseProcess):
             if debug: print "helpers", helpers
             # the child only cares about fdmap.values()
 
-            self._fork(path, uid, gid, executable, args, environment, fdmap=fdmap)
+            self._spawn(path, uid, gid, executable, args, environment, fdmap)
         except:
             map(os.close, _openedPipes)
             raise
@@ -716,6 +729,40 @@ class Process(_BaseProcess):
         registerReapProcessHandler(self.pid, self)
 
 
+    def _canSpawn(self, uid, gid):
+        """
+        Return whether the process can be started with posix_spawn(): only
+        when neither the user nor the way the child is set up change.
+        """
+        cls = self.__class__
+        return (_posixspawn is not None and self.usePosixSpawn
+                and not self.debug_child and uid is None and gid is None
+                and cls._setupChild.im_func is Process._setupChild.im_func
+                and cls._execChild.im_func is _BaseProcess._execChild.im_func)
+
+
+    def _spawn(self, path, uid, gid, executable, args, environment, fdmap):
+        """
+        Start the process with posix_spawn() if possible, else with
+        L{_fork}.
+        """
+        if self._canSpawn(uid, gid):
+            defaultSignals = [
+                signum for signum in range(1, signal.NSIG)
+                if signal.getsignal(signum) == signal.SIG_IGN]
+            try:
+                self.pid = _posixspawn.spawn(
+                    executable, args, environment, fdmap, path,
+                    defaultSignals, _listOpenFDs)
+            except OSError:
+                # Let the child started by _fork report the error, as usual.
+                pass
+            else:
+                self.status = -1
+                return
+        self._fork(path, uid, gid, executable, args, environment, fdmap=fdmap)
+
+
     def _setupChild(self, fdmap):
         """
         fdmap[childFD] = parentFD
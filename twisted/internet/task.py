@@ -11,15 +11,21 @@ Scheduling utility methods and classes.
 __metaclass__ = type
 
 import time
+import random
 
 from zope.interface import implements
 
-from twisted.python import reflect
+from twisted.python import reflect, log
 from twisted.python.failure import Failure
 
 from twisted.internet import base, defer
 from twisted.internet.interfaces import IReactorTime
 
+try:
+    from twisted.python._monotonic import monotonic as _monotonic
+except ImportError:
+    _monotonic = time.time
+
 
 class LoopingCall:
     """Call a function repeatedly.
@@ -247,6 +253,246 @@ class LoopingCall:
 
 
 
+class PeriodicTask(object):
+    """
+    A function called periodically by a L{PeriodicScheduler}.
+
+    If the function returns a L{defer.Deferred}, the task is not called
+    again until it fires; the iterations meanwhile are skipped.  If the
+    function raises an exception or the L{defer.Deferred} fails, the task
+    stops.
+
+    @ivar interval: The number of seconds between calls.
+    @ivar f: The function to call.
+    @ivar a: A tuple of arguments to pass the function.
+    @ivar kw: A dictionary of keyword arguments to pass the function.
+    @ivar running: Whether the task is still to be called.
+    @ivar calls: The number of calls made so far.
+    @ivar skipped: The number of iterations in which no call was made,
+        because the reactor was too busy to make it in time or because the
+        L{defer.Deferred} of the previous call had not fired.
+    @ivar late: The number of seconds by which the last call was late.
+    @ivar deferred: A L{defer.Deferred} which fires with the task when it
+        is stopped, or fails with the failure of a call.  C{None} once the
+        task stopped.
+
+    @ivar _group: The L{_PeriodicGroup} which calls the task.
+    @ivar _waiting: Whether the L{defer.Deferred} of the last call is yet
+        to fire.
+    """
+
+    def __init__(self, group, f, a, kw):
+        self.interval = group.interval
+        self.f = f
+        self.a = a
+        self.kw = kw
+        self.running = True
+        self.calls = 0
+        self.skipped = 0
+        self.late = 0.0
+        self.deferred = defer.Deferred()
+        self._group = group
+        self._waiting = False
+
+
+    def stop(self):
+        """
+        Stop calling the function.
+        """
+        assert self.running, ("Tried to stop a PeriodicTask that was "
+                              "not running.")
+        self._finish()
+        d, self.deferred = self.deferred, None
+        d.callback(self)
+
+
+    def _finish(self):
+        self.running = False
+        self._group._taskFinished()
+
+
+    def _call(self, late):
+        """
+        Call the function, unless the previous call has not finished.
+        """
+        if self._waiting:
+            self.skipped += 1
+            return
+        self.calls += 1
+        self.late = late
+        try:
+            result = self.f(*self.a, **self.kw)
+        except:
+            self._failed(Failure())
+        else:
+            if isinstance(result, defer.Deferred):
+                self._waiting = True
+                result.addCallbacks(self._finished, self._failed)
+
+
+    def _finished(self, ignored):
+        self._waiting = False
+
+
+    def _failed(self, reason):
+        self._waiting = False
+        if not self.running:
+            return reason
+        self._finish()
+        d, self.deferred = self.deferred, None
+        d.errback(reason)
+
+
+    def __repr__(self):
+        return 'PeriodicTask<%r>(%s, *%s, **%s)' % (
+            self.interval, reflect.safe_repr(self.f),
+            reflect.safe_repr(self.a), reflect.safe_repr(self.kw))
+
+
+
+class _PeriodicGroup(object):
+    """
+    The L{PeriodicTask}s of a L{PeriodicScheduler} with the same interval
+    and phase, which are all called by the same delayed call.
+
+    @ivar nextAt: When the tasks are next to be called, on the clock of the
+        scheduler.
+    @ivar tasks: The tasks, as well as those stopped since the last call.
+    @ivar count: The number of running tasks.
+    @ivar call: The delayed call of the next call, or C{None}.
+    """
+
+    def __init__(self, scheduler, key, interval, phase):
+        self.scheduler = scheduler
+        self.key = key
+        self.interval = interval
+        self.nextAt = scheduler.seconds() + interval + phase
+        self.tasks = []
+        self.count = 0
+        self.call = None
+
+
+    def add(self, task):
+        self.tasks.append(task)
+        self.count += 1
+        if self.count == 1:
+            self._schedule(self.scheduler.seconds())
+
+
+    def _taskFinished(self):
+        self.count -= 1
+        if not self.count:
+            if self.call is not None:
+                self.call.cancel()
+                self.call = None
+            del self.scheduler._groups[self.key]
+
+
+    def _schedule(self, now):
+        self.call = self.scheduler.clock.callLater(
+            max(self.nextAt - now, 0), self._tick)
+
+
+    def _tick(self):
+        """
+        Call the tasks, counting the iterations missed since the last call,
+        and schedule the next call at the next multiple of the interval.
+        """
+        self.call = None
+        now = self.scheduler.seconds()
+        if now < self.nextAt:
+            # The reactor's clock went faster than ours.
+            self._schedule(now)
+            return
+        missed, late = divmod(now - self.nextAt, self.interval)
+        missed = int(missed)
+        self.nextAt += (missed + 1) * self.interval
+        tasks, self.tasks = self.tasks, []
+        running = []
+        for task in tasks:
+            if task.running:
+                task.skipped += missed
+                task._call(late)
+                if task.running:
+                    running.append(task)
+        if self.count:
+            self.tasks[:0] = running
+            self._schedule(now)
+
+
+
+class PeriodicScheduler(object):
+    """
+    Call many functions periodically, with one delayed call for all the
+    functions with the same interval and phase.
+
+    Calls are scheduled on a monotonic clock, so that setting the time of the
+    system neither skips nor repeats them, and at fixed multiples of their
+    interval, so that they do not drift.  When the reactor is too busy to
+    make a call in time, it is made once, late, and the iterations missed
+    are counted in L{PeriodicTask.skipped}.
+
+    @ivar clock: A provider of L{IReactorTime} to schedule calls with.
+    @ivar seconds: A callable returning the time on the monotonic clock.
+    @ivar jitter: The largest part of its interval by which the calls of a
+        new task are delayed, at random, so that tasks added at once are not
+        all called at once.
+    @ivar resolution: The number of seconds the random delays are rounded
+        to; the tasks whose delay is the same share their calls.
+
+    @ivar _groups: A C{dict} mapping C{(interval, phase)} to
+        L{_PeriodicGroup}s.
+    """
+
+    def __init__(self, clock=None, seconds=None, jitter=0.0,
+                 resolution=0.01):
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+        if seconds is None:
+            seconds = _monotonic
+        self.clock = clock
+        self.seconds = seconds
+        self.jitter = jitter
+        self.resolution = resolution
+        self._groups = {}
+        self._random = random.random
+
+
+    def add(self, interval, f, *a, **kw):
+        """
+        Call C{f(*a, **kw)} every C{interval} seconds, starting within
+        C{interval} seconds plus the jitter.
+
+        @return: A L{PeriodicTask}.
+        """
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+        phase = 0.0
+        if self.jitter:
+            phase = self.resolution * round(
+                self._random() * self.jitter * interval / self.resolution)
+        key = (interval, phase)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _PeriodicGroup(
+                self, key, interval, phase)
+        task = PeriodicTask(group, f, a, kw)
+        group.add(task)
+        return task
+
+
+    def stop(self):
+        """
+        Stop every task.
+        """
+        for group in self._groups.values():
+            for task in group.tasks:
+                if task.running:
+                    task.stop()
+
+
+
 class SchedulerError(Exception):
     """
     The operation could not be completed because the scheduler or one of its
@@ -305,8 +551,10 @@ class NotPaused(SchedulerError):
 
 class _Timer(object):
     MAX_SLICE = 0.01
-    def __init__(self):
-        self.end = time.time() + self.MAX_SLICE
+    def __init__(self, timeSlice=None):
+        if timeSlice is None:
+            timeSlice = self.MAX_SLICE
+        self.end = time.time() + timeSlice
 
 
     def __call__(self):
@@ -320,6 +568,14 @@ def _defaultScheduler(x):
     return reactor.callLater(_EPSILON, x)
 
 
+
+# The priorities of cooperative tasks: in each round of a Cooperator, a task
+# does as many units of work as its priority.
+LOW_PRIORITY = 1
+NORMAL_PRIORITY = 2
+HIGH_PRIORITY = 4
+
+
 class CooperativeTask(object):
     """
     A L{CooperativeTask} is a task object inside a L{Cooperator}, which can be
@@ -354,15 +610,34 @@ class CooperativeTask(object):
         L{StopIteration}.
 
     @type _completionState: L{TaskFinished}
+
+    @ivar priority: The number of units of work this task does in each round
+        of its L{Cooperator}, such as L{LOW_PRIORITY}, L{NORMAL_PRIORITY} or
+        L{HIGH_PRIORITY}.
+    @type priority: C{int}
+
+    @ivar workUnits: The number of units of work done so far.
+    @type workUnits: C{int}
+
+    @ivar timeSpent: The number of seconds spent doing them.
+    @type timeSpent: C{float}
     """
 
-    def __init__(self, iterator, cooperator):
+    def __init__(self, iterator, cooperator, priority=NORMAL_PRIORITY):
         """
         A private constructor: to create a new L{CooperativeTask}, see
         L{Cooperator.cooperate}.
+
+        @raise ValueError: If C{priority} is less than 1.
         """
+        if priority < 1:
+            raise ValueError("priority must be at least 1, not %r" % (
+                    priority,))
         self._iterator = iterator
         self._cooperator = cooperator
+        self.priority = priority
+        self.workUnits = 0
+        self.timeSpent = 0.0
         self._deferreds = []
         self._pauseCount = 0
         self._completionState = None
@@ -487,12 +762,42 @@ class CooperativeTask(object):
 class Cooperator(object):
     """
     Cooperative task scheduler.
+
+    Tasks take turns in rounds, higher priorities first, and do as many units
+    of work in each round as their priority, so that tasks of a lower
+    priority are slowed down but never starved.  Tasks of the same priority
+    simply alternate.
+
+    @ivar monitor: A callable called after each step with each task which
+        did work in it, the number of units of work it did and the number of
+        seconds they took, or C{None}.
+
+    @ivar targetLatency: The number of seconds each iteration of the reactor
+        should take, steps included, or C{None} if steps are bounded by the
+        termination predicate instead.
+
+    @ivar loopLag: The number of seconds steps wait for, once scheduled, on
+        average.  This is the time the reactor spends on other work between
+        two steps.
+
+    @ivar timeSlice: The number of seconds the last step was allowed to run
+        for, if C{targetLatency} is set.
     """
 
+    # How much each new measure of the lag weighs in loopLag.
+    _lagSmoothing = 0.25
+
+    loopLag = 0.0
+    timeSlice = None
+    _scheduledAt = None
+    _now = staticmethod(time.time)
+
     def __init__(self,
                  terminationPredicateFactory=_Timer,
                  scheduler=_defaultScheduler,
-                 started=True):
+                 started=True,
+                 targetLatency=None,
+                 monitor=None):
         """
         Create a scheduler-like object to which iterators may be added.
 
@@ -509,6 +814,16 @@ class Cooperator(object):
         @param started: A boolean which indicates whether iterators should be
         stepped as soon as they are added, or if they will be queued up until
         L{Cooperator.start} is called.
+
+        @param targetLatency: If given, the number of seconds each iteration
+        of the reactor should take.  Each step then runs for what is left of
+        it once the time the reactor spends on other work, as measured by
+        C{loopLag}, is taken off, but at least a tenth of it, and
+        C{terminationPredicateFactory} is not used.
+
+        @param monitor: A callable called after each step with each task
+        which did work in it, the number of units of work it did and the
+        number of seconds they took.
         """
         self._tasks = []
         self._metarator = iter(())
@@ -517,9 +832,12 @@ class Cooperator(object):
         self._delayedCall = None
         self._stopped = False
         self._started = started
+        self.targetLatency = targetLatency
+        self.monitor = monitor
 
 
-    def coiterate(self, iterator, doneDeferred=None):
+    def coiterate(self, iterator, doneDeferred=None,
+                  priority=NORMAL_PRIORITY):
         """
         Add an iterator to the list of iterators this L{Cooperator} is
         currently running.
@@ -528,36 +846,54 @@ class Cooperator(object):
             the completion deferred.  It is suggested that you use the default,
             which creates a new Deferred for you.
 
+        @param priority: The priority of the new task.
+
         @return: a Deferred that will fire when the iterator finishes.
+
+        @raise ValueError: If C{priority} is less than 1.
         """
         if doneDeferred is None:
             doneDeferred = defer.Deferred()
-        CooperativeTask(iterator, self).whenDone().chainDeferred(doneDeferred)
+        CooperativeTask(iterator, self, priority).whenDone().chainDeferred(
+            doneDeferred)
         return doneDeferred
 
 
-    def cooperate(self, iterator):
+    def cooperate(self, iterator, priority=NORMAL_PRIORITY):
         """
         Start running the given iterator as a long-running cooperative task, by
         calling next() on it as a periodic timed event.
 
         @param iterator: the iterator to invoke.
 
+        @param priority: The priority of the new task: L{LOW_PRIORITY},
+            L{NORMAL_PRIORITY}, L{HIGH_PRIORITY} or another positive
+            integer.
+
         @return: a L{CooperativeTask} object representing this task.
+
+        @raise ValueError: If C{priority} is less than 1.
         """
-        return CooperativeTask(iterator, self)
+        return CooperativeTask(iterator, self, priority)
 
 
     def _addTask(self, task):
         """
-        Add a L{CooperativeTask} object to this L{Cooperator}.
+        Add a L{CooperativeTask} object to this L{Cooperator}, after the
+        tasks of the same or a higher priority.
         """
+        tasks = self._tasks
+        if not tasks or tasks[-1].priority >= task.priority:
+            tasks.append(task)
+        else:
+            for index, other in enumerate(tasks):
+                if other.priority < task.priority:
+                    tasks.insert(index, task)
+                    break
         if self._stopped:
-            self._tasks.append(task) # XXX silly, I know, but _completeWith
-                                     # does the inverse
+            # XXX silly, I know, but _completeWith does the inverse
             task._completeWith(SchedulerStopped(), Failure(SchedulerStopped()))
         else:
-            self._tasks.append(task)
             self._reschedule()
 
 
@@ -572,18 +908,47 @@ class Cooperator(object):
             self._delayedCall = None
 
 
+    def _round(self):
+        """
+        Return an iterator over the L{CooperativeTask} objects to do one unit
+        of work each, as many times each as its priority, in one round.
+        """
+        tasks = self._tasks
+        if not tasks or tasks[0].priority == tasks[-1].priority:
+            return iter(tasks)
+        return self._weightedRound(list(tasks))
+
+
+    def _weightedRound(self, tasks):
+        """
+        Yield each of C{tasks}, sorted by decreasing priority, as many times as
+        its priority, unless it is paused or done by then.
+        """
+        for turn in range(tasks[0].priority):
+            for t in tasks:
+                if t.priority <= turn:
+                    break
+                if not t._pauseCount and t._completionState is None:
+                    yield t
+
+
     def _tasksWhileNotStopped(self):
         """
         Yield all L{CooperativeTask} objects in a loop as long as this
         L{Cooperator}'s termination condition has not been met.
         """
-        terminator = self._terminationPredicateFactory()
+        if self.targetLatency is None:
+            terminator = self._terminationPredicateFactory()
+        else:
+            self.timeSlice = max(self.targetLatency - self.loopLag,
+                                 self.targetLatency / 10)
+            terminator = _Timer(self.timeSlice)
         while self._tasks:
             for t in self._metarator:
                 yield t
                 if terminator():
                     return
-            self._metarator = iter(self._tasks)
+            self._metarator = self._round()
 
 
     def _tick(self):
@@ -591,8 +956,31 @@ class Cooperator(object):
         Run one scheduler tick.
         """
         self._delayedCall = None
+        now = self._now
+        last = now()
+        if self._scheduledAt is not None:
+            self.loopLag += (
+                (last - self._scheduledAt - self.loopLag) * self._lagSmoothing)
+            self._scheduledAt = None
+        monitor = self.monitor
+        if monitor is not None:
+            ticked = {}
         for taskObj in self._tasksWhileNotStopped():
             taskObj._oneWorkUnit()
+            current = now()
+            elapsed = current - last
+            last = current
+            taskObj.workUnits += 1
+            taskObj.timeSpent += elapsed
+            if monitor is not None:
+                units, spent = ticked.get(taskObj, (0, 0.0))
+                ticked[taskObj] = (units + 1, spent + elapsed)
+        if monitor is not None:
+            for taskObj, (units, spent) in ticked.iteritems():
+                try:
+                    monitor(taskObj, units, spent)
+                except:
+                    log.err(None, "Error in Cooperator monitor")
         self._reschedule()
 
 
@@ -602,6 +990,7 @@ class Cooperator(object):
             self._mustScheduleOnStart = True
             return
         if self._delayedCall is None and self._tasks:
+            self._scheduledAt = self._now()
             self._delayedCall = self._scheduler(self._tick)
 
 
@@ -634,26 +1023,35 @@ class Cooperator(object):
 
 _theCooperator = Cooperator()
 
-def coiterate(iterator):
+def coiterate(iterator, priority=NORMAL_PRIORITY):
     """
     Cooperatively iterate over the given iterator, dividing runtime between it
     and all other iterators which have been passed to this function and not yet
     exhausted.
+
+    @param priority: The priority of the new task.
+
+    @raise ValueError: If C{priority} is less than 1.
     """
-    return _theCooperator.coiterate(iterator)
+    return _theCooperator.coiterate(iterator, priority=priority)
 
 
 
-def cooperate(iterator):
+def cooperate(iterator, priority=NORMAL_PRIORITY):
     """
     Start running the given iterator as a long-running cooperative task, by
     calling next() on it as a periodic timed event.
 
     @param iterator: the iterator to invoke.
 
+    @param priority: The priority of the new task: L{LOW_PRIORITY},
+        L{NORMAL_PRIORITY}, L{HIGH_PRIORITY} or another positive integer.
+
     @return: a L{CooperativeTask} object representing this task.
+
+    @raise ValueError: If C{priority} is less than 1.
     """
-    return _theCooperator.cooperate(iterator)
+    return _theCooperator.cooperate(iterator, priority)
 
 
 
@@ -772,11 +1170,12 @@ def deferLater(clock, delay, callable, *args, **kw):
 
 
 __all__ = [
-    'LoopingCall',
+    'LoopingCall', 'PeriodicScheduler', 'PeriodicTask',
 
     'Clock',
 
-    'SchedulerStopped', 'Cooperator', 'coiterate',
+    'SchedulerStopped', 'Cooperator', 'coiterate', 'cooperate',
+    'LOW_PRIORITY', 'NORMAL_PRIORITY', 'HIGH_PRIORITY',
 
     'deferLater',
     ]
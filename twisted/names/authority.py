@@ -8,6 +8,7 @@ Authoritative resolvers.
 
 import os
 import time
+from bisect import bisect_left
 
 from twisted.names import dns
 from twisted.internet import defer
@@ -59,11 +60,39 @@ def getSerial(filename = '/tmp/twisted-names.serial'):
 #            return r
 
 
+def _reverseName(name):
+    """
+    Return a name with its labels in reverse order, so that sorting reversed
+    names places every name right after its ancestors.
+    """
+    labels = name.split('.')
+    labels.reverse()
+    return '.'.join(labels)
+
+
+
 class FileAuthority(common.ResolverBase):
-    """An Authority that is loaded from a file."""
+    """An Authority that is loaded from a file.
+
+    Besides looking names up in C{records} directly, I answer for names
+    below a delegation to a child zone with a referral, for names without
+    records of their own but with descendants with an empty answer, and for
+    other missing names with the records of a matching wildcard (RFC 1034,
+    section 4.3.3).  To find those, I keep the names in C{records} sorted
+    with their labels reversed.  Code which changes C{records} in place
+    rather than replacing it must call L{recordsChanged} afterwards.
+
+    @ivar _sortedNames: A sorted C{list} of the reversed names in C{records}.
+    @ivar _generation: The number of times L{recordsChanged} was called.
+    @ivar _indexed: The C{records} dict and C{_generation} when
+        C{_sortedNames} was built.
+    """
 
     soa = None
     records = None
+    _sortedNames = None
+    _generation = 0
+    _indexed = None
 
     def __init__(self, filename):
         common.ResolverBase.__init__(self)
@@ -75,6 +104,69 @@ class FileAuthority(common.ResolverBase):
         self.__dict__ = state
 #        print 'setstate ', self.soa
 
+    def recordsChanged(self):
+        """
+        Note that names were added to or removed from C{records}.
+        """
+        self._generation += 1
+
+
+    def _index(self):
+        """
+        Make sure C{_sortedNames} reflects C{records}.
+        """
+        # Compare the dict by identity: comparing it by value would cost as
+        # much as building the index again.
+        if (self._indexed is None or self._indexed[0] is not self.records
+            or self._indexed[1] != self._generation):
+            self._sortedNames = sorted(map(_reverseName, self.records))
+            self._indexed = (self.records, self._generation)
+
+
+    def _hasDescendants(self, name):
+        """
+        Return whether any name in C{records} is below the given lowercase
+        name.
+        """
+        self._index()
+        key = _reverseName(name) + '.'
+        i = bisect_left(self._sortedNames, key)
+        return (i < len(self._sortedNames)
+                and self._sortedNames[i].startswith(key))
+
+
+    def _closestRecords(self, name):
+        """
+        Find the records which answer for a lowercase name in this zone which
+        has no records of its own.
+
+        @return: A tuple of the owner name for the records and a C{list} of
+            them: the I{NS} records of the delegation the name is below, or
+            the records of the wildcard which matches it.  If there are none,
+            the C{list} is empty.
+        """
+        apex = self.soa[0].lower()
+        labels = name[:-len(apex) - 1].split('.')
+
+        # The highest zone cut above the name decides where it is served.
+        for i in range(len(labels) - 1, 0, -1):
+            cut = '.'.join(labels[i:] + [apex])
+            nameservers = [r for r in self.records.get(cut, ())
+                           if r.TYPE == dns.NS]
+            if nameservers:
+                return cut, nameservers
+
+        if self._hasDescendants(name):
+            return name, []
+
+        # A wildcard only matches below the closest existing ancestor.
+        for i in range(1, len(labels) + 1):
+            encloser = '.'.join(labels[i:] + [apex])
+            if encloser in self.records or self._hasDescendants(encloser):
+                return name, self.records.get('*.' + encloser, [])
+        return name, []
+
+
     def _lookup(self, name, cls, type, timeout = None):
         cnames = []
         results = []
@@ -82,7 +174,23 @@ class FileAuthority(common.ResolverBase):
         additional = []
         default_ttl = max(self.soa[1].minimum, self.soa[1].expire)
 
+        owner = name
         domain_records = self.records.get(name.lower())
+        if (not domain_records
+            and name.lower().endswith('.' + self.soa[0].lower())):
+            owner, domain_records = self._closestRecords(name.lower())
+            if not domain_records and self._hasDescendants(name.lower()):
+                # An empty non-terminal: the name exists, without records.
+                if self.soa[1].ttl is not None:
+                    ttl = self.soa[1].ttl
+                else:
+                    ttl = default_ttl
+                authority.append(
+                    dns.RRHeader(self.soa[0], dns.SOA, dns.IN, ttl, self.soa[1], auth=True)
+                    )
+                return defer.succeed((results, authority, additional))
+            if owner == name.lower():
+                owner = name
 
         if domain_records:
             for record in domain_records:
@@ -91,20 +199,20 @@ class FileAuthority(common.ResolverBase):
                 else:
                     ttl = default_ttl
 
-                if record.TYPE == dns.NS and name.lower() != self.soa[0].lower():
+                if record.TYPE == dns.NS and owner.lower() != self.soa[0].lower():
                     # NS record belong to a child zone: this is a referral.  As
                     # NS records are authoritative in the child zone, ours here
                     # are not.  RFC 2181, section 6.1.
                     authority.append(
-                        dns.RRHeader(name, record.TYPE, dns.IN, ttl, record, auth=False)
+                        dns.RRHeader(owner, record.TYPE, dns.IN, ttl, record, auth=False)
                     )
                 elif record.TYPE == type or type == dns.ALL_RECORDS:
                     results.append(
-                        dns.RRHeader(name, record.TYPE, dns.IN, ttl, record, auth=True)
+                        dns.RRHeader(owner, record.TYPE, dns.IN, ttl, record, auth=True)
                     )
                 if record.TYPE == dns.CNAME:
                     cnames.append(
-                        dns.RRHeader(name, record.TYPE, dns.IN, ttl, record, auth=True)
+                        dns.RRHeader(owner, record.TYPE, dns.IN, ttl, record, auth=True)
                     )
             if not results:
                 results = cnames
@@ -179,6 +287,7 @@ class PySourceAuthority(FileAuthority):
             if isinstance(rr[1], dns.Record_SOA):
                 self.soa = rr
             self.records.setdefault(rr[0].lower(), []).append(rr[1])
+        self.recordsChanged()
 
 
     def wrapRecord(self, type):
@@ -254,6 +363,7 @@ class BindAuthority(FileAuthority):
                 raise NotImplementedError('$GENERATE directive not implemented')
             else:
                 self.parseRecordLine(ORIGIN, TTL, line)
+        self.recordsChanged()
 
 
     def addRecord(self, owner, ttl, type, domain, cls, rdata):
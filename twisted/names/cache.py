@@ -1,96 +1,370 @@
-# -*- test-case-name: twisted.names.test -*-
+# -*- test-case-name: twisted.names.test.test_cache -*-
 # Copyright (c) Twisted Matrix Laboratories.
 # See LICENSE for details.
 
+"""
+An in-memory DNS cache.
+"""
 
-import time
+from heapq import heappush, heappop, heapify
 
 from zope.interface import implements
 
 from twisted.names import dns
+from twisted.names.error import DNSNameError
 from twisted.python import failure, log
 from twisted.internet import interfaces, defer
 
 import common
 
+
+class _CacheEntry(object):
+    """
+    A cached response, linked into the least-recently-used order of its
+    L{CacheResolver}.
+
+    @ivar payload: The C{(answers, authority, additional)} tuple, or C{None}
+        for a cached name error.
+    @ivar when: The time the entry was cached.
+    @ivar expires: The time the entry expires, or C{None} if it does not.
+    @ivar hits: The number of lookups the entry has answered.
+    @ivar soa: The I{SOA} L{dns.RRHeader} of the response of a cached name
+        error, or C{None}.
+    """
+    __slots__ = ('query', 'when', 'payload', 'expires', 'hits',
+                 'prev', 'next', 'resultAge', 'result', 'soa')
+
+    def __init__(self, query, when, payload, expires):
+        self.query = query
+        self.when = when
+        self.payload = payload
+        self.expires = expires
+        self.hits = 0
+        self.prev = self.next = None
+        self.resultAge = None
+        self.result = None
+        self.soa = None
+
+
+
 class CacheResolver(common.ResolverBase):
-    """A resolver that serves records from a local, memory cache."""
+    """
+    A resolver that serves records from a local, memory cache.
+
+    At most C{maxEntries} responses are kept; adding more evicts the least
+    recently used ones.  Entries are expired through a single timer for the
+    earliest expiry, rather than one timer per entry.  Name errors which
+    carry an I{SOA} record in their authority section are cached as
+    described by RFC 2308, and reported as a L{dns.AuthoritativeDomainError}
+    whose arguments are the name and a L{dns.Message} with that record, its
+    TTL lowered to the time the error remains cached.
+
+    @ivar cache: A C{dict} mapping L{dns.Query} instances to C{(when,
+        payload)} tuples, where C{payload} is C{None} for cached name errors.
+
+    @ivar maxEntries: The number of responses to keep, or C{None} for no
+        limit.
+
+    @ivar prefetchResolver: An L{IResolver} provider used to refresh popular
+        entries shortly before they expire, or C{None} to let them expire.
+
+    @ivar prefetchHits: The number of hits which make an entry popular.
+
+    @ivar prefetchRatio: The fraction of an entry's lifetime, at the end of
+        it, during which a hit on a popular entry refreshes it.
+
+    @ivar _entries: A C{dict} mapping L{dns.Query} instances to
+        L{_CacheEntry} instances.
+
+    @ivar _head: A sentinel L{_CacheEntry} whose C{next} is the least and
+        whose C{prev} is the most recently used entry.
+
+    @ivar _expiries: A heap of C{(expires, query)} tuples.  Tuples which no
+        longer match an entry are discarded when they reach the top.
+
+    @ivar _expiryCall: The L{IDelayedCall} for the top of C{_expiries}, or
+        C{None}.
+
+    @ivar _prefetching: A C{dict} whose keys are the queries being refreshed.
+
+    @ivar _reactor: An L{IReactorTime} provider.
+    """
 
     implements(interfaces.IResolver)
 
     cache = None
+    prefetchHits = 10
+    prefetchRatio = 0.1
+
+    _expiryCall = None
 
-    def __init__(self, cache = None, verbose = 0):
+    def __init__(self, cache=None, verbose=0, reactor=None,
+                 maxEntries=10000, prefetchResolver=None):
         common.ResolverBase.__init__(self)
 
-        if cache is None:
-            cache = {}
-        self.cache = cache
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+
+        self.cache = {}
         self.verbose = verbose
-        self.cancel = {}
+        self.maxEntries = maxEntries
+        self.prefetchResolver = prefetchResolver
 
+        self._entries = {}
+        self._head = _CacheEntry(None, None, None, None)
+        self._head.prev = self._head.next = self._head
+        self._expiries = []
+        self._prefetching = {}
+
+        if cache is not None:
+            now = self._reactor.seconds()
+            for query, (when, payload) in cache.items():
+                ttl = self._ttlFor(payload)
+                if ttl is None:
+                    # Nothing in it to expire; keep it, as always.
+                    self._add(query, when, payload, None)
+                elif when + ttl > now:
+                    self._add(query, when, payload, when + ttl)
 
-    def __setstate__(self, state):
-        self.__dict__ = state
 
-        now = time.time()
-        for (k, (when, (ans, add, ns))) in self.cache.items():
-            diff = now - when
-            for rec in ans + add + ns:
-                if rec.ttl < diff:
-                    del self.cache[k]
-                    break
+    def __setstate__(self, state):
+        self.__init__(
+            state['cache'], state.get('verbose', 0),
+            maxEntries=state.get('maxEntries', 10000))
 
 
     def __getstate__(self):
-        for c in self.cancel.values():
-            c.cancel()
-        self.cancel.clear()
-        return self.__dict__
+        if self._expiryCall is not None:
+            self._expiryCall.cancel()
+            self._expiryCall = None
+        return {'cache': dict([
+                    (query, (when, payload))
+                    for (query, (when, payload)) in self.cache.iteritems()
+                    if payload is not None]),
+                'verbose': self.verbose,
+                'maxEntries': self.maxEntries}
 
 
     def _lookup(self, name, cls, type, timeout):
-        now = time.time()
         q = dns.Query(name, type, cls)
-        try:
-            when, (ans, auth, add) = self.cache[q]
-        except KeyError:
+        entry = self._entries.get(q)
+        if entry is None:
             if self.verbose > 1:
                 log.msg('Cache miss for ' + repr(name))
             return defer.fail(failure.Failure(dns.DomainError(name)))
-        else:
-            if self.verbose:
-                log.msg('Cache hit for ' + repr(name))
-            diff = now - when
-            return defer.succeed((
-                [dns.RRHeader(str(r.name), r.type, r.cls, r.ttl - diff, r.payload) for r in ans],
-                [dns.RRHeader(str(r.name), r.type, r.cls, r.ttl - diff, r.payload) for r in auth],
-                [dns.RRHeader(str(r.name), r.type, r.cls, r.ttl - diff, r.payload) for r in add]
-            ))
+
+        if self.verbose:
+            log.msg('Cache hit for ' + repr(name))
+
+        # Move the entry to the most recently used end.
+        head = self._head
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+        entry.prev = head.prev
+        entry.next = head
+        head.prev.next = entry
+        head.prev = entry
+        entry.hits += 1
+
+        now = self._reactor.seconds()
+        if (self.prefetchResolver is not None
+            and entry.expires is not None
+            and entry.hits >= self.prefetchHits
+            and entry.expires - now <=
+                (entry.expires - entry.when) * self.prefetchRatio):
+            self._prefetch(q)
+
+        if entry.payload is None:
+            response = dns.Message(answer=1, rCode=dns.ENAME)
+            if entry.soa is not None:
+                soa = entry.soa
+                response.authority.append(dns.RRHeader(
+                        str(soa.name), soa.type, soa.cls,
+                        max(0, int(entry.expires - now)), soa.payload))
+            return defer.fail(failure.Failure(
+                    dns.AuthoritativeDomainError(name, response)))
+
+        # Records are rebuilt with their remaining TTL at most once a second.
+        age = int(now - entry.when)
+        if age != entry.resultAge:
+            entry.resultAge = age
+            entry.result = [
+                [dns.RRHeader(str(r.name), r.type, r.cls,
+                              max(0, r.ttl - age), r.payload)
+                 for r in section]
+                for section in entry.payload]
+        ans, auth, add = entry.result
+        return defer.succeed((list(ans), list(auth), list(add)))
 
 
     def lookupAllRecords(self, name, timeout = None):
         return defer.fail(failure.Failure(dns.DomainError(name)))
 
 
+    def _ttlFor(self, payload):
+        """
+        Return how many seconds a response may be cached for, or C{None} if
+        it has no records.
+
+        A response without answers but with an I{SOA} record in its
+        authority section is a negative response, which lives for the
+        smaller of the I{SOA} record's TTL and its MINIMUM field (RFC 2308,
+        section 5).
+        """
+        ans, auth, add = payload
+        records = list(ans) + list(auth) + list(add)
+        if not records:
+            return None
+        if not ans:
+            for r in auth:
+                if r.type == dns.SOA:
+                    return min(r.ttl, r.payload.minimum)
+        return min([r.ttl for r in records])
+
+
     def cacheResult(self, query, payload):
+        """
+        Cache a response.
+
+        @param query: The L{dns.Query} answered.
+        @param payload: The C{(answers, authority, additional)} tuple.
+        """
+        ttl = self._ttlFor(payload)
+        if ttl is None:
+            return
         if self.verbose > 1:
             log.msg('Adding %r to cache' % query)
+        now = self._reactor.seconds()
+        self._add(query, now, payload, now + ttl)
+
+
+    def cacheError(self, query, reason):
+        """
+        Cache a name error, if the response which caused it allows that.
 
-        self.cache[query] = (time.time(), payload)
+        @param query: The L{dns.Query} which failed.
+        @param reason: A L{failure.Failure} wrapping a L{dns.DNSNameError}
+            whose argument is the response L{dns.Message}.  The error is
+            cached for as long as the I{SOA} record in the response's
+            authority section allows; other failures are not cached.
+        """
+        if not reason.check(DNSNameError):
+            return
+        args = reason.value.args
+        if not args or not isinstance(args[0], dns.Message):
+            return
+        for r in args[0].authority:
+            if r.type == dns.SOA:
+                break
+        else:
+            return
+        if self.verbose > 1:
+            log.msg('Adding name error for %r to cache' % query)
+        now = self._reactor.seconds()
+        entry = self._add(
+            query, now, None, now + min(r.ttl, r.payload.minimum))
+        entry.soa = r
 
-        if self.cancel.has_key(query):
-            self.cancel[query].cancel()
 
-        s = list(payload[0]) + list(payload[1]) + list(payload[2])
-        m = s[0].ttl
-        for r in s:
-            m = min(m, r.ttl)
+    def _add(self, query, when, payload, expires):
+        """
+        Insert or replace an entry, evict least recently used entries beyond
+        C{maxEntries}, and index the new entry's expiry.
 
-        from twisted.internet import reactor
-        self.cancel[query] = reactor.callLater(m, self.clearEntry, query)
+        @return: The new L{_CacheEntry}.
+        """
+        if query in self._entries:
+            self._remove(query)
+        entry = _CacheEntry(query, when, payload, expires)
+        head = self._head
+        entry.prev = head.prev
+        entry.next = head
+        head.prev.next = entry
+        head.prev = entry
+        self._entries[query] = entry
+        self.cache[query] = (when, payload)
 
+        if self.maxEntries is not None:
+            while len(self._entries) > self.maxEntries:
+                self._remove(head.next.query)
 
-    def clearEntry(self, query):
+        if expires is not None:
+            heappush(self._expiries, (expires, query))
+            if len(self._expiries) > 2 * len(self._entries) + 16:
+                self._expiries = [(e.expires, q)
+                                  for (q, e) in self._entries.iteritems()
+                                  if e.expires is not None]
+                heapify(self._expiries)
+            self._scheduleExpiry()
+        return entry
+
+
+    def _remove(self, query):
+        entry = self._entries.pop(query)
         del self.cache[query]
-        del self.cancel[query]
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+        entry.prev = entry.next = None
+
+
+    def _scheduleExpiry(self):
+        """
+        Make sure the expiry timer fires for the earliest expiry.
+        """
+        if not self._expiries:
+            if self._expiryCall is not None:
+                self._expiryCall.cancel()
+                self._expiryCall = None
+            return
+        delay = max(0, self._expiries[0][0] - self._reactor.seconds())
+        if self._expiryCall is None:
+            self._expiryCall = self._reactor.callLater(delay, self._expire)
+        elif self._expiryCall.getTime() > self._expiries[0][0]:
+            self._expiryCall.reset(delay)
+
+
+    def _expire(self):
+        """
+        Remove every entry which has expired.
+        """
+        self._expiryCall = None
+        now = self._reactor.seconds()
+        expiries = self._expiries
+        while expiries and expiries[0][0] <= now:
+            expires, query = heappop(expiries)
+            entry = self._entries.get(query)
+            if entry is not None and entry.expires == expires:
+                self._remove(query)
+        self._scheduleExpiry()
+
+
+    def clearEntry(self, query):
+        """
+        Remove the entry for a query.
+        """
+        self._remove(query)
+
+
+    def _prefetch(self, query):
+        """
+        Refresh the entry for a query from C{prefetchResolver}, unless a
+        refresh is already in progress.
+        """
+        if query in self._prefetching:
+            return
+        self._prefetching[query] = True
+        if self.verbose > 1:
+            log.msg('Prefetching %r' % (query,))
+        d = self.prefetchResolver.query(query)
+        def cbPrefetched(result):
+            self.cacheResult(query, result)
+        def ebPrefetched(reason):
+            if self.verbose:
+                log.msg('Prefetch of %r failed: %s' % (
+                        query, reason.getErrorMessage()))
+        def cbDone(ignored):
+            del self._prefetching[query]
+        d.addCallbacks(cbPrefetched, ebPrefetched)
+        d.addErrback(log.err, 'Caching the prefetch of %r failed' % (query,))
+        d.addBoth(cbDone)
@@ -45,11 +45,26 @@ class Resolver(common.ResolverBase):
     @ivar _reactor: A provider of L{IReactorTCP}, L{IReactorUDP}, and
         L{IReactorTime} which will be used to set up network resources and
         track timeouts.
+
+    @ivar parallel: If C{True}, each round of a UDP query is sent to every
+        server at once and the first response is used, rather than trying
+        the servers one after another.
+
+    @ivar _rtt: A C{dict} mapping server addresses to their smoothed round
+        trip time in seconds.  Servers which have not been queried yet are
+        absent and preferred over all others, so that each gets measured.
     """
     implements(interfaces.IResolver)
 
     index = 0
     timeout = None
+    parallel = False
+
+    # Weight of the newest round trip time sample, and the factor applied to
+    # the estimate of every other server when a sample is taken so that a
+    # server which was slow once is eventually tried again.
+    _rttWeight = 0.3
+    _rttDecay = 0.98
 
     factory = None
     servers = None
@@ -71,7 +86,8 @@ class Resolver(common.ResolverBase):
     protocol = property(_getProtocol)
 
 
-    def __init__(self, resolv=None, servers=None, timeout=(1, 3, 11, 45), reactor=None):
+    def __init__(self, resolv=None, servers=None, timeout=(1, 3, 11, 45),
+                 reactor=None, parallel=False):
         """
         Construct a resolver which will query domain name servers listed in
         the C{resolv.conf(5)}-format file given by C{resolv} as well as
@@ -99,6 +115,9 @@ class Resolver(common.ResolverBase):
             for DNS datagrams, and enforce timeouts.  If not provided, the
             global reactor will be used.
 
+        @type parallel: C{bool}
+        @param parallel: If C{True}, race each UDP query across all servers.
+
         @raise ValueError: Raised if no nameserver addresses can be found.
         """
         common.ResolverBase.__init__(self)
@@ -108,6 +127,7 @@ class Resolver(common.ResolverBase):
         self._reactor = reactor
 
         self.timeout = timeout
+        self.parallel = parallel
 
         if servers is None:
             self.servers = []
@@ -126,6 +146,7 @@ class Resolver(common.ResolverBase):
         self.pending = []
 
         self._waiting = {}
+        self._rtt = {}
 
         self.maybeParseConfig()
 
@@ -196,11 +217,14 @@ class Resolver(common.ResolverBase):
         """
         Return the address of a nameserver.
 
-        TODO: Weight servers for response time so faster ones can be
-        preferred.
+        Once round trip times have been measured, the server with the lowest
+        one is returned.  Until then, servers are picked in a round-robin
+        fashion.
         """
         if not self.servers and not self.dynServers:
             return None
+        if self._rtt:
+            return self._serverOrder()[0]
         serverL = len(self.servers)
         dynL = len(self.dynServers)
 
@@ -212,6 +236,38 @@ class Resolver(common.ResolverBase):
             return self.dynServers[self.index - serverL]
 
 
+    def _serverOrder(self):
+        """
+        Return a C{list} of all nameserver addresses, fastest first.
+
+        Servers with no round trip time measurement come first and servers
+        with equal measurements keep the order they were configured in.
+        """
+        addresses = self.servers + list(self.dynServers)
+        rtt = self._rtt
+        addresses.sort(key=lambda address: rtt.get(address, 0))
+        return addresses
+
+
+    def _updateRTT(self, address, sample):
+        """
+        Fold a round trip time measurement for one server into its smoothed
+        estimate, and age the estimates of all the others.
+
+        @param sample: The number of seconds the server took to respond, or
+            the timeout it failed to respond within.
+        """
+        rtt = self._rtt
+        for other in rtt:
+            if other != address:
+                rtt[other] *= self._rttDecay
+        if address in rtt:
+            weight = self._rttWeight
+            rtt[address] = (1 - weight) * rtt[address] + weight * sample
+        else:
+            rtt[address] = sample
+
+
     def _connectedProtocol(self):
         """
         Return a new L{DNSDatagramProtocol} bound to a randomly selected port
@@ -260,8 +316,14 @@ class Resolver(common.ResolverBase):
         """
         protocol = self._connectedProtocol()
         d = protocol.query(*args)
+        address, timeout = args[0], args[2]
+        started = self._reactor.seconds()
         def cbQueried(result):
             protocol.transport.stopListening()
+            if not isinstance(result, failure.Failure):
+                self._updateRTT(address, self._reactor.seconds() - started)
+            elif result.check(dns.DNSQueryTimeoutError):
+                self._updateRTT(address, timeout)
             return result
         d.addBoth(cbQueried)
         return d
@@ -271,6 +333,9 @@ class Resolver(common.ResolverBase):
         """
         Make a number of DNS queries via UDP.
 
+        Servers are tried fastest first, or all at once if C{parallel} is
+        set.
+
         @type queries: A C{list} of C{dns.Query} instances
         @param queries: The queries to make.
 
@@ -285,12 +350,17 @@ class Resolver(common.ResolverBase):
         if timeout is None:
             timeout = self.timeout
 
-        addresses = self.servers + list(self.dynServers)
+        addresses = self._serverOrder()
         if not addresses:
             return defer.fail(IOError("No domain name servers available"))
 
+        if self.parallel:
+            d = self._race(addresses, queries, timeout[0])
+            d.addErrback(self._rerace, addresses, queries, timeout)
+            return d
+
         # Make sure we go through servers in the list in the order they were
-        # specified.
+        # picked.
         addresses.reverse()
 
         used = addresses.pop()
@@ -329,6 +399,48 @@ class Resolver(common.ResolverBase):
         return d
 
 
+    def _race(self, addresses, queries, timeout):
+        """
+        Send the same queries to several servers at once.
+
+        @param timeout: The number of seconds to wait for each server.
+
+        @return: A L{Deferred} which fires with the first response received,
+            or fails with the first failure once every server has failed.  It
+            fails with L{dns.DNSQueryTimeoutError} only if every server timed
+            out.
+        """
+        result = defer.Deferred()
+        failures = []
+        def cbAnswered(message):
+            if not result.called:
+                result.callback(message)
+        def ebFailed(reason):
+            failures.append(reason)
+            if len(failures) == len(addresses) and not result.called:
+                others = [f for f in failures
+                          if not f.check(dns.DNSQueryTimeoutError)]
+                result.errback((others or failures)[0])
+        for address in addresses:
+            d = self._query(address, queries, timeout)
+            d.addCallbacks(cbAnswered, ebFailed)
+        return result
+
+
+    def _rerace(self, reason, addresses, queries, timeout):
+        """
+        Race the queries again with the next timeout after every server timed
+        out, or give up if there is none.
+        """
+        reason.trap(dns.DNSQueryTimeoutError)
+        timeout = timeout[1:]
+        if not timeout:
+            return failure.Failure(defer.TimeoutError(queries))
+        d = self._race(addresses, queries, timeout[0])
+        d.addErrback(self._rerace, addresses, queries, timeout)
+        return d
+
+
     def queryTCP(self, queries, timeout = 10):
         """
         Make a number of DNS queries via TCP.
@@ -282,6 +282,8 @@ class Charstr(object):
 class Name:
     implements(IEncodable)
 
+    _table = None
+
     def __init__(self, name=''):
         assert isinstance(name, types.StringTypes), "%r is not a string" % (name,)
         self.name = name
@@ -299,24 +301,43 @@ class Name:
         and whose addresses may be backreferenced by this Name (for the purpose
         of reducing the message size).
         """
-        name = self.name
-        while name:
+        for suffix, label in self._labels():
             if compDict is not None:
-                if name in compDict:
+                if suffix in compDict:
                     strio.write(
-                        struct.pack("!H", 0xc000 | compDict[name]))
+                        struct.pack("!H", 0xc000 | compDict[suffix]))
                     return
                 else:
-                    compDict[name] = strio.tell() + Message.headerSize
+                    compDict[suffix] = strio.tell() + Message.headerSize
+            strio.write(label)
+        strio.write(chr(0))
+
+
+    def _labels(self):
+        """
+        Return the compression table entries of this Name: a C{list} of
+        C{(suffix, label)} tuples, where C{suffix} is the name from a label
+        onwards and C{label} is that label with its length byte prefixed.
+
+        The table is computed once and reused for as long as C{self.name}
+        does not change, so names served repeatedly are not split again for
+        every message.
+        """
+        if self._table is not None and self._table[0] is self.name:
+            return self._table[1]
+        labels = []
+        name = self.name
+        while name:
             ind = name.find('.')
             if ind > 0:
-                label, name = name[:ind], name[ind + 1:]
+                label, rest = name[:ind], name[ind + 1:]
             else:
-                label, name = name, ''
+                label, rest = name, ''
                 ind = len(label)
-            strio.write(chr(ind))
-            strio.write(label)
-        strio.write(chr(0))
+            labels.append((name, chr(ind) + label))
+            name = rest
+        self._table = (self.name, labels)
+        return labels
 
 
     def decode(self, strio, length=None):
@@ -371,6 +392,62 @@ class Name:
     def __str__(self):
         return self.name
 
+
+
+def _decodeName(data, offset):
+    """
+    Decode a domain name from a complete message.
+
+    This is the buffer based equivalent of L{Name.decode}, used by
+    L{Message.fromStr}.
+
+    @type data: C{str}
+    @param data: The bytes of the whole message, which compression pointers
+        index into.
+
+    @type offset: C{int}
+    @param offset: The index of the first byte of the name.
+
+    @return: A C{tuple} of the decoded name as a C{str} and the index of the
+        first byte after it.
+
+    @raise EOFError: If the name runs past the end of C{data}.
+    @raise ValueError: If the name contains a compression loop.
+    """
+    labels = []
+    end = None
+    visited = None
+    while 1:
+        try:
+            l = ord(data[offset])
+        except IndexError:
+            raise EOFError("Name runs past the end of the message")
+        if l == 0:
+            offset += 1
+            break
+        if (l >> 6) == 3:
+            if offset + 2 > len(data):
+                raise EOFError("Name runs past the end of the message")
+            if end is None:
+                end = offset + 2
+                visited = set()
+            offset = (l & 63) << 8 | ord(data[offset + 1])
+            if offset in visited:
+                raise ValueError("Compression loop in encoded name")
+            visited.add(offset)
+            continue
+        offset += 1
+        label = data[offset:offset + l]
+        if len(label) != l:
+            raise EOFError("Name runs past the end of the message")
+        labels.append(label)
+        offset += l
+    if end is None:
+        end = offset
+    return '.'.join(labels), end
+
+
+
 class Query:
     """
     Represent a single DNS query.
@@ -493,7 +570,7 @@ class RRHeader(tputil.FancyEqMixin):
     def encode(self, strio, compDict=None):
         self.name.encode(strio, compDict)
         strio.write(struct.pack(self.fmt, self.type, self.cls, self.ttl, 0))
-        if self.payload:
+        if self.payload is not None:
             prefix = strio.tell()
             self.payload.encode(strio, compDict)
             aft = strio.tell()
@@ -524,6 +601,97 @@ class RRHeader(tputil.FancyEqMixin):
 
 
 
+class _LazyRRHeader(object):
+    """
+    A resource record header parsed by L{Message.fromStr}, whose payload is
+    only decoded when it is first used.
+
+    Instances behave like (and compare equal to) L{RRHeader} instances with
+    the same attributes, but hold on to the message they were parsed from
+    instead of a decoded payload.  Most clients only look at the payloads
+    of some records of a response, so the others are never decoded.  Only
+    payloads of a fixed size are left undecoded, since whether the others
+    are complete is only known once they are decoded.
+
+    @ivar _recordType: The record class to decode the payload with.
+    @ivar _data: The bytes of the whole message, or C{None} once the
+        payload has been decoded.
+    @ivar _offset: The index of the payload in C{_data}.
+    """
+
+    implements(IEncodable)
+
+    __slots__ = ('name', 'type', 'cls', 'ttl', 'auth', 'rdlength',
+                 '_payload', '_recordType', '_data', '_offset')
+
+    compareAttributes = RRHeader.compareAttributes
+    fmt = RRHeader.fmt
+
+    def __init__(self, name, type, cls, ttl, rdlength, recordType, data,
+                 offset):
+        self.name = Name(name)
+        self.type = type
+        self.cls = cls
+        self.ttl = ttl
+        self.auth = False
+        self.rdlength = rdlength
+        self._payload = None
+        self._recordType = recordType
+        self._data = data
+        self._offset = offset
+
+
+    def _getPayload(self):
+        if self._data is not None:
+            payload = self._recordType(ttl=self.ttl)
+            strio = StringIO.StringIO(self._data)
+            strio.seek(self._offset)
+            payload.decode(strio, self.rdlength)
+            self._payload = payload
+            self._data = None
+        return self._payload
+
+
+    def _setPayload(self, payload):
+        self._payload = payload
+        self._data = None
+
+    payload = property(_getPayload, _setPayload)
+
+
+    def __eq__(self, other):
+        if isinstance(other, (RRHeader, _LazyRRHeader)):
+            return (
+                [getattr(self, name) for name in self.compareAttributes] ==
+                [getattr(other, name) for name in self.compareAttributes])
+        return NotImplemented
+
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+
+    def __getstate__(self):
+        return {'name': self.name, 'type': self.type, 'cls': self.cls,
+                'ttl': self.ttl, 'auth': self.auth, 'rdlength': self.rdlength,
+                'payload': self.payload}
+
+
+    def __setstate__(self, state):
+        for name in ('name', 'type', 'cls', 'ttl', 'auth', 'rdlength',
+                     'payload'):
+            setattr(self, name, state[name])
+
+
+    encode = RRHeader.encode.im_func
+    isAuthoritative = RRHeader.isAuthoritative.im_func
+    __str__ = __repr__ = RRHeader.__str__.im_func
+
+
+
 class SimpleRecord(tputil.FancyStrMixin, tputil.FancyEqMixin):
     """
     A Resource Record which consists of a single RFC 1035 domain-name.
@@ -1532,6 +1700,12 @@ class Record_SPF(Record_TXT):
 
 
 
+# The record classes whose payloads always have the same size, so that
+# Message.fromStr can check they are complete without decoding them.
+_fixedPayloadSizes = {Record_A: 4, Record_AAAA: 16}
+
+
+
 class Message:
     """
     L{Message} contains all the information represented by a single
@@ -1686,8 +1860,73 @@ class Message:
 
 
     def fromStr(self, str):
-        strio = StringIO.StringIO(str)
-        self.decode(strio)
+        """
+        Decode a complete message.
+
+        Unlike L{decode}, this parses C{str} in place rather than through a
+        file, and leaves the payloads of fixed size records undecoded until
+        they are used (see L{_LazyRRHeader}).
+        """
+        self.maxSize = 0
+        if len(str) < self.headerSize:
+            raise EOFError("Message is shorter than its header")
+        r = struct.unpack(self.headerFmt, str[:self.headerSize])
+        self.id, byte3, byte4, nqueries, nans, nns, nadd = r
+        self.answer = ( byte3 >> 7 ) & 1
+        self.opCode = ( byte3 >> 3 ) & 0xf
+        self.auth = ( byte3 >> 2 ) & 1
+        self.trunc = ( byte3 >> 1 ) & 1
+        self.recDes = byte3 & 1
+        self.recAv = ( byte4 >> 7 ) & 1
+        self.rCode = byte4 & 0xf
+
+        self.queries = []
+        self.answers = []
+        self.authority = []
+        self.additional = []
+
+        # A truncated message yields the queries and records which precede
+        # the point of truncation, like decode does.
+        offset = self.headerSize
+        size = len(str)
+        unpack = struct.unpack
+        try:
+            for i in xrange(nqueries):
+                name, offset = _decodeName(str, offset)
+                if offset + 4 > size:
+                    return
+                type, cls = unpack("!HH", str[offset:offset + 4])
+                offset += 4
+                self.queries.append(Query(name, type, cls))
+
+            for (records, n) in ((self.answers, nans),
+                                 (self.authority, nns),
+                                 (self.additional, nadd)):
+                for i in xrange(n):
+                    name, offset = _decodeName(str, offset)
+                    if offset + 10 > size:
+                        return
+                    type, cls, ttl, rdlength = unpack(
+                        RRHeader.fmt, str[offset:offset + 10])
+                    offset += 10
+                    if offset + rdlength > size:
+                        return
+                    t = self.lookupRecordType(type)
+                    if t:
+                        header = _LazyRRHeader(
+                            name, type, cls, ttl, rdlength, t, str, offset)
+                        fixedSize = _fixedPayloadSizes.get(t)
+                        if fixedSize is None:
+                            # The extent of other payloads is only known
+                            # once they are decoded: decode them now, so a
+                            # malformed one ends the message as in decode.
+                            header.payload
+                        elif offset + fixedSize > size:
+                            return
+                        records.append(header)
+                    offset += rdlength
+        except EOFError:
+            return
 
 
 
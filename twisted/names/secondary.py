@@ -85,6 +85,7 @@ class SecondaryAuthority(common.ResolverBase):
                 self.soa = (str(rec.name).lower(), rec.payload)
             else:
                 r.setdefault(str(rec.name).lower(), []).append(rec.payload)
+        self.recordsChanged()
 
     def _ebZone(self, failure):
         log.msg("Updating %s from %s failed during zone transfer" % (self.domain, self.primary))
@@ -18,10 +18,157 @@ for resolvers to deal with.  Fix it.
 """
 
 import time
+import struct
 
 from twisted.internet import protocol
-from twisted.names import dns, resolve
-from twisted.python import log
+from twisted.names import dns, resolve, authority
+from twisted.names.error import DNSNameError
+from twisted.python import failure, log
+
+
+
+class PrecompiledAnswers(object):
+    """
+    Wire-format responses, built ahead of time, for every name and record
+    type stored in some L{authority.FileAuthority} zones.
+
+    A response template is kept for each C{(name, type)} pair in a zone, and
+    one for each name for the types it has no records of.  To answer a query,
+    only its ID, its recursion desired flag and its question section (which
+    has the same length for every spelling of a name) are copied into the
+    template.  Queries for anything else, such as names matched by a
+    wildcard or below a delegation, are left to the usual path.
+
+    @ivar authorities: The zones to compile, in order of precedence.
+    @ivar recAv: Whether the responses advertise recursion.
+    @ivar templates: A C{dict} mapping C{(name, type)} to a tuple of the
+        first flags byte without the recursion desired bit, the rest of the
+        header after it, and the response after its question section.  For
+        the response to types without records, C{type} is C{None}.
+        Names and types the authority fails to look up are mapped to
+        C{None}.
+    """
+
+    def __init__(self, authorities, recAv=False):
+        self.authorities = authorities
+        self.recAv = recAv
+        self.compile()
+
+
+    def compile(self):
+        """
+        (Re)build C{templates} from the current contents of C{authorities}.
+        """
+        self.templates = templates = {}
+        for zone in self.authorities:
+            if not isinstance(zone, authority.FileAuthority):
+                continue
+            for name, records in zone.records.iteritems():
+                types = set([record.TYPE for record in records])
+                types.update([dns.ALL_RECORDS, None])
+                for type in types:
+                    if (name, type) not in templates:
+                        templates[name, type] = self._compileAnswer(
+                            zone, name, type)
+
+
+    def _compileAnswer(self, zone, name, type):
+        """
+        Build the response template for one name and type of a zone, or
+        return C{None} if the lookup fails.
+
+        Like any other response, the template is truncated to fit in a
+        datagram.
+        """
+        result = []
+        zone._lookup(name, dns.IN, type).addBoth(result.append)
+        if isinstance(result[0], failure.Failure):
+            return None
+        answers, authority, additional = result[0]
+        message = dns.Message(answer=1, recAv=self.recAv)
+        message.queries = [dns.Query(name, type or 0, dns.IN)]
+        message.answers = answers
+        message.authority = authority
+        message.additional = additional
+        for record in answers:
+            if record.isAuthoritative():
+                message.auth = 1
+                break
+        data = message.toStr()
+        end = self._questionEnd(data)
+        return (ord(data[2]), data[3:12], data[end:])
+
+
+    def _questionEnd(self, data):
+        """
+        Return the offset just past the only question of a message, or
+        C{None} if it does not have exactly one uncompressed question.
+        """
+        if data[4:6] != '\x00\x01':
+            return None
+        i = 12
+        size = len(data)
+        while i < size:
+            length = ord(data[i])
+            if length == 0:
+                end = i + 5
+                if end > size:
+                    return None
+                return end
+            if length > 63:
+                return None
+            i += length + 1
+        return None
+
+
+    def respond(self, data):
+        """
+        Build the response to a query datagram.
+
+        @return: The response C{str}, or C{None} if there is no template for
+            the query or it is not a standard query for the I{IN} class.
+        """
+        if len(data) < 17 or ord(data[2]) & 0xf8:
+            # A response, or an operation other than a standard query.
+            return None
+        end = self._questionEnd(data)
+        if end is None or data[end - 2:end] != '\x00\x01':
+            return None
+        labels = []
+        i = 12
+        length = ord(data[i])
+        while length:
+            labels.append(data[i + 1:i + 1 + length])
+            i += length + 1
+            length = ord(data[i])
+        name = '.'.join(labels).lower()
+        type = struct.unpack('!H', data[end - 4:end - 2])[0]
+        key = (name, type)
+        if key not in self.templates:
+            key = (name, None)
+        template = self.templates.get(key)
+        if template is None:
+            return None
+        flags, header, rest = template
+        return ''.join([data[:2], chr(flags | (ord(data[2]) & 1)), header,
+                        data[12:end], rest])
+
+
+
+class DNSServerDatagramProtocol(dns.DNSDatagramProtocol):
+    """
+    DNS over UDP for a L{DNSServerFactory}, answering queries from the
+    factory's L{PrecompiledAnswers} without decoding them when it can.
+    """
+
+    def datagramReceived(self, data, addr):
+        precompiled = self.controller.precompiled
+        if precompiled is not None:
+            response = precompiled.respond(data)
+            if response is not None:
+                self.transport.write(response, addr)
+                return
+        dns.DNSDatagramProtocol.datagramReceived(self, data, addr)
 
 
 class DNSServerFactory(protocol.ServerFactory):
@@ -32,12 +179,18 @@ class DNSServerFactory(protocol.ServerFactory):
     @ivar connections: A list of all the connected L{DNSProtocol}
         instances using this object as their controller.
     @type connections: C{list} of L{DNSProtocol}
+
+    @ivar precompiled: A L{PrecompiledAnswers} for the authorities, used by
+        L{DNSServerDatagramProtocol}, or C{None}.  Precompiled answers are
+        sent without consulting L{allowQuery} or logging.
     """
 
     protocol = dns.DNSProtocol
     cache = None
+    precompiled = None
 
-    def __init__(self, authorities = None, caches = None, clients = None, verbose = 0):
+    def __init__(self, authorities = None, caches = None, clients = None,
+                 verbose = 0, precompile = False):
         resolvers = []
         if authorities is not None:
             resolvers.extend(authorities)
@@ -51,6 +204,9 @@ class DNSServerFactory(protocol.ServerFactory):
         self.verbose = verbose
         if caches:
             self.cache = caches[-1]
+        if precompile:
+            self.precompiled = PrecompiledAnswers(
+                authorities or [], self.canRecurse)
         self.connections = []
 
 
@@ -119,6 +275,12 @@ class DNSServerFactory(protocol.ServerFactory):
     def gotResolverError(self, failure, protocol, message, address):
         if failure.check(dns.DomainError, dns.AuthoritativeDomainError):
             message.rCode = dns.ENAME
+            if failure.check(DNSNameError, dns.AuthoritativeDomainError):
+                # Pass on the SOA record of a name error, which tells the
+                # client how long it may cache the error.
+                for arg in failure.value.args:
+                    if isinstance(arg, dns.Message):
+                        message.authority = arg.authority
         else:
             message.rCode = dns.ESERVER
             log.err(failure)
@@ -127,6 +289,9 @@ class DNSServerFactory(protocol.ServerFactory):
         if self.verbose:
             log.msg("Lookup failed")
 
+        if self.cache:
+            self.cache.cacheError(message.queries[0], failure)
+
 
     def handleQuery(self, message, protocol, address):
         # Discard all but the first query!  HOO-AAH HOOOOO-AAAAH
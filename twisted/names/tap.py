@@ -9,7 +9,6 @@ Domain Name Server
 import os, traceback
 
 from twisted.python import usage
-from twisted.names import dns
 from twisted.application import internet, service
 
 from twisted.names import server
@@ -29,6 +28,8 @@ class Options(usage.Options):
         ["cache",       "c", "Enable record caching"],
         ["recursive",   "r", "Perform recursive lookups"],
         ["verbose",     "v", "Log verbosely"],
+        ["precompile",  None, "Answer UDP queries for zone data from "
+                              "precompiled responses"],
     ]
 
     compData = usage.Completions(
@@ -111,8 +112,9 @@ def makeService(config):
     if config['hosts-file']:
         cl.append(hosts.Resolver(file=config['hosts-file']))
 
-    f = server.DNSServerFactory(config.zones, ca, cl, config['verbose'])
-    p = dns.DNSDatagramProtocol(f)
+    f = server.DNSServerFactory(config.zones, ca, cl, config['verbose'],
+                                config['precompile'])
+    p = server.DNSServerDatagramProtocol(f)
     f.noisy = 0
     ret = service.MultiService()
     for (klass, arg) in [(internet.TCPServer, f), (internet.UDPServer, p)]:
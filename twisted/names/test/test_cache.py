@@ -5,10 +5,197 @@ import time
 
 from twisted.trial import unittest
 
+from twisted.internet import defer, task
 from twisted.names import dns, cache
+from twisted.names.error import DNSNameError, DNSServerError
+from twisted.python import failure
 
 class Caching(unittest.TestCase):
     def testLookup(self):
         c = cache.CacheResolver({
             dns.Query(name='example.com', type=dns.MX, cls=dns.IN): (time.time(), ([], [], []))})
         return c.lookupMailExchange('example.com').addCallback(self.assertEqual, ([], [], []))
+
+
+
+class CacheResolverTests(unittest.TestCase):
+    """
+    Tests for the expiry, eviction, negative caching and prefetching done by
+    L{cache.CacheResolver}.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.query = dns.Query('example.com', dns.A, dns.IN)
+
+
+    def answer(self, name='example.com', ttl=60, address='1.2.3.4'):
+        return ([dns.RRHeader(name, dns.A, dns.IN, ttl,
+                              dns.Record_A(address, ttl))], [], [])
+
+
+    def test_remainingTTL(self):
+        """
+        Cached records are returned with the whole seconds left of their TTL.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        c.cacheResult(self.query, self.answer())
+        self.clock.advance(10.5)
+        d = c.lookupAddress('example.com')
+        d.addCallback(lambda (ans, auth, add): [r.ttl for r in ans])
+        d.addCallback(self.assertEqual, [50])
+        return d
+
+
+    def test_expiry(self):
+        """
+        An entry is removed once its smallest TTL has passed, using a single
+        delayed call for all entries.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        c.cacheResult(self.query, self.answer(ttl=60))
+        other = dns.Query('example.org', dns.A, dns.IN)
+        c.cacheResult(other, self.answer('example.org', ttl=30))
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(30)
+        self.assertEqual(c.cache.keys(), [self.query])
+        self.clock.advance(30)
+        self.assertEqual(c.cache, {})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        return self.assertFailure(
+            c.lookupAddress('example.com'), dns.DomainError)
+
+
+    def test_replaceExpiry(self):
+        """
+        Caching a query again replaces its expiry time.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        c.cacheResult(self.query, self.answer(ttl=10))
+        self.clock.advance(5)
+        c.cacheResult(self.query, self.answer(ttl=10))
+        self.clock.advance(5)
+        self.assertEqual(c.cache.keys(), [self.query])
+        self.clock.advance(5)
+        self.assertEqual(c.cache, {})
+
+
+    def test_leastRecentlyUsedEvicted(self):
+        """
+        When C{maxEntries} is exceeded, the least recently used entry is
+        discarded.
+        """
+        c = cache.CacheResolver(reactor=self.clock, maxEntries=2)
+        queries = [dns.Query(name, dns.A, dns.IN)
+                   for name in ('a.example', 'b.example', 'c.example')]
+        c.cacheResult(queries[0], self.answer('a.example'))
+        c.cacheResult(queries[1], self.answer('b.example'))
+        c.lookupAddress('a.example')
+        c.cacheResult(queries[2], self.answer('c.example'))
+        self.assertEqual(
+            sorted(c.cache.keys()), sorted([queries[0], queries[2]]))
+
+
+    def test_negativeCaching(self):
+        """
+        A name error whose response carries an I{SOA} record is cached for
+        the smaller of that record's TTL and MINIMUM, and reported as an
+        L{dns.AuthoritativeDomainError} meanwhile.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        response = dns.Message()
+        response.authority.append(dns.RRHeader(
+                'example.com', dns.SOA, dns.IN, 300,
+                dns.Record_SOA(minimum=30)))
+        c.cacheError(self.query, failure.Failure(DNSNameError(response)))
+        d = self.assertFailure(
+            c.lookupAddress('example.com'), dns.AuthoritativeDomainError)
+        def cbFailed(ignored):
+            self.clock.advance(30)
+            self.assertEqual(c.cache, {})
+        return d.addCallback(cbFailed)
+
+
+    def test_negativeCachingAuthority(self):
+        """
+        The L{dns.AuthoritativeDomainError} of a cached name error carries a
+        response with the I{SOA} record, whose TTL is the time left before
+        the error expires.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        soa = dns.Record_SOA(minimum=30)
+        response = dns.Message()
+        response.authority.append(dns.RRHeader(
+                'example.com', dns.SOA, dns.IN, 300, soa))
+        c.cacheError(self.query, failure.Failure(DNSNameError(response)))
+        self.clock.advance(12)
+        d = self.assertFailure(
+            c.lookupAddress('example.com'), dns.AuthoritativeDomainError)
+        def cbFailed(error):
+            name, cached = error.args
+            self.assertEqual(name, 'example.com')
+            self.assertEqual(cached.rCode, dns.ENAME)
+            self.assertEqual(cached.authority, [
+                    dns.RRHeader('example.com', dns.SOA, dns.IN, 18, soa)])
+        return d.addCallback(cbFailed)
+
+
+    def test_negativeWithoutSOA(self):
+        """
+        Name errors without an I{SOA} record, and other errors, are not
+        cached.
+        """
+        c = cache.CacheResolver(reactor=self.clock)
+        c.cacheError(
+            self.query, failure.Failure(DNSNameError(dns.Message())))
+        c.cacheError(
+            self.query, failure.Failure(DNSServerError(dns.Message())))
+        self.assertEqual(c.cache, {})
+
+
+    def test_prefetch(self):
+        """
+        A popular entry looked up near the end of its lifetime is refreshed
+        from C{prefetchResolver}, only once at a time.
+        """
+        queried = []
+        class Upstream(object):
+            def query(self, query):
+                queried.append(defer.Deferred())
+                return queried[-1]
+        c = cache.CacheResolver(
+            reactor=self.clock, prefetchResolver=Upstream())
+        c.prefetchHits = 2
+        c.cacheResult(self.query, self.answer(ttl=100))
+        c.lookupAddress('example.com')
+        c.lookupAddress('example.com')
+        self.assertEqual(queried, [])
+        self.clock.advance(95)
+        c.lookupAddress('example.com')
+        c.lookupAddress('example.com')
+        self.assertEqual(len(queried), 1)
+        queried[0].callback(self.answer(ttl=100))
+        self.clock.advance(10)
+        self.assertEqual(c.cache.keys(), [self.query])
+
+
+    def test_prefetchErrors(self):
+        """
+        An error caching a prefetched response is logged, and the entry can
+        be prefetched again.
+        """
+        queried = []
+        class Upstream(object):
+            def query(self, query):
+                queried.append(defer.Deferred())
+                return queried[-1]
+        c = cache.CacheResolver(
+            reactor=self.clock, prefetchResolver=Upstream())
+        c.prefetchHits = 1
+        c.cacheResult(self.query, self.answer(ttl=100))
+        self.clock.advance(95)
+        c.lookupAddress('example.com')
+        queried[0].callback(None)
+        self.assertEqual(len(self.flushLoggedErrors(TypeError)), 1)
+        self.assertEqual(c._prefetching, {})
+        c.lookupAddress('example.com')
+        self.assertEqual(len(queried), 2)
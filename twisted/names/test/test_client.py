@@ -10,6 +10,7 @@ from twisted.names.error import DNSQueryTimeoutError
 from twisted.trial import unittest
 from twisted.names.common import ResolverBase
 from twisted.internet import defer, error
+from twisted.internet.task import Clock
 from twisted.python import failure
 from twisted.python.deprecate import getWarningMethod, setWarningMethod
 from twisted.python.compat import set
@@ -415,6 +416,133 @@ class ResolverTests(unittest.TestCase):
         return self.assertFailure(queryResult, ExpectedException)
 
 
+    def test_fastestServerFirst(self):
+        """
+        L{client.Resolver.queryUDP} sends queries to the server with the
+        lowest measured round trip time first, after trying each server which
+        has not been measured, and L{client.Resolver.pickServer} returns that
+        server too.
+        """
+        clock = Clock()
+        servers = [('1.1.1.1', 53), ('2.2.2.2', 53)]
+        resolver = client.Resolver(servers=servers, reactor=clock)
+        resolver.protocol = StubDNSDatagramProtocol()
+        queries = resolver.protocol.queries
+
+        resolver.queryUDP(None)
+        self.assertEqual(queries[-1][0], servers[0])
+        clock.advance(0.5)
+        queries[-1][-1].callback(dns.Message())
+
+        resolver.queryUDP(None)
+        self.assertEqual(queries[-1][0], servers[1])
+        clock.advance(0.1)
+        queries[-1][-1].callback(dns.Message())
+
+        resolver.queryUDP(None)
+        self.assertEqual(queries[-1][0], servers[1])
+        self.assertEqual(resolver.pickServer(), servers[1])
+
+
+    def test_timeoutPenalizesServer(self):
+        """
+        A server which times out is charged the timeout as its round trip time
+        and tried after faster servers.
+        """
+        servers = [('1.1.1.1', 53), ('2.2.2.2', 53)]
+        resolver = client.Resolver(servers=servers, reactor=Clock())
+        resolver.protocol = StubDNSDatagramProtocol()
+        queries = resolver.protocol.queries
+
+        resolver.queryUDP(None)
+        queries[-1][-1].errback(DNSQueryTimeoutError(0))
+        self.assertEqual(resolver._rtt, {servers[0]: 1})
+        queries[-1][-1].callback(dns.Message())
+
+        resolver.queryUDP(None)
+        self.assertEqual(queries[-1][0], servers[1])
+
+
+    def test_updateRTT(self):
+        """
+        L{client.Resolver._updateRTT} folds a measurement into the estimate
+        of its server and ages the estimates of the other servers only.
+        """
+        servers = [('1.1.1.1', 53), ('2.2.2.2', 53)]
+        resolver = client.Resolver(servers=servers, reactor=Clock())
+        resolver._updateRTT(servers[0], 1.0)
+        resolver._updateRTT(servers[1], 1.0)
+        resolver._updateRTT(servers[0], 2.0)
+        weight = resolver._rttWeight
+        decay = resolver._rttDecay
+        self.assertEqual(resolver._rtt, {
+                servers[0]: (1 - weight) * decay + weight * 2.0,
+                servers[1]: decay})
+
+
+    def test_parallelQuery(self):
+        """
+        A L{client.Resolver} created with C{parallel=True} sends each query to
+        every server at once and fires with the first response.
+        """
+        servers = [('1.1.1.1', 53), ('2.2.2.2', 53)]
+        resolver = client.Resolver(
+            servers=servers, reactor=Clock(), parallel=True)
+        resolver.protocol = StubDNSDatagramProtocol()
+        queries = resolver.protocol.queries
+
+        d = resolver.queryUDP(None)
+        self.assertEqual([q[0] for q in queries], servers)
+        response = dns.Message()
+        queries[1][-1].callback(response)
+        queries[0][-1].callback(dns.Message())
+        d.addCallback(self.assertIdentical, response)
+        return d
+
+
+    def test_parallelTimeout(self):
+        """
+        When every server times out, a parallel query is raced again with the
+        next timeout, and fails with L{defer.TimeoutError} once all timeouts
+        are used up.
+        """
+        servers = [('1.1.1.1', 53), ('2.2.2.2', 53)]
+        resolver = client.Resolver(
+            servers=servers, reactor=Clock(), parallel=True)
+        resolver.protocol = StubDNSDatagramProtocol()
+        queries = resolver.protocol.queries
+
+        d = resolver.queryUDP(None, timeout=(1, 3))
+        for expected in (1, 3):
+            self.assertEqual([q[2] for q in queries], [expected, expected])
+            issued = queries[:]
+            del queries[:]
+            for q in issued:
+                q[-1].errback(DNSQueryTimeoutError(0))
+        self.assertEqual(queries, [])
+        return self.assertFailure(d, defer.TimeoutError)
+
+
+    def test_parallelFailure(self):
+        """
+        If every server fails, a parallel query fails with an error other
+        than a timeout when there is one.
+        """
+        class ExpectedException(Exception):
+            pass
+
+        servers = [('1.1.1.1', 53), ('2.2.2.2', 53)]
+        resolver = client.Resolver(
+            servers=servers, reactor=Clock(), parallel=True)
+        resolver.protocol = StubDNSDatagramProtocol()
+        queries = resolver.protocol.queries
+
+        d = resolver.queryUDP(None)
+        queries[0][-1].errback(DNSQueryTimeoutError(0))
+        queries[1][-1].errback(ExpectedException())
+        return self.assertFailure(d, ExpectedException)
+
+
 
 class ClientTestCase(unittest.TestCase):
 
@@ -8,7 +8,7 @@ Tests for twisted.names.dns.
 
 from cStringIO import StringIO
 
-import struct
+import struct, pickle
 
 from twisted.python.failure import Failure
 from twisted.internet import address, task
@@ -81,6 +81,19 @@ class NameTests(unittest.TestCase):
             compression)
 
 
+    def test_encodeAfterRename(self):
+        """
+        L{Name.encode} encodes the current value of C{name}, even if the name
+        was encoded before under a different value.
+        """
+        name = dns.Name("foo.example.com")
+        name.encode(StringIO())
+        name.name = "bar.example.org"
+        stream = StringIO()
+        name.encode(stream)
+        self.assertEqual(stream.getvalue(), "\x03bar\x07example\x03org\x00")
+
+
     def test_unknown(self):
         """
         A resource record of unknown type and class is parsed into an
@@ -343,6 +356,123 @@ class MessageTestCase(unittest.TestCase):
         self.assertEqual(msg.additional, [])
 
 
+    def _response(self):
+        """
+        Return the bytes of a response with a question, two answers and an
+        authority record.
+        """
+        m = dns.Message(id=7, answer=1)
+        m.queries = [dns.Query('example.com', dns.A)]
+        m.answers = [
+            dns.RRHeader('example.com', dns.A, ttl=60,
+                         payload=dns.Record_A('10.0.0.1', ttl=60)),
+            dns.RRHeader('example.com', dns.A, ttl=60,
+                         payload=dns.Record_A('10.0.0.2', ttl=60))]
+        m.authority = [
+            dns.RRHeader('example.com', dns.NS, ttl=300,
+                         payload=dns.Record_NS('ns.example.com', ttl=300))]
+        return m, m.toStr()
+
+
+    def test_fromStrMatchesDecode(self):
+        """
+        L{Message.fromStr} parses a message into the same queries and records
+        as L{Message.decode}.
+        """
+        original, data = self._response()
+        viaString = dns.Message()
+        viaString.fromStr(data)
+        viaFile = dns.Message()
+        viaFile.decode(StringIO(data))
+        self.assertEqual(viaString.queries, viaFile.queries)
+        self.assertEqual(viaString.answers, viaFile.answers)
+        self.assertEqual(viaString.authority, viaFile.authority)
+        self.assertEqual(viaString.answers, original.answers)
+        self.assertEqual(viaString.toStr(), data)
+
+
+    def test_lazyPayload(self):
+        """
+        The payloads of fixed size records parsed by L{Message.fromStr} are
+        decoded when they are first used; the others are decoded at once.
+        """
+        original, data = self._response()
+        m = dns.Message()
+        m.fromStr(data)
+        a = m.answers[1]
+        self.assertNotIdentical(a._data, None)
+        self.assertEqual(a.payload, dns.Record_A('10.0.0.2', ttl=60))
+        self.assertIdentical(a._data, None)
+        self.assertIdentical(a.payload, a.payload)
+        self.assertIdentical(m.authority[0]._data, None)
+
+
+    def test_replacePayload(self):
+        """
+        The payload of a record parsed by L{Message.fromStr} can be replaced
+        before it is decoded.
+        """
+        original, data = self._response()
+        m = dns.Message()
+        m.fromStr(data)
+        payload = dns.Record_A('10.0.0.3')
+        m.answers[0].payload = payload
+        self.assertIdentical(m.answers[0].payload, payload)
+
+
+    def test_truncatedRecords(self):
+        """
+        L{Message.fromStr} keeps the records which precede the point where a
+        message was cut short.
+        """
+        original, data = self._response()
+        m = dns.Message()
+        m.fromStr(data[:-5])
+        self.assertEqual(m.answers, original.answers)
+        self.assertEqual(m.authority, [])
+
+
+    def test_truncatedPayload(self):
+        """
+        L{Message.fromStr} drops a record whose payload runs past the end of
+        the message, and those following it, like L{Message.decode}.
+        """
+        header = struct.pack(dns.Message.headerFmt, 1, 0, 0, 0, 1, 0, 0)
+        for type, rdata in [(dns.SOA, "\x00\x00\x00"), (dns.A, "\x0a\x00")]:
+            data = header + "\x00" + struct.pack(
+                dns.RRHeader.fmt, type, dns.IN, 60, len(rdata)) + rdata
+            viaString = dns.Message()
+            viaString.fromStr(data)
+            viaFile = dns.Message()
+            viaFile.decode(StringIO(data))
+            self.assertEqual(viaString.answers, [])
+            self.assertEqual(viaFile.answers, [])
+
+
+    def test_fromStrCompressionLoop(self):
+        """
+        L{Message.fromStr} raises L{ValueError} for a name with a compression
+        loop.
+        """
+        data = struct.pack(dns.Message.headerFmt, 1, 0, 0, 1, 0, 0, 0)
+        data += "\xc0\x0c\x00\x01\x00\x01"
+        self.assertRaises(ValueError, dns.Message().fromStr, data)
+
+
+    def test_pickleLazyRecord(self):
+        """
+        A record parsed by L{Message.fromStr} can be pickled, with its payload
+        decoded.
+        """
+        original, data = self._response()
+        m = dns.Message()
+        m.fromStr(data)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(m.answers[0], protocol))
+            self.assertIdentical(copy._data, None)
+            self.assertEqual(copy, original.answers[0])
+
+
     def testNULL(self):
         bytes = ''.join([chr(i) for i in range(256)])
         rec = dns.Record_NULL(bytes)
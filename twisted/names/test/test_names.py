@@ -7,6 +7,7 @@ Test cases for twisted.names.
 """
 
 import socket, operator, copy
+from StringIO import StringIO
 
 from twisted.trial import unittest
 
@@ -501,6 +502,30 @@ class DNSServerFactoryTests(unittest.TestCase):
         self.assertEqual(factory.connections, [])
 
 
+    def test_nameErrorAuthority(self):
+        """
+        L{DNSServerFactory.gotResolverError} answers a name error whose
+        failure carries a response with the authority section of that
+        response.
+        """
+        class FakeProtocol(object):
+            def writeMessage(self, message):
+                self.written = message
+        soa = dns.RRHeader('example.com', dns.SOA, dns.IN, 20,
+                           dns.Record_SOA(minimum=30))
+        response = Message()
+        response.authority = [soa]
+        message = Message()
+        message.queries = [dns.Query('foo.example.com')]
+        protocol = FakeProtocol()
+        factory = server.DNSServerFactory()
+        factory.gotResolverError(
+            failure.Failure(dns.AuthoritativeDomainError(
+                    'foo.example.com', response)), protocol, message, None)
+        self.assertEqual(protocol.written.rCode, dns.ENAME)
+        self.assertEqual(protocol.written.authority, [soa])
+
+
 class HelperTestCase(unittest.TestCase):
     def testSerialGenerator(self):
         f = self.mktemp()
@@ -795,6 +820,239 @@ class AuthorityTests(unittest.TestCase):
         self._referralTest('lookupAllRecords')
 
 
+    def _zoneLookup(self, records, name):
+        """
+        Look up the address of C{name} in a zone for I{test-domain.com}
+        holding C{records} and return the result.
+        """
+        zone = dict(records)
+        zone[str(soa_record.mname)] = [soa_record]
+        authority = NoFileAuthority(
+            soa=(str(soa_record.mname), soa_record), records=zone)
+        result = []
+        authority.lookupAddress(name).addBoth(result.append)
+        return result[0]
+
+
+    def test_referralBelowDelegation(self):
+        """
+        A name below a delegation to a child zone gets a referral to that
+        zone, with glue addresses for its nameservers.
+        """
+        nameserver = dns.Record_NS('ns.child.test-domain.com')
+        glue = dns.Record_A('10.0.0.1')
+        answer, authority, additional = self._zoneLookup({
+                'child.test-domain.com': [nameserver],
+                'ns.child.test-domain.com': [glue]},
+            'www.Child.test-domain.com')
+        self.assertEqual(answer, [])
+        self.assertEqual(
+            authority, [dns.RRHeader(
+                    'child.test-domain.com', dns.NS, ttl=soa_record.expire,
+                    payload=nameserver, auth=False)])
+        self.assertEqual(
+            additional, [dns.RRHeader(
+                    'ns.child.test-domain.com', dns.A, ttl=soa_record.expire,
+                    payload=glue, auth=True)])
+
+
+    def test_emptyNonTerminal(self):
+        """
+        A name without records which has names with records below it exists:
+        the response has no answers and the zone's I{SOA} record.
+        """
+        answer, authority, additional = self._zoneLookup({
+                'a.b.test-domain.com': [dns.Record_A('10.0.0.1')]},
+            'b.test-domain.com')
+        self.assertEqual(answer, [])
+        self.assertEqual([r.type for r in authority], [dns.SOA])
+
+
+    def test_recordsChanged(self):
+        """
+        After L{authority.FileAuthority.recordsChanged}, names swapped in
+        C{records} in place are taken into account, even though the number
+        of names did not change.
+        """
+        zone = {str(soa_record.mname): [soa_record],
+                'a.b.test-domain.com': [dns.Record_A('10.0.0.1')]}
+        auth = NoFileAuthority(
+            soa=(str(soa_record.mname), soa_record), records=zone)
+        self.assertTrue(auth._hasDescendants('b.test-domain.com'))
+        del zone['a.b.test-domain.com']
+        zone['a.c.test-domain.com'] = [dns.Record_A('10.0.0.1')]
+        auth.recordsChanged()
+        self.assertFalse(auth._hasDescendants('b.test-domain.com'))
+        self.assertTrue(auth._hasDescendants('c.test-domain.com'))
+
+
+    def test_wildcard(self):
+        """
+        A wildcard answers for missing names below its parent, with the
+        queried name as the owner of the records.
+        """
+        address = dns.Record_A('10.0.0.1')
+        answer, authority, additional = self._zoneLookup({
+                '*.test-domain.com': [address]},
+            'Foo.bar.test-domain.com')
+        self.assertEqual(
+            answer, [dns.RRHeader(
+                    'Foo.bar.test-domain.com', dns.A, ttl=soa_record.expire,
+                    payload=address, auth=True)])
+
+
+    def test_wildcardBlockedByExistingName(self):
+        """
+        A wildcard does not match below a name which exists, even one without
+        records of its own.
+        """
+        result = self._zoneLookup({
+                '*.test-domain.com': [dns.Record_A('10.0.0.1')],
+                'x.b.test-domain.com': [dns.Record_A('10.0.0.2')]},
+            'y.b.test-domain.com')
+        self.assertIsInstance(result, failure.Failure)
+        result.trap(dns.AuthoritativeDomainError)
+
+
+
+class PrecompiledAnswersTests(unittest.TestCase):
+    """
+    Tests for L{server.PrecompiledAnswers}.
+    """
+    def setUp(self):
+        self.precompiled = server.PrecompiledAnswers([test_domain_com])
+
+
+    def query(self, name, type=dns.A, id=1234, recDes=1):
+        """
+        Return the precompiled response to a query, decoded, or C{None}.
+        """
+        message = dns.Message(id=id, recDes=recDes)
+        message.queries = [dns.Query(name, type, dns.IN)]
+        data = self.precompiled.respond(message.toStr())
+        if data is None:
+            return None
+        response = dns.Message()
+        response.fromStr(data)
+        return response
+
+
+    def summarize(self, record):
+        """
+        Return the name, type, TTL and encoded payload of a record.
+        """
+        payload = StringIO()
+        record.payload.encode(payload)
+        return (str(record.name), record.type, record.ttl, payload.getvalue())
+
+
+    def test_sameAsLookup(self):
+        """
+        Precompiled responses hold the records the authority looks up for
+        each name and type, including types without records.
+        """
+        for name, type in [('test-domain.com', dns.A),
+                           ('test-domain.com', dns.MX),
+                           ('host.test-domain.com', dns.ALL_RECORDS),
+                           ('host.test-domain.com', dns.A),
+                           ('host.test-domain.com', dns.MX),
+                           ('cname.test-domain.com', dns.A)]:
+            response = self.query(name, type)
+            result = []
+            test_domain_com._lookup(name, dns.IN, type).addCallback(
+                result.append)
+            answers, authority, additional = result[0]
+            self.assertEqual(
+                map(self.summarize, response.answers + response.authority +
+                    response.additional),
+                map(self.summarize, answers + authority + additional))
+            self.assertEqual(response.queries, [dns.Query(name, type)])
+            self.assertTrue(response.answer)
+            self.assertEqual(response.auth, bool(answers))
+
+
+    def test_headerAndQuestionCopied(self):
+        """
+        The ID, the recursion desired flag and the spelling of the name in the
+        question are taken from the query.
+        """
+        response = self.query('HOST.test-Domain.com', id=4321, recDes=0)
+        self.assertEqual(response.id, 4321)
+        self.assertEqual(response.recDes, 0)
+        self.assertEqual(str(response.queries[0].name),
+                         'HOST.test-Domain.com')
+        self.assertEqual(str(response.answers[0].name),
+                         'HOST.test-Domain.com')
+        response = self.query('host.test-domain.com', id=1, recDes=1)
+        self.assertEqual(response.id, 1)
+        self.assertEqual(response.recDes, 1)
+
+
+    def test_truncated(self):
+        """
+        Responses which do not fit in a datagram are truncated.
+        """
+        response = self.query('test-domain.com', dns.ALL_RECORDS)
+        self.assertTrue(response.trunc)
+
+
+    def test_unknownName(self):
+        """
+        Queries for names which are not in a zone are not answered.
+        """
+        self.assertIdentical(self.query('unknown.test-domain.com'), None)
+
+
+    def test_notQuery(self):
+        """
+        Messages other than standard queries are not answered.
+        """
+        message = dns.Message(id=1, opCode=dns.OP_STATUS)
+        message.queries = [dns.Query('test-domain.com', dns.A)]
+        self.assertIdentical(self.precompiled.respond(message.toStr()), None)
+        message = dns.Message(id=1, answer=1)
+        message.queries = [dns.Query('test-domain.com', dns.A)]
+        self.assertIdentical(self.precompiled.respond(message.toStr()), None)
+        self.assertIdentical(self.precompiled.respond('\x00' * 5), None)
+
+
+    def test_datagramProtocol(self):
+        """
+        L{server.DNSServerDatagramProtocol} writes precompiled responses to
+        its transport and passes other datagrams on to its factory.
+        """
+        factory = server.DNSServerFactory([test_domain_com], precompile=True)
+        received = []
+        factory.messageReceived = lambda *args: received.append(args)
+        written = []
+        protocol = server.DNSServerDatagramProtocol(factory)
+        protocol.transport = StubUDPTransport(written)
+        protocol.startProtocol()
+        message = dns.Message(id=1)
+        message.queries = [dns.Query('test-domain.com', dns.A)]
+        protocol.datagramReceived(message.toStr(), ('127.0.0.1', 53))
+        self.assertEqual(len(written), 1)
+        self.assertEqual(written[0][1], ('127.0.0.1', 53))
+        self.assertEqual(received, [])
+        message.queries = [dns.Query('unknown.test-domain.com', dns.A)]
+        protocol.datagramReceived(message.toStr(), ('127.0.0.1', 53))
+        self.assertEqual(len(written), 1)
+        self.assertEqual(len(received), 1)
+
+
+
+class StubUDPTransport(object):
+    """
+    A UDP transport which records what is written to it.
+    """
+    def __init__(self, written):
+        self.written = written
+
+
+    def write(self, data, address):
+        self.written.append((data, address))
+
+
 
 class NoInitialResponseTestCase(unittest.TestCase):
 
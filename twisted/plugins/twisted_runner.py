@@ -8,3 +8,9 @@ TwistedProcmon = ServiceMaker(
     "twisted.runner.procmontap",
     ("A process watchdog / supervisor"),
     "procmon")
+
+TwistedPrefork = ServiceMaker(
+    "Twisted Prefork Supervisor",
+    "twisted.runner.preforktap",
+    ("Run workers accepting connections on shared listening sockets"),
+    "prefork")
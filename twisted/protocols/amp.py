@@ -176,7 +176,7 @@ __metaclass__ = type
 import types, warnings
 
 from cStringIO import StringIO
-from struct import pack
+from struct import pack, unpack
 import decimal, datetime
 
 from zope.interface import Interface, implements
@@ -191,7 +191,10 @@ from twisted.internet.main import CONNECTION_LOST
 from twisted.internet.error import PeerVerifyError, ConnectionLost
 from twisted.internet.error import ConnectionClosed
 from twisted.internet.defer import Deferred, maybeDeferred, fail
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.protocol import Factory
 from twisted.protocols.basic import Int16StringReceiver, StatefulStringProtocol
+from twisted.protocols.policies import WrappingFactory
 
 try:
     from twisted.internet import ssl
@@ -213,6 +216,13 @@ ERROR_DESCRIPTION = '_error_description'
 UNKNOWN_ERROR_CODE = 'UNKNOWN'
 UNHANDLED_ERROR_CODE = 'UNHANDLED'
 
+STREAM = '_stream'
+STREAM_CHUNK = '_chunk'
+STREAM_CREDIT = '_credit'
+STREAM_END = '_end'
+STREAM_ERROR = '_stream_error'
+STREAM_ABORT = '_abort'
+
 MAX_KEY_LENGTH = 0xff
 MAX_VALUE_LENGTH = 0xffff
 
@@ -513,6 +523,13 @@ class IncompatibleVersions(AmpError):
     """
 
 
+
+class NoConnectionAvailable(AmpError):
+    """
+    An L{AMPPool} has no connection to send a command on.
+    """
+
+
 PROTOCOL_ERRORS = {UNHANDLED_ERROR_CODE: UnhandledCommand}
 
 class AmpBox(dict):
@@ -654,6 +671,12 @@ class BoxDispatcher:
     @ivar _outstandingRequests: a dictionary mapping request IDs to
     L{Deferred}s which were returned for those requests.
 
+    @ivar _incomingStreams: a dictionary mapping stream IDs to the
+    L{StreamReceiver}s for the L{Stream} arguments received.
+
+    @ivar _outgoingStreams: a dictionary mapping stream IDs to the
+    L{_StreamSender}s for the L{Stream} arguments sent.
+
     @ivar locator: an object with a L{locateResponder} method that locates a
     responder function that takes a Box and returns a result (either a Box or a
     Deferred which fires one).
@@ -667,11 +690,15 @@ class BoxDispatcher:
 
     _failAllReason = None
     _outstandingRequests = None
+    _incomingStreams = None
+    _outgoingStreams = None
     _counter = 0L
     boxSender = None
 
     def __init__(self, locator):
         self._outstandingRequests = {}
+        self._incomingStreams = {}
+        self._outgoingStreams = {}
         self.locator = locator
 
 
@@ -688,9 +715,17 @@ class BoxDispatcher:
     def stopReceivingBoxes(self, reason):
         """
         No further boxes will be received here.  Terminate all currently
-        oustanding command deferreds with the given reason.
+        oustanding command deferreds and incoming streams with the given
+        reason.
         """
         self.failAllOutgoing(reason)
+        if self._incomingStreams:
+            streams = self._incomingStreams.values()
+            self._incomingStreams.clear()
+            for stream in streams:
+                stream._finished(reason)
+        if self._outgoingStreams:
+            self._outgoingStreams.clear()
 
 
     def failAllOutgoing(self, reason):
@@ -911,6 +946,73 @@ class BoxDispatcher:
             self._errorReceived(box)
         elif COMMAND in box:
             self._commandReceived(box)
+        elif STREAM in box:
+            self._streamBoxReceived(box)
+        else:
+            raise NoEmptyBoxes(box)
+
+
+    def _sendStream(self, payload):
+        """
+        Start sending a L{Stream} argument.
+
+        @param payload: a C{str}, or a file-like object to read the payload
+            from.
+
+        @return: the ID of the new stream.
+        """
+        if isinstance(payload, str):
+            payload = StringIO(payload)
+        streamID = self._nextTag()
+        self._outgoingStreams[streamID] = _StreamSender(
+            self, streamID, payload)
+        return streamID
+
+
+    def _receiveStream(self, streamID):
+        """
+        Start receiving a L{Stream} argument, granting its sender the first
+        window of chunks.
+
+        @return: a L{StreamReceiver}.
+        """
+        receiver = StreamReceiver(self, streamID)
+        self._incomingStreams[streamID] = receiver
+        receiver._grant(receiver.window)
+        return receiver
+
+
+    def _streamBoxReceived(self, box):
+        """
+        An AMP box carrying a chunk of, or controlling the flow of, a
+        L{Stream} argument was received.
+
+        @param box: an L{AmpBox} with a value for its L{STREAM} key.
+        """
+        streamID = box[STREAM]
+        # Boxes for a stream which the receiver has aborted may still be on
+        # their way: the sender only stops once it sees the abort.
+        if STREAM_CHUNK in box:
+            receiver = self._incomingStreams.get(streamID)
+            if receiver is not None:
+                receiver._chunkReceived(box[STREAM_CHUNK])
+        elif STREAM_CREDIT in box:
+            sender = self._outgoingStreams.get(streamID)
+            if sender is not None:
+                sender.addCredit(int(box[STREAM_CREDIT]))
+        elif STREAM_END in box:
+            receiver = self._incomingStreams.pop(streamID, None)
+            if receiver is not None:
+                receiver._finished(None)
+        elif STREAM_ERROR in box:
+            receiver = self._incomingStreams.pop(streamID, None)
+            if receiver is not None:
+                receiver._finished(
+                    Failure(UnknownRemoteError(box[STREAM_ERROR])))
+        elif STREAM_ABORT in box:
+            sender = self._outgoingStreams.pop(streamID, None)
+            if sender is not None:
+                sender.stop()
         else:
             raise NoEmptyBoxes(box)
 
@@ -1473,6 +1575,209 @@ class AmpList(Argument):
                     objects, self.subargs, Box(), proto
                     ).serialize() for objects in inObject])
 
+
+
+class _StreamSender(object):
+    """
+    The sending end of a L{Stream} argument: reads chunks of the payload and
+    sends them in boxes of their own as the receiver grants credit for them.
+
+    @ivar dispatcher: the L{BoxDispatcher} sending the stream.
+    @ivar streamID: the ID of the stream on its connection.
+    @ivar payload: the file-like object read from, or C{None} once the
+        stream is over.
+    @ivar credit: the number of chunks which may be sent without waiting.
+    """
+    chunkSize = MAX_VALUE_LENGTH
+
+    def __init__(self, dispatcher, streamID, payload):
+        self.dispatcher = dispatcher
+        self.streamID = streamID
+        self.payload = payload
+        self.credit = 0
+
+
+    def addCredit(self, count):
+        """
+        Send up to C{count} more chunks, and the end of the stream if it is
+        reached.
+        """
+        self.credit += count
+        while self.credit > 0 and self.payload is not None:
+            try:
+                chunk = self.payload.read(self.chunkSize)
+            except:
+                log.err(None, "Reading a streamed argument failed")
+                self._finish(STREAM_ERROR, "Unknown Error")
+                return
+            if not chunk:
+                self._finish(STREAM_END, "")
+                return
+            self.credit -= 1
+            self.dispatcher._safeEmit(
+                AmpBox({STREAM: self.streamID, STREAM_CHUNK: chunk}))
+
+
+    def _finish(self, key, value):
+        self.stop()
+        del self.dispatcher._outgoingStreams[self.streamID]
+        self.dispatcher._safeEmit(AmpBox({STREAM: self.streamID, key: value}))
+
+
+    def stop(self):
+        """
+        Stop sending the stream.
+        """
+        self.payload = None
+
+
+
+class StreamReceiver(object):
+    """
+    The receiving end of a L{Stream} argument.
+
+    Chunks are buffered until L{deliverTo} is called, and then written to
+    the consumer as they arrive.  Credit for more chunks is only granted to
+    the sender as chunks are written to the consumer, so a consumer which
+    pauses this producer stops the sender after at most L{window} chunks.
+
+    @ivar window: the number of chunks the sender may send ahead of those
+        written to the consumer.
+    @type window: C{int}
+    """
+    implements(IPushProducer)
+
+    window = 16
+
+    def __init__(self, dispatcher, streamID):
+        self._dispatcher = dispatcher
+        self._streamID = streamID
+        self._chunks = []
+        self._consumer = None
+        self._deferred = None
+        self._paused = False
+        self._ended = False
+        self._reason = None
+        self._delivered = 0
+
+
+    def deliverTo(self, consumer):
+        """
+        Write the payload to C{consumer}, which this receiver registers with
+        as a streaming producer.
+
+        @param consumer: an L{IConsumer} provider.
+
+        @return: a L{Deferred} which fires with C{None} once the whole
+            payload has been written to C{consumer}, or fails if the stream
+            or its connection fails first.
+        """
+        self._consumer = consumer
+        self._deferred = d = Deferred()
+        consumer.registerProducer(self, True)
+        self._flush()
+        return d
+
+
+    def _chunkReceived(self, chunk):
+        self._chunks.append(chunk)
+        if self._consumer is not None:
+            self._flush()
+
+
+    def _finished(self, reason):
+        """
+        The stream is over, successfully if C{reason} is C{None}.
+        """
+        self._ended = True
+        self._reason = reason
+        if self._consumer is not None:
+            self._flush()
+
+
+    def _grant(self, count):
+        self._dispatcher._safeEmit(AmpBox({
+                    STREAM: self._streamID, STREAM_CREDIT: str(count)}))
+
+
+    def _flush(self):
+        """
+        Write buffered chunks to the consumer unless it is paused, grant the
+        sender credit for them, and finish the delivery at the end of the
+        stream.
+        """
+        chunks = self._chunks
+        while chunks and not self._paused:
+            self._consumer.write(chunks.pop(0))
+            self._delivered += 1
+        if self._ended:
+            if not chunks and self._deferred is not None:
+                d, self._deferred = self._deferred, None
+                self._consumer.unregisterProducer()
+                if self._reason is None:
+                    d.callback(None)
+                else:
+                    d.errback(self._reason)
+        elif self._delivered >= self.window // 2:
+            self._grant(self._delivered)
+            self._delivered = 0
+
+
+    def pauseProducing(self):
+        """
+        Stop writing to the consumer and granting credit to the sender.
+        """
+        self._paused = True
+
+
+    def resumeProducing(self):
+        """
+        Resume writing to the consumer.
+        """
+        self._paused = False
+        if self._consumer is not None:
+            self._flush()
+
+
+    def stopProducing(self):
+        """
+        Abandon the stream, asking the sender to stop.
+        """
+        self._chunks = []
+        if not self._ended:
+            self._dispatcher._incomingStreams.pop(self._streamID, None)
+            self._dispatcher._safeEmit(AmpBox({
+                        STREAM: self._streamID, STREAM_ABORT: ""}))
+            self._ended = True
+        if self._deferred is not None:
+            d, self._deferred = self._deferred, None
+            d.errback(Exception("Consumer asked us to stop producing"))
+
+
+
+class Stream(Argument):
+    """
+    Transfer a payload of any size, unlike L{String} which is limited to
+    65535 bytes.
+
+    The box carrying this argument only holds an identifier for the stream;
+    the payload follows in boxes of its own, each carrying a chunk of it, so
+    other commands can proceed on the connection meanwhile.  The receiver
+    grants the sender credit for a few chunks at a time, so neither end
+    buffers more than L{StreamReceiver.window} chunks.
+
+    The value sent is a C{str} or a file-like object with a C{read} method,
+    and the value received is a L{StreamReceiver}.  Streams need the
+    protocol the argument is converted for to be the L{BoxDispatcher} too,
+    as it is for L{AMP}.
+    """
+    def fromStringProto(self, inString, proto):
+        return proto._receiveStream(inString)
+
+
+    def toStringProto(self, inObject, proto):
+        return proto._sendStream(inObject)
+
 class Command:
     """
     Subclass me to specify an AMP Command.
@@ -1512,6 +1817,11 @@ class Command:
     method must always be a dictionary adhering to the contract specified by
     L{response}, because clients are always free to request a response if they
     want one.
+
+    @cvar idempotent: a boolean; defaults to False.  Set it to True on your
+    subclass if sending the command more than once has the same effect as
+    sending it once, so that an L{AMPPool} may send it again on another
+    connection when the one it was sent on is lost.
     """
 
     class __metaclass__(type):
@@ -1547,6 +1857,7 @@ class Command:
     responseType = Box
 
     requiresAnswer = True
+    idempotent = False
 
 
     def __init__(self, **kw):
@@ -2054,7 +2365,57 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver):
         if self.innerProtocol is not None:
             self.innerProtocol.dataReceived(data)
             return
-        return Int16StringReceiver.dataReceived(self, data)
+        if self._currentBox is not None:
+            # Some strings were delivered to stringReceived directly.
+            return Int16StringReceiver.dataReceived(self, data)
+
+        # Parse whole boxes straight from the buffer, rather than one string
+        # at a time through the state machine.  The buffer attributes are
+        # those of Int16StringReceiver, so that _switchTo can take over the
+        # unparsed bytes between two boxes.
+        alldata = self._unprocessed + data
+        self._unprocessed = alldata
+        end = len(alldata)
+        offset = 0
+        maxKeyLength = self._MAX_KEY_LENGTH
+        while not self.paused:
+            box = AmpBox()
+            position = offset
+            complete = False
+            while end >= position + 2:
+                keyLength, = unpack("!H", alldata[position:position + 2])
+                position += 2
+                if not keyLength:
+                    complete = True
+                    break
+                if keyLength > maxKeyLength:
+                    self._compatibilityOffset = offset
+                    self.lengthLimitExceeded(keyLength)
+                    return
+                keyEnd = position + keyLength
+                if end < keyEnd + 2:
+                    break
+                valueLength, = unpack("!H", alldata[keyEnd:keyEnd + 2])
+                valueEnd = keyEnd + 2 + valueLength
+                if end < valueEnd:
+                    break
+                box[alldata[position:keyEnd]] = alldata[keyEnd + 2:valueEnd]
+                position = valueEnd
+            if not complete:
+                break
+            offset = position
+            self._compatibilityOffset = offset
+            self.boxReceiver.ampBoxReceived(box)
+            if 'recvd' in self.__dict__:
+                # The protocol was switched, and took the remaining bytes.
+                alldata = self.__dict__.pop('recvd')
+                self._unprocessed = alldata
+                self._compatibilityOffset = offset = 0
+                end = len(alldata)
+                if not alldata:
+                    return
+        self._unprocessed = alldata[offset:]
+        self._compatibilityOffset = 0
 
 
     def connectionLost(self, reason):
@@ -2580,3 +2941,297 @@ class DateTime(Argument):
             sign,
             abs(minutesOffset) // 60,
             abs(minutesOffset) % 60)
+
+
+
+class _CommandStatistics(object):
+    """
+    The statistics of one command sent through an L{AMPPool}.
+
+    @ivar calls: the number of calls which completed.
+    @ivar failures: the number of those calls which failed.
+    @ivar retries: the number of times calls were sent again on another
+        connection.
+    @ivar totalLatency: the sum of the seconds the calls took.
+    @ivar maxLatency: the longest a call took, in seconds.
+    """
+    __slots__ = ('calls', 'failures', 'retries', 'totalLatency', 'maxLatency')
+
+    def __init__(self):
+        self.calls = self.failures = self.retries = 0
+        self.totalLatency = self.maxLatency = 0.0
+
+
+    def record(self, latency, failed):
+        self.calls += 1
+        if failed:
+            self.failures += 1
+        self.totalLatency += latency
+        if latency > self.maxLatency:
+            self.maxLatency = latency
+
+
+    def snapshot(self):
+        if self.calls:
+            mean = self.totalLatency / self.calls
+        else:
+            mean = 0.0
+        return {'calls': self.calls, 'failures': self.failures,
+                'retries': self.retries, 'meanLatency': mean,
+                'maxLatency': self.maxLatency}
+
+
+
+class _AMPConnector(WrappingFactory):
+    """
+    The factory for one of the connections of an L{AMPPool}, reconnecting
+    it with exponential backoff.
+
+    The protocols it builds are wrapped so that the pool learns when their
+    connection is lost.
+
+    @ivar endpoint: the L{IStreamClientEndpoint} connected to.
+    @ivar delay: the number of seconds to wait before the next connection
+        attempt.
+    @ivar current: the connected L{AMP} instance, or C{None}.
+    """
+    current = None
+
+    def __init__(self, pool, endpoint):
+        factory = Factory()
+        factory.protocol = pool.protocolClass
+        WrappingFactory.__init__(self, factory)
+        self.pool = pool
+        self.endpoint = endpoint
+        self.delay = pool.retryDelay
+
+
+    def connect(self):
+        """
+        Make a connection attempt.
+        """
+        d = self.endpoint.connect(self)
+        d.addCallbacks(self._connected, self._failed)
+
+
+    def _connected(self, wrapper):
+        self.current = wrapper.wrappedProtocol
+        self.delay = self.pool.retryDelay
+        self.pool._connectionMade(self)
+
+
+    def _failed(self, reason):
+        self.pool._connectionFailed(self, reason)
+
+
+    def unregisterProtocol(self, p):
+        """
+        The connection of C{p} was lost: tell the pool, and reconnect.
+        """
+        WrappingFactory.unregisterProtocol(self, p)
+        if p.wrappedProtocol is self.current:
+            self.current = None
+            self.pool._connectionLost(self, p.wrappedProtocol)
+
+
+
+class AMPPool(object):
+    """
+    A client keeping several AMP connections to each of a set of servers,
+    and distributing commands over them.
+
+    Each command is sent on the connection with the fewest commands waiting
+    for an answer.  Lost connections are made again after C{retryDelay}
+    seconds, doubling for each consecutive failure up to C{maxRetryDelay}.
+    A command whose C{idempotent} attribute is true is sent again on another
+    connection, up to C{retries} times, if the connection it was sent on is
+    lost before it is answered.
+
+    @ivar protocols: the connected L{AMP} instances.
+    @ivar protocolClass: the class of the connections, called without
+        arguments.
+    @ivar statistics: a C{dict} mapping command names to their
+        L{_CommandStatistics}.
+    @ivar _connectors: the L{_AMPConnector} of each connection.
+    @ivar _retries: a C{dict} mapping connectors to the L{IDelayedCall}
+        which will reconnect them.
+    @ivar _reactor: an L{IReactorTime} provider.
+    """
+    protocolClass = AMP
+
+    def __init__(self, endpoints, connectionsPerEndpoint=2, retryDelay=1.0,
+                 maxRetryDelay=60.0, retries=1, reactor=None):
+        """
+        @param endpoints: the L{IStreamClientEndpoint} providers to connect
+            to.
+
+        @param connectionsPerEndpoint: the number of connections to make to
+            each endpoint.
+        @type connectionsPerEndpoint: C{int}
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.retries = retries
+        self.protocols = []
+        self.statistics = {}
+        self._connectors = []
+        for endpoint in endpoints:
+            for i in range(connectionsPerEndpoint):
+                self._connectors.append(_AMPConnector(self, endpoint))
+        self._attempts = set()
+        self._retries = {}
+        self._started = None
+        self._stopped = False
+
+
+    def start(self):
+        """
+        Make every connection.
+
+        @return: a L{Deferred} which fires with this pool once every first
+            connection attempt has succeeded or failed.
+        """
+        started = self._started = Deferred()
+        for connector in self._connectors:
+            connector.connect()
+        if not self._connectors:
+            self._started = None
+            started.callback(self)
+        return started
+
+
+    def stop(self):
+        """
+        Close every connection and stop reconnecting.
+        """
+        self._stopped = True
+        for call in self._retries.values():
+            call.cancel()
+        self._retries.clear()
+        for p in self.protocols[:]:
+            p.transport.loseConnection()
+        if self._started is not None:
+            started, self._started = self._started, None
+            started.callback(self)
+
+
+    def _connectionMade(self, connector):
+        if self._stopped:
+            # The connection was attempted before stop: close it without
+            # making it one of ours.
+            p, connector.current = connector.current, None
+            p.transport.loseConnection()
+        else:
+            self.protocols.append(connector.current)
+        self._attempted(connector)
+
+
+    def _connectionFailed(self, connector, reason):
+        log.msg("AMP connection to %r failed: %s" % (
+                connector.endpoint, reason.getErrorMessage()))
+        self._attempted(connector)
+        self._retry(connector)
+
+
+    def _connectionLost(self, connector, p):
+        if p in self.protocols:
+            self.protocols.remove(p)
+        self._retry(connector)
+
+
+    def _attempted(self, connector):
+        """
+        Fire the L{Deferred} of L{start} once every connection has been
+        tried.
+        """
+        self._attempts.add(connector)
+        if (self._started is not None
+            and len(self._attempts) == len(self._connectors)):
+            started, self._started = self._started, None
+            started.callback(self)
+
+
+    def _retry(self, connector):
+        """
+        Reconnect C{connector} after its delay, and double it.
+        """
+        if self._stopped:
+            return
+        delay = connector.delay
+        connector.delay = min(delay * 2, self.maxRetryDelay)
+        def reconnect():
+            del self._retries[connector]
+            connector.connect()
+        self._retries[connector] = self._reactor.callLater(delay, reconnect)
+
+
+    def _protocolFor(self, exclude):
+        """
+        Return the connection with the fewest commands waiting for an
+        answer, other than those in C{exclude}, or C{None}.
+        """
+        candidates = [p for p in self.protocols if p not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda p: len(p._outstandingRequests))
+
+
+    def callRemote(self, commandType, *a, **kw):
+        """
+        Send a command on the least busy connection.
+
+        See L{BoxDispatcher.callRemote}.  The result fails with
+        L{NoConnectionAvailable} if there is no connection.
+        """
+        if not commandType.requiresAnswer:
+            p = self._protocolFor(())
+            if p is not None:
+                p.callRemote(commandType, *a, **kw)
+            return None
+        stats = self.statistics.get(commandType.commandName)
+        if stats is None:
+            stats = self.statistics[commandType.commandName] = (
+                _CommandStatistics())
+        started = self._reactor.seconds()
+        d = self._callRemote(commandType, a, kw, [], stats)
+        def record(result):
+            stats.record(self._reactor.seconds() - started,
+                         isinstance(result, Failure))
+            return result
+        return d.addBoth(record)
+
+
+    def _callRemote(self, commandType, a, kw, tried, stats):
+        """
+        Send a command on a connection not in C{tried}, and send it again
+        if that connection is lost and the command is idempotent.
+        """
+        p = self._protocolFor(tried)
+        if p is None:
+            return fail(NoConnectionAvailable())
+        tried.append(p)
+        d = p.callRemote(commandType, *a, **kw)
+        if commandType.idempotent and len(tried) <= self.retries:
+            def retry(reason):
+                reason.trap(ConnectionClosed)
+                if self._protocolFor(tried) is None:
+                    return reason
+                stats.retries += 1
+                return self._callRemote(commandType, a, kw, tried, stats)
+            d.addErrback(retry)
+        return d
+
+
+    def getStatistics(self):
+        """
+        Return the statistics of each command sent through this pool.
+
+        @return: a C{dict} mapping command names to C{dict}s with the
+            C{calls}, C{failures}, C{retries}, C{meanLatency} and
+            C{maxLatency} of the command.
+        """
+        return dict([(name, stats.snapshot())
+                     for (name, stats) in self.statistics.iteritems()])
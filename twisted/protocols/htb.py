@@ -87,13 +87,18 @@ class Bucket:
 
         if self.rate is None:
             self.content = 0
-            return True
         else:
             now = time()
-            deltaT = now - self.lastDrip
-            self.content = long(max(0, self.content - deltaT * self.rate))
-            self.lastDrip = now
-            return False
+            drained = long((now - self.lastDrip) * self.rate)
+            if drained >= self.content:
+                self.content = 0
+                self.lastDrip = now
+            elif drained:
+                # Only consume the time which paid for whole tokens, so that
+                # frequent calls don't round the drain rate up.
+                self.content -= drained
+                self.lastDrip += drained / float(self.rate)
+        return self.content == 0
 
 
 class IBucketFilter(Interface):
@@ -142,10 +147,22 @@ class HierarchicalBucketFilter:
         key = self.getBucketKey(*a, **kw)
         bucket = self.buckets.get(key)
         if bucket is None:
-            bucket = self.bucketFactory(parentBucket)
+            bucket = self.makeBucket(key, parentBucket)
             self.buckets[key] = bucket
         return bucket
 
+    def makeBucket(self, key, parentBucket):
+        """I make a new bucket for a key which has none.
+
+        Unless I'm overridden, every key gets a L{bucketFactory} bucket.
+
+        @param key: The result of L{getBucketKey}.
+        @param parentBucket: The bucket from my parent filter, or None.
+
+        @returntype: L{Bucket}
+        """
+        return self.bucketFactory(parentBucket)
+
     def getBucketKey(self, *a, **kw):
         """I determine who gets which bucket.
 
@@ -21,8 +21,22 @@ To connect to a server, create a factory for L{MemCacheProtocol}::
 All the operations of the memcache protocol are present, but
 L{MemCacheProtocol.set} and L{MemCacheProtocol.get} are the more important.
 
+To spread keys over several servers, use a L{MemCachePool}, which has the
+same key-based operations::
+
+    from twisted.protocols.memcache import MemCachePool
+    pool = MemCachePool(["cache1:11211", "cache2:11211", "cache3"])
+    d = pool.start()
+    d.addCallback(lambda pool: pool.getMultiple(["foo", "bar"]))
+
+Values read very often can be kept in the process by putting a L{NearCache}
+in front of a protocol or a pool.
+
 See U{http://code.sixapart.com/svn/memcached/trunk/server/doc/protocol.txt} for
 more information about the protocol.
+
+L{MemCacheBinaryProtocol} has the same API but speaks the binary protocol,
+which is cheaper to parse and fetches many keys with a single write.
 """
 
 try:
@@ -33,10 +47,17 @@ except ImportError:
             return self.pop(0)
 
 
+import struct
+from bisect import bisect_left, insort
+
 from twisted.protocols.basic import LineReceiver
+from twisted.internet.protocol import Protocol
 from twisted.protocols.policies import TimeoutMixin
-from twisted.internet.defer import Deferred, fail, TimeoutError
-from twisted.python import log
+from twisted.internet.protocol import ClientFactory
+from twisted.internet.defer import Deferred, fail, succeed, TimeoutError
+from twisted.internet.defer import gatherResults, FirstError
+from twisted.python import log, failure
+from twisted.python.hashlib import md5
 
 
 
@@ -754,5 +775,1172 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
 
 
 
+class MemCacheBinaryProtocol(Protocol, TimeoutMixin):
+    """
+    A memcache client speaking the binary protocol, with the API of
+    L{MemCacheProtocol}.
+
+    Every request carries an opaque identifier which its response echoes,
+    so responses are matched to requests without parsing lines.
+    L{getMultiple} sends a quiet I{getkq} request for each key followed by
+    a I{noop} in one write: the server only answers the keys it has, and
+    the I{noop} answer marks the end of the batch.
+
+    Identifiers returned by C{get(key, withIdentifier=True)} are the
+    decimal string of the 64 bit I{cas} value, as with L{MemCacheProtocol}.
+
+    @ivar persistentTimeOut: the timeout period used to wait for a response.
+    @type persistentTimeOut: C{int}
+
+    @ivar _current: the requests waiting for an answer, keyed by opaque
+        identifier.
+    @type _current: C{dict} mapping C{int} to L{Command}
+
+    @ivar _buffer: received bytes which do not form a whole response yet.
+    @type _buffer: C{str}
+    """
+    MAX_KEY_LENGTH = 250
+    _disconnected = False
+
+    headerFormat = "!BBHBBHLLQ"
+
+    REQUEST = 0x80
+    RESPONSE = 0x81
+
+    GET, SET, ADD, REPLACE, DELETE, INCREMENT, DECREMENT = range(7)
+    FLUSH, GETQ, NOOP, VERSION, GETK, GETKQ, APPEND, PREPEND, STAT = range(
+        8, 17)
+    CAS = SET
+
+    NO_ERROR = 0x00
+    KEY_NOT_FOUND = 0x01
+    KEY_EXISTS = 0x02
+    VALUE_TOO_LARGE = 0x03
+    INVALID_ARGUMENTS = 0x04
+    NOT_STORED = 0x05
+    NON_NUMERIC = 0x06
+    UNKNOWN_COMMAND = 0x81
+
+    def __init__(self, timeOut=60):
+        """
+        Create the protocol.
+
+        @param timeOut: the timeout to wait before detecting that the
+            connection is dead and close it. It's expressed in seconds.
+        @type timeOut: C{int}
+        """
+        self._current = {}
+        self._buffer = ""
+        self._opaque = 0
+        self.persistentTimeOut = self.timeOut = timeOut
+
+
+    def _cancelCommands(self, reason):
+        """
+        Cancel all the outstanding commands, making them fail with C{reason}.
+        """
+        commands = set(self._current.values())
+        self._current.clear()
+        for cmd in commands:
+            cmd.fail(reason)
+
+
+    def timeoutConnection(self):
+        """
+        Close the connection in case of timeout.
+        """
+        self._cancelCommands(TimeoutError("Connection timeout"))
+        self.transport.loseConnection()
+
+
+    def connectionLost(self, reason):
+        """
+        Cause any outstanding commands to fail.
+        """
+        self._disconnected = True
+        self._cancelCommands(reason)
+
+
+    def _request(self, opcode, key="", extras="", value="", cas=0):
+        """
+        Encode a request and return its opaque identifier along with it.
+        """
+        self._opaque = opaque = (self._opaque + 1) & 0xffffffff
+        header = struct.pack(
+            self.headerFormat, self.REQUEST, opcode, len(key), len(extras),
+            0, 0, len(extras) + len(key) + len(value), opaque, cas)
+        return opaque, header + extras + key + value
+
+
+    def _send(self, data, cmd, opaques):
+        """
+        Write requests for C{cmd}, which will receive the responses to the
+        requests identified by C{opaques}.
+        """
+        if not self._current:
+            self.setTimeout(self.persistentTimeOut)
+        for opaque in opaques:
+            self._current[opaque] = cmd
+        self.transport.write(data)
+        return cmd._deferred
+
+
+    def _checkKey(self, key):
+        """
+        Return a failed L{Deferred} if C{key} cannot be sent, or C{None}.
+        """
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        if not isinstance(key, str):
+            return fail(ClientError(
+                "Invalid type for key: %s, expecting a string" % (type(key),)))
+        if len(key) > self.MAX_KEY_LENGTH:
+            return fail(ClientError("Key too long"))
+        return None
+
+
+    def dataReceived(self, data):
+        """
+        Split the received bytes into responses and dispatch them.
+        """
+        self.resetTimeout()
+        data = self._buffer + data
+        offset = 0
+        end = len(data)
+        unpack = struct.unpack
+        while end - offset >= 24:
+            (magic, opcode, keyLength, extrasLength, dataType, status,
+             bodyLength, opaque, cas) = unpack(
+                self.headerFormat, data[offset:offset + 24])
+            if end - offset < 24 + bodyLength:
+                break
+            start = offset + 24
+            offset = start + bodyLength
+            if magic != self.RESPONSE:
+                self._buffer = ""
+                self.transport.loseConnection()
+                return
+            cmd = self._current.get(opaque)
+            if cmd is None:
+                raise RuntimeError("Unexpected commands answer.")
+            extras = data[start:start + extrasLength]
+            key = data[start + extrasLength:start + extrasLength + keyLength]
+            value = data[start + extrasLength + keyLength:offset]
+            cmd.handler(cmd, opaque, status, extras, key, value, cas)
+        self._buffer = data[offset:]
+        if not self._current:
+            self.setTimeout(None)
+
+
+    def _error(self, cmd, opaque, status, value):
+        """
+        Fail C{cmd} for an error status other than the ones its command
+        expects.
+        """
+        del self._current[opaque]
+        if status == self.UNKNOWN_COMMAND:
+            log.err("Non-existent command sent.")
+            cmd.fail(NoSuchCommand())
+        elif status in (self.VALUE_TOO_LARGE, self.INVALID_ARGUMENTS,
+                        self.NON_NUMERIC):
+            log.err("Invalid input: %s" % (value,))
+            cmd.fail(ClientError(value))
+        else:
+            log.err("Server error: %s" % (value,))
+            cmd.fail(ServerError(value))
+
+
+    def _handleBoolean(self, cmd, opaque, status, extras, key, value, cas):
+        """
+        Handle the response to a command which succeeds with C{True}, or
+        with C{False} when a condition is not met.
+        """
+        if status == self.NO_ERROR:
+            del self._current[opaque]
+            cmd.success(True)
+        elif status in (self.KEY_NOT_FOUND, self.KEY_EXISTS,
+                        self.NOT_STORED):
+            del self._current[opaque]
+            cmd.success(False)
+        else:
+            self._error(cmd, opaque, status, value)
+
+
+    def _handleGet(self, cmd, opaque, status, extras, key, value, cas):
+        if status == self.NO_ERROR:
+            flags = struct.unpack("!L", extras[:4])[0]
+            cmd.flags, cmd.cas, cmd.value = flags, str(cas), value
+        elif status != self.KEY_NOT_FOUND:
+            self._error(cmd, opaque, status, value)
+            return
+        del self._current[opaque]
+        if cmd.withIdentifier:
+            cmd.success((cmd.flags, cmd.cas, cmd.value))
+        else:
+            cmd.success((cmd.flags, cmd.value))
+
+
+    def _handleGetMultiple(self, cmd, opaque, status, extras, key, value,
+                           cas):
+        del self._current[opaque]
+        if opaque == cmd.end:
+            # The noop answer: every hit has been received.
+            for keyOpaque in cmd.opaques:
+                self._current.pop(keyOpaque, None)
+            cmd.success(cmd.values)
+        elif status == self.NO_ERROR:
+            flags = struct.unpack("!L", extras[:4])[0]
+            if cmd.withIdentifier:
+                cmd.values[key] = (flags, str(cas), value)
+            else:
+                cmd.values[key] = (flags, value)
+
+
+    def _handleCounter(self, cmd, opaque, status, extras, key, value, cas):
+        if status == self.NO_ERROR:
+            del self._current[opaque]
+            cmd.success(struct.unpack("!Q", value)[0])
+        elif status == self.KEY_NOT_FOUND:
+            del self._current[opaque]
+            cmd.success(False)
+        else:
+            self._error(cmd, opaque, status, value)
+
+
+    def _handleValue(self, cmd, opaque, status, extras, key, value, cas):
+        if status == self.NO_ERROR:
+            del self._current[opaque]
+            cmd.success(value)
+        else:
+            self._error(cmd, opaque, status, value)
+
+
+    def _handleStat(self, cmd, opaque, status, extras, key, value, cas):
+        if status != self.NO_ERROR:
+            self._error(cmd, opaque, status, value)
+        elif key:
+            cmd.values[key] = value
+        else:
+            del self._current[opaque]
+            cmd.success(cmd.values)
+
+
+    def get(self, key, withIdentifier=False):
+        """
+        See L{MemCacheProtocol.get}.
+        """
+        error = self._checkKey(key)
+        if error is not None:
+            return error
+        opaque, data = self._request(self.GET, key)
+        cmd = Command("get", key=key, flags=0, cas="", value=None,
+                      withIdentifier=withIdentifier, handler=self._handleGet)
+        return self._send(data, cmd, [opaque])
+
+
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Get the given list of C{keys} with one quiet request per key,
+        followed by a I{noop}, sent in a single write.
+
+        See L{MemCacheProtocol.getMultiple}.
+        """
+        for key in keys:
+            error = self._checkKey(key)
+            if error is not None:
+                return error
+        if withIdentifier:
+            values = dict([(key, (0, "", None)) for key in keys])
+        else:
+            values = dict([(key, (0, None)) for key in keys])
+        requests = []
+        opaques = []
+        for key in keys:
+            opaque, data = self._request(self.GETKQ, key)
+            opaques.append(opaque)
+            requests.append(data)
+        end, data = self._request(self.NOOP)
+        requests.append(data)
+        cmd = Command("get", keys=keys, values=values, opaques=opaques,
+                      end=end, withIdentifier=withIdentifier,
+                      handler=self._handleGetMultiple)
+        return self._send("".join(requests), cmd, opaques + [end])
+
+
+    def _store(self, opcode, key, val, flags, expireTime, cas=0):
+        """
+        Internal wrapper for setting values.
+        """
+        error = self._checkKey(key)
+        if error is not None:
+            return error
+        if not isinstance(val, str):
+            return fail(ClientError(
+                "Invalid type for value: %s, expecting a string" %
+                (type(val),)))
+        if opcode in (self.APPEND, self.PREPEND):
+            extras = ""
+        else:
+            extras = struct.pack("!LL", flags, expireTime)
+        opaque, data = self._request(opcode, key, extras, val, cas)
+        cmd = Command("store", key=key, handler=self._handleBoolean)
+        return self._send(data, cmd, [opaque])
+
+
+    def set(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.set}.
+        """
+        return self._store(self.SET, key, val, flags, expireTime)
+
+
+    def add(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.add}.
+        """
+        return self._store(self.ADD, key, val, flags, expireTime)
+
+
+    def replace(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.replace}.
+        """
+        return self._store(self.REPLACE, key, val, flags, expireTime)
+
+
+    def checkAndSet(self, key, val, cas, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.checkAndSet}.
+        """
+        return self._store(self.CAS, key, val, flags, expireTime, int(cas))
+
+
+    def append(self, key, val):
+        """
+        See L{MemCacheProtocol.append}.
+        """
+        return self._store(self.APPEND, key, val, 0, 0)
+
+
+    def prepend(self, key, val):
+        """
+        See L{MemCacheProtocol.prepend}.
+        """
+        return self._store(self.PREPEND, key, val, 0, 0)
+
+
+    def _counter(self, opcode, key, val):
+        error = self._checkKey(key)
+        if error is not None:
+            return error
+        # An expiration of all ones makes a missing key an error, as in the
+        # text protocol, instead of creating it.
+        extras = struct.pack("!QQL", int(val), 0, 0xffffffff)
+        opaque, data = self._request(opcode, key, extras)
+        cmd = Command("counter", key=key, handler=self._handleCounter)
+        return self._send(data, cmd, [opaque])
+
+
+    def increment(self, key, val=1):
+        """
+        See L{MemCacheProtocol.increment}.
+        """
+        return self._counter(self.INCREMENT, key, val)
+
+
+    def decrement(self, key, val=1):
+        """
+        See L{MemCacheProtocol.decrement}.
+        """
+        return self._counter(self.DECREMENT, key, val)
+
+
+    def delete(self, key):
+        """
+        See L{MemCacheProtocol.delete}.
+        """
+        error = self._checkKey(key)
+        if error is not None:
+            return error
+        opaque, data = self._request(self.DELETE, key)
+        cmd = Command("delete", key=key, handler=self._handleBoolean)
+        return self._send(data, cmd, [opaque])
+
+
+    def flushAll(self):
+        """
+        See L{MemCacheProtocol.flushAll}.
+        """
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        opaque, data = self._request(self.FLUSH)
+        cmd = Command("flush_all", handler=self._handleBoolean)
+        return self._send(data, cmd, [opaque])
+
+
+    def version(self):
+        """
+        See L{MemCacheProtocol.version}.
+        """
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        opaque, data = self._request(self.VERSION)
+        cmd = Command("version", handler=self._handleValue)
+        return self._send(data, cmd, [opaque])
+
+
+    def stats(self, arg=None):
+        """
+        See L{MemCacheProtocol.stats}.
+        """
+        if self._disconnected:
+            return fail(RuntimeError("not connected"))
+        opaque, data = self._request(self.STAT, arg or "")
+        cmd = Command("stats", values={}, handler=self._handleStat)
+        return self._send(data, cmd, [opaque])
+
+
+
+def _ketamaPoints(digest):
+    """
+    Split an md5 digest into the four 32 bit points libketama uses.
+    """
+    return [ord(digest[3 + h * 4]) << 24 | ord(digest[2 + h * 4]) << 16 |
+            ord(digest[1 + h * 4]) << 8 | ord(digest[h * 4])
+            for h in range(4)]
+
+
+
+class HashRing(object):
+    """
+    A consistent hash ring, placing nodes and keys like libketama does, so
+    that keys map to the same servers as in other ketama based clients.
+    Adding or removing a node only moves the keys of that node.
+
+    @ivar pointsPerNode: The number of points each node has on the ring.
+    @ivar _points: A sorted C{list} of C{(point, node)} tuples.
+    @ivar _keys: The points of C{_points}, for bisection.
+    """
+    pointsPerNode = 160
+
+    def __init__(self, nodes=()):
+        self._points = []
+        self._keys = []
+        for node in nodes:
+            self.add(node)
+
+
+    def __contains__(self, node):
+        for point, n in self._points:
+            if n == node:
+                return True
+        return False
+
+
+    def add(self, node):
+        """
+        Put C{node}, a C{str} such as C{"10.0.0.1:11211"}, on the ring.
+        """
+        for i in range(self.pointsPerNode / 4):
+            for point in _ketamaPoints(md5("%s-%d" % (node, i)).digest()):
+                insort(self._points, (point, node))
+        self._keys = [point for (point, n) in self._points]
+
+
+    def remove(self, node):
+        """
+        Take C{node} off the ring.
+        """
+        self._points = [(point, n) for (point, n) in self._points
+                        if n != node]
+        self._keys = [point for (point, n) in self._points]
+
+
+    def nodeFor(self, key):
+        """
+        Return the node responsible for C{key}, or C{None} if the ring is
+        empty.
+        """
+        if not self._points:
+            return None
+        i = bisect_left(self._keys, _ketamaPoints(md5(key).digest())[0])
+        if i == len(self._keys):
+            i = 0
+        return self._points[i][1]
+
+
+
+class _MemCacheServer(object):
+    """
+    The connections of a L{MemCachePool} to one server.
+
+    @ivar name: The C{"host:port"} name of the server on the ring.
+    @ivar protocols: The connected protocol instances.
+    @ivar attempted: Whether a first connection attempt has completed.
+    """
+    def __init__(self, name, host, port):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.protocols = []
+        self.attempted = False
+
+
+
+class _MemCacheConnector(ClientFactory):
+    """
+    The factory for one of the connections of a L{MemCachePool} to a
+    server, reconnecting it with exponential backoff.
+
+    @ivar delay: The number of seconds to wait before the next reconnection
+        attempt.
+    @ivar current: The connected protocol, or C{None}.
+    """
+    current = None
+
+    def __init__(self, pool, server):
+        self.pool = pool
+        self.server = server
+        self.delay = pool.retryDelay
+
+
+    def buildProtocol(self, addr):
+        p = self.pool.protocolClass(self.pool.timeOut)
+        p.factory = self
+        p.callLater = self.pool._reactor.callLater
+        self.current = p
+        self.delay = self.pool.retryDelay
+        self.pool._connectionMade(self.server, p)
+        return p
+
+
+    def clientConnectionLost(self, connector, reason):
+        p, self.current = self.current, None
+        self.pool._connectionLost(self.server, p)
+        self.pool._retry(self, connector)
+
+
+    def clientConnectionFailed(self, connector, reason):
+        self.pool._connectionFailed(self.server, reason)
+        self.pool._retry(self, connector)
+
+
+
+class MemCachePool(object):
+    """
+    A client for a cluster of memcached servers, with several connections
+    to each of them.
+
+    Keys are spread over the servers with a L{HashRing}.  A server is taken
+    off the ring when its last connection is lost or when it cannot be
+    reached, so its keys move to the other servers, and it is put back once
+    a connection succeeds again.  Connections are retried after
+    C{retryDelay} seconds, doubling for each consecutive failure up to
+    C{maxRetryDelay}.  Each command is sent on the connection of its
+    server with the fewest outstanding commands.
+
+    Commands fail with L{ServerError} when no server is connected.
+
+    @ivar servers: A C{dict} mapping C{"host:port"} names to the
+        L{_MemCacheServer} state of each server.
+    @ivar ring: The L{HashRing} of the connected servers.
+    @ivar protocolClass: The client protocol, called with C{timeOut} to
+        create each connection.
+    @ivar _retries: A C{dict} mapping connection factories to the
+        L{IDelayedCall} which will reconnect them.
+    @ivar _reactor: An L{IReactorTCP} and L{IReactorTime} provider.
+    """
+    protocolClass = MemCacheProtocol
+
+    def __init__(self, servers, connectionsPerServer=2, retryDelay=1.0,
+                 maxRetryDelay=60.0, timeOut=60, reactor=None):
+        """
+        @param servers: The servers, as C{"host"} or C{"host:port"}
+            strings.
+        @type servers: C{list} of C{str}
+
+        @param connectionsPerServer: The number of connections to open to
+            each server.
+        @type connectionsPerServer: C{int}
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.connectionsPerServer = connectionsPerServer
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.timeOut = timeOut
+        self.ring = HashRing()
+        self.servers = {}
+        for server in servers:
+            if ":" in server:
+                host, port = server.split(":", 1)
+                port = int(port)
+            else:
+                host, port = server, DEFAULT_PORT
+            name = "%s:%d" % (host, port)
+            self.servers[name] = _MemCacheServer(name, host, port)
+        self._retries = {}
+        self._started = None
+        self._stopped = False
+
+
+    def start(self):
+        """
+        Connect to every server.
+
+        @return: a deferred that will fire with this pool once a connection
+            to each server has succeeded or failed.
+        @rtype: L{Deferred}
+        """
+        self._started = Deferred()
+        for server in self.servers.values():
+            for i in range(self.connectionsPerServer):
+                self._reactor.connectTCP(server.host, server.port,
+                                         _MemCacheConnector(self, server))
+        return self._started
+
+
+    def stop(self):
+        """
+        Close every connection and stop reconnecting.
+        """
+        self._stopped = True
+        for call in self._retries.values():
+            call.cancel()
+        self._retries.clear()
+        for server in self.servers.values():
+            for p in server.protocols[:]:
+                p.transport.loseConnection()
+
+
+    def _connectionMade(self, server, p):
+        server.protocols.append(p)
+        if len(server.protocols) == 1:
+            self.ring.add(server.name)
+        self._attempted(server)
+
+
+    def _connectionLost(self, server, p):
+        if p in server.protocols:
+            server.protocols.remove(p)
+            if not server.protocols:
+                log.msg("Lost all connections to memcache server %s" % (
+                        server.name,))
+                self.ring.remove(server.name)
+
+
+    def _connectionFailed(self, server, reason):
+        self._attempted(server)
+
+
+    def _attempted(self, server):
+        """
+        Fire the L{Deferred} of L{start} once every server has been tried.
+        """
+        server.attempted = True
+        if self._started is None:
+            return
+        for s in self.servers.itervalues():
+            if not s.attempted:
+                return
+        started, self._started = self._started, None
+        # Connections are reported before the protocol is connected to its
+        # transport, so let that happen before using the pool.
+        self._reactor.callLater(0, started.callback, self)
+
+
+    def _retry(self, factory, connector):
+        """
+        Reconnect C{connector} after its factory's delay, and double it.
+        """
+        if self._stopped:
+            return
+        delay = factory.delay
+        factory.delay = min(delay * 2, self.maxRetryDelay)
+        def reconnect():
+            del self._retries[factory]
+            connector.connect()
+        self._retries[factory] = self._reactor.callLater(delay, reconnect)
+
+
+    def _protocolFor(self, key):
+        """
+        Return the least busy connection to the server for C{key}.
+
+        @raise ServerError: If no server is connected.
+        """
+        name = self.ring.nodeFor(key)
+        if name is None:
+            raise ServerError("No memcache server available")
+        return min(self.servers[name].protocols,
+                   key=lambda p: len(p._current))
+
+
+    def _call(self, method, key, *args, **kwargs):
+        """
+        Call C{method} of the connection for C{key}.
+        """
+        if not isinstance(key, str):
+            return fail(ClientError(
+                "Invalid type for key: %s, expecting a string" % (type(key),)))
+        try:
+            p = self._protocolFor(key)
+        except ServerError:
+            return fail()
+        return getattr(p, method)(key, *args, **kwargs)
+
+
+    def get(self, key, withIdentifier=False):
+        """
+        See L{MemCacheProtocol.get}.
+        """
+        return self._call("get", key, withIdentifier)
+
+
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Get the given list of C{keys} from their servers, with one request
+        to each server sent in parallel, and merge the results.
+
+        See L{MemCacheProtocol.getMultiple}.
+        """
+        byServer = {}
+        for key in keys:
+            if not isinstance(key, str):
+                return fail(ClientError(
+                    "Invalid type for key: %s, expecting a string" % (
+                        type(key),)))
+            try:
+                p = self._protocolFor(key)
+            except ServerError:
+                return fail()
+            byServer.setdefault(p, []).append(key)
+        d = gatherResults([p.getMultiple(serverKeys, withIdentifier)
+                           for (p, serverKeys) in byServer.iteritems()],
+                          consumeErrors=True)
+        def merge(results):
+            values = {}
+            for result in results:
+                values.update(result)
+            return values
+        def unwrap(reason):
+            reason.trap(FirstError)
+            return reason.value.subFailure
+        return d.addCallbacks(merge, unwrap)
+
+
+    def set(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.set}.
+        """
+        return self._call("set", key, val, flags, expireTime)
+
+
+    def add(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.add}.
+        """
+        return self._call("add", key, val, flags, expireTime)
+
+
+    def replace(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.replace}.
+        """
+        return self._call("replace", key, val, flags, expireTime)
+
+
+    def checkAndSet(self, key, val, cas, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.checkAndSet}.
+        """
+        return self._call("checkAndSet", key, val, cas, flags, expireTime)
+
+
+    def append(self, key, val):
+        """
+        See L{MemCacheProtocol.append}.
+        """
+        return self._call("append", key, val)
+
+
+    def prepend(self, key, val):
+        """
+        See L{MemCacheProtocol.prepend}.
+        """
+        return self._call("prepend", key, val)
+
+
+    def increment(self, key, val=1):
+        """
+        See L{MemCacheProtocol.increment}.
+        """
+        return self._call("increment", key, val)
+
+
+    def decrement(self, key, val=1):
+        """
+        See L{MemCacheProtocol.decrement}.
+        """
+        return self._call("decrement", key, val)
+
+
+    def delete(self, key):
+        """
+        See L{MemCacheProtocol.delete}.
+        """
+        return self._call("delete", key)
+
+
+
+class _NearCacheEntry(object):
+    """
+    A value held by a L{NearCache}, linked into its least-recently-used
+    order.
+
+    @ivar result: The C{(flags, value)} tuple returned by the client.
+    @ivar expires: The time after which the entry is stale.
+    """
+    __slots__ = ('key', 'result', 'expires', 'prev', 'next')
+
+    def __init__(self, key, result, expires):
+        self.key = key
+        self.result = result
+        self.expires = expires
+        self.prev = self.next = None
+
+
+
+class NearCache(object):
+    """
+    An in-process cache of values in front of a memcache client, such as a
+    L{MemCacheProtocol} or a L{MemCachePool}, for keys which are read far
+    more often than they change.
+
+    Up to C{maxEntries} results of L{get} are kept for C{timeToLive}
+    seconds, evicting the least recently used ones.  Concurrent misses on
+    the same key share a single request to the client.  With a
+    C{staleTime}, a value which expired less than C{staleTime} seconds ago
+    is still returned while it is fetched again in the background.
+
+    Changes made through this object update or invalidate its copy of the
+    key; changes made by other clients are only seen once the copy
+    expires.
+
+    @ivar client: The memcache client.
+    @ivar hits: The number of L{get}s answered with a fresh value.
+    @ivar staleHits: The number of L{get}s answered with a stale value.
+    @ivar misses: The number of L{get}s sent to the client.
+    @ivar coalesced: The number of L{get}s which waited for a request
+        already sent for the same key.
+    @ivar evictions: The number of values dropped to make room.
+
+    @ivar _entries: A C{dict} mapping keys to L{_NearCacheEntry} instances.
+    @ivar _head: A sentinel L{_NearCacheEntry} whose C{next} is the least
+        and whose C{prev} is the most recently used entry.
+    @ivar _pending: A C{dict} mapping keys being fetched to the C{list} of
+        L{Deferred}s waiting for them.
+    @ivar _generations: A C{dict} mapping keys with L{getMultiple}s or
+        stores in progress to a C{[generation, requests]} list, where
+        C{generation} counts the invalidations of the key since the first
+        of these C{requests} started.
+    """
+
+    def __init__(self, client, maxEntries=10000, timeToLive=1.0,
+                 staleTime=0, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.client = client
+        self.maxEntries = maxEntries
+        self.timeToLive = timeToLive
+        self.staleTime = staleTime
+        self._entries = {}
+        self._head = _NearCacheEntry(None, None, None)
+        self._head.prev = self._head.next = self._head
+        self._pending = {}
+        self._generations = {}
+        self.hits = self.staleHits = self.misses = 0
+        self.coalesced = self.evictions = 0
+
+
+    def stats(self):
+        """
+        Return the hit and miss counters and the number of values held, as
+        a C{dict}.
+        """
+        return {'hits': self.hits, 'staleHits': self.staleHits,
+                'misses': self.misses, 'coalesced': self.coalesced,
+                'evictions': self.evictions, 'entries': len(self._entries)}
+
+
+    def _touch(self, entry):
+        """
+        Make C{entry} the most recently used one.
+        """
+        head = self._head
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+        entry.prev = head.prev
+        entry.next = head
+        head.prev.next = entry
+        head.prev = entry
+
+
+    def _store(self, key, result):
+        self._discard(key)
+        entry = _NearCacheEntry(
+            key, result, self._reactor.seconds() + self.timeToLive)
+        head = self._head
+        entry.prev = head.prev
+        entry.next = head
+        head.prev.next = entry
+        head.prev = entry
+        self._entries[key] = entry
+        while len(self._entries) > self.maxEntries:
+            self._discard(head.next.key)
+            self.evictions += 1
+
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.prev.next = entry.next
+            entry.next.prev = entry.prev
+            entry.prev = entry.next = None
+
+
+    def invalidate(self, key):
+        """
+        Forget the local copy of C{key}, and make sure a request for it which
+        is in progress does not store its result.
+        """
+        self._discard(key)
+        # Its waiters still get the result of the request they made, but
+        # later gets send a new one.
+        self._pending.pop(key, None)
+        generation = self._generations.get(key)
+        if generation is not None:
+            generation[0] += 1
+
+
+    def _begin(self, key):
+        """
+        Note that a request whose result may be stored for C{key} is starting.
+
+        @return: The current generation of C{key}, to pass to L{_end}.
+        """
+        generation = self._generations.setdefault(key, [0, 0])
+        generation[1] += 1
+        return generation[0]
+
+
+    def _end(self, key, started):
+        """
+        Note that a request started by L{_begin} for C{key} has finished.
+
+        @param started: The generation L{_begin} returned.
+        @return: Whether C{key} was not invalidated while the request was in
+            progress, so that its result may be stored.
+        """
+        generation = self._generations[key]
+        generation[1] -= 1
+        if not generation[1]:
+            del self._generations[key]
+        return generation[0] == started
+
+
+    def get(self, key, withIdentifier=False):
+        """
+        Get C{key}, from the local copy if it is fresh enough.
+
+        With C{withIdentifier}, the request always goes to the client,
+        since the identifier must be current to be useful.
+
+        See L{MemCacheProtocol.get}.
+        """
+        if withIdentifier:
+            return self.client.get(key, True)
+        entry = self._entries.get(key)
+        if entry is not None:
+            now = self._reactor.seconds()
+            if now < entry.expires:
+                self.hits += 1
+                self._touch(entry)
+                return succeed(entry.result)
+            if now < entry.expires + self.staleTime:
+                self.staleHits += 1
+                self._touch(entry)
+                if key not in self._pending:
+                    self._fetch(key)
+                return succeed(entry.result)
+        waiters = self._pending.get(key)
+        if waiters is not None:
+            self.coalesced += 1
+        else:
+            waiters = self._fetch(key)
+        d = Deferred()
+        waiters.append(d)
+        return d
+
+
+    def _fetch(self, key):
+        """
+        Request C{key} from the client and return the C{list} of
+        L{Deferred}s to fire with the result.
+        """
+        self.misses += 1
+        waiters = self._pending[key] = []
+        d = self.client.get(key)
+        d.addBoth(self._fetched, key, waiters)
+        return waiters
+
+
+    def _fetched(self, result, key, waiters):
+        if self._pending.get(key) is waiters:
+            del self._pending[key]
+            if not isinstance(result, failure.Failure):
+                self._store(key, result)
+        for d in waiters:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Get C{keys}, asking the client only for those without a fresh local
+        copy.
+
+        See L{MemCacheProtocol.getMultiple}.
+        """
+        if withIdentifier:
+            return self.client.getMultiple(keys, True)
+        now = self._reactor.seconds()
+        values = {}
+        missing = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.expires:
+                self.hits += 1
+                self._touch(entry)
+                values[key] = entry.result
+            else:
+                missing.append(key)
+        if not missing:
+            return succeed(values)
+        self.misses += len(missing)
+        started = [self._begin(key) for key in missing]
+        d = self.client.getMultiple(missing)
+        def cbFetched(fetched):
+            for key, generation in zip(missing, started):
+                current = self._end(key, generation)
+                if (current and key in fetched
+                        and key not in self._pending):
+                    self._store(key, fetched[key])
+            values.update(fetched)
+            return values
+        def ebFetched(reason):
+            for key, generation in zip(missing, started):
+                self._end(key, generation)
+            return reason
+        return d.addCallbacks(cbFetched, ebFetched)
+
+
+    def _write(self, method, key, *args):
+        """
+        Invalidate C{key} and pass a change on to the client.
+        """
+        self.invalidate(key)
+        return getattr(self.client, method)(key, *args)
+
+
+    def _writeThrough(self, method, key, val, flags, expireTime):
+        """
+        Pass a store command on to the client and keep the stored value
+        if it succeeds.
+        """
+        self.invalidate(key)
+        started = self._begin(key)
+        d = getattr(self.client, method)(key, val, flags, expireTime)
+        def cbStored(stored):
+            current = self._end(key, started)
+            if stored and current and key not in self._pending:
+                self._store(key, (flags, val))
+            return stored
+        def ebStored(reason):
+            self._end(key, started)
+            return reason
+        return d.addCallbacks(cbStored, ebStored)
+
+
+    def set(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.set}.
+        """
+        return self._writeThrough("set", key, val, flags, expireTime)
+
+
+    def add(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.add}.
+        """
+        return self._writeThrough("add", key, val, flags, expireTime)
+
+
+    def replace(self, key, val, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.replace}.
+        """
+        return self._writeThrough("replace", key, val, flags, expireTime)
+
+
+    def checkAndSet(self, key, val, cas, flags=0, expireTime=0):
+        """
+        See L{MemCacheProtocol.checkAndSet}.
+        """
+        return self._write("checkAndSet", key, val, cas, flags, expireTime)
+
+
+    def append(self, key, val):
+        """
+        See L{MemCacheProtocol.append}.
+        """
+        return self._write("append", key, val)
+
+
+    def prepend(self, key, val):
+        """
+        See L{MemCacheProtocol.prepend}.
+        """
+        return self._write("prepend", key, val)
+
+
+    def increment(self, key, val=1):
+        """
+        See L{MemCacheProtocol.increment}.
+        """
+        return self._write("increment", key, val)
+
+
+    def decrement(self, key, val=1):
+        """
+        See L{MemCacheProtocol.decrement}.
+        """
+        return self._write("decrement", key, val)
+
+
+    def delete(self, key):
+        """
+        See L{MemCacheProtocol.delete}.
+        """
+        return self._write("delete", key)
+
+
+
+
 __all__ = ["MemCacheProtocol", "DEFAULT_PORT", "NoSuchCommand", "ClientError",
-           "ServerError"]
+           "ServerError", "HashRing", "MemCachePool", "NearCache",
+           "MemCacheBinaryProtocol"]
@@ -0,0 +1,64 @@
+# -*- test-case-name: twisted.python.test.test_monotonic -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Very low-level ctypes-based interface to the monotonic clock of Linux,
+C{clock_gettime(CLOCK_MONOTONIC)}.
+
+Unlike C{time.time}, this clock never jumps when the time of the system is
+set.  ctypes and Linux are required.
+"""
+
+import sys
+import ctypes
+
+if not sys.platform.startswith('linux'):
+    raise ImportError("CLOCK_MONOTONIC is only known on Linux")
+
+CLOCK_MONOTONIC = 1
+
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+
+def monotonic():
+    """
+    Return the number of seconds since some unspecified point in the past,
+    which never goes backwards.
+    """
+    t = timespec()
+    if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        raise OSError("clock_gettime(CLOCK_MONOTONIC) failed")
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+
+
+def initializeModule(lib):
+    """
+    Check that C{lib} has C{clock_gettime} and set its argtypes and restype.
+    """
+    if getattr(lib, 'clock_gettime', None) is None:
+        raise ImportError("clock_gettime not found")
+    lib.clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    lib.clock_gettime.restype = ctypes.c_int
+    return lib.clock_gettime
+
+
+
+# clock_gettime is in the C library, which the interpreter is linked with,
+# since glibc 2.17 and in librt before.  ctypes.util.find_library is not
+# used: it leaks a descriptor.
+clock_gettime = None
+for _name in (None, 'librt.so.1'):
+    try:
+        clock_gettime = initializeModule(ctypes.CDLL(_name))
+    except (OSError, ImportError):
+        continue
+    break
+if clock_gettime is None:
+    raise ImportError("Can't find clock_gettime.")
+del _name
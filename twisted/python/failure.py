@@ -16,6 +16,7 @@ import sys
 import linecache
 import inspect
 import opcode
+import weakref
 from cStringIO import StringIO
 from inspect import getmro
 
@@ -77,6 +78,79 @@ EXCEPTION_CAUGHT_HERE = "--- <exception caught here> ---"
 
 
 
+def _frameVars(f):
+    """
+    Return the C{(localsItems, globalsItems)} of a frame, as captured by
+    L{Failure} with C{captureVars}.
+    """
+    localz = f.f_locals.copy()
+    if f.f_locals is f.f_globals:
+        globalz = {}
+    else:
+        globalz = f.f_globals.copy()
+    for d in globalz, localz:
+        if "__builtins__" in d:
+            del d["__builtins__"]
+    return localz.items(), globalz.items()
+
+
+
+def _framesFromTraceback(tb, captureVars):
+    """
+    Return the frames of a traceback, innermost first, as in
+    L{Failure.frames}.
+    """
+    frames = []
+    while tb is not None:
+        f = tb.tb_frame
+        if captureVars:
+            localz, globalz = _frameVars(f)
+        else:
+            localz = globalz = ()
+        frames.append((
+            f.f_code.co_name,
+            f.f_code.co_filename,
+            tb.tb_lineno,
+            localz,
+            globalz,
+            ))
+        tb = tb.tb_next
+    return frames
+
+
+
+# The qualified names of exception classes, and of their bases, met so far.
+# They are weakly keyed, so that remembering the names of a class does not
+# keep it alive.
+_qualNames = weakref.WeakKeyDictionary()
+_parentNames = weakref.WeakKeyDictionary()
+
+def _qual(klass):
+    """
+    Return L{reflect.qual} of a class, remembering it for as long as the
+    class exists.
+    """
+    try:
+        return _qualNames[klass]
+    except KeyError:
+        name = _qualNames[klass] = reflect.qual(klass)
+        return name
+
+
+
+def _parents(excType):
+    """
+    Return the qualified names of an exception class and of its bases, as
+    in L{Failure.parents}.
+    """
+    try:
+        parents = _parentNames[excType]
+    except KeyError:
+        parents = _parentNames[excType] = map(_qual, getmro(excType))
+    return parents[:]
+
+
+
 class NoCurrentExceptionError(Exception):
     """
     Raised when trying to create a Failure from the current interpreter
@@ -153,14 +227,22 @@ class Failure:
     C{locals().items()}/C{globals().items()} for that frame, or an empty tuple
     if those details were not captured.
 
+    Unless C{captureVars} is set, C{frames} is only extracted from the
+    traceback when it is first used, and C{stack} only holds the
+    C{traceupLength} innermost frames, which are all tracebacks show, if
+    C{lazy} is true.  Failures which are trapped without being printed or
+    pickled then never pay for their frames.
+
     @ivar value: The exception instance responsible for this failure.
     @ivar type: The exception's class.
     @ivar stack: list of frames, innermost last, excluding C{Failure.__init__}.
     @ivar frames: list of frames, innermost first.
+    @cvar lazy: Whether new failures extract their frames lazily.
     """
 
     pickled = 0
     stack = None
+    lazy = True
 
     # The opcode of "yield" in Python bytecode. We need this in _findFailure in
     # order to identify whether an exception was thrown by a
@@ -237,7 +319,6 @@ class Failure:
 #                 for s in traceback.format_stack():
 #                     log.msg(s)
 
-        frames = self.frames = []
         stack = self.stack = []
 
         # added 2003-06-23 by Chris Armstrong. Yes, I actually have a
@@ -267,21 +348,17 @@ class Failure:
         #   catching means tracebacks generated here don't tend to show
         #   what called upon the PB object.
 
-        while f:
+        lazy = self.lazy and not captureVars
+        if lazy:
+            depth = traceupLength
+        else:
+            depth = -1
+        while f and depth:
             if captureVars:
-                localz = f.f_locals.copy()
-                if f.f_locals is f.f_globals:
-                    globalz = {}
-                else:
-                    globalz = f.f_globals.copy()
-                for d in globalz, localz:
-                    if "__builtins__" in d:
-                        del d["__builtins__"]
-                localz = localz.items()
-                globalz = globalz.items()
+                localz, globalz = _frameVars(f)
             else:
                 localz = globalz = ()
-            stack.insert(0, (
+            stack.append((
                 f.f_code.co_name,
                 f.f_code.co_filename,
                 f.f_lineno,
@@ -289,36 +366,29 @@ class Failure:
                 globalz,
                 ))
             f = f.f_back
+            depth -= 1
+        stack.reverse()
 
-        while tb is not None:
-            f = tb.tb_frame
-            if captureVars:
-                localz = f.f_locals.copy()
-                if f.f_locals is f.f_globals:
-                    globalz = {}
-                else:
-                    globalz = f.f_globals.copy()
-                for d in globalz, localz:
-                    if "__builtins__" in d:
-                        del d["__builtins__"]
-                localz = localz.items()
-                globalz = globalz.items()
-            else:
-                localz = globalz = ()
-            frames.append((
-                f.f_code.co_name,
-                f.f_code.co_filename,
-                tb.tb_lineno,
-                localz,
-                globalz,
-                ))
-            tb = tb.tb_next
+        if lazy and tb is not None:
+            self._lazyTraceback = tb
+        else:
+            self.frames = _framesFromTraceback(tb, captureVars)
         if inspect.isclass(self.type) and issubclass(self.type, Exception):
-            parentCs = getmro(self.type)
-            self.parents = map(reflect.qual, parentCs)
+            self.parents = _parents(self.type)
         else:
             self.parents = [self.type]
 
+
+    def __getattr__(self, name):
+        """
+        Extract C{frames} from the traceback when it is first used.
+        """
+        if name == 'frames' and '_lazyTraceback' in self.__dict__:
+            tb = self.__dict__.pop('_lazyTraceback')
+            frames = self.frames = _framesFromTraceback(tb, False)
+            return frames
+        raise AttributeError(name)
+
     def trap(self, *errorTypes):
         """Trap this failure if its type is in a predetermined list.
 
@@ -356,7 +426,7 @@ class Failure:
         for error in errorTypes:
             err = error
             if inspect.isclass(error) and issubclass(error, Exception):
-                err = reflect.qual(error)
+                err = _qual(error)
             if err in self.parents:
                 return error
         return None
@@ -451,6 +521,8 @@ class Failure:
         """
         if self.pickled:
             return self.__dict__
+        # Extract the frames before the traceback goes.
+        self.frames
         c = self.__dict__.copy()
 
         c['frames'] = [
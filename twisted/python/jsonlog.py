@@ -0,0 +1,209 @@
+# -*- test-case-name: twisted.python.test.test_jsonlog -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Log files for machines: one JSON object per event and per line.
+
+Write them with L{JSONLogObserver}, read them back with L{JSONLogReader}.
+"""
+
+import re
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+from twisted.python import log
+
+
+# Every line starts with the level and the namespace of its event, in this
+# form, so that readers may skip events without decoding them.
+_prefix = re.compile(
+    r'\{"logLevel":(-?\d+),"namespace":("(?:[^"\\]|\\.)*"|null),')
+
+# The keys of an event which are not written as they are.
+_omitted = dict.fromkeys(['message', 'format', 'failure', 'logLevel',
+                          'namespace', 'text'])
+
+_simpleTypes = (str, unicode, int, long, float, bool, type(None))
+
+
+
+def _decoded(value):
+    """
+    Return C{value}, as C{unicode} if it is a C{str}, so that C{json} never
+    fails to encode it.
+    """
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+
+class JSONLogObserver(log.FileLogObserver):
+    """
+    Log observer that writes events to a file-like object as JSON objects,
+    one per line.
+
+    Each object has the C{logLevel} and C{namespace} of the event, as
+    L{log.levelOf} and L{log.namespaceOf} find them, its text under
+    C{"text"}, and every other key of the event whose value is a string, a
+    number, a boolean or C{None}.  Events with no text are not written.  A
+    level which is not a number is replaced by the level of the event
+    without it.
+    """
+
+    def __init__(self, f):
+        if json is None:
+            raise ImportError("JSONLogObserver requires json or simplejson")
+        log.FileLogObserver.__init__(self, f)
+
+
+    def _formatEvent(self, eventDict):
+        text = log.textFromEventDict(eventDict)
+        if text is None:
+            return None
+        record = {'text': _decoded(text)}
+        for key, value in eventDict.iteritems():
+            if key not in _omitted and isinstance(value, _simpleTypes):
+                record[key] = _decoded(value)
+        try:
+            level = int(log.levelOf(eventDict))
+        except (TypeError, ValueError):
+            level = log.levelOf({'isError': eventDict.get('isError')})
+        namespace = log.namespaceOf(eventDict)
+        if not isinstance(namespace, basestring):
+            namespace = None
+        return '{"logLevel":%d,"namespace":%s,%s\n' % (
+            level, json.dumps(_decoded(namespace)),
+            json.dumps(record, separators=(',', ':'))[1:])
+
+
+
+class JSONLogReader:
+    """
+    Read the events of a log file written by L{JSONLogObserver}, as
+    C{dict}s with C{unicode} strings.
+
+    Only the events at least as important as C{minimumLevel}, in one of
+    C{namespaces} or their children if it is given, and for which
+    C{predicate} returns true if it is given, are read.  The level and
+    namespace of an event are checked before the rest of it is decoded.
+
+    Events may be read while the file is still being written: reading stops
+    at the end of the last complete line and resumes from there.
+
+    @ivar minimumLevel: The level of the least important events to read.
+    @ivar namespaces: A sequence of namespaces, or C{None} to read events of
+        all namespaces.
+    @ivar predicate: A callable called with each decoded event, or C{None}.
+    @ivar _pending: The lines read from the file but not decoded yet, last
+        first.
+    @ivar _partial: The start of an unfinished line at the end of the file.
+    @ivar _namespaces: A C{dict} mapping the encoded namespaces met so far
+        to whether their events are read.
+    """
+    readSize = 2 ** 16
+
+    def __init__(self, name, minimumLevel=None, namespaces=None,
+                 predicate=None):
+        if json is None:
+            raise ImportError("JSONLogReader requires json or simplejson")
+        self._file = file(name, "r")
+        self.minimumLevel = minimumLevel
+        self.namespaces = namespaces
+        self.predicate = predicate
+        self._pending = []
+        self._partial = ''
+        self._namespaces = {}
+
+
+    def _isNamespaceRead(self, namespace):
+        if self.namespaces is None:
+            return True
+        if not isinstance(namespace, basestring):
+            return False
+        for prefix in self.namespaces:
+            if namespace == prefix or namespace.startswith(prefix + '.'):
+                return True
+        return False
+
+
+    def _decode(self, line):
+        """
+        Decode a line, or return C{None} if its event is not to be read.
+        """
+        match = _prefix.match(line)
+        if match is not None:
+            if (self.minimumLevel is not None
+                and int(match.group(1)) < self.minimumLevel):
+                return None
+            encoded = match.group(2)
+            try:
+                isRead = self._namespaces[encoded]
+            except KeyError:
+                isRead = self._namespaces[encoded] = self._isNamespaceRead(
+                    json.loads(encoded))
+            if not isRead:
+                return None
+            event = json.loads(line)
+        else:
+            event = json.loads(line)
+            if (self.minimumLevel is not None
+                and log.levelOf(event) < self.minimumLevel):
+                return None
+            if not self._isNamespaceRead(event.get('namespace')):
+                return None
+        if self.predicate is not None and not self.predicate(event):
+            return None
+        return event
+
+
+    def __iter__(self):
+        """
+        Iterate over the events written so far and not read yet.
+        """
+        pending = self._pending
+        while True:
+            while pending:
+                line = pending.pop()
+                if line.strip():
+                    event = self._decode(line)
+                    if event is not None:
+                        yield event
+            lines = self._file.readlines(self.readSize)
+            if not lines:
+                return
+            if self._partial:
+                lines[0] = self._partial + lines[0]
+                self._partial = ''
+            if not lines[-1].endswith('\n'):
+                self._partial = lines.pop()
+            lines.reverse()
+            pending.extend(lines)
+
+
+    def readEvents(self, events=10):
+        """
+        Read a list of at most C{events} events from the log file.
+
+        This doesn't return all of the file's events - call it multiple
+        times.
+        """
+        result = []
+        if events <= 0:
+            return result
+        for event in self:
+            result.append(event)
+            if len(result) == events:
+                break
+        return result
+
+
+    def close(self):
+        self._file.close()
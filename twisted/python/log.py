@@ -11,6 +11,7 @@ from __future__ import division
 import sys
 import time
 import warnings
+import threading
 from datetime import datetime
 import logging
 
@@ -55,6 +56,13 @@ class ILogObserver(Interface):
               - C{format}: A string format used in place of C{message} to
                 customize the event.  The intent is for the observer to format
                 a message by doing something like C{format % eventDict}.
+              - C{logLevel}: The importance of the event, as one of the
+                levels of the L{logging} module.  Events without it are
+                C{logging.ERROR} if they are errors, C{logging.INFO}
+                otherwise.
+              - C{namespace}: A dotted C{str} naming the component which
+                logged the event, used in place of C{system} to filter
+                events.
         """
 
 
@@ -241,6 +249,7 @@ class LogPublisher:
 
     def __init__(self):
         self.observers = []
+        self.filters = []
 
     def addObserver(self, other):
         """
@@ -259,6 +268,24 @@ class LogPublisher:
         """
         self.observers.remove(other)
 
+    def addFilter(self, predicate):
+        """
+        Add a filter, which decides which messages are published before any
+        work is done for them.
+
+        @param predicate: A callable called with the level and the namespace
+            of each new message, as L{levelOf} and L{namespaceOf} find them,
+            returning false if the message is to be discarded.
+        """
+        assert callable(predicate)
+        self.filters.append(predicate)
+
+    def removeFilter(self, predicate):
+        """
+        Remove a filter.
+        """
+        self.filters.remove(predicate)
+
     def msg(self, *message, **kw):
         """
         Log a new message.
@@ -275,6 +302,14 @@ class LogPublisher:
         These forms work (sometimes) by accident and will be disabled
         entirely in the future.
         """
+        if self.filters:
+            level = levelOf(kw)
+            namespace = kw.get('namespace') or kw.get('system')
+            if namespace is None:
+                namespace = namespaceOf(context.get(ILogContext) or {})
+            for predicate in self.filters:
+                if not predicate(level, namespace):
+                    return
         actualEventDict = (context.get(ILogContext) or {}).copy()
         actualEventDict.update(kw)
         actualEventDict['message'] = message
@@ -349,6 +384,88 @@ except NameError:
     removeObserver = theLogPublisher.removeObserver
     msg = theLogPublisher.msg
     showwarning = theLogPublisher.showwarning
+    addFilter = theLogPublisher.addFilter
+    removeFilter = theLogPublisher.removeFilter
+
+
+
+def levelOf(eventDict):
+    """
+    Return the level of an event, as one of the levels of the L{logging}
+    module: its C{logLevel} key, or else C{logging.ERROR} for errors and
+    C{logging.INFO} for other events.
+    """
+    level = eventDict.get('logLevel')
+    if level is None:
+        if eventDict.get('isError'):
+            return logging.ERROR
+        return logging.INFO
+    return level
+
+
+
+def namespaceOf(eventDict):
+    """
+    Return the namespace of an event: its C{namespace} key, or else its
+    C{system}.
+    """
+    return eventDict.get('namespace') or eventDict.get('system')
+
+
+
+class LevelFilter(object):
+    """
+    A filter for L{LogPublisher.addFilter} which discards messages less
+    important than the level of their namespace.
+
+    The level of a namespace is the level set for it or for the closest of
+    its parents, C{"a.b"} being the parent of C{"a.b.c"}, or C{defaultLevel}
+    if there is none.
+
+    @ivar defaultLevel: The level of namespaces with no level set.
+    @ivar levels: A C{dict} mapping namespaces to levels.
+    @ivar _thresholds: A C{dict} mapping the namespaces met recently to
+        their levels.
+    """
+    _maxThresholds = 1000
+
+    def __init__(self, defaultLevel=logging.INFO, levels=None):
+        self.defaultLevel = defaultLevel
+        self.levels = dict(levels or {})
+        self._thresholds = {}
+
+
+    def setLevel(self, namespace, level):
+        """
+        Set the level of a namespace, and of its children with no level set.
+        """
+        self.levels[namespace] = level
+        self._thresholds.clear()
+
+
+    def _threshold(self, namespace):
+        if not isinstance(namespace, str):
+            return self.defaultLevel
+        name = namespace
+        while name:
+            if name in self.levels:
+                return self.levels[name]
+            name = name.rpartition('.')[0]
+        return self.defaultLevel
+
+
+    def __call__(self, level, namespace):
+        try:
+            threshold = self._thresholds[namespace]
+        except KeyError:
+            # Systems often name connections, so forget them now and then.
+            if len(self._thresholds) >= self._maxThresholds:
+                self._thresholds.clear()
+            threshold = self._thresholds[namespace] = self._threshold(
+                namespace)
+        except TypeError:
+            threshold = self.defaultLevel
+        return level >= threshold
 
 
 def _safeFormat(fmtString, fmtDict):
@@ -468,16 +585,26 @@ class FileLogObserver:
             when.hour, when.minute, when.second,
             tzSign, tzHour, tzMin)
 
-    def emit(self, eventDict):
+    def _formatEvent(self, eventDict):
+        """
+        Format an event as a line of the log, or return C{None} if it has no
+        text.
+        """
         text = textFromEventDict(eventDict)
         if text is None:
-            return
+            return None
 
         timeStr = self.formatTime(eventDict['time'])
         fmtDict = {'system': eventDict['system'], 'text': text.replace("\n", "\n\t")}
         msgStr = _safeFormat("[%(system)s] %(text)s\n", fmtDict)
+        return timeStr + " " + msgStr
 
-        util.untilConcludes(self.write, timeStr + " " + msgStr)
+    def emit(self, eventDict):
+        line = self._formatEvent(eventDict)
+        if line is None:
+            return
+
+        util.untilConcludes(self.write, line)
         util.untilConcludes(self.flush)  # Hoorj!
 
     def start(self):
@@ -493,6 +620,193 @@ class FileLogObserver:
         removeObserver(self.emit)
 
 
+class BufferedLogObserver(FileLogObserver):
+    """
+    Log observer that writes to a file-like object from a thread of its own,
+    so that a slow file does not hold up the thread logging.
+
+    Events are queued in a ring buffer of C{bufferSize} events; the writer
+    thread formats all the queued events and writes them at once, then
+    flushes the file.  When the buffer is full, new events are dropped and
+    counted in C{dropped} or, if C{block} is true, the thread logging waits
+    for room.  Formatted timestamps are reused for events in the same
+    second.
+
+    Once started, the observer is stopped, and everything queued written,
+    when the reactor shuts down.
+
+    @ivar bufferSize: The number of events which may be queued.
+    @ivar block: Whether to wait for room when the buffer is full rather
+        than drop events.
+    @ivar dropped: The number of events dropped because the buffer was full,
+        or because they could not be formatted or written.
+
+    @ivar _buffer: A C{list} of C{bufferSize} slots, of which C{_count}
+        starting at C{_first}, and wrapping around, hold queued events.
+    @ivar _lock: A C{threading.Condition} protecting the buffer, notified
+        whenever events are queued or taken from it and when the observer
+        stops.
+    @ivar _thread: The writer C{threading.Thread}, or C{None}.
+    @ivar _trigger: The identifier of the reactor shutdown trigger, or
+        C{None}.
+    """
+    _thread = None
+    _trigger = None
+    _stopping = False
+    _lastSecond = None
+    _lastTimeStr = None
+
+    def __init__(self, f, bufferSize=10000, block=False, reactor=None):
+        FileLogObserver.__init__(self, f)
+        self.bufferSize = bufferSize
+        self.block = block
+        self.dropped = 0
+        self._reactor = reactor
+        self._buffer = [None] * bufferSize
+        self._first = 0
+        self._count = 0
+        self._lock = threading.Condition()
+
+    def formatTime(self, when):
+        """
+        Format a timestamp as L{FileLogObserver.formatTime} does, once per
+        second.
+        """
+        second = int(when)
+        if second != self._lastSecond:
+            self._lastTimeStr = FileLogObserver.formatTime(self, second)
+            self._lastSecond = second
+        return self._lastTimeStr
+
+    def emit(self, eventDict):
+        """
+        Queue an event for the writer thread.
+        """
+        lock = self._lock
+        lock.acquire()
+        try:
+            while self._count == self.bufferSize:
+                if (not self.block or self._thread is None or self._stopping
+                    or threading.currentThread() is self._thread):
+                    self.dropped += 1
+                    return
+                lock.wait()
+            index = (self._first + self._count) % self.bufferSize
+            self._buffer[index] = eventDict
+            self._count += 1
+            lock.notifyAll()
+        finally:
+            lock.release()
+
+    def _takeEvents(self):
+        """
+        Wait for events to be queued, or for the observer to stop, and take
+        all the queued events from the buffer.
+
+        @return: A C{list} of events, empty if the observer is stopping and
+            nothing is left to write.
+        """
+        lock = self._lock
+        lock.acquire()
+        try:
+            while not self._count and not self._stopping:
+                lock.wait()
+            buffer, first, count = self._buffer, self._first, self._count
+            end = first + count
+            wrapped = max(0, end - self.bufferSize)
+            events = buffer[first:end] + buffer[:wrapped]
+            buffer[first:end] = [None] * (count - wrapped)
+            buffer[:wrapped] = [None] * wrapped
+            self._first = self._count = 0
+            lock.notifyAll()
+            return events
+        finally:
+            lock.release()
+
+    def _writeEvents(self):
+        """
+        Write queued events, in batches, until the observer stops.
+        """
+        while True:
+            events = self._takeEvents()
+            if not events:
+                return
+            lines = []
+            failed = 0
+            for eventDict in events:
+                try:
+                    line = self._formatEvent(eventDict)
+                except:
+                    failed += 1
+                else:
+                    if line is not None:
+                        lines.append(line)
+            try:
+                util.untilConcludes(self.write, "".join(lines))
+                util.untilConcludes(self.flush)
+            except:
+                failed = len(events)
+            if failed:
+                # There is nowhere left to report this.
+                self._lock.acquire()
+                self.dropped += failed
+                self._lock.release()
+
+    def start(self):
+        """
+        Start observing log events and writing them from a new thread.
+        """
+        self._startWriting()
+        addObserver(self.emit)
+
+    def _startWriting(self):
+        """
+        Start the writer thread, to be stopped when the reactor shuts down.
+        """
+        reactor = self._reactor
+        if reactor is None:
+            from twisted.internet import reactor
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._writeEvents, name=self.__class__.__name__)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        self._trigger = reactor.addSystemEventTrigger(
+            'after', 'shutdown', self._shutdown)
+
+    def _shutdown(self):
+        self._trigger = None
+        self.stop()
+
+    def stop(self):
+        """
+        Stop observing log events and wait for the events already queued to
+        be written.
+        """
+        removeObserver(self.emit)
+        self._stopWriting()
+
+    def _stopWriting(self):
+        """
+        Stop the writer thread once the events queued are written.
+        """
+        if self._trigger is not None:
+            reactor = self._reactor
+            if reactor is None:
+                from twisted.internet import reactor
+            reactor.removeSystemEventTrigger(self._trigger)
+            self._trigger = None
+        self._lock.acquire()
+        try:
+            self._stopping = True
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
 class PythonLoggingObserver(object):
     """
     Output twisted messages to Python standard library L{logging} module.
@@ -0,0 +1,160 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Tests for L{twisted.python.jsonlog}.
+"""
+
+import logging
+from cStringIO import StringIO
+
+from twisted.trial.unittest import TestCase
+from twisted.python.failure import Failure
+from twisted.python import jsonlog
+
+
+def event(message, **kw):
+    """
+    Make an event as L{log.msg} does.
+    """
+    eventDict = {'message': (message,), 'isError': 0, 'system': '-',
+                 'time': 1000000000.0}
+    eventDict.update(kw)
+    return eventDict
+
+
+
+class JSONLogTests(TestCase):
+    """
+    Tests for L{jsonlog.JSONLogObserver} and L{jsonlog.JSONLogReader}.
+    """
+    if jsonlog.json is None:
+        skip = "json and simplejson are not available"
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.logFile = file(self.path, 'w')
+        self.addCleanup(self.logFile.close)
+        self.observer = jsonlog.JSONLogObserver(self.logFile)
+
+
+    def read(self, **kw):
+        reader = jsonlog.JSONLogReader(self.path, **kw)
+        self.addCleanup(reader.close)
+        return reader
+
+
+    def test_oneLinePerEvent(self):
+        """
+        Each event is written as a JSON object on a line of its own, which
+        starts with its level and namespace.
+        """
+        f = StringIO()
+        observer = jsonlog.JSONLogObserver(f)
+        observer.emit(event('hello', namespace='app.db', rows=3))
+        observer.emit(event('two\nlines', isError=1))
+        observer.emit({'message': (), 'isError': 0, 'system': '-',
+                       'time': 0})
+        lines = f.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith(
+                '{"logLevel":20,"namespace":"app.db",'), lines[0])
+        self.assertTrue(lines[1].startswith(
+                '{"logLevel":40,"namespace":"-",'), lines[1])
+        self.assertEqual(
+            jsonlog.json.loads(lines[0]),
+            {'logLevel': 20, 'namespace': 'app.db', 'text': 'hello',
+             'rows': 3, 'isError': 0, 'system': '-',
+             'time': 1000000000.0})
+        self.assertEqual(jsonlog.json.loads(lines[1])['text'], 'two\nlines')
+
+
+    def test_invalidLevel(self):
+        """
+        An event whose C{logLevel} is not a number is written with the level
+        it would have without it.
+        """
+        f = StringIO()
+        observer = jsonlog.JSONLogObserver(f)
+        observer.emit(event('info', logLevel='info'))
+        observer.emit(event('error', logLevel=None, isError=1))
+        observer.emit(event('numeric', logLevel='30'))
+        levels = [jsonlog.json.loads(line)['logLevel']
+                  for line in f.getvalue().splitlines()]
+        self.assertEqual(levels, [logging.INFO, logging.ERROR,
+                                  logging.WARNING])
+
+
+    def test_textKey(self):
+        """
+        A C{text} key of an event does not replace the text of the event.
+        """
+        f = StringIO()
+        observer = jsonlog.JSONLogObserver(f)
+        observer.emit(event('hello', text='overwritten'))
+        self.assertEqual(jsonlog.json.loads(f.getvalue())['text'], 'hello')
+
+
+    def test_roundTrip(self):
+        """
+        L{jsonlog.JSONLogReader} reads back the events written, failures
+        as their traceback and strings which are not UTF-8 replaced.
+        """
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            failure = Failure()
+        self.observer.emit(event('caf\xc3\xa9 \xff'))
+        self.observer.emit({'failure': failure, 'why': 'oops', 'isError': 1,
+                            'system': 'worker', 'time': 1.0,
+                            'message': ()})
+        self.logFile.flush()
+        events = list(self.read())
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0]['text'], u'caf\xe9 \ufffd')
+        self.assertEqual(events[1]['logLevel'], logging.ERROR)
+        self.assertEqual(events[1]['why'], 'oops')
+        self.assertIn('ZeroDivisionError', events[1]['text'])
+
+
+    def test_filters(self):
+        """
+        L{jsonlog.JSONLogReader} only reads the events at least as important
+        as C{minimumLevel}, in one of C{namespaces} or their children and
+        accepted by C{predicate}.
+        """
+        self.observer.emit(event('debug', logLevel=logging.DEBUG,
+                                 namespace='app'))
+        self.observer.emit(event('app', namespace='app'))
+        self.observer.emit(event('db', namespace='app.db'))
+        self.observer.emit(event('other', namespace='application'))
+        self.observer.emit(event('skipped', namespace='app', skip=True))
+        self.logFile.flush()
+        reader = self.read(minimumLevel=logging.INFO, namespaces=['app'],
+                           predicate=lambda e: not e.get('skip'))
+        self.assertEqual([e['text'] for e in reader], ['app', 'db'])
+
+
+    def test_readEvents(self):
+        """
+        L{jsonlog.JSONLogReader.readEvents} reads events a few at a time and
+        events written after the end of the file was reached, but not
+        unfinished lines.
+        """
+        for i in range(5):
+            self.observer.emit(event(str(i)))
+        self.logFile.flush()
+        reader = self.read()
+        self.assertEqual([e['text'] for e in reader.readEvents(3)],
+                         ['0', '1', '2'])
+        self.assertEqual([e['text'] for e in reader.readEvents(3)],
+                         ['3', '4'])
+        self.assertEqual(reader.readEvents(3), [])
+        self.observer.emit(event('5'))
+        line = self.observer._formatEvent(event('6'))
+        self.logFile.write(line[:10])
+        self.logFile.flush()
+        self.assertEqual([e['text'] for e in reader.readEvents(3)], ['5'])
+        self.logFile.write(line[10:])
+        self.logFile.flush()
+        self.assertEqual([e['text'] for e in reader.readEvents(3)], ['6'])
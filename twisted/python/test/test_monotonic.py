@@ -0,0 +1,48 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Tests for L{twisted.python._monotonic}.
+"""
+
+import time
+
+from twisted.trial.unittest import TestCase
+
+try:
+    from twisted.python import _monotonic
+except ImportError:
+    _monotonic = None
+
+
+
+class MonotonicTests(TestCase):
+    """
+    Tests for L{twisted.python._monotonic}.
+    """
+    if _monotonic is None:
+        skip = "This platform has no CLOCK_MONOTONIC."
+
+    def test_missingClockGettime(self):
+        """
+        If the library passed to L{_monotonic.initializeModule} has no
+        C{clock_gettime} attribute, L{ImportError} is raised.
+        """
+        class lib:
+            pass
+        self.assertRaises(ImportError, _monotonic.initializeModule, lib())
+
+
+    def test_monotonic(self):
+        """
+        L{_monotonic.monotonic} returns a number of seconds which does not go
+        backwards and advances as C{time.time} does.
+        """
+        before = _monotonic.monotonic()
+        wallBefore = time.time()
+        time.sleep(0.05)
+        wallAfter = time.time()
+        after = _monotonic.monotonic()
+        self.assertTrue(after >= before)
+        self.assertTrue(after - before >= 0.04, after - before)
+        self.assertTrue(after - before < wallAfter - wallBefore + 1)
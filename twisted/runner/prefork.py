@@ -0,0 +1,714 @@
+# -*- test-case-name: twisted.runner.test.test_prefork -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Run several worker processes which accept connections on the same listening
+sockets, so that a server uses all the cores of a machine.
+
+A L{PreforkService}, in a supervisor process, binds the listening sockets
+and spawns the workers, passing them the sockets and a control channel.  In
+each worker, a L{Worker} service accepts connections on the sockets it was
+passed::
+
+    # supervisor.tac
+    from twisted.application import service
+    from twisted.runner.prefork import PreforkService
+
+    application = service.Application("supervisor")
+    supervisor = PreforkService(['twistd', '-n', '-y', 'worker.tac'])
+    supervisor.listen(8080)
+    supervisor.setServiceParent(application)
+
+    # worker.tac
+    from twisted.application import service
+    from twisted.runner.prefork import Worker
+
+    application = service.Application("worker")
+    worker = Worker()
+    worker.listen(0, factory)
+    worker.setServiceParent(application)
+
+The supervisor restarts workers which exit or stop answering its
+heartbeats, collects their statistics and, with L{PreforkService.restartAll},
+replaces them one at a time without dropping connections.
+
+This module is only available on POSIX platforms.
+"""
+
+import os
+import socket
+
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.internet import defer, error, fdesc, tcp, task, stdio
+from twisted.internet import reactor as _reactor
+from twisted.internet.error import CannotListenError
+from twisted.internet._posixstdio import PipeAddress
+from twisted.application import service
+from twisted.protocols import amp, policies
+from twisted.runner.procmon import ProcessMonitor, LoggingProtocol
+
+
+# The descriptors of the control channel in a worker: it reads the commands
+# of the supervisor from the first and writes to the second.  The listening
+# sockets follow.
+_CONTROL_IN = 3
+_CONTROL_OUT = 4
+_FIRST_PORT_FD = 5
+
+# The environment variables telling a worker its name and the descriptors of
+# its listening sockets.
+_NAME_VARIABLE = 'TWISTED_PREFORK_WORKER'
+_PORTS_VARIABLE = 'TWISTED_PREFORK_FDS'
+
+
+
+class Ready(amp.Command):
+    """
+    Sent by a worker to its supervisor once it accepts connections.
+    """
+
+
+
+class Heartbeat(amp.Command):
+    """
+    Sent by a supervisor to check that a worker is alive and to collect its
+    statistics: the number of connections it accepted and the number of
+    those still open.
+    """
+    response = [('pid', amp.Integer()),
+                ('accepted', amp.Integer()),
+                ('connections', amp.Integer())]
+
+
+
+class Drain(amp.Command):
+    """
+    Sent by a supervisor to make a worker stop accepting connections.  The
+    worker answers once its open connections are closed, or after C{timeout}
+    seconds, with the number of connections still open.
+    """
+    arguments = [('timeout', amp.Float())]
+    response = [('connections', amp.Integer())]
+
+
+
+def _cpuCount():
+    """
+    Return the number of processors online, or 1 if unknown.
+    """
+    try:
+        return max(int(os.sysconf('SC_NPROCESSORS_ONLN')), 1)
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+
+
+class _ControlTransport(object):
+    """
+    The transport of the control channel of a supervisor with a worker,
+    which writes to a pipe of the worker's process.
+    """
+
+    def __init__(self, process, childFD):
+        self.process = process
+        self.childFD = childFD
+
+
+    def write(self, data):
+        self.process.writeToChild(self.childFD, data)
+
+
+    def writeSequence(self, data):
+        self.write(''.join(data))
+
+
+    def loseConnection(self):
+        self.process.closeChildFD(self.childFD)
+
+
+    def getPeer(self):
+        return PipeAddress()
+
+
+    def getHost(self):
+        return PipeAddress()
+
+
+
+class _SupervisorControl(amp.AMP):
+    """
+    The supervisor's end of the control channel with a worker.
+    """
+
+    def __init__(self, workerProtocol):
+        amp.AMP.__init__(self)
+        self.workerProtocol = workerProtocol
+
+
+    def ready(self):
+        self.workerProtocol.service._workerReady(self.workerProtocol.name)
+        return {}
+    Ready.responder(ready)
+
+
+
+class WorkerProtocol(LoggingProtocol):
+    """
+    The protocol of a worker process: logs its output, like
+    L{LoggingProtocol}, and speaks AMP on its control channel.
+
+    @ivar control: The L{amp.AMP} connected to the worker.
+    @ivar ready: Whether the worker accepts connections.
+    @ivar stats: The response to the last L{Heartbeat}.
+    @ivar lastSeen: When the worker last answered a L{Heartbeat}, or when it
+        was started.
+    @ivar waiting: Whether a L{Heartbeat} is yet to be answered.
+    """
+
+    control = None
+    ready = False
+    waiting = False
+    lastSeen = None
+
+    def connectionMade(self):
+        LoggingProtocol.connectionMade(self)
+        self.stats = {}
+        self.lastSeen = self.service._reactor.seconds()
+        self.control = _SupervisorControl(self)
+        self.control.makeConnection(
+            _ControlTransport(self.transport, _CONTROL_IN))
+
+
+    def childDataReceived(self, childFD, data):
+        if childFD == _CONTROL_OUT:
+            self.control.dataReceived(data)
+        else:
+            LoggingProtocol.childDataReceived(self, childFD, data)
+
+
+    def childConnectionLost(self, childFD):
+        if childFD == _CONTROL_OUT:
+            self._controlLost(Failure(error.ConnectionDone()))
+        else:
+            LoggingProtocol.childConnectionLost(self, childFD)
+
+
+    def _controlLost(self, reason):
+        if self.control.transport is not None:
+            self.ready = False
+            self.control.connectionLost(reason)
+            self.control.transport = None
+
+
+    def heartbeat(self):
+        """
+        Send a L{Heartbeat} to the worker and record its response.
+        """
+        self.waiting = True
+        d = self.control.callRemote(Heartbeat)
+        d.addCallback(self._beat)
+        d.addErrback(self._noBeat)
+
+
+    def _beat(self, stats):
+        self.waiting = False
+        self.stats = stats
+        self.lastSeen = self.service._reactor.seconds()
+
+
+    def _noBeat(self, reason):
+        reason.trap(error.ConnectionDone, error.ConnectionLost)
+
+
+    def processEnded(self, reason):
+        self._controlLost(Failure(error.ConnectionLost()))
+        LoggingProtocol.processEnded(self, reason)
+
+
+
+class PreforkService(ProcessMonitor):
+    """
+    Bind listening sockets and run C{workers} processes which accept
+    connections on them, restarting them like L{ProcessMonitor} does when
+    they exit or when they do not answer a L{Heartbeat} for
+    C{heartbeatTimeout} seconds.
+
+    The sockets are bound by L{privilegedStartService}, so that privileged
+    ports can be used by workers running as another user.
+
+    @type heartbeatInterval: C{float}
+    @ivar heartbeatInterval: The number of seconds between heartbeats.
+
+    @type heartbeatTimeout: C{float}
+    @ivar heartbeatTimeout: The number of seconds after which a worker which
+        has not answered a heartbeat, or which has not answered any since it
+        was started, is killed.
+
+    @type drainTimeout: C{float}
+    @ivar drainTimeout: How long a worker being stopped may take to finish
+        the connections it accepted before it is sent a TERM signal.
+
+    @ivar sockets: The listening sockets, once bound.
+
+    @ivar _ports: A list of C{(port, interface, backlog)} to bind.
+    @ivar _serial: The number of the last worker added.
+    @ivar _readyWaiters: A C{dict} mapping the names of workers to lists of
+        L{defer.Deferred}s to fire when they are ready.
+    """
+    heartbeatInterval = 5
+    heartbeatTimeout = 30
+    drainTimeout = 30
+
+    def __init__(self, args, workers=None, uid=None, gid=None, env=None,
+                 reactor=_reactor):
+        """
+        @param args: The argv sequence of a worker, typically running
+            I{twistd} with an application which has a L{Worker} service.
+        @param workers: The number of workers, by default the number of
+            processors.
+        @param env: The environment of the workers, by default that of the
+            supervisor.
+        """
+        ProcessMonitor.__init__(self, reactor=reactor)
+        if workers is None:
+            workers = _cpuCount()
+        self.sockets = []
+        self._ports = []
+        self._serial = 0
+        self._readyWaiters = {}
+        self._heartbeatCall = None
+        for i in range(workers):
+            self.addProcess(self._nextName(), args, uid, gid, env)
+
+
+    def __getstate__(self):
+        dct = ProcessMonitor.__getstate__(self)
+        dct['sockets'] = []
+        dct['_readyWaiters'] = {}
+        dct['_heartbeatCall'] = None
+        return dct
+
+
+    def _nextName(self):
+        name = 'worker-%d' % (self._serial,)
+        self._serial += 1
+        return name
+
+
+    def listen(self, port, interface='', backlog=50):
+        """
+        Add a TCP port for the workers to accept connections on.
+
+        @return: The index of the port, which the workers pass to
+            L{Worker.listen}.
+        """
+        self._ports.append((port, interface, backlog))
+        return len(self._ports) - 1
+
+
+    def _bind(self):
+        """
+        Bind the listening sockets, unless they are bound already.
+        """
+        if self.sockets:
+            return
+        for port, interface, backlog in self._ports:
+            skt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            skt.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                skt.bind((interface, port))
+            except socket.error, e:
+                skt.close()
+                self._closeSockets()
+                raise CannotListenError(interface, port, e)
+            skt.listen(backlog)
+            skt.setblocking(0)
+            fdesc._setCloseOnExec(skt.fileno())
+            self.sockets.append(skt)
+
+
+    def _closeSockets(self):
+        for skt in self.sockets:
+            skt.close()
+        self.sockets = []
+
+
+    def privilegedStartService(self):
+        """
+        Bind the listening sockets.
+        """
+        ProcessMonitor.privilegedStartService(self)
+        self._bind()
+
+
+    def startService(self):
+        """
+        Bind the listening sockets if needed, start the workers and their
+        heartbeats.
+        """
+        self._bind()
+        ProcessMonitor.startService(self)
+        self._heartbeatCall = task.LoopingCall(self._heartbeat)
+        self._heartbeatCall.clock = self._reactor
+        self._heartbeatCall.start(self.heartbeatInterval, now=False)
+
+
+    def stopService(self):
+        """
+        Drain and stop the workers and close the listening sockets.
+
+        @return: A L{defer.Deferred} which fires once the workers are
+            drained and have been sent a TERM signal.
+        """
+        if self._heartbeatCall is not None:
+            self._heartbeatCall.stop()
+            self._heartbeatCall = None
+        d = defer.gatherResults([self._drain(name)
+                                 for name in self.protocols.keys()])
+        d.addCallback(lambda ignored: ProcessMonitor.stopService(self))
+        d.addCallback(lambda ignored: self._closeSockets())
+        return d
+
+
+    def startProcess(self, name):
+        """
+        Spawn the named worker, passing it the control channel and the
+        listening sockets.
+        """
+        if name in self.protocols:
+            return
+        args, uid, gid, env = self.processes[name]
+        if env is None:
+            env = os.environ
+        env = dict(env)
+        childFDs = {0: 'w', 1: 'r', 2: 'r',
+                    _CONTROL_IN: 'w', _CONTROL_OUT: 'r'}
+        fds = []
+        for i, skt in enumerate(self.sockets):
+            childFDs[_FIRST_PORT_FD + i] = skt.fileno()
+            fds.append(str(_FIRST_PORT_FD + i))
+        env[_NAME_VARIABLE] = name
+        env[_PORTS_VARIABLE] = ','.join(fds)
+
+        proto = WorkerProtocol()
+        proto.service = self
+        proto.name = name
+        self.protocols[name] = proto
+        self.timeStarted[name] = self._reactor.seconds()
+        self._reactor.spawnProcess(proto, args[0], args, uid=uid, gid=gid,
+                                   env=env, childFDs=childFDs)
+
+
+    def _heartbeat(self):
+        """
+        Kill the workers which have not answered a heartbeat in time and
+        send one to the others.
+        """
+        now = self._reactor.seconds()
+        for name, proto in self.protocols.items():
+            if proto.control.transport is None:
+                continue
+            if now - proto.lastSeen > self.heartbeatTimeout:
+                log.msg("Worker %s missed its heartbeats, killing it" %
+                        (name,))
+                self._forceStopProcess(proto.transport)
+            elif not proto.waiting:
+                proto.heartbeat()
+
+
+    def _workerReady(self, name):
+        self.protocols[name].ready = True
+        for d in self._readyWaiters.pop(name, []):
+            d.callback(name)
+
+
+    def _whenReady(self, name):
+        """
+        Return a L{defer.Deferred} which fires when the named worker, or the
+        worker restarted in its place, is ready.
+        """
+        d = defer.Deferred()
+        self._readyWaiters.setdefault(name, []).append(d)
+        return d
+
+
+    def _drain(self, name):
+        """
+        Ask the named worker to stop accepting connections and to finish
+        those it accepted.
+        """
+        proto = self.protocols.get(name)
+        if proto is None or not proto.ready:
+            return defer.succeed(None)
+        d = proto.control.callRemote(Drain, timeout=self.drainTimeout)
+        def drained(result):
+            if result['connections']:
+                log.msg("Worker %s still has %d connections open" %
+                        (name, result['connections']))
+        d.addCallbacks(drained, proto._noBeat)
+        return d
+
+
+    def _retire(self, name):
+        """
+        Drain the named worker, then stop it for good.
+        """
+        def drained(ignored):
+            restart = self.restart.pop(name, None)
+            if restart is not None and restart.active():
+                restart.cancel()
+            self.removeProcess(name)
+            self._readyWaiters.pop(name, None)
+        return self._drain(name).addCallback(drained)
+
+
+    def restartAll(self):
+        """
+        Replace the workers one at a time: start a new worker, wait for it to
+        accept connections, then drain and stop an old one.  No connection
+        is refused, since the new worker accepts on the same sockets, and
+        none is dropped unless it outlives C{drainTimeout}.
+
+        @return: A L{defer.Deferred} which fires once every worker was
+            replaced.
+        """
+        d = defer.succeed(None)
+        if not self.running:
+            return d
+        for name in sorted(self.processes):
+            d.addCallback(lambda ignored, name=name: self._replace(name))
+        return d
+
+
+    def _replace(self, name):
+        args, uid, gid, env = self.processes[name]
+        new = self._nextName()
+        d = self._whenReady(new)
+        self.addProcess(new, args, uid, gid, env)
+        d.addCallback(lambda ignored: self._retire(name))
+        return d
+
+
+    def stats(self):
+        """
+        Return the statistics of the workers, as of their last heartbeat.
+
+        @return: A C{dict} with the number of C{workers} ready, the numbers
+            of connections C{accepted} and of C{connections} open summed over
+            the workers, and C{byWorker}, a C{dict} mapping the name of each
+            worker to its own statistics.
+        """
+        byWorker = {}
+        totals = {'workers': 0, 'accepted': 0, 'connections': 0,
+                  'byWorker': byWorker}
+        for name, proto in self.protocols.items():
+            stats = dict(proto.stats)
+            stats['ready'] = proto.ready
+            stats['lastSeen'] = proto.lastSeen
+            byWorker[name] = stats
+            if proto.ready:
+                totals['workers'] += 1
+            totals['accepted'] += stats.get('accepted', 0)
+            totals['connections'] += stats.get('connections', 0)
+        return totals
+
+
+
+class _InheritedPort(tcp.Port):
+    """
+    A TCP port accepting connections on a listening socket inherited from
+    the supervisor.
+    """
+
+    def __init__(self, fileno, factory, reactor=None):
+        tcp.Port.__init__(self, None, factory, reactor=reactor)
+        self._inheritedFileno = fileno
+
+
+    def startListening(self):
+        skt = socket.fromfd(self._inheritedFileno, self.addressFamily,
+                            self.socketType)
+        os.close(self._inheritedFileno)
+        skt.setblocking(0)
+        fdesc._setCloseOnExec(skt.fileno())
+        self._realPortNumber = self.port = skt.getsockname()[1]
+
+        log.msg("%s starting on inherited %s" % (
+                self._getLogPrefix(self.factory), self._realPortNumber))
+
+        self.factory.doStart()
+        self.connected = True
+        self.socket = skt
+        self.fileno = self.socket.fileno
+        self.numberAccepts = 100
+
+        self.startReading()
+
+
+    def _closeSocket(self, orderly):
+        # Shutting the socket down would stop it listening in the supervisor
+        # and in every other worker too.
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+
+
+
+class _CountingFactory(policies.WrappingFactory):
+    """
+    Count the connections of a L{Worker}.
+    """
+
+    def __init__(self, worker, wrappedFactory):
+        policies.WrappingFactory.__init__(self, wrappedFactory)
+        self.worker = worker
+
+
+    def registerProtocol(self, p):
+        policies.WrappingFactory.registerProtocol(self, p)
+        self.worker.accepted += 1
+        self.worker.connections += 1
+
+
+    def unregisterProtocol(self, p):
+        policies.WrappingFactory.unregisterProtocol(self, p)
+        self.worker.connections -= 1
+        if not self.worker.connections:
+            waiters, self.worker._idleWaiters = self.worker._idleWaiters, []
+            for d in waiters:
+                d.callback(None)
+
+
+
+class _WorkerControl(amp.AMP):
+    """
+    A worker's end of the control channel with its supervisor.
+    """
+
+    def __init__(self, worker):
+        amp.AMP.__init__(self)
+        self.worker = worker
+
+
+    def heartbeat(self):
+        return {'pid': os.getpid(),
+                'accepted': self.worker.accepted,
+                'connections': self.worker.connections}
+    Heartbeat.responder(heartbeat)
+
+
+    def drain(self, timeout):
+        d = self.worker.drain(timeout)
+        d.addCallback(lambda connections: {'connections': connections})
+        return d
+    Drain.responder(drain)
+
+
+
+class Worker(service.Service):
+    """
+    Accept connections on the listening sockets passed by the
+    L{PreforkService} which started this process, and answer its commands.
+
+    @ivar name: The name the supervisor gave this worker, or C{None} when
+        not started by a supervisor.
+    @ivar fds: The descriptors of the listening sockets, in the order in
+        which the supervisor listened on them.
+    @ivar ports: The L{IListeningPort}s accepting connections.
+    @ivar accepted: The number of connections accepted.
+    @ivar connections: The number of connections open.
+    @ivar control: The L{amp.AMP} connected to the supervisor, or C{None}.
+    """
+    control = None
+
+    def __init__(self, environ=None, reactor=None):
+        if environ is None:
+            environ = os.environ
+        if reactor is None:
+            reactor = _reactor
+        self._reactor = reactor
+        self.name = environ.get(_NAME_VARIABLE)
+        self.fds = [int(fd)
+                    for fd in environ.get(_PORTS_VARIABLE, '').split(',')
+                    if fd]
+        self.ports = []
+        self.accepted = 0
+        self.connections = 0
+        self._factories = []
+        self._idleWaiters = []
+
+
+    def listen(self, index, factory):
+        """
+        Accept connections for C{factory} on the C{index}th socket the
+        supervisor listened on.
+        """
+        if not 0 <= index < len(self.fds):
+            raise CannotListenError(
+                None, index, "No inherited listening socket %d" % (index,))
+        wrapper = _CountingFactory(self, factory)
+        self._factories.append((index, wrapper))
+        if self.running:
+            self._adopt(index, wrapper)
+
+
+    def _adopt(self, index, factory):
+        port = _InheritedPort(self.fds[index], factory, self._reactor)
+        port.startListening()
+        self.ports.append(port)
+
+
+    def startService(self):
+        """
+        Accept connections and tell the supervisor this worker is ready.
+        """
+        service.Service.startService(self)
+        for index, factory in self._factories:
+            self._adopt(index, factory)
+        if self.name is not None:
+            self.control = _WorkerControl(self)
+            stdio.StandardIO(self.control, _CONTROL_IN, _CONTROL_OUT)
+            self.control.callRemote(Ready).addErrback(
+                log.err, "Could not tell the supervisor we are ready")
+
+
+    def stopService(self):
+        """
+        Stop accepting connections.
+        """
+        service.Service.stopService(self)
+        return self._stopListening()
+
+
+    def _stopListening(self):
+        ports, self.ports = self.ports, []
+        return defer.gatherResults(
+            [defer.maybeDeferred(port.stopListening) for port in ports])
+
+
+    def drain(self, timeout):
+        """
+        Stop accepting connections and wait for those open to be closed.
+
+        @return: A L{defer.Deferred} which fires, once no connection is open
+            or after C{timeout} seconds, with the number of connections
+            still open.
+        """
+        d = self._stopListening()
+        def stopped(ignored):
+            if not self.connections:
+                return 0
+            idle = defer.Deferred()
+            self._idleWaiters.append(idle)
+            call = self._reactor.callLater(timeout, idle.callback, None)
+            def done(ignored):
+                if call.active():
+                    call.cancel()
+                else:
+                    self._idleWaiters.remove(idle)
+                return self.connections
+            return idle.addCallback(done)
+        return d.addCallback(stopped)
@@ -0,0 +1,83 @@
+# -*- test-case-name: twisted.runner.test.test_preforktap -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Support for creating a service which runs prefork workers.
+"""
+
+from twisted.python import usage
+from twisted.runner.prefork import PreforkService
+
+
+class Options(usage.Options):
+    """
+    Define the options accepted by the I{twistd prefork} plugin.
+    """
+
+    synopsis = "[prefork options] worker commandline"
+
+    optParameters = [["workers", "w", None, "The number of workers, by "
+                      "default the number of processors.", int],
+                     ["draintimeout", "d", 30, "How long a worker being "
+                      "stopped may take to finish its connections, in "
+                      "seconds.", float],
+                     ["heartbeattimeout", "t", 30, "How long a worker may "
+                      "take to answer a heartbeat before it is killed, in "
+                      "seconds.", float]]
+
+    optFlags = []
+
+    longdesc = """\
+prefork binds TCP ports and runs workers, typically twistd processes with a
+twisted.runner.prefork.Worker service, which accept connections on them.
+Workers which exit or stop answering heartbeats are restarted.
+
+Eg twistd prefork --port 8080 twistd -n -y worker.tac"""
+
+    def __init__(self):
+        usage.Options.__init__(self)
+        self['ports'] = []
+
+
+    def opt_port(self, port):
+        """
+        A TCP port for the workers to accept connections on, as PORT or
+        INTERFACE:PORT.  May be given several times; workers refer to the
+        ports by their order.
+        """
+        interface, sep, number = port.rpartition(':')
+        try:
+            number = int(number)
+        except ValueError:
+            raise usage.UsageError("Invalid port: %r" % (port,))
+        self['ports'].append((number, interface))
+
+    opt_p = opt_port
+
+
+    def parseArgs(self, *args):
+        """
+        Grab the command line of the workers.
+        """
+        self['args'] = args
+
+
+    def postOptions(self):
+        """
+        Check that a worker command line and a port were given.
+        """
+        if len(self['args']) < 1:
+            raise usage.UsageError("Please specify a worker commandline")
+        if not self['ports']:
+            raise usage.UsageError("Please specify at least one port")
+
+
+
+def makeService(config):
+    s = PreforkService(list(config['args']), workers=config['workers'])
+    s.drainTimeout = config['draintimeout']
+    s.heartbeatTimeout = config['heartbeattimeout']
+    for port, interface in config['ports']:
+        s.listen(port, interface)
+    return s
@@ -0,0 +1,464 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Tests for L{twisted.runner.prefork}.
+"""
+
+import os
+import sys
+import socket
+
+from twisted.trial import unittest
+from twisted.python.runtime import platform
+from twisted.internet import defer, error, protocol, interfaces
+from twisted.internet.task import Clock
+
+if platform.isWindows():
+    prefork = None
+else:
+    from twisted.runner import prefork
+    from twisted.runner.test.test_procmon import (
+        DummyProcess, DummyProcessReactor)
+
+
+
+class LoopbackTransport(object):
+    """
+    The transport of the worker's end of a fake control channel, which
+    delivers what is written to the supervisor's L{prefork.WorkerProtocol}
+    in the next iteration of C{clock}.
+    """
+
+    def __init__(self, workerProtocol, clock):
+        self.workerProtocol = workerProtocol
+        self.clock = clock
+
+
+    def write(self, data):
+        self.clock.callLater(0, self.workerProtocol.childDataReceived,
+                             prefork._CONTROL_OUT, data)
+
+
+    def writeSequence(self, data):
+        self.write(''.join(data))
+
+
+    def loseConnection(self):
+        pass
+
+
+    def getPeer(self):
+        return prefork.PipeAddress()
+    getHost = getPeer
+
+
+
+if prefork is not None:
+    class WorkerProcess(DummyProcess):
+        """
+        A fake worker process with a L{prefork.Worker} answering its
+        supervisor's commands, as long as C{answering} is true.
+        """
+        answering = True
+
+        def __init__(self, *a, **kw):
+            DummyProcess.__init__(self, *a, **kw)
+            self.worker = prefork.Worker({}, self._reactor)
+            self.control = prefork._WorkerControl(self.worker)
+            self.control.makeConnection(
+                LoopbackTransport(self.proto, self._reactor))
+            self.closed = []
+
+
+        def writeToChild(self, childFD, data):
+            if childFD == prefork._CONTROL_IN and self.answering:
+                self._reactor.callLater(0, self.control.dataReceived, data)
+
+
+        def closeChildFD(self, childFD):
+            self.closed.append(childFD)
+
+
+        def ready(self):
+            """
+            Tell the supervisor the worker is ready.
+            """
+            d = self.control.callRemote(prefork.Ready)
+            self._reactor.advance(0)
+            return d
+
+
+
+    class WorkerProcessReactor(DummyProcessReactor):
+        """
+        A fake reactor spawning L{WorkerProcess}es.
+        """
+
+        def spawnProcess(self, processProtocol, executable, args=(), env={},
+                         path=None, uid=None, gid=None, usePTY=0,
+                         childFDs=None):
+            proc = WorkerProcess(self, executable, args, env, path,
+                                 processProtocol, uid, gid, usePTY, childFDs)
+            processProtocol.makeConnection(proc)
+            self.spawnedProcesses.append(proc)
+            return proc
+
+
+
+class PreforkServiceTests(unittest.TestCase):
+    """
+    Tests for L{prefork.PreforkService}.
+    """
+    if prefork is None:
+        skip = "twisted.runner.prefork is only available on POSIX"
+
+    def setUp(self):
+        self.reactor = WorkerProcessReactor()
+        self.supervisor = prefork.PreforkService(
+            ['worker'], workers=2, env={'KEY': 'value'},
+            reactor=self.reactor)
+        self.supervisor.listen(0, '127.0.0.1')
+        self.addCleanup(self.supervisor._closeSockets)
+
+
+    def start(self):
+        """
+        Start the supervisor and make its workers ready.
+        """
+        self.supervisor.startService()
+        for proc in self.reactor.spawnedProcesses:
+            proc.ready()
+
+
+    def test_spawn(self):
+        """
+        L{prefork.PreforkService.startService} binds the listening sockets
+        and spawns the workers with the control channel and the sockets as
+        descriptors, and their names and sockets in the environment.
+        """
+        self.supervisor.startService()
+        self.assertEqual(len(self.supervisor.sockets), 1)
+        fileno = self.supervisor.sockets[0].fileno()
+        procs = self.reactor.spawnedProcesses
+        self.assertEqual(len(procs), 2)
+        self.assertEqual(sorted([proc._environment[prefork._NAME_VARIABLE]
+                                 for proc in procs]),
+                         ['worker-0', 'worker-1'])
+        for proc in procs:
+            self.assertEqual(proc._args, ['worker'])
+            self.assertEqual(proc._environment['KEY'], 'value')
+            self.assertEqual(proc._environment[prefork._PORTS_VARIABLE], '5')
+            self.assertEqual(proc._childFDs,
+                             {0: 'w', 1: 'r', 2: 'r', 3: 'w', 4: 'r',
+                              5: fileno})
+
+
+    def test_listenError(self):
+        """
+        L{prefork.PreforkService.startService} raises L{CannotListenError} if
+        a port cannot be bound, and closes the sockets already bound.
+        """
+        skt = socket.socket()
+        self.addCleanup(skt.close)
+        skt.bind(('127.0.0.1', 0))
+        skt.listen(1)
+        self.supervisor.listen(skt.getsockname()[1], '127.0.0.1')
+        self.assertEqual(len(self.supervisor._ports), 2)
+        self.assertRaises(error.CannotListenError,
+                          self.supervisor.startService)
+        self.assertEqual(self.supervisor.sockets, [])
+        self.assertEqual(self.reactor.spawnedProcesses, [])
+
+
+    def test_statsAndHeartbeat(self):
+        """
+        The supervisor sends heartbeats to its workers every
+        C{heartbeatInterval} seconds and sums the statistics they return.
+        """
+        self.start()
+        self.reactor.spawnedProcesses[0].worker.accepted = 3
+        self.reactor.spawnedProcesses[1].worker.accepted = 4
+        self.reactor.spawnedProcesses[1].worker.connections = 2
+        stats = self.supervisor.stats()
+        self.assertEqual((stats['workers'], stats['accepted']), (2, 0))
+        self.reactor.advance(self.supervisor.heartbeatInterval)
+        stats = self.supervisor.stats()
+        self.assertEqual(
+            (stats['workers'], stats['accepted'], stats['connections']),
+            (2, 7, 2))
+        worker = stats['byWorker']['worker-1']
+        self.assertEqual(worker['pid'], os.getpid())
+        self.assertEqual(worker['lastSeen'], self.reactor.seconds())
+        self.assertTrue(worker['ready'])
+
+
+    def test_heartbeatTimeout(self):
+        """
+        A worker which does not answer heartbeats for C{heartbeatTimeout}
+        seconds is killed, and restarted.
+        """
+        self.start()
+        hung = self.reactor.spawnedProcesses[0]
+        hung.answering = False
+        self.supervisor.minRestartDelay = 0
+        self.reactor.advance(self.supervisor.heartbeatTimeout)
+        self.assertNotIdentical(hung.pid, None)
+        for i in range(3):
+            self.reactor.advance(self.supervisor.heartbeatInterval)
+        self.assertIdentical(hung.pid, None)
+        self.assertIdentical(self.reactor.spawnedProcesses[1].pid, 1)
+        self.assertEqual(len(self.reactor.spawnedProcesses), 3)
+        self.assertEqual(sorted(self.supervisor.protocols),
+                         ['worker-0', 'worker-1'])
+
+
+    def test_restartAll(self):
+        """
+        L{prefork.PreforkService.restartAll} replaces the workers one at a
+        time: an old worker is drained and stopped once its replacement is
+        ready.
+        """
+        self.start()
+        old = [self.supervisor.protocols[name].transport
+               for name in ('worker-0', 'worker-1')]
+        d = self.supervisor.restartAll()
+        self.assertEqual(len(self.reactor.spawnedProcesses), 3)
+        self.reactor.advance(old[0]._terminationDelay)
+        self.assertNotIdentical(old[0].pid, None)
+
+        self.reactor.spawnedProcesses[2].ready()
+        self.reactor.advance(old[0]._terminationDelay)
+        self.assertIdentical(old[0].pid, None)
+        self.assertNotIdentical(old[1].pid, None)
+        self.assertEqual(len(self.reactor.spawnedProcesses), 4)
+
+        self.reactor.spawnedProcesses[3].ready()
+        self.reactor.advance(old[1]._terminationDelay)
+        self.assertIdentical(old[1].pid, None)
+        self.assertEqual(sorted(self.supervisor.processes),
+                         ['worker-2', 'worker-3'])
+        self.assertEqual(sorted(self.supervisor.protocols),
+                         ['worker-2', 'worker-3'])
+        result = []
+        d.addCallback(result.append)
+        self.assertEqual(result, [None])
+
+
+    def test_stopService(self):
+        """
+        L{prefork.PreforkService.stopService} drains the workers, stops them
+        and closes the listening sockets.
+        """
+        self.start()
+        procs = self.reactor.spawnedProcesses
+        procs[0].worker.connections = 1
+        result = []
+        self.supervisor.stopService().addCallback(result.append)
+        self.reactor.advance(0)
+        self.assertEqual(result, [])
+        self.reactor.advance(self.supervisor.drainTimeout)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(self.supervisor.sockets, [])
+        self.reactor.advance(procs[0]._terminationDelay)
+        self.assertEqual([proc.pid for proc in procs], [None, None])
+        self.assertEqual(len(procs), 2)
+
+
+
+class Echo(protocol.Protocol):
+    def dataReceived(self, data):
+        self.transport.write(data)
+
+
+
+class WorkerTests(unittest.TestCase):
+    """
+    Tests for L{prefork.Worker}.
+    """
+    if prefork is None:
+        skip = "twisted.runner.prefork is only available on POSIX"
+
+    def setUp(self):
+        self.clock = Clock()
+        self.worker = prefork.Worker(
+            {prefork._PORTS_VARIABLE: '7,9'}, self.clock)
+
+
+    def test_environment(self):
+        """
+        A L{prefork.Worker} reads its name and the descriptors of its
+        listening sockets from the environment.
+        """
+        self.assertIdentical(self.worker.name, None)
+        self.assertEqual(self.worker.fds, [7, 9])
+        worker = prefork.Worker({prefork._NAME_VARIABLE: 'worker-3'})
+        self.assertEqual((worker.name, worker.fds), ('worker-3', []))
+
+
+    def test_listenUnknownSocket(self):
+        """
+        L{prefork.Worker.listen} raises L{CannotListenError} for a socket the
+        supervisor did not pass.
+        """
+        self.assertRaises(error.CannotListenError, self.worker.listen, 2,
+                          protocol.ServerFactory())
+
+
+    def connect(self):
+        """
+        Make the worker count a connection, returning it.
+        """
+        factory = prefork._CountingFactory(self.worker,
+                                           protocol.ServerFactory())
+        factory.wrappedFactory.protocol = protocol.Protocol
+        proto = factory.buildProtocol(None)
+        proto.makeConnection(
+            type('Transport', (object,), {'loseConnection': lambda self: 0,
+                                          'getPeer': lambda self: None})())
+        return proto
+
+
+    def test_drain(self):
+        """
+        L{prefork.Worker.drain} fires with 0 once the connections open are
+        closed.
+        """
+        connections = [self.connect(), self.connect()]
+        self.assertEqual((self.worker.accepted, self.worker.connections),
+                         (2, 2))
+        result = []
+        self.worker.drain(10).addCallback(result.append)
+        for proto in connections:
+            self.assertEqual(result, [])
+            proto.connectionLost(None)
+        self.assertEqual(result, [0])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_drainTimeout(self):
+        """
+        L{prefork.Worker.drain} fires with the number of connections still
+        open after C{timeout} seconds.
+        """
+        self.connect()
+        result = []
+        self.worker.drain(10).addCallback(result.append)
+        self.clock.advance(10)
+        self.assertEqual(result, [1])
+        self.assertEqual(self.worker._idleWaiters, [])
+
+
+
+class PreforkProcessTests(unittest.TestCase):
+    """
+    Tests for L{prefork.PreforkService} running real workers.
+    """
+    if prefork is None:
+        skip = "twisted.runner.prefork is only available on POSIX"
+    else:
+        from twisted.internet import reactor
+        if not interfaces.IReactorProcess.providedBy(reactor):
+            skip = "This reactor cannot spawn processes"
+
+    workerSource = """
+import sys
+from twisted.internet import reactor, protocol
+from twisted.runner.prefork import Worker
+from twisted.runner.test.test_prefork import Echo
+
+factory = protocol.ServerFactory()
+factory.protocol = Echo
+worker = Worker()
+worker.listen(0, factory)
+reactor.callWhenRunning(worker.startService)
+reactor.addSystemEventTrigger('before', 'shutdown', worker.stopService)
+reactor.run()
+"""
+
+    def setUp(self):
+        from twisted.internet import reactor
+        self.reactor = reactor
+        path = self.mktemp()
+        f = file(path, 'w')
+        f.write(self.workerSource)
+        f.close()
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        self.supervisor = prefork.PreforkService(
+            [sys.executable, path], workers=2, env=env)
+        self.supervisor.listen(0, '127.0.0.1')
+
+
+    def echo(self, data):
+        """
+        Connect to the supervisor's port and return a L{defer.Deferred}
+        which fires with what the worker echoes.
+        """
+        port = self.supervisor.sockets[0].getsockname()[1]
+        received = defer.Deferred()
+        class Client(protocol.Protocol):
+            def connectionMade(self):
+                self.transport.write(data)
+            def dataReceived(self, data):
+                self.transport.loseConnection()
+                received.callback(data)
+        return protocol.ClientCreator(self.reactor, Client).connectTCP(
+            '127.0.0.1', port).addCallback(lambda ignored: received)
+
+
+    def whenEnded(self, names):
+        """
+        Return a L{defer.Deferred} which fires when the named workers have
+        exited.
+        """
+        ended = []
+        for name in names:
+            d = defer.Deferred()
+            proto = self.supervisor.protocols[name]
+            def processEnded(reason, proto=proto, d=d):
+                prefork.WorkerProtocol.processEnded(proto, reason)
+                d.callback(None)
+            proto.processEnded = processEnded
+            ended.append(d)
+        return defer.gatherResults(ended)
+
+
+    def test_serve(self):
+        """
+        Workers accept connections on the sockets bound by the supervisor,
+        report their statistics and are replaced by
+        L{prefork.PreforkService.restartAll}.
+        """
+        self.supervisor.startService()
+        names = sorted(self.supervisor.processes)
+        d = defer.gatherResults([self.supervisor._whenReady(name)
+                                 for name in names])
+        d.addCallback(lambda ignored: self.echo('hello'))
+        d.addCallback(self.assertEqual, 'hello')
+        def heartbeat(ignored):
+            return defer.gatherResults(
+                [proto.control.callRemote(prefork.Heartbeat).addCallback(
+                        proto._beat)
+                 for proto in self.supervisor.protocols.values()])
+        d.addCallback(heartbeat)
+        def checkStats(ignored):
+            stats = self.supervisor.stats()
+            self.assertEqual(stats['workers'], 2)
+            self.assertEqual(stats['accepted'], 1)
+            ended = self.whenEnded(names)
+            restarted = self.supervisor.restartAll()
+            return defer.gatherResults([ended, restarted])
+        d.addCallback(checkStats)
+        def restarted(ignored):
+            self.assertEqual(sorted(self.supervisor.processes),
+                             ['worker-2', 'worker-3'])
+            return self.echo('again')
+        d.addCallback(restarted)
+        d.addCallback(self.assertEqual, 'again')
+        def stop(ignored):
+            ended = self.whenEnded(self.supervisor.protocols.keys())
+            return defer.gatherResults([ended,
+                                        self.supervisor.stopService()])
+        d.addCallback(stop)
+        return d
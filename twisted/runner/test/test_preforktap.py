@@ -0,0 +1,73 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Tests for L{twisted.runner.preforktap}.
+"""
+
+from twisted.python.usage import UsageError
+from twisted.python.runtime import platform
+from twisted.trial import unittest
+
+if platform.isWindows():
+    tap = None
+else:
+    from twisted.runner.prefork import PreforkService
+    from twisted.runner import preforktap as tap
+
+
+class PreforkTapTests(unittest.TestCase):
+    """
+    Tests for L{twisted.runner.preforktap}'s option parsing and makeService
+    method.
+    """
+    if tap is None:
+        skip = "twisted.runner.prefork is only available on POSIX"
+
+    def test_commandLineRequired(self):
+        """
+        The command line of the workers must be provided.
+        """
+        opt = tap.Options()
+        self.assertRaises(UsageError, opt.parseOptions, ['--port', '80'])
+
+
+    def test_portRequired(self):
+        """
+        At least one port must be provided.
+        """
+        opt = tap.Options()
+        self.assertRaises(UsageError, opt.parseOptions, ['worker'])
+
+
+    def test_ports(self):
+        """
+        The port option may be given several times, with or without an
+        interface, and worker options are left to the worker command line.
+        """
+        opt = tap.Options()
+        opt.parseOptions(['--port', '80', '-p', '127.0.0.1:8080',
+                          'twistd', '-n', '--port', '1'])
+        self.assertEqual(opt['ports'], [(80, ''), (8080, '127.0.0.1')])
+        self.assertEqual(opt['args'], ('twistd', '-n', '--port', '1'))
+        self.assertRaises(UsageError, tap.Options().parseOptions,
+                          ['--port', 'http', 'worker'])
+
+
+    def test_makeService(self):
+        """
+        L{tap.makeService} makes a L{PreforkService} running the worker
+        command line and listening on the ports given.
+        """
+        opt = tap.Options()
+        opt.parseOptions(['--workers', '3', '--draintimeout', '7.5',
+                          '--port', '8080', 'twistd', '-n', '-y', 'w.tac'])
+        s = tap.makeService(opt)
+        self.assertIsInstance(s, PreforkService)
+        self.assertEqual(sorted(s.processes), ['worker-0', 'worker-1',
+                                               'worker-2'])
+        self.assertEqual(s.processes['worker-0'][0],
+                         ['twistd', '-n', '-y', 'w.tac'])
+        self.assertEqual(s.drainTimeout, 7.5)
+        self.assertEqual(s.heartbeatTimeout, 30)
+        self.assertEqual(s._ports, [(8080, '', 50)])
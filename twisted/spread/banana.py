@@ -12,7 +12,7 @@ for more details.
 @author: Glyph Lefkowitz
 """
 
-import copy, cStringIO, struct
+import copy, cStringIO, re, struct
 
 from twisted.internet import protocol
 from twisted.persisted import styles
@@ -42,12 +42,9 @@ def b1282int(st):
     @return: The integer value extracted from the string.
     @rtype: C{int} or C{long}
     """
-    e = 1
     i = 0
-    for char in st:
-        n = ord(char)
-        i += (n * e)
-        e <<= 7
+    for char in reversed(st):
+        i = (i << 7) | ord(char)
     return i
 
 
@@ -65,6 +62,9 @@ VOCAB    = chr(0x87)
 
 HIGH_BIT_SET = chr(0x80)
 
+# Finds the type byte ending a prefix.
+_typeByte = re.compile('[\x80-\xff]')
+
 def setPrefixLimit(limit):
     """
     Set the limit on the prefix length for all Banana connections
@@ -155,73 +155,80 @@ class Banana(protocol.Protocol, styles.Ephemeral):
     buffer = ''
 
     def dataReceived(self, chunk):
+        """
+        Decode as many elements as possible from the received data.
+
+        The buffer is walked with an offset, and only the undecoded bytes
+        are kept once all the complete elements are decoded.
+        """
         buffer = self.buffer + chunk
+        end = len(buffer)
+        offset = 0
         listStack = self.listStack
         gotItem = self.gotItem
-        while buffer:
-            assert self.buffer != buffer, "This ain't right: %s %s" % (repr(self.buffer), repr(buffer))
-            self.buffer = buffer
-            pos = 0
-            for ch in buffer:
-                if ch >= HIGH_BIT_SET:
-                    break
-                pos = pos + 1
-            else:
-                if pos > self.prefixLimit:
-                    raise BananaError("Security precaution: more than %d bytes of prefix" % (self.prefixLimit,))
-                return
-            num = buffer[:pos]
-            typebyte = buffer[pos]
-            rest = buffer[pos+1:]
-            if len(num) > self.prefixLimit:
-                raise BananaError("Security precaution: longer than %d bytes worth of prefix" % (self.prefixLimit,))
-            if typebyte == LIST:
-                num = b1282int(num)
-                if num > SIZE_LIMIT:
-                    raise BananaError("Security precaution: List too long.")
-                listStack.append((num, []))
-                buffer = rest
-            elif typebyte == STRING:
-                num = b1282int(num)
-                if num > SIZE_LIMIT:
-                    raise BananaError("Security precaution: String too long.")
-                if len(rest) >= num:
-                    buffer = rest[num:]
-                    gotItem(rest[:num])
+        prefixLimit = self.prefixLimit
+        search = _typeByte.search
+        try:
+            while offset < end:
+                match = search(buffer, offset, offset + prefixLimit + 1)
+                if match is None:
+                    if end - offset <= prefixLimit:
+                        return
+                    if search(buffer, offset) is None:
+                        raise BananaError(
+                            "Security precaution: more than %d bytes of "
+                            "prefix" % (prefixLimit,))
+                    raise BananaError(
+                        "Security precaution: longer than %d bytes worth of "
+                        "prefix" % (prefixLimit,))
+                pos = match.start()
+                typebyte = buffer[pos]
+                # Most prefixes are one or two digits long.
+                length = pos - offset
+                if length == 1:
+                    num = ord(buffer[offset])
+                elif length == 2:
+                    num = ord(buffer[offset]) | (ord(buffer[offset + 1]) << 7)
                 else:
-                    return
-            elif typebyte == INT:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(num)
-            elif typebyte == LONGINT:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(num)
-            elif typebyte == LONGNEG:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(-num)
-            elif typebyte == NEG:
-                buffer = rest
-                num = -b1282int(num)
-                gotItem(num)
-            elif typebyte == VOCAB:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(self.incomingVocabulary[num])
-            elif typebyte == FLOAT:
-                if len(rest) >= 8:
-                    buffer = rest[8:]
-                    gotItem(struct.unpack("!d", rest[:8])[0])
+                    num = b1282int(buffer[offset:pos])
+                rest = pos + 1
+                if typebyte == STRING:
+                    if num > SIZE_LIMIT:
+                        raise BananaError(
+                            "Security precaution: String too long.")
+                    if end - rest < num:
+                        return
+                    offset = rest + num
+                    gotItem(buffer[rest:offset])
+                elif typebyte == LIST:
+                    if num > SIZE_LIMIT:
+                        raise BananaError(
+                            "Security precaution: List too long.")
+                    listStack.append((num, []))
+                    offset = rest
+                elif typebyte == INT or typebyte == LONGINT:
+                    offset = rest
+                    gotItem(num)
+                elif typebyte == VOCAB:
+                    offset = rest
+                    gotItem(self.incomingVocabulary[num])
+                elif typebyte == NEG or typebyte == LONGNEG:
+                    offset = rest
+                    gotItem(-num)
+                elif typebyte == FLOAT:
+                    if end - rest < 8:
+                        return
+                    offset = rest + 8
+                    gotItem(struct.unpack("!d", buffer[rest:offset])[0])
                 else:
-                    return
-            else:
-                raise NotImplementedError(("Invalid Type Byte %r" % (typebyte,)))
-            while listStack and (len(listStack[-1][1]) == listStack[-1][0]):
-                item = listStack.pop()[1]
-                gotItem(item)
-        self.buffer = ''
+                    raise NotImplementedError(
+                        ("Invalid Type Byte %r" % (typebyte,)))
+                while listStack and (
+                    len(listStack[-1][1]) == listStack[-1][0]):
+                    item = listStack.pop()[1]
+                    gotItem(item)
+        finally:
+            self.buffer = buffer[offset:]
 
 
     def expressionReceived(self, lst):
@@ -81,6 +81,7 @@ from types import InstanceType
 from types import NoneType
 from types import ClassType
 import copy
+import weakref
 
 import datetime
 from types import BooleanType
@@ -108,7 +109,7 @@ from zope.interface import implements
 
 # Twisted Imports
 from twisted.python.reflect import namedObject, qual
-from twisted.persisted.crefutil import NotKnown, _Tuple, _InstanceMethod
+from twisted.persisted.crefutil import NotKnown, _InstanceMethod
 from twisted.persisted.crefutil import _DictKeyAndValue, _Dereference
 from twisted.persisted.crefutil import _Container
 from twisted.python.compat import reduce
@@ -147,6 +148,50 @@ unjellyableFactoryRegistry = {}
 
 _NO_STATE = object()
 
+# Types returned as they are.
+_immutableTypes = {StringType: True, IntType: True, LongType: True,
+                   FloatType: True}
+
+# Builtin containers, jellied and unjellied without recursion, and their atoms.
+_containerAtoms = {ListType: list_atom, TupleType: tuple_atom,
+                   DictionaryType: dictionary_atom,
+                   _sets.Set: set_atom, _sets.ImmutableSet: frozenset_atom}
+if _set is not None:
+    _containerAtoms[set] = set_atom
+    _containerAtoms[frozenset] = frozenset_atom
+
+# The types unjellied from the atoms of the builtin containers.
+_containerTypes = {list_atom: list, tuple_atom: tuple, dictionary_atom: dict,
+                   set_atom: _set or _sets.Set,
+                   frozenset_atom: _set and frozenset or _sets.ImmutableSet}
+
+_NO_KEY = object()
+
+
+def _flattenItems(d):
+    """
+    Iterate over the keys and values of a dictionary, alternately.
+    """
+    for key, value in d.iteritems():
+        yield key
+        yield value
+
+
+# Weakly keyed, so that remembering the name of a class does not keep it
+# alive.
+_qualCache = weakref.WeakKeyDictionary()
+
+def _qual(klass):
+    """
+    Return the fully qualified name of C{klass}, as L{qual} does, remembering
+    it for as long as C{klass} exists.
+    """
+    try:
+        return _qualCache[klass]
+    except KeyError:
+        name = _qualCache[klass] = qual(klass)
+        return name
+
 def _newInstance(cls, state=_NO_STATE):
     """
     Make a new instance of a class without calling its __init__ method.
@@ -380,6 +425,8 @@ class _Jellier:
         self._ref_id = 1
         self.persistentStore = persistentStore
         self.invoker = invoker
+        # The taster's decision for each type met so far.
+        self._allowedTypes = {}
 
 
     def _cook(self, object):
@@ -465,14 +512,104 @@ class _Jellier:
             return self.cooked[objId]
 
 
+    def _isTypeAllowed(self, objType):
+        """
+        Ask the taster whether C{objType} may be jellied, once per type.
+        """
+        try:
+            return self._allowedTypes[objType]
+        except KeyError:
+            allowed = self._allowedTypes[objType] = bool(
+                self.taster.isTypeAllowed(_qual(objType)))
+            return allowed
+
+
     def jelly(self, obj):
+        objType = type(obj)
+        if objType in _immutableTypes and self._isTypeAllowed(objType):
+            return obj
+        if objType in _containerAtoms and self._isTypeAllowed(objType):
+            preRef = self._checkMutable(obj)
+            if preRef:
+                return preRef
+            return self._jellyContainer(obj)
+        return self._jellyObject(obj)
+
+
+    def _jellyContainer(self, obj):
+        """
+        Jelly a builtin container, and the builtin containers in it, with an
+        explicit stack rather than recursion, so that the depth of nesting is
+        not limited by the recursion limit.
+
+        Each frame of the stack is a list of the container, its
+        s-expression, an iterator over the objects to jelly into it and, for
+        dictionaries, the jellied key waiting for its value or C{_NO_KEY}
+        (C{None} for other containers).
+        """
+        stack = []
+        frame = self._startContainer(obj)
+        while True:
+            for item in frame[2]:
+                itemType = type(item)
+                if itemType in _immutableTypes and self._isTypeAllowed(
+                    itemType):
+                    value = item
+                elif itemType in _containerAtoms and self._isTypeAllowed(
+                    itemType):
+                    value = self._checkMutable(item)
+                    if not value:
+                        stack.append(frame)
+                        frame = self._startContainer(item)
+                        break
+                else:
+                    value = self._jellyObject(item)
+                self._addToContainer(frame, value)
+            else:
+                value = self.preserve(frame[0], frame[1])
+                if not stack:
+                    return value
+                frame = stack.pop()
+                self._addToContainer(frame, value)
+
+
+    def _startContainer(self, obj):
+        """
+        Return a new frame for L{_jellyContainer}.
+        """
+        atom = _containerAtoms[type(obj)]
+        sxp = self.prepare(obj)
+        sxp.append(atom)
+        if atom is dictionary_atom:
+            return [obj, sxp, _flattenItems(obj), _NO_KEY]
+        return [obj, sxp, iter(obj), None]
+
+
+    def _addToContainer(self, frame, value):
+        """
+        Add a jellied object to the s-expression of a frame.
+        """
+        key = frame[3]
+        if key is None:
+            frame[1].append(value)
+        elif key is _NO_KEY:
+            frame[3] = value
+        else:
+            frame[1].append([key, value])
+            frame[3] = _NO_KEY
+
+
+    def _jellyObject(self, obj):
+        """
+        Jelly anything but the builtin containers and immutable types.
+        """
         if isinstance(obj, Jellyable):
             preRef = self._checkMutable(obj)
             if preRef:
                 return preRef
             return obj.jellyFor(self)
         objType = type(obj)
-        if self.taster.isTypeAllowed(qual(objType)):
+        if self._isTypeAllowed(objType):
             # "Immutable" Types
             if ((objType is StringType) or
                 (objType is IntType) or
@@ -524,41 +661,27 @@ class _Jellier:
                 preRef = self._checkMutable(obj)
                 if preRef:
                     return preRef
-                # "Mutable" Types
+                # "Mutable" Types; the builtin containers are handled by
+                # _jellyContainer.
                 sxp = self.prepare(obj)
-                if objType is ListType:
-                    sxp.extend(self._jellyIterable(list_atom, obj))
-                elif objType is TupleType:
-                    sxp.extend(self._jellyIterable(tuple_atom, obj))
-                elif objType in DictTypes:
-                    sxp.append(dictionary_atom)
-                    for key, val in obj.items():
-                        sxp.append([self.jelly(key), self.jelly(val)])
-                elif (_set is not None and objType is set or
-                      objType is _sets.Set):
-                    sxp.extend(self._jellyIterable(set_atom, obj))
-                elif (_set is not None and objType is frozenset or
-                      objType is _sets.ImmutableSet):
-                    sxp.extend(self._jellyIterable(frozenset_atom, obj))
-                else:
-                    className = qual(obj.__class__)
-                    persistent = None
-                    if self.persistentStore:
-                        persistent = self.persistentStore(obj, self)
-                    if persistent is not None:
-                        sxp.append(persistent_atom)
-                        sxp.append(persistent)
-                    elif self.taster.isClassAllowed(obj.__class__):
-                        sxp.append(className)
-                        if hasattr(obj, "__getstate__"):
-                            state = obj.__getstate__()
-                        else:
-                            state = obj.__dict__
-                        sxp.append(self.jelly(state))
+                className = _qual(obj.__class__)
+                persistent = None
+                if self.persistentStore:
+                    persistent = self.persistentStore(obj, self)
+                if persistent is not None:
+                    sxp.append(persistent_atom)
+                    sxp.append(persistent)
+                elif self.taster.isClassAllowed(obj.__class__):
+                    sxp.append(className)
+                    if hasattr(obj, "__getstate__"):
+                        state = obj.__getstate__()
                     else:
-                        self.unpersistable(
-                            "instance of class %s deemed insecure" %
-                            qual(obj.__class__), sxp)
+                        state = obj.__dict__
+                    sxp.append(self.jelly(state))
+                else:
+                    self.unpersistable(
+                        "instance of class %s deemed insecure" %
+                        qual(obj.__class__), sxp)
                 return self.preserve(obj, sxp)
         else:
             if objType is InstanceType:
@@ -568,24 +691,6 @@ class _Jellier:
                                 (objType, obj))
 
 
-    def _jellyIterable(self, atom, obj):
-        """
-        Jelly an iterable object.
-
-        @param atom: the identifier atom of the object.
-        @type atom: C{str}
-
-        @param obj: any iterable object.
-        @type obj: C{iterable}
-
-        @return: a generator of jellied data.
-        @rtype: C{generator}
-        """
-        yield atom
-        for item in obj:
-            yield self.jelly(item)
-
-
     def jelly_decimal(self, d):
         """
         Jelly a decimal object.
@@ -624,6 +729,12 @@ class _Unjellier:
         self.references = {}
         self.postCallbacks = []
         self.invoker = invoker
+        # The taster's decision, whether it is unjellied by
+        # _unjellyContainer and the _unjelly_ method for each type met so
+        # far.
+        self._allowedTypes = {}
+        self._containers = {}
+        self._thunks = {}
 
 
     def unjellyFull(self, obj):
@@ -633,11 +744,42 @@ class _Unjellier:
         return o
 
 
+    def _isTypeAllowed(self, jelType):
+        """
+        Ask the taster whether C{jelType} may be unjellied, once per type.
+        """
+        try:
+            return self._allowedTypes[jelType]
+        except KeyError:
+            allowed = self._allowedTypes[jelType] = bool(
+                self.taster.isTypeAllowed(jelType))
+            return allowed
+
+
+    def _isContainer(self, jelType):
+        """
+        Return whether s-expressions of C{jelType} are builtin containers or
+        references, allowed and not overridden by a registered unjellyable,
+        which L{_unjellyContainer} unjellies.
+        """
+        try:
+            return self._containers[jelType]
+        except KeyError:
+            isContainer = self._containers[jelType] = (
+                (jelType in _containerTypes or jelType == reference_atom)
+                and jelType not in unjellyableRegistry
+                and jelType not in unjellyableFactoryRegistry
+                and self._isTypeAllowed(jelType))
+            return isContainer
+
+
     def unjelly(self, obj):
         if type(obj) is not types.ListType:
             return obj
         jelType = obj[0]
-        if not self.taster.isTypeAllowed(jelType):
+        if self._isContainer(jelType):
+            return self._unjellyContainer(obj)
+        if not self._isTypeAllowed(jelType):
             raise InsecureJelly(jelType)
         regClass = unjellyableRegistry.get(jelType)
         if regClass is not None:
@@ -662,9 +804,13 @@ class _Unjellier:
             if hasattr(inst, 'postUnjelly'):
                 self.postCallbacks.append(inst.postUnjelly)
             return inst
-        thunk = getattr(self, '_unjelly_%s'%jelType, None)
+        try:
+            thunk = self._thunks[jelType]
+        except KeyError:
+            thunk = self._thunks[jelType] = getattr(
+                self.__class__, '_unjelly_%s' % (jelType,), None)
         if thunk is not None:
-            ret = thunk(obj[1:])
+            ret = thunk(self, obj[1:])
         else:
             nameSplit = jelType.split('.')
             modName = '.'.join(nameSplit[:-1])
@@ -759,92 +905,104 @@ class _Unjellier:
         return der
 
 
-    def _unjelly_reference(self, lst):
-        refid = lst[0]
-        exp = lst[1]
-        o = self.unjelly(exp)
-        ref = self.references.get(refid)
-        if (ref is None):
-            self.references[refid] = o
-        elif isinstance(ref, NotKnown):
-            ref.resolveDependants(o)
-            self.references[refid] = o
-        else:
-            assert 0, "Multiple references with same ID!"
-        return o
-
-
-    def _unjelly_tuple(self, lst):
-        l = range(len(lst))
-        finished = 1
-        for elem in l:
-            if isinstance(self.unjellyInto(l, elem, lst[elem]), NotKnown):
-                finished = 0
-        if finished:
-            return tuple(l)
-        else:
-            return _Tuple(l)
-
-
-    def _unjelly_list(self, lst):
-        l = range(len(lst))
-        for elem in l:
-            self.unjellyInto(l, elem, lst[elem])
-        return l
-
-
-    def _unjellySetOrFrozenset(self, lst, containerType):
+    def _unjellyContainer(self, obj):
         """
-        Helper method to unjelly set or frozenset.
-
-        @param lst: the content of the set.
-        @type lst: C{list}
-
-        @param containerType: the type of C{set} to use.
+        Unjelly a builtin container or a reference, and the containers and
+        references in it, with an explicit stack of L{_UnjellyFrame}s rather
+        than recursion, so that the depth of nesting is not limited by the
+        recursion limit.
         """
-        l = range(len(lst))
-        finished = True
-        for elem in l:
-            data = self.unjellyInto(l, elem, lst[elem])
-            if isinstance(data, NotKnown):
-                finished = False
-        if not finished:
-            return _Container(l, containerType)
-        else:
-            return containerType(l)
+        stack = []
+        frame = _UnjellyFrame(obj)
+        while True:
+            items = frame.items
+            while frame.index < len(items):
+                jel = items[frame.index]
+                if type(jel) is ListType:
+                    if jel and self._isContainer(jel[0]):
+                        stack.append(frame)
+                        frame = _UnjellyFrame(jel)
+                        break
+                    jel = self.unjelly(jel)
+                self._addToContainer(frame, jel)
+            else:
+                value = self._finishContainer(frame)
+                if not stack:
+                    return value
+                frame = stack.pop()
+                self._addToContainer(frame, value)
 
 
-    def _unjelly_set(self, lst):
+    def _addToContainer(self, frame, value):
         """
-        Unjelly set using either the C{set} builtin if available, or
-        C{sets.Set} as fallback.
+        Put an unjellied object in its place in the container of a frame,
+        arranging for it to be replaced if it is not known yet.
         """
-        if _set is not None:
-            containerType = set
+        index = frame.index
+        frame.index = index + 1
+        unknown = isinstance(value, NotKnown)
+        if frame.atom == dictionary_atom:
+            # Only pairs with an unknown key or value go through a
+            # _DictKeyAndValue.
+            if not index & 1:
+                frame.key = value
+                frame.pair = None
+                if unknown:
+                    frame.pair = _DictKeyAndValue(frame.dict)
+                    value.addDependant(frame.pair, 0)
+                    frame.pair[0] = value
+                return
+            target = frame.pair
+            if target is None:
+                if not unknown:
+                    frame.dict[frame.key] = value
+                    return
+                target = _DictKeyAndValue(frame.dict)
+                target[0] = frame.key
+            loc = 1
+        elif frame.atom == reference_atom:
+            frame.values[0] = value
+            return
         else:
-            containerType = _sets.Set
-        return self._unjellySetOrFrozenset(lst, containerType)
+            target, loc = frame.values, index
+        if unknown:
+            value.addDependant(target, loc)
+            frame.finished = False
+        target[loc] = value
 
 
-    def _unjelly_frozenset(self, lst):
+    def _finishContainer(self, frame):
         """
-        Unjelly frozenset using either the C{frozenset} builtin if available,
-        or C{sets.ImmutableSet} as fallback.
+        Return the object unjellied by a frame whose contents are all
+        unjellied.
         """
-        if _set is not None:
-            containerType = frozenset
+        atom = frame.atom
+        if atom == list_atom:
+            return frame.values
+        elif atom == dictionary_atom:
+            return frame.dict
+        elif atom == reference_atom:
+            return self._resolveReference(frame.refid, frame.values[0])
+        containerType = _containerTypes[atom]
+        if frame.finished:
+            return containerType(frame.values)
+        return _Container(frame.values, containerType)
+
+
+    def _resolveReference(self, refid, o):
+        """
+        Record C{o} as the object referenced by C{refid}, resolving the
+        dereferences to it met so far.
+        """
+        ref = self.references.get(refid)
+        if (ref is None):
+            self.references[refid] = o
+        elif isinstance(ref, NotKnown):
+            ref.resolveDependants(o)
+            self.references[refid] = o
         else:
-            containerType = _sets.ImmutableSet
-        return self._unjellySetOrFrozenset(lst, containerType)
-
-
-    def _unjelly_dictionary(self, lst):
-        d = {}
-        for k, v in lst:
-            kvd = _DictKeyAndValue(d)
-            self.unjellyInto(kvd, 0, k)
-            self.unjellyInto(kvd, 1, v)
-        return d
+            assert 0, "Multiple references with same ID!"
+        return o
 
 
     def _unjelly_module(self, rest):
@@ -935,6 +1093,49 @@ class _Unjellier:
 
 
 
+class _UnjellyFrame(object):
+    """
+    A builtin container or reference being unjellied by
+    L{_Unjellier._unjellyContainer}.
+
+    @ivar atom: The type of the s-expression.
+    @ivar items: The s-expressions to unjelly into the container; the keys
+        and values of a dictionary alternate.
+    @ivar index: The position in C{items} of the next one to unjelly.
+    @ivar values: The C{list} the items are unjellied into.
+    @ivar finished: Whether every item unjellied so far is known.
+    @ivar dict: For dictionaries, the C{dict}.
+    @ivar key: For dictionaries, the key waiting for its value.
+    @ivar pair: For dictionaries, the L{_DictKeyAndValue} for C{key} if it
+        is not known yet, or C{None}.
+    @ivar refid: For references, the identifier of the reference.
+    """
+    __slots__ = ('atom', 'items', 'index', 'values', 'finished',
+                 'dict', 'key', 'pair', 'refid')
+
+    def __init__(self, obj):
+        self.atom = atom = obj[0]
+        self.index = 0
+        self.finished = True
+        self.dict = self.key = self.pair = self.refid = None
+        if atom == dictionary_atom:
+            self.dict = {}
+            items = []
+            for k, v in obj[1:]:
+                items.append(k)
+                items.append(v)
+            self.values = None
+        elif atom == reference_atom:
+            self.refid = obj[1]
+            items = [obj[2]]
+            self.values = [None]
+        else:
+            items = obj[1:]
+            self.values = range(len(items))
+        self.items = items
+
+
+
 class _Dummy:
     """
     (Internal) Dummy class, used for unserializing instances.
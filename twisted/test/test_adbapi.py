@@ -10,11 +10,14 @@ from twisted.trial import unittest
 
 import os, stat
 import types
+from Queue import Queue
 
 from twisted.enterprise.adbapi import ConnectionPool, ConnectionLost, safe
 from twisted.enterprise.adbapi import Connection, Transaction
 from twisted.enterprise.adbapi import _unreleasedVersion
 from twisted.internet import reactor, defer, interfaces
+from twisted.enterprise import adbapi
+from twisted.internet.task import Clock
 from twisted.python.failure import Failure
 
 
@@ -835,3 +838,557 @@ class ConnectionPoolTestCase(unittest.TestCase):
         pool.close()
         # But not anymore.
         self.assertFalse(reactor.triggers)
+
+
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+
+class InlineThreadPool(NonThreadPool):
+    """
+    A L{NonThreadPool} with an (always empty) queue of work and a C{stop}
+    method, like L{twisted.python.threadpool.ThreadPool}.
+    """
+    def __init__(self):
+        self.q = Queue()
+
+
+    def callInThread(self, f, *a, **kw):
+        f(*a, **kw)
+
+
+    def stop(self):
+        pass
+
+
+
+def inlineSQLite3Pool(clock, **kw):
+    """
+    Create a L{ConnectionPool} for an in-memory sqlite3 database, which
+    runs interactions in the calling thread and schedules calls with
+    C{clock}.
+    """
+    kw['cp_reactor'] = EventReactor(False)
+    pool = ConnectionPool('sqlite3', ':memory:', **kw)
+    pool.threadpool = InlineThreadPool()
+    pool._reactor = clock
+    conn = pool.connect()
+    conn.execute("CREATE TABLE simple (x integer primary key)")
+    conn.commit()
+    return pool
+
+
+
+class RecordingTransaction(Transaction):
+    """
+    A L{Transaction} which records the calls made to its cursor's
+    C{executemany} method in its pool's C{executed} list.
+    """
+    def executemany(self, sql, params):
+        self._pool.executed.append((sql, list(params)))
+        return self._cursor.executemany(sql, params)
+
+
+
+class BatchedOperationTestCase(unittest.TestCase):
+    """
+    Tests for L{ConnectionPool.runBatchedOperation}, executed against an
+    in-memory sqlite3 database in the main thread.
+    """
+    if sqlite3 is None:
+        skip = "sqlite3 is not available"
+
+    def setUp(self):
+        self.clock = Clock()
+        self.pool = inlineSQLite3Pool(self.clock)
+        self.pool.transactionFactory = RecordingTransaction
+        self.pool.executed = []
+
+
+    def tearDown(self):
+        for conn in self.pool.connections.values():
+            conn.close()
+
+
+    def insert(self, x):
+        return self.pool.runBatchedOperation(
+            "INSERT INTO simple (x) VALUES (?)", (x,))
+
+
+    def rows(self):
+        return [x for (x,) in self.pool.connect().execute(
+                "SELECT x FROM simple ORDER BY x")]
+
+
+    def test_batchDelay(self):
+        """
+        Operations submitted within C{batch_delay} seconds are executed
+        together with C{executemany}, and each of their Deferreds fires.
+        """
+        ds = [self.insert(x) for x in range(3)]
+        self.assertEqual(self.pool.executed, [])
+        self.clock.advance(self.pool.batch_delay)
+        self.assertEqual(self.pool.executed, [
+                ("INSERT INTO simple (x) VALUES (?)", [(0,), (1,), (2,)])])
+        d = defer.gatherResults(ds)
+        def cbInserted(results):
+            self.assertEqual(results, [None, None, None])
+            self.assertEqual(self.rows(), [0, 1, 2])
+        d.addCallback(cbInserted)
+        return d
+
+
+    def test_batchSize(self):
+        """
+        Once C{batch_size} operations are waiting they are executed without
+        waiting for C{batch_delay} to pass.
+        """
+        self.pool.batch_size = 2
+        ds = [self.insert(x) for x in range(3)]
+        self.assertEqual(len(self.pool.executed), 1)
+        self.clock.advance(self.pool.batch_delay)
+        self.assertEqual(len(self.pool.executed), 2)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        return defer.gatherResults(ds)
+
+
+    def test_order(self):
+        """
+        Operations are executed in the order they were submitted, with only
+        consecutive operations of the same statement sharing an
+        C{executemany} call.
+        """
+        self.insert(1)
+        self.insert(2)
+        self.pool.runBatchedOperation("DELETE FROM simple WHERE x = ?", (1,))
+        d = self.insert(3)
+        self.pool.flushBatch()
+        self.assertEqual([sql.split()[0] for (sql, params)
+                          in self.pool.executed],
+                         ["INSERT", "DELETE", "INSERT"])
+        d.addCallback(lambda ignored: self.assertEqual(self.rows(), [2, 3]))
+        return d
+
+
+    def test_failureIsolation(self):
+        """
+        If a batch fails, its operations are executed again one by one and
+        only the Deferreds of the operations which fail by themselves
+        receive a failure.
+        """
+        first = self.insert(1)
+        duplicate = self.insert(1)
+        last = self.insert(2)
+        self.pool.flushBatch()
+        d = self.assertFailure(duplicate, sqlite3.IntegrityError)
+        d.addCallback(lambda ignored: defer.gatherResults([first, last]))
+        d.addCallback(lambda ignored: self.assertEqual(self.rows(), [1, 2]))
+        return d
+
+
+    def test_singleFailure(self):
+        """
+        A batch of one operation which fails passes its failure to the
+        operation's Deferred.
+        """
+        d = self.pool.runBatchedOperation("INSERT INTO missing VALUES (?)",
+                                          (1,))
+        self.pool.flushBatch()
+        self.assertEqual(len(self.pool.executed), 1)
+        return self.assertFailure(d, sqlite3.OperationalError)
+
+
+    def test_closeExecutesBatch(self):
+        """
+        Closing a running pool executes its pending operations before its
+        threads are stopped, and fires their Deferreds.
+        """
+        self.pool.running = True
+        ds = [self.insert(x) for x in range(2)]
+        self.pool.finalClose()
+        self.assertEqual(len(self.pool.executed), 1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        return defer.gatherResults(ds)
+
+
+    def test_closeBatchFails(self):
+        """
+        If the pending operations of a pool fail when it is closed, each of
+        their Deferreds fails, without executing them again one by one.
+        """
+        self.pool.running = True
+        first = self.insert(1)
+        duplicate = self.insert(1)
+        self.pool.finalClose()
+        self.assertEqual(len(self.pool.executed), 1)
+        return defer.gatherResults([
+                self.assertFailure(first, sqlite3.IntegrityError),
+                self.assertFailure(duplicate, sqlite3.IntegrityError)])
+
+
+    def test_closeNotRunning(self):
+        """
+        Closing a pool which is not running fails its pending operations
+        with L{adbapi.PoolClosed}.
+        """
+        d = self.insert(1)
+        self.pool.finalClose()
+        self.assertEqual(self.pool.executed, [])
+        return self.assertFailure(d, adbapi.PoolClosed)
+
+
+
+class HistogramTestCase(unittest.TestCase):
+    """
+    Tests for L{adbapi.Histogram} and L{adbapi.fingerprint}.
+    """
+
+    def test_snapshot(self):
+        """
+        L{adbapi.Histogram.snapshot} reports the number, mean and maximum of
+        the durations added and how many fell into each bucket.
+        """
+        histogram = adbapi.Histogram()
+        for duration in (0.0001, 0.002, 0.002, 20):
+            histogram.add(duration)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 4)
+        self.assertEqual(snapshot['max'], 20)
+        self.assertAlmostEqual(snapshot['mean'], 20.0041 / 4)
+        buckets = dict(snapshot['buckets'])
+        self.assertEqual(buckets[0.0005], 1)
+        self.assertEqual(buckets[0.0025], 2)
+        self.assertEqual(buckets[None], 1)
+        self.assertEqual(sum(buckets.values()), 4)
+
+
+    def test_fingerprint(self):
+        """
+        L{adbapi.fingerprint} replaces literals with C{?} and collapses
+        whitespace.
+        """
+        self.assertEqual(
+            adbapi.fingerprint(
+                "SELECT *  FROM t1\n WHERE x = 12 AND y = 'it''s' AND z=1.5"),
+            "SELECT * FROM t1 WHERE x = ? AND y = ? AND z=?")
+
+
+
+class PoolStatisticsTestCase(unittest.TestCase):
+    """
+    Tests for the statistics, statement cache and connection checks of
+    L{ConnectionPool}.
+    """
+    if sqlite3 is None:
+        skip = "sqlite3 is not available"
+
+    def setUp(self):
+        self.clock = Clock()
+        # Stand in for the time module, so connection ages can be faked.
+        self.clock.time = self.clock.seconds
+        self.patch(adbapi, 'time', self.clock)
+
+
+    def makePool(self, **kw):
+        pool = inlineSQLite3Pool(self.clock, **kw)
+        self.addCleanup(pool.finalClose)
+        return pool
+
+
+    def test_statistics(self):
+        """
+        L{ConnectionPool.getStatistics} reports the connections, the time
+        spent waiting for and holding them, and the execution time of each
+        statement fingerprint.
+        """
+        pool = self.makePool()
+        d = pool.runQuery("SELECT * FROM simple WHERE x = 1")
+        d.addCallback(lambda ignored: pool.runQuery(
+                "SELECT * FROM simple WHERE x = 2"))
+        def cbQueried(ignored):
+            stats = pool.getStatistics()
+            self.assertEqual(stats['connections'], 1)
+            self.assertEqual(stats['active'], 0)
+            self.assertEqual(stats['idle'], 1)
+            self.assertEqual(stats['queued'], 0)
+            self.assertEqual(stats['wait']['count'], 2)
+            self.assertEqual(stats['checkout']['count'], 2)
+            self.assertEqual(stats['queries'].keys(),
+                             ["SELECT * FROM simple WHERE x = ?"])
+            self.assertEqual(
+                stats['queries']["SELECT * FROM simple WHERE x = ?"]['count'],
+                2)
+        d.addCallback(cbQueried)
+        return d
+
+
+    def test_statementCache(self):
+        """
+        With C{cp_statement_cache} set, each statement is executed with the
+        same cursor for as long as it is one of the most recently executed
+        ones.
+        """
+        pool = self.makePool(cp_statement_cache=2)
+        first = "SELECT * FROM simple WHERE x = 1"
+        d = pool.runQuery(first)
+        def cursorFor(sql):
+            return pool._statements[pool.threadID()][1][sql][0]
+        def cbFirst(ignored):
+            self.cursor = cursorFor(first)
+            return pool.runQuery(first)
+        d.addCallback(cbFirst)
+        def cbSecond(ignored):
+            self.assertIdentical(cursorFor(first), self.cursor)
+            d = pool.runQuery("SELECT 2")
+            d.addCallback(lambda ignored: pool.runQuery("SELECT 3"))
+            return d
+        d.addCallback(cbSecond)
+        def cbEvicted(ignored):
+            self.assertEqual(
+                sorted(pool._statements[pool.threadID()][1]),
+                ["SELECT 2", "SELECT 3"])
+        d.addCallback(cbEvicted)
+        return d
+
+
+    def test_maxLifetime(self):
+        """
+        A connection older than C{cp_max_lifetime} is replaced when it is
+        next used.
+        """
+        pool = self.makePool(cp_max_lifetime=60)
+        conn = pool.connect()
+        self.clock.advance(30)
+        self.assertIdentical(pool.connect(), conn)
+        self.clock.advance(30)
+        self.assertNotIdentical(pool.connect(), conn)
+        self.assertEqual(pool.statistics.recycled, 1)
+
+
+    def test_validateIdle(self):
+        """
+        A connection left unused for C{cp_validate_idle} seconds is checked
+        with C{good_sql} before it is used again, and replaced if the check
+        fails.
+        """
+        pool = self.makePool(cp_validate_idle=10)
+        conn = pool.connect()
+        self.clock.advance(10)
+        self.assertIdentical(pool.connect(), conn)
+        pool.good_sql = "SELECT * FROM missing"
+        self.clock.advance(5)
+        self.assertIdentical(pool.connect(), conn)
+        self.clock.advance(10)
+        self.assertNotIdentical(pool.connect(), conn)
+        self.assertEqual(pool.statistics.invalidated, 1)
+
+
+
+class FakeDBAPI(object):
+    """
+    A stand-in for the exceptions of a DB-API module.
+    """
+    class OperationalError(Exception):
+        pass
+
+    class ProgrammingError(Exception):
+        pass
+
+
+
+class RecordingPool(object):
+    """
+    A fake L{ConnectionPool} which records the calls made to it and
+    answers them with C{result}.
+
+    @ivar calls: A C{list} of C{(method, args)} tuples.
+    @ivar load: The value returned as C{queued} by C{getStatistics}.
+    """
+    dbapi = FakeDBAPI
+    dbapiName = 'fake'
+
+    def __init__(self, name, result=None):
+        self.name = name
+        self.result = result
+        self.calls = []
+        self.load = 0
+
+
+    def _call(self, method, *args):
+        self.calls.append((method, args))
+        if isinstance(self.result, Exception):
+            return defer.fail(self.result)
+        return defer.succeed((self.name, self.result))
+
+
+    def runQuery(self, *args):
+        return self._call('runQuery', *args)
+
+
+    def runOperation(self, *args):
+        return self._call('runOperation', *args)
+
+
+    def runBatchedOperation(self, *args):
+        return self._call('runBatchedOperation', *args)
+
+
+    def runInteraction(self, *args):
+        return self._call('runInteraction', *args)
+
+
+    def getStatistics(self):
+        return {'queued': self.load, 'active': 0}
+
+
+
+class RoutingConnectionPoolTestCase(unittest.TestCase):
+    """
+    Tests for L{adbapi.RoutingConnectionPool}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.primary = RecordingPool('primary')
+        self.replicas = [RecordingPool('r1'), RecordingPool('r2')]
+        self.pool = adbapi.RoutingConnectionPool(
+            self.primary, self.replicas, retryInterval=10,
+            reactor=self.clock)
+
+
+    def names(self, count):
+        names = []
+        for i in range(count):
+            self.pool.runQuery("SELECT 1").addCallback(
+                lambda (name, result): names.append(name))
+        return names
+
+
+    def test_readsRoundRobin(self):
+        """
+        Queries are sent to each replica in turn.
+        """
+        self.assertEqual(self.names(4), ['r1', 'r2', 'r1', 'r2'])
+        self.assertEqual(self.primary.calls, [])
+
+
+    def test_writesToPrimary(self):
+        """
+        Operations and interactions are sent to the primary.
+        """
+        self.pool.runOperation("DELETE FROM simple")
+        self.pool.runInteraction(len)
+        self.assertEqual(self.primary.calls, [
+                ('runOperation', ("DELETE FROM simple",)),
+                ('runInteraction', (len,))])
+        self.assertEqual(self.replicas[0].calls, [])
+
+
+    def test_leastLoaded(self):
+        """
+        With C{leastLoaded}, queries are sent to the replica with the fewest
+        interactions queued or in progress.
+        """
+        self.pool.leastLoaded = True
+        self.replicas[0].load = 3
+        self.assertEqual(self.names(2), ['r2', 'r2'])
+
+
+    def test_failover(self):
+        """
+        A replica whose query fails with a connection error is taken out of
+        rotation for C{retryInterval} seconds and the query is retried
+        elsewhere.
+        """
+        self.replicas[0].result = adbapi.ConnectionLost()
+        self.assertEqual(self.names(3), ['r2', 'r2', 'r2'])
+        self.assertEqual(len(self.replicas[0].calls), 1)
+        self.replicas[0].result = None
+        self.clock.advance(10)
+        self.assertEqual(self.names(2), ['r1', 'r2'])
+
+
+    def test_allReplicasDown(self):
+        """
+        Queries are sent to the primary when every replica is out of
+        rotation.
+        """
+        for replica in self.replicas:
+            replica.result = adbapi.ConnectionLost()
+        self.assertEqual(self.names(2), ['primary', 'primary'])
+
+
+    def test_queryError(self):
+        """
+        A query which fails for another reason than a connection error fails
+        without taking the replica out of rotation.
+        """
+        self.replicas[0].result = FakeDBAPI.ProgrammingError()
+        d = self.pool.runQuery("SELEC 1")
+        self.assertFailure(d, FakeDBAPI.ProgrammingError)
+        self.assertEqual(self.pool._down, {})
+        return d
+
+
+    def test_operationalError(self):
+        """
+        By default, a query which fails with the C{OperationalError} of the
+        DB-API module fails without taking the replica out of rotation.
+        """
+        self.replicas[0].result = FakeDBAPI.OperationalError()
+        d = self.pool.runQuery("SELECT 1")
+        self.assertFailure(d, FakeDBAPI.OperationalError)
+        self.assertEqual(self.pool._down, {})
+        return d
+
+
+    def test_isConnectionError(self):
+        """
+        The C{isConnectionError} callable decides which failures take a
+        replica out of rotation.
+        """
+        checked = []
+        def isConnectionError(replica, reason):
+            checked.append(replica)
+            return reason.check(FakeDBAPI.OperationalError) is not None
+        self.pool = adbapi.RoutingConnectionPool(
+            self.primary, self.replicas, isConnectionError=isConnectionError,
+            reactor=self.clock)
+        self.replicas[0].result = FakeDBAPI.OperationalError()
+        self.assertEqual(self.names(2), ['r2', 'r2'])
+        self.assertEqual(checked, [self.replicas[0]])
+
+
+
+class ShardedConnectionPoolTestCase(unittest.TestCase):
+    """
+    Tests for L{adbapi.ShardedConnectionPool}.
+    """
+    def test_sameKeySameShard(self):
+        """
+        Every call with the same key goes to the same shard, and keys are
+        spread over the shards.
+        """
+        shards = [RecordingPool(i) for i in range(4)]
+        pool = adbapi.ShardedConnectionPool(shards)
+        for key in range(100):
+            pool.runQuery(key, "SELECT 1")
+            pool.runOperation(key, "DELETE FROM simple")
+            pool.runBatchedOperation(key, "INSERT INTO simple", (key,))
+            pool.runInteraction(key, len)
+            self.assertEqual(len(pool.shardFor(key).calls) % 4, 0)
+        for shard in shards:
+            self.assertNotEqual(shard.calls, [])
+
+
+    def test_stableHash(self):
+        """
+        The shard of a key depends only on the key's string form.
+        """
+        pool = adbapi.ShardedConnectionPool(range(5))
+        self.assertEqual(pool.shardFor('user:1'), pool.shardFor(u'user:1'))
+        self.assertEqual([pool.shardFor(i) for i in range(5)],
+                         [1, 0, 0, 0, 2])
@@ -8,6 +8,7 @@ Tests for L{twisted.protocols.amp}.
 
 import datetime
 import decimal
+from cStringIO import StringIO
 
 from zope.interface.verify import verifyObject
 
@@ -19,6 +20,7 @@ from twisted.trial import unittest
 from twisted.internet import protocol, defer, error, reactor, interfaces
 from twisted.test import iosim
 from twisted.test.proto_helpers import StringTransport
+from twisted.internet.task import Clock
 
 ssl = None
 try:
@@ -945,6 +947,37 @@ class BinaryProtocolTests(unittest.TestCase):
         self.assertEqual(self.boxes, [amp.AmpBox(hello="world")])
 
 
+    def test_receiveSeveralBoxes(self):
+        """
+        Several boxes and the start of another received at once are all
+        delivered, and the incomplete one is delivered when the rest of it
+        is received.
+        """
+        a = amp.BinaryBoxProtocol(self)
+        a.makeConnection(StringTransport())
+        first = amp.AmpBox(hello="world", x="")
+        second = amp.AmpBox(goodbye="world")
+        third = amp.AmpBox(long="x" * 1000, short="y")
+        data = third.serialize()
+        a.dataReceived(first.serialize() + second.serialize() + data[:510])
+        self.assertEqual(self.boxes, [first, second])
+        a.dataReceived(data[510:])
+        self.assertEqual(self.boxes, [first, second, third])
+
+
+    def test_receiveBoxByteByByte(self):
+        """
+        A box received one byte at a time is delivered once complete.
+        """
+        a = amp.BinaryBoxProtocol(self)
+        a.makeConnection(StringTransport())
+        box = amp.AmpBox(hello="world", empty="")
+        for byte in box.serialize():
+            self.assertEqual(self.boxes, [])
+            a.dataReceived(byte)
+        self.assertEqual(self.boxes, [box])
+
+
     def test_firstBoxFirstKeyExcessiveLength(self):
         """
         L{amp.BinaryBoxProtocol} drops its connection if the length prefix for
@@ -2627,6 +2660,463 @@ class CommandTestCase(unittest.TestCase):
             None)
 
 
+class Upload(amp.Command):
+    arguments = [('name', amp.String()),
+                 ('data', amp.Stream())]
+    response = [('size', amp.Integer())]
+
+
+
+class Download(amp.Command):
+    arguments = [('name', amp.String())]
+    response = [('data', amp.Stream())]
+
+
+
+class PausingConsumer(StringTransport):
+    """
+    A consumer which pauses its producer as soon as it is registered.
+    """
+    def registerProducer(self, producer, streaming):
+        StringTransport.registerProducer(self, producer, streaming)
+        producer.pauseProducing()
+
+
+
+class BrokenFile(object):
+    """
+    A file which fails to be read.
+    """
+    def read(self, size):
+        raise IOError("read failed")
+
+
+
+class StreamingProtocol(amp.AMP):
+    """
+    An AMP protocol which stores the payloads uploaded to it by name and
+    streams them back.
+
+    @ivar consumerFactory: the factory of the consumers uploads are
+        delivered to.
+    """
+    consumerFactory = StringTransport
+
+    def __init__(self):
+        amp.AMP.__init__(self)
+        self.files = {}
+        self.receivers = []
+
+
+    def upload(self, name, data):
+        self.receivers.append(data)
+        consumer = self.consumerFactory()
+        def delivered(ignored):
+            self.files[name] = consumer.value()
+            return {'size': len(self.files[name])}
+        return data.deliverTo(consumer).addCallback(delivered)
+    Upload.responder(upload)
+
+
+    def download(self, name):
+        return {'data': self.files[name]}
+    Download.responder(download)
+
+
+
+class StreamTests(unittest.TestCase):
+    """
+    Tests for L{amp.Stream} arguments.
+    """
+    def setUp(self):
+        self.client, self.server, self.pump = connectedServerAndClient(
+            StreamingProtocol, StreamingProtocol)
+        self.chunkSize = amp._StreamSender.chunkSize
+        self.window = amp.StreamReceiver.window
+
+
+    def download(self, name):
+        """
+        Download C{name} from the server and return its L{StreamReceiver}.
+        """
+        results = []
+        self.client.callRemote(Download, name=name).addCallback(
+            results.append)
+        self.pump.flush()
+        return results[0]['data']
+
+
+    def test_upload(self):
+        """
+        A payload longer than the limit of a box value is sent in chunks
+        and reassembled by the receiving L{amp.StreamReceiver}.
+        """
+        payload = "".join([chr(i % 256) for i in range(3 * self.chunkSize)])
+        payload += "tail"
+        results = []
+        self.client.callRemote(Upload, name="a", data=payload).addCallback(
+            results.append)
+        self.pump.flush()
+        self.assertEqual(results, [{'size': len(payload)}])
+        self.assertEqual(self.server.files["a"], payload)
+        self.assertEqual(self.client._outgoingStreams, {})
+        self.assertEqual(self.server._incomingStreams, {})
+
+
+    def test_download(self):
+        """
+        A L{amp.Stream} can be a response value, and a file-like object can
+        be sent.
+        """
+        self.server.files["a"] = StringIO("hello" * 20000)
+        consumer = StringTransport()
+        results = []
+        self.download("a").deliverTo(consumer).addCallback(results.append)
+        self.pump.flush()
+        self.assertEqual(results, [None])
+        self.assertEqual(consumer.value(), "hello" * 20000)
+        self.assertIdentical(consumer.producer, None)
+
+
+    def test_backpressure(self):
+        """
+        The sender stops once it has sent a window of chunks which the
+        receiver's consumer has not taken, and goes on when the consumer
+        resumes the receiver.
+        """
+        self.server.consumerFactory = PausingConsumer
+        payload = "x" * (self.chunkSize * (self.window + 4))
+        results = []
+        self.client.callRemote(Upload, name="a", data=payload).addCallback(
+            results.append)
+        self.pump.flush()
+        [receiver] = self.server.receivers
+        self.assertEqual(len(receiver._chunks), self.window)
+        self.assertEqual(results, [])
+        receiver.resumeProducing()
+        self.pump.flush()
+        self.assertEqual(results, [{'size': len(payload)}])
+
+
+    def test_readError(self):
+        """
+        If the payload cannot be read, the receiver fails with
+        L{amp.UnknownRemoteError}.
+        """
+        self.server.files["a"] = BrokenFile()
+        d = self.download("a").deliverTo(StringTransport())
+        self.pump.flush()
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        self.assertEqual(self.server._outgoingStreams, {})
+        return self.assertFailure(d, amp.UnknownRemoteError)
+
+
+    def test_connectionLost(self):
+        """
+        If the connection is lost, the receiver delivers the chunks it has
+        and fails with the reason the connection was lost.
+        """
+        self.server.files["a"] = "x" * (self.chunkSize * (self.window + 4))
+        receiver = self.download("a")
+        self.client.connectionLost(Failure(error.ConnectionDone()))
+        consumer = StringTransport()
+        d = receiver.deliverTo(consumer)
+        self.assertEqual(len(consumer.value()), self.chunkSize * self.window)
+        return self.assertFailure(d, error.ConnectionDone)
+
+
+    def test_stopProducing(self):
+        """
+        Stopping the receiver makes it fail and stops the sender.
+        """
+        self.server.files["a"] = "x" * (self.chunkSize * (self.window + 4))
+        receiver = self.download("a")
+        d = receiver.deliverTo(PausingConsumer())
+        receiver.stopProducing()
+        self.pump.flush()
+        self.assertEqual(self.server._outgoingStreams, {})
+        self.assertEqual(self.client._incomingStreams, {})
+        return self.assertFailure(d, Exception)
+
+
+    def test_stopProducingWithChunksInFlight(self):
+        """
+        Chunks and the end of a stream which the sender sent before it saw
+        the receiver stop are ignored.
+        """
+        self.server.files["a"] = "x" * (self.chunkSize * self.window * 4)
+        receiver = self.download("a")
+        consumer = StringTransport()
+        d = receiver.deliverTo(consumer)
+        received = len(consumer.value())
+        # The credit granted for the chunks written is sent before the abort,
+        # so the sender sends more chunks before it stops.
+        receiver.stopProducing()
+        self.pump.flush()
+        self.assertEqual(len(consumer.value()), received)
+        self.client.ampBoxReceived(amp.AmpBox({
+                    amp.STREAM: receiver._streamID, amp.STREAM_END: ""}))
+        self.assertEqual(self.server._outgoingStreams, {})
+        self.assertEqual(self.client._incomingStreams, {})
+        return self.assertFailure(d, Exception)
+
+
+
+class Echo(amp.Command):
+    arguments = [('value', amp.Integer())]
+    response = [('value', amp.Integer())]
+    idempotent = True
+
+
+
+class Record(amp.Command):
+    arguments = [('value', amp.Integer())]
+    response = [('value', amp.Integer())]
+
+
+
+class HoldingProtocol(amp.AMP):
+    """
+    An AMP protocol which answers L{Echo} and L{Record} only when told to.
+    """
+    def __init__(self):
+        amp.AMP.__init__(self)
+        self.held = []
+
+
+    def echo(self, value):
+        d = defer.Deferred()
+        self.held.append((value, d))
+        return d
+    Echo.responder(echo)
+    Record.responder(echo)
+
+
+    def answer(self):
+        held, self.held = self.held, []
+        for value, d in held:
+            d.callback({'value': value})
+
+
+
+class FakeEndpoint(object):
+    """
+    A client endpoint whose connections are to L{HoldingProtocol}s, through
+    L{iosim}.
+
+    @ivar connections: a C{list} of the C{(client, server, pump)} of each
+        connection.
+    @ivar refuse: whether connection attempts fail.
+    @ivar hold: whether connection attempts wait for L{complete}.
+    @ivar pending: a C{list} of the C{(factory, deferred)} of each connection
+        attempt waiting for L{complete}.
+    """
+    def __init__(self):
+        self.connections = []
+        self.refuse = False
+        self.hold = False
+        self.pending = []
+
+
+    def connect(self, factory):
+        if self.refuse:
+            return defer.fail(error.ConnectionRefusedError())
+        if self.hold:
+            d = defer.Deferred()
+            self.pending.append((factory, d))
+            return d
+        return defer.succeed(self._connect(factory))
+
+
+    def _connect(self, factory):
+        c, s, p = iosim.connectedServerAndClient(
+            HoldingProtocol, lambda: factory.buildProtocol(None))
+        self.connections.append((c, s, p))
+        return c
+
+
+    def complete(self):
+        """
+        Make the connections whose attempts are waiting.
+        """
+        pending, self.pending = self.pending, []
+        for factory, d in pending:
+            d.callback(self._connect(factory))
+
+
+    def flush(self):
+        for c, s, p in self.connections:
+            p.flush()
+
+
+    def answer(self):
+        for c, s, p in self.connections:
+            s.answer()
+        self.flush()
+
+
+
+class AMPPoolTests(unittest.TestCase):
+    """
+    Tests for L{amp.AMPPool}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.endpoints = [FakeEndpoint(), FakeEndpoint()]
+
+
+    def startPool(self, **kw):
+        pool = amp.AMPPool(self.endpoints, reactor=self.clock, **kw)
+        started = []
+        pool.start().addCallback(started.append)
+        self.assertEqual(started, [pool])
+        return pool
+
+
+    def callRemote(self, pool, command, value):
+        results = []
+        pool.callRemote(command, value=value).addBoth(results.append)
+        for endpoint in self.endpoints:
+            endpoint.flush()
+        return results
+
+
+    def test_start(self):
+        """
+        L{amp.AMPPool.start} makes C{connectionsPerEndpoint} connections to
+        each endpoint.
+        """
+        pool = self.startPool(connectionsPerEndpoint=3)
+        self.assertEqual(len(pool.protocols), 6)
+        self.assertEqual([len(e.connections) for e in self.endpoints], [3, 3])
+
+
+    def test_leastOutstanding(self):
+        """
+        Each command is sent on the connection with the fewest commands
+        waiting for an answer.
+        """
+        pool = self.startPool()
+        results = []
+        for i in range(8):
+            results.append(self.callRemote(pool, Echo, i))
+        held = [len(s.held)
+                for e in self.endpoints for (c, s, p) in e.connections]
+        self.assertEqual(held, [2, 2, 2, 2])
+        for endpoint in self.endpoints:
+            endpoint.answer()
+        self.assertEqual(results, [[{'value': i}] for i in range(8)])
+
+
+    def test_reconnect(self):
+        """
+        A lost connection is made again after C{retryDelay} seconds.
+        """
+        pool = self.startPool(retryDelay=2)
+        client = self.endpoints[0].connections[0][0]
+        client.connectionLost(Failure(error.ConnectionDone()))
+        self.assertEqual(len(pool.protocols), 3)
+        self.clock.advance(2)
+        self.assertEqual(len(pool.protocols), 4)
+        self.assertEqual(len(self.endpoints[0].connections), 3)
+
+
+    def test_connectionFailedBackoff(self):
+        """
+        Failed connection attempts are retried, doubling the delay each
+        time, and commands fail with L{amp.NoConnectionAvailable} meanwhile.
+        """
+        self.endpoints = [FakeEndpoint()]
+        self.endpoints[0].refuse = True
+        pool = self.startPool(connectionsPerEndpoint=1)
+        self.assertEqual(pool.protocols, [])
+        [result] = self.callRemote(pool, Echo, 1)
+        self.assertTrue(result.check(amp.NoConnectionAvailable))
+        self.clock.advance(1)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.assertEqual(self.clock.getDelayedCalls()[0].getTime(), 3)
+        self.endpoints[0].refuse = False
+        self.clock.advance(2)
+        self.assertEqual(len(pool.protocols), 1)
+        pool.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_stopWhileConnecting(self):
+        """
+        L{amp.AMPPool.stop} fires the L{Deferred} of L{amp.AMPPool.start} if
+        connection attempts are in progress, and a connection made after it
+        is closed and not used.
+        """
+        self.endpoints = [FakeEndpoint()]
+        self.endpoints[0].hold = True
+        pool = amp.AMPPool(self.endpoints, connectionsPerEndpoint=1,
+                           reactor=self.clock)
+        started = []
+        pool.start().addCallback(started.append)
+        pool.stop()
+        self.assertEqual(started, [pool])
+        self.endpoints[0].complete()
+        [(client, server, pump)] = self.endpoints[0].connections
+        self.assertTrue(client.transport.disconnecting)
+        client.connectionLost(Failure(error.ConnectionDone()))
+        self.assertEqual(pool.protocols, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_retryIdempotent(self):
+        """
+        An idempotent command is sent again on another connection if its
+        connection is lost before it is answered.
+        """
+        self.endpoints = [FakeEndpoint()]
+        pool = self.startPool()
+        results = self.callRemote(pool, Echo, 7)
+        [(first, firstServer, firstPump),
+         (second, secondServer, secondPump)] = self.endpoints[0].connections
+        self.assertEqual(len(firstServer.held), 1)
+        first.connectionLost(Failure(error.ConnectionDone()))
+        secondPump.flush()
+        self.assertEqual(len(secondServer.held), 1)
+        secondServer.answer()
+        secondPump.flush()
+        self.assertEqual(results, [{'value': 7}])
+        self.assertEqual(pool.getStatistics()['Echo']['retries'], 1)
+
+
+    def test_noRetry(self):
+        """
+        A command which is not idempotent fails if its connection is lost.
+        """
+        self.endpoints = [FakeEndpoint()]
+        pool = self.startPool()
+        results = self.callRemote(pool, Record, 7)
+        first = self.endpoints[0].connections[0][0]
+        first.connectionLost(Failure(error.ConnectionDone()))
+        [result] = results
+        self.assertTrue(result.check(error.ConnectionDone))
+        self.assertEqual(pool.getStatistics()['Record']['failures'], 1)
+
+
+    def test_statistics(self):
+        """
+        L{amp.AMPPool.getStatistics} reports the calls, failures and latency
+        of each command.
+        """
+        pool = self.startPool()
+        self.callRemote(pool, Echo, 1)
+        self.clock.advance(2)
+        self.callRemote(pool, Record, 2)
+        for endpoint in self.endpoints:
+            endpoint.answer()
+        self.assertEqual(pool.getStatistics(), {
+                'Echo': {'calls': 1, 'failures': 0, 'retries': 0,
+                         'meanLatency': 2.0, 'maxLatency': 2.0},
+                'Record': {'calls': 1, 'failures': 0, 'retries': 0,
+                           'meanLatency': 0.0, 'maxLatency': 0.0}})
+
+
+
 class ListOfTestsMixin:
     """
     Base class for testing L{ListOf}, a parameterized zero-or-more argument
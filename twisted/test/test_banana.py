@@ -180,6 +180,42 @@ class BananaTestCase(unittest.TestCase):
             self.enc.dataReceived(byte)
         assert self.result == foo, "%s!=%s" % (repr(self.result), repr(foo))
 
+    def test_largeList(self):
+        """
+        A long list of small elements received in one chunk is decoded.
+        """
+        foo = [i % 3 and "item%d" % (i,) or i for i in range(50000)]
+        self.enc.sendEncoded(foo)
+        self.enc.dataReceived(self.io.getvalue())
+        self.assertEqual(self.result, foo)
+
+
+    def test_deepNesting(self):
+        """
+        Deeply nested lists are decoded.
+        """
+        foo = []
+        for i in range(500):
+            foo = [foo, i]
+        self.enc.sendEncoded(foo)
+        self.enc.dataReceived(self.io.getvalue())
+        self.assertEqual(self.result, foo)
+
+
+    def test_unfinishedElements(self):
+        """
+        The bytes of an element which is not complete yet are kept, and
+        decoded once the rest of it is received.
+        """
+        self.enc.sendEncoded(["hello", 1.5, "world"])
+        data = self.io.getvalue()
+        self.enc.dataReceived(data[:11])
+        self.assertEqual(self.enc.buffer, data[9:11])
+        self.enc.dataReceived(data[11:])
+        self.assertEqual(self.enc.buffer, "")
+        self.assertEqual(self.result, ["hello", 1.5, "world"])
+
+
     def feed(self, data):
         for byte in data:
             self.enc.dataReceived(byte)
@@ -667,3 +667,152 @@ class RunStateTests(unittest.TestCase):
 
 
 
+
+
+
+class SchedulingTests(unittest.TestCase):
+    """
+    Tests for the priorities of L{CooperativeTask}s, the accounting of their
+    work and the time slices of L{Cooperator}s.
+    """
+
+    def setUp(self):
+        self.scheduler = FakeScheduler()
+        self.clock = [0.0]
+        self.done = []
+
+
+    def cooperator(self, unitsPerTick=1, **kw):
+        """
+        Make a L{task.Cooperator} whose steps do C{unitsPerTick} units of work
+        and whose clock is C{self.clock}.
+        """
+        def terminationPredicateFactory():
+            units = [0]
+            def terminate():
+                units[0] += 1
+                return units[0] >= unitsPerTick
+            return terminate
+        cooperator = task.Cooperator(
+            terminationPredicateFactory=terminationPredicateFactory,
+            scheduler=self.scheduler, **kw)
+        cooperator._now = lambda: self.clock[0]
+        return cooperator
+
+
+    def work(self, name, duration=0.0):
+        """
+        Do units of work recorded as C{name} and taking C{duration} seconds
+        of C{self.clock}.
+        """
+        while True:
+            self.done.append(name)
+            self.clock[0] += duration
+            yield None
+
+
+    def test_priorities(self):
+        """
+        Tasks do as many units of work in each round as their priority,
+        higher priorities first.
+        """
+        cooperator = self.cooperator()
+        cooperator.cooperate(self.work('low'), task.LOW_PRIORITY)
+        cooperator.cooperate(self.work('normal'))
+        cooperator.cooperate(self.work('high'), task.HIGH_PRIORITY)
+        for i in range(14):
+            self.scheduler.pump()
+        self.assertEqual(
+            self.done,
+            ['high', 'normal', 'low', 'high', 'normal', 'high', 'high'] * 2)
+        cooperator.stop()
+
+
+    def test_invalidPriority(self):
+        """
+        L{task.Cooperator.cooperate}, L{task.Cooperator.coiterate} and the
+        module-level L{task.cooperate} and L{task.coiterate} raise
+        L{ValueError} for a priority less than 1, without adding a task.
+        """
+        cooperator = self.cooperator()
+        tasks = list(task._theCooperator._tasks)
+        for priority in 0, -1:
+            self.assertRaises(ValueError, cooperator.cooperate,
+                              self.work('bad'), priority)
+            self.assertRaises(ValueError, cooperator.coiterate,
+                              self.work('bad'), priority=priority)
+            self.assertRaises(ValueError, task.cooperate,
+                              self.work('bad'), priority)
+            self.assertRaises(ValueError, task.coiterate,
+                              self.work('bad'), priority)
+        self.assertEqual(self.scheduler.work, [])
+        self.assertEqual(task._theCooperator._tasks, tasks)
+
+
+    def test_pausedTaskSkipped(self):
+        """
+        A task paused during a round does no more work in it.
+        """
+        cooperator = self.cooperator()
+        low = cooperator.cooperate(self.work('low'), task.LOW_PRIORITY)
+        high = cooperator.cooperate(self.work('high'), task.HIGH_PRIORITY)
+        self.scheduler.pump()
+        high.pause()
+        self.scheduler.pump()
+        self.scheduler.pump()
+        self.assertEqual(self.done, ['high', 'low', 'low'])
+        cooperator.stop()
+
+
+    def test_accounting(self):
+        """
+        Each task counts its units of work and the time they take, and the
+        monitor of its L{task.Cooperator} is told about those of each step.
+        """
+        reports = []
+        cooperator = self.cooperator(
+            unitsPerTick=3,
+            monitor=lambda *report: reports.append(report))
+        fast = cooperator.cooperate(self.work('fast', 0.5))
+        slow = cooperator.cooperate(self.work('slow', 2.0))
+        self.scheduler.pump()
+        self.assertEqual((fast.workUnits, fast.timeSpent), (2, 1.0))
+        self.assertEqual((slow.workUnits, slow.timeSpent), (1, 2.0))
+        self.assertEqual(sorted(reports), sorted([(fast, 2, 1.0),
+                                                  (slow, 1, 2.0)]))
+        cooperator.stop()
+
+
+    def test_monitorError(self):
+        """
+        An exception raised by the monitor is logged, and does not stop the
+        L{task.Cooperator}.
+        """
+        def monitor(*report):
+            raise UnhandledException()
+        cooperator = self.cooperator(monitor=monitor)
+        cooperator.cooperate(self.work('task'))
+        self.scheduler.pump()
+        self.scheduler.pump()
+        self.assertEqual(self.done, ['task', 'task'])
+        self.assertEqual(len(self.flushLoggedErrors(UnhandledException)), 2)
+        cooperator.stop()
+
+
+    def test_adaptiveTimeSlice(self):
+        """
+        With a C{targetLatency}, the time slice of a step is what is left of
+        it once the average time steps wait for is taken off, but at least a
+        tenth of it.
+        """
+        cooperator = self.cooperator(targetLatency=0.01)
+        cooperator.cooperate(self.work('task'))
+        self.clock[0] += 0.008
+        self.scheduler.pump()
+        self.assertAlmostEqual(cooperator.loopLag, 0.002)
+        self.assertAlmostEqual(cooperator.timeSlice, 0.008)
+        for i in range(20):
+            self.clock[0] += 0.1
+            self.scheduler.pump()
+        self.assertAlmostEqual(cooperator.timeSlice, 0.001)
+        cooperator.stop()
@@ -556,6 +556,46 @@ class DeferredTestCase(unittest.TestCase):
         self.assertEqual(called, [1, 2])
 
 
+    def test_callbacksRemovedWhenRun(self):
+        """
+        Callbacks are removed from L{Deferred.callbacks} as they are run, and
+        those not run yet when the L{Deferred} waits for another one are
+        kept.
+        """
+        inner = defer.Deferred()
+        called = []
+        deferred = defer.Deferred()
+        deferred.addCallback(lambda ignored: inner)
+        deferred.addCallback(called.append)
+        deferred.callback(None)
+        self.assertEqual(len(deferred.callbacks), 1)
+        inner.callback('result')
+        self.assertEqual(called, ['result'])
+        self.assertEqual(deferred.callbacks, [])
+        self.assertEqual(inner.callbacks, [])
+
+
+    def test_argumentsOfEveryKind(self):
+        """
+        Positional and keyword arguments given to L{Deferred.addCallback},
+        L{Deferred.addErrback}, L{Deferred.addBoth} and
+        L{Deferred.addCallbacks} are passed to their callback or errback.
+        """
+        calls = []
+        def record(result, *args, **kw):
+            calls.append((result, args, kw))
+            return result
+        deferred = defer.Deferred()
+        deferred.addCallback(record, 1, a=2)
+        deferred.addErrback(record, 3)
+        deferred.addBoth(record, b=4)
+        deferred.addCallbacks(record, record, callbackArgs=(5,),
+                              errbackKeywords={'c': 6})
+        deferred.callback('x')
+        self.assertEqual(calls, [('x', (1,), {'a': 2}), ('x', (), {'b': 4}),
+                                 ('x', (5,), {})])
+
+
     def test_reentrantRunCallbacksWithFailure(self):
         """
         After an exception is raised by a callback which was added to a
@@ -1901,6 +1941,159 @@ class OtherPrimitives(unittest.TestCase):
 
 
 
+class ParallelMapTests(unittest.TestCase):
+    """
+    Tests for L{defer.parallelMap}.
+    """
+
+    def setUp(self):
+        self.taken = []
+        self.calls = {}
+        self.cancelled = []
+
+
+    def items(self, n):
+        """
+        Generate C{n} items, recording when each is taken.
+        """
+        for i in range(n):
+            self.taken.append(i)
+            yield i
+
+
+    def resultOf(self, d):
+        """
+        Return the result of a L{defer.Deferred} which has one.
+        """
+        results = []
+        d.addBoth(results.append)
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+
+    def call(self, item):
+        """
+        Return a L{defer.Deferred} for the result of an item, to be fired by
+        the test, which records its cancellation.
+        """
+        d = self.calls[item] = defer.Deferred(
+            lambda d: self.cancelled.append(item))
+        return d
+
+
+    def test_concurrency(self):
+        """
+        Items are only taken when fewer than C{concurrency} results are
+        awaited, and the L{defer.Deferred} returned fires with the results
+        in the order they are known.
+        """
+        d = defer.parallelMap(self.call, self.items(5), 2)
+        self.assertEqual(self.taken, [0, 1])
+        self.calls[1].callback('b')
+        self.assertEqual(self.taken, [0, 1, 2])
+        self.calls[2].callback('c')
+        self.calls[0].callback('a')
+        self.assertEqual(self.taken, [0, 1, 2, 3, 4])
+        self.calls[4].callback('e')
+        self.calls[3].callback('d')
+        self.assertEqual(self.resultOf(d),
+                         [(1, 'b'), (2, 'c'), (0, 'a'), (4, 'e'), (3, 'd')])
+
+
+    def test_consumer(self):
+        """
+        Results, failures included, are given to the consumer as they are
+        known, and the L{defer.Deferred} returned fires with C{None}.
+        """
+        consumed = []
+        def f(item):
+            if item == 1:
+                raise GenericError()
+            return item * 10
+        d = defer.parallelMap(
+            f, self.items(3), 2,
+            consumer=lambda index, result: consumed.append((index, result)))
+        self.assertIdentical(self.resultOf(d), None)
+        self.assertEqual(consumed[0], (0, 0))
+        self.assertEqual(consumed[1][0], 1)
+        consumed[1][1].trap(GenericError)
+        self.assertEqual(consumed[2], (2, 20))
+
+
+    def test_synchronousResults(self):
+        """
+        Results known at once do not make L{defer.parallelMap} recurse.
+        """
+        d = defer.parallelMap(defer.succeed, xrange(10000), 3)
+        self.assertEqual(len(self.resultOf(d)), 10000)
+
+
+    def test_fireOnOneErrback(self):
+        """
+        With C{fireOnOneErrback}, the first failure stops taking items,
+        cancels the calls whose result is awaited and makes the
+        L{defer.Deferred} returned fail with a L{defer.FirstError}.
+        """
+        d = defer.parallelMap(self.call, self.items(10), 3,
+                              fireOnOneErrback=True)
+        self.calls[1].errback(GenericError())
+        error = self.resultOf(d).value
+        self.assertIsInstance(error, defer.FirstError)
+        self.assertEqual(error.index, 1)
+        error.subFailure.trap(GenericError)
+        self.assertEqual(self.taken, [0, 1, 2])
+        self.assertEqual(sorted(self.cancelled), [0, 2])
+
+
+    def test_cancel(self):
+        """
+        Cancelling the L{defer.Deferred} returned stops taking items and
+        cancels the calls whose result is awaited.
+        """
+        d = defer.parallelMap(self.call, self.items(10), 2)
+        self.calls[0].callback(None)
+        d.cancel()
+        self.resultOf(d).trap(defer.CancelledError)
+        self.assertEqual(self.taken, [0, 1, 2])
+        self.assertEqual(sorted(self.cancelled), [1, 2])
+
+
+    def test_consumerError(self):
+        """
+        An exception raised by the consumer stops the mapping and makes the
+        L{defer.Deferred} returned fail with it.
+        """
+        def consumer(index, result):
+            raise GenericError()
+        d = defer.parallelMap(self.call, self.items(10), 2,
+                              consumer=consumer)
+        self.calls[0].callback(None)
+        self.resultOf(d).trap(GenericError)
+        self.assertEqual(self.taken, [0, 1])
+        self.assertEqual(self.cancelled, [1])
+
+
+    def test_iterableError(self):
+        """
+        An exception raised while taking an item makes the
+        L{defer.Deferred} returned fail with it.
+        """
+        def items():
+            yield 0
+            raise GenericError()
+        d = defer.parallelMap(self.call, items(), 2)
+        self.resultOf(d).trap(GenericError)
+        self.assertEqual(self.cancelled, [0])
+
+
+    def test_badConcurrency(self):
+        """
+        A C{concurrency} smaller than 1 is rejected.
+        """
+        self.assertRaises(ValueError, defer.parallelMap, self.call, [], 0)
+
+
+
 class DeferredFilesystemLockTestCase(unittest.TestCase):
     """
     Test the behavior of L{DeferredFilesystemLock}
@@ -271,6 +271,33 @@ class InlineCallbacksTests(BaseDefgenTests, unittest.TestCase):
         return _return().addCallback(self.assertEqual, 6)
 
 
+    def test_yieldFiredDeferred(self):
+        """
+        The result of a L{Deferred} which already has one is taken when it
+        is yielded, failures included, unless the L{Deferred} is paused.
+        """
+        succeeded = defer.succeed('result')
+        failed = defer.fail(TerminalException())
+        paused = defer.succeed('later')
+        paused.pause()
+        results = []
+        def _gen():
+            results.append((yield succeeded))
+            try:
+                yield failed
+            except TerminalException:
+                results.append('failure')
+            results.append((yield paused))
+        _gen = inlineCallbacks(_gen)
+
+        d = _gen()
+        self.assertEqual(results, ['result', 'failure'])
+        self.assertEqual((succeeded.result, failed.result), (None, None))
+        paused.unpause()
+        self.assertEqual(results, ['result', 'failure', 'later'])
+        return d
+
+
     def test_nonGeneratorReturn(self):
         """
         Ensure that C{TypeError} with a message about L{inlineCallbacks} is
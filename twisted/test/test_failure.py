@@ -7,13 +7,16 @@ Test cases for failure module.
 
 import re
 import sys
+import gc
+import weakref
 import StringIO
 import traceback
 import pdb
+import inspect
 
 from twisted.trial import unittest, util
 
-from twisted.python import failure
+from twisted.python import failure, reflect
 
 try:
     from twisted.test import raiser
@@ -294,6 +297,94 @@ class FailureTestCase(unittest.TestCase):
         self.assertEqual(f.getTracebackObject(), None)
 
 
+    def _lazyAndEager(self):
+        """
+        Make a lazy and an eager L{failure.Failure} of the same exception.
+        """
+        self.patch(failure.Failure, 'lazy', True)
+        try:
+            1/0
+        except ZeroDivisionError:
+            lazy = failure.Failure()
+            self.patch(failure.Failure, 'lazy', False)
+            eager = failure.Failure()
+        return lazy, eager
+
+
+    def test_lazyFrames(self):
+        """
+        A lazy L{failure.Failure} extracts its frames from its traceback
+        only when they are used, and they are the frames an eager one has.
+        """
+        lazy, eager = self._lazyAndEager()
+        self.assertNotIn('frames', lazy.__dict__)
+        self.assertEqual(lazy.frames, eager.frames)
+        self.assertIn('frames', lazy.__dict__)
+        self.assertNotIn('_lazyTraceback', lazy.__dict__)
+        self.assertEqual(lazy.getTraceback(), eager.getTraceback())
+
+
+    def test_lazyStack(self):
+        """
+        A lazy L{failure.Failure} only keeps the C{traceupLength} innermost
+        frames of its stack, which are those an eager one shows.
+        """
+        lazy, eager = self._lazyAndEager()
+        self.assertTrue(len(eager.stack) > failure.traceupLength)
+        self.assertEqual(lazy.stack,
+                         eager.stack[-failure.traceupLength:])
+
+
+    def test_lazyClean(self):
+        """
+        Cleaning a lazy L{failure.Failure} keeps its frames.
+        """
+        lazy, eager = self._lazyAndEager()
+        lazy.cleanFailure()
+        eager.cleanFailure()
+        self.assertEqual(lazy.frames, eager.frames)
+        self.assertNotIn('_lazyTraceback', lazy.__dict__)
+
+
+    def test_captureVarsNotLazy(self):
+        """
+        A L{failure.Failure} capturing variables extracts its frames and its
+        whole stack at once.
+        """
+        self.patch(failure.Failure, 'lazy', True)
+        f = getDivisionFailure(captureVars=True)
+        self.assertIn('frames', f.__dict__)
+        self.assertTrue(len(f.stack) > failure.traceupLength)
+
+
+    def test_parents(self):
+        """
+        L{failure.Failure.parents} holds the qualified names of the class of
+        the exception and of its bases, and belongs to its failure.
+        """
+        f = getDivisionFailure()
+        f.parents.append('extra')
+        f = getDivisionFailure()
+        self.assertEqual(
+            f.parents,
+            [reflect.qual(c) for c in inspect.getmro(ZeroDivisionError)])
+
+
+    def test_parentsDoNotKeepClasses(self):
+        """
+        Remembering the qualified names of an exception class does not keep
+        it alive once nothing else refers to it.
+        """
+        class Transient(Exception):
+            pass
+        f = failure.Failure(Transient())
+        self.assertTrue(f.check(Transient))
+        ref = weakref.ref(Transient)
+        del f, Transient
+        gc.collect()
+        self.assertIdentical(ref(), None)
+
+
 
 class BrokenStr(Exception):
     """
@@ -41,6 +41,28 @@ class TestBucket(TestBucketBase):
         fit = b.add(1000)
         self.assertEqual(20, fit)
 
+    def test_frequentDrip(self):
+        """
+        Draining the bucket in steps too small to release a whole token
+        releases tokens at the bucket's rate.
+        """
+        b = SomeBucket()
+        b.add(100)
+        for i in range(1, 11):
+            self.clock.set(i * 0.1)
+            b.drip()
+        self.assertEqual(98, b.content)
+
+    def test_dripEmpty(self):
+        """
+        L{htb.Bucket.drip} returns True only when the bucket is empty.
+        """
+        b = SomeBucket()
+        b.add(4)
+        self.assertFalse(b.drip())
+        self.clock.set(2)
+        self.assertTrue(b.drip())
+
 class TestBucketNesting(TestBucketBase):
     def setUp(self):
         TestBucketBase.setUp(self)
@@ -68,6 +90,39 @@ class TestBucketNesting(TestBucketBase):
         self.assertEqual(10, fit)
 
 
+class TestFilter(TestBucketBase):
+    def test_sweepEmpty(self):
+        """
+        L{htb.HierarchicalBucketFilter.sweep} discards unused empty buckets
+        and keeps the others.
+        """
+        class ByName(htb.HierarchicalBucketFilter):
+            bucketFactory = SomeBucket
+            def getBucketKey(self, name):
+                return name
+        f = ByName()
+        f.getBucketFor("a").add(2)
+        f.getBucketFor("b").add(10)
+        self.clock.set(1)
+        f.sweep()
+        self.assertEqual(["b"], f.buckets.keys())
+
+    def test_makeBucket(self):
+        """
+        L{htb.HierarchicalBucketFilter.getBucketFor} creates missing buckets
+        with L{htb.HierarchicalBucketFilter.makeBucket}.
+        """
+        made = []
+        class Recording(htb.HierarchicalBucketFilter):
+            def makeBucket(self, key, parentBucket):
+                made.append((key, parentBucket))
+                return SomeBucket(parentBucket)
+        f = Recording()
+        bucket = f.getBucketFor()
+        self.assertIdentical(bucket, f.getBucketFor())
+        self.assertEqual([(None, None)], made)
+
+
 # TODO: Test the Transport stuff?
 
 from test_pcp import DummyConsumer
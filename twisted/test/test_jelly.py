@@ -5,6 +5,9 @@
 Test cases for L{jelly} object serialization.
 """
 
+import sys
+import gc
+import weakref
 import datetime
 
 try:
@@ -446,6 +449,71 @@ class JellyTestCase(unittest.TestCase):
         self.assertIdentical(z[0][0][0], z)
 
 
+    def test_deepNesting(self):
+        """
+        Builtin containers nested more deeply than the recursion limit can be
+        jellied and unjellied.
+        """
+        depth = sys.getrecursionlimit() * 2
+        inner = outer = [1]
+        for i in xrange(depth):
+            if i % 4 == 0:
+                inner = (inner, 'x')
+            elif i % 4 == 1:
+                inner = {'key': inner}
+            else:
+                inner = [inner]
+        sexp = jelly.jelly(inner)
+        result = jelly.unjelly(sexp)
+        for i in xrange(depth - 1, -1, -1):
+            if i % 4 == 0:
+                self.assertIsInstance(result, tuple)
+                self.assertEqual(result[1], 'x')
+                result = result[0]
+            elif i % 4 == 1:
+                self.assertEqual(result.keys(), ['key'])
+                result = result['key']
+            else:
+                self.assertIsInstance(result, list)
+                result = result[0]
+        self.assertEqual(result, outer)
+
+
+    def test_deepCycle(self):
+        """
+        A cycle through builtin containers longer than the recursion limit
+        keeps its identity when jellied and unjellied.
+        """
+        depth = sys.getrecursionlimit() * 2
+        top = []
+        inner = top
+        for i in xrange(depth):
+            inner.append([])
+            inner = inner[0]
+        inner.append(top)
+        result = jelly.unjelly(jelly.jelly(top))
+        inner = result
+        for i in xrange(depth):
+            inner = inner[0]
+        self.assertIdentical(inner[0], result)
+
+
+    def test_dictionaryReferences(self):
+        """
+        A dictionary which contains itself, as a value and inside a tuple used
+        as a key, keeps its identity when jellied and unjellied.
+        """
+        d = {}
+        d['self'] = d
+        d[(1, 'self')] = 'a value'
+        shared = [d]
+        z = jelly.unjelly(jelly.jelly((shared, shared, d)))
+        self.assertIdentical(z[0], z[1])
+        self.assertIdentical(z[0][0], z[2])
+        self.assertIdentical(z[2]['self'], z[2])
+        self.assertEqual(z[2][(1, 'self')], 'a value')
+
+
     def test_typeSecurity(self):
         """
         Test for type-level security of serialization.
@@ -461,6 +529,21 @@ class JellyTestCase(unittest.TestCase):
         self.assertIdentical(D, uj)
 
 
+    def test_qualCacheDoesNotKeepClasses(self):
+        """
+        Jellying an instance of a class does not keep the class alive once
+        nothing else refers to it.
+        """
+        class Transient(object):
+            pass
+        jelly.jelly(Transient())
+        self.assertIn(Transient, jelly._qualCache)
+        ref = weakref.ref(Transient)
+        del Transient
+        gc.collect()
+        self.assertIdentical(ref(), None)
+
+
     def test_lotsaTypes(self):
         """
         Test for all types currently supported in jelly
@@ -330,6 +330,60 @@ class LogPublisherTestCase(LogPublisherTestCaseMixin, unittest.TestCase):
 
 
 
+class FilterTestCase(unittest.TestCase):
+    """
+    Tests for L{log.LogPublisher.addFilter} and L{log.LevelFilter}.
+    """
+    def setUp(self):
+        self.events = []
+        self.lp = log.LogPublisher()
+        self.lp.addObserver(self.events.append)
+
+
+    def test_levelAndNamespace(self):
+        """
+        Filters are called with the level and namespace of each message,
+        before the observers.
+        """
+        seen = []
+        def predicate(level, namespace):
+            seen.append((level, namespace))
+            return namespace != 'discarded'
+        self.lp.addFilter(predicate)
+        self.lp.msg('info')
+        self.lp.msg('debug', logLevel=logging.DEBUG, namespace='app')
+        self.lp.msg(isError=1, why='error', system='worker')
+        log.callWithContext({'system': 'discarded'}, self.lp.msg, 'gone')
+        self.assertEqual(seen, [(logging.INFO, '-'), (logging.DEBUG, 'app'),
+                                (logging.ERROR, 'worker'),
+                                (logging.INFO, 'discarded')])
+        self.assertEqual([e['message'] for e in self.events],
+                         [('info',), ('debug',), ()])
+        self.lp.removeFilter(predicate)
+        self.lp.msg('no filter', system='discarded')
+        self.assertEqual(len(self.events), 4)
+
+
+    def test_levelFilter(self):
+        """
+        L{log.LevelFilter} discards messages less important than the level
+        set for their namespace, or its closest parent with one.
+        """
+        levels = log.LevelFilter(logging.WARNING, {'app': logging.INFO})
+        levels.setLevel('app.db', logging.DEBUG)
+        self.lp.addFilter(levels)
+        self.lp.msg('1', namespace='other')
+        self.lp.msg('2', namespace='other', logLevel=logging.WARNING)
+        self.lp.msg('3', namespace='app.web')
+        self.lp.msg('4', namespace='app.web', logLevel=logging.DEBUG)
+        self.lp.msg('5', namespace='app.db.pool', logLevel=logging.DEBUG)
+        self.lp.msg('6', namespace='application')
+        self.lp.msg('7', system=[EvilRepr()], logLevel=logging.ERROR)
+        self.assertEqual([e['message'] for e in self.events],
+                         [('2',), ('3',), ('5',), ('7',)])
+
+
+
 class FileObserverTestCase(LogPublisherTestCaseMixin, unittest.TestCase):
     def test_getTimezoneOffset(self):
         """
@@ -542,6 +596,142 @@ class FileObserverTestCase(LogPublisherTestCaseMixin, unittest.TestCase):
         self.assertIdentical(sys.stdout, fakeStdout)
 
 
+class FakeTriggerReactor(object):
+    """
+    Just enough of a reactor to register system event triggers with.
+    """
+    def __init__(self):
+        self.triggers = {}
+
+    def addSystemEventTrigger(self, phase, eventType, f):
+        self.triggers[len(self.triggers)] = (phase, eventType, f)
+        return len(self.triggers) - 1
+
+    def removeSystemEventTrigger(self, triggerID):
+        del self.triggers[triggerID]
+
+
+
+class BufferedLogObserverTestCase(unittest.TestCase):
+    """
+    Tests for L{log.BufferedLogObserver}.
+    """
+    def setUp(self):
+        self.out = FakeFile()
+        self.reactor = FakeTriggerReactor()
+
+
+    def observe(self, **kw):
+        observer = log.BufferedLogObserver(
+            self.out, reactor=self.reactor, **kw)
+        def stop():
+            if observer._thread is not None:
+                observer.stop()
+        self.addCleanup(stop)
+        return observer
+
+
+    def event(self, text, when=1000000000.0):
+        return {'message': (text,), 'isError': 0, 'system': 'test',
+                'time': when}
+
+
+    def written(self):
+        return ''.join(self.out).splitlines()
+
+
+    def test_written(self):
+        """
+        Events logged while the observer is started are formatted as
+        L{log.FileLogObserver} formats them and written by the time it is
+        stopped.
+        """
+        observer = self.observe()
+        observer.start()
+        log.msg("first", system="buffered")
+        log.msg("second", system="buffered")
+        observer.stop()
+        lines = [line for line in self.written() if '[buffered]' in line]
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(' [buffered] first'), lines[0])
+        self.assertTrue(lines[1].endswith(' [buffered] second'), lines[1])
+        self.assertNotIn(observer.emit, log.theLogPublisher.observers)
+
+
+    def test_dropWhenFull(self):
+        """
+        Events which do not fit in the buffer are dropped and counted.
+        """
+        observer = self.observe(bufferSize=2)
+        for text in 'one', 'two', 'three':
+            observer.emit(self.event(text))
+        self.assertEqual(observer.dropped, 1)
+        observer.start()
+        observer.stop()
+        self.assertEqual(
+            [line.split('] ')[1] for line in self.written()], ['one', 'two'])
+
+
+    def test_blockWhenFull(self):
+        """
+        With C{block} set, logging waits for room in the buffer rather than
+        drop events.
+        """
+        observer = self.observe(bufferSize=1, block=True)
+        observer.start()
+        for i in range(50):
+            observer.emit(self.event(str(i)))
+        observer.stop()
+        self.assertEqual(observer.dropped, 0)
+        self.assertEqual(
+            [line.split('] ')[1] for line in self.written()],
+            [str(i) for i in range(50)])
+
+
+    def test_stopOnShutdown(self):
+        """
+        The observer stops, after writing the events queued, when the
+        reactor shuts down.
+        """
+        observer = self.observe()
+        observer.start()
+        [(phase, eventType, trigger)] = self.reactor.triggers.values()
+        self.assertEqual((phase, eventType), ('after', 'shutdown'))
+        observer.emit(self.event('last words'))
+        trigger()
+        self.assertIdentical(observer._thread, None)
+        self.assertNotIn(observer.emit, log.theLogPublisher.observers)
+        self.assertEqual(self.written()[-1].split('] ')[1], 'last words')
+
+
+    def test_stopRemovesTrigger(self):
+        """
+        Stopping the observer removes its shutdown trigger.
+        """
+        observer = self.observe()
+        observer.start()
+        observer.stop()
+        self.assertEqual(self.reactor.triggers, {})
+
+
+    def test_timestampCached(self):
+        """
+        The timestamp is formatted once for all the events in the same
+        second.
+        """
+        observer = self.observe()
+        offsets = []
+        def getTimezoneOffset(when):
+            offsets.append(when)
+            return 0
+        observer.getTimezoneOffset = getTimezoneOffset
+        first = observer.formatTime(1000000000.25)
+        self.assertEqual(observer.formatTime(1000000000.75), first)
+        self.assertNotEqual(observer.formatTime(1000000001.0), first)
+        self.assertEqual(offsets, [1000000000, 1000000001])
+
+
+
 class PythonLoggingObserverTestCase(unittest.TestCase):
     """
     Test the bridge with python logging module.
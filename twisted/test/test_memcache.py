@@ -5,13 +5,19 @@
 Test the memcache client protocol.
 """
 
+import gc
+import struct
+
 from twisted.internet.error import ConnectionDone
 
 from twisted.protocols.memcache import MemCacheProtocol, NoSuchCommand
 from twisted.protocols.memcache import ClientError, ServerError
+from twisted.protocols.memcache import HashRing, MemCachePool, NearCache
+from twisted.protocols.memcache import MemCacheBinaryProtocol
 
 from twisted.trial.unittest import TestCase
 from twisted.test.proto_helpers import StringTransportWithDisconnection
+from twisted.test.proto_helpers import MemoryReactor
 from twisted.internet.task import Clock
 from twisted.internet.defer import Deferred, gatherResults, TimeoutError
 from twisted.internet.defer import DeferredList
@@ -661,3 +667,675 @@ class CommandFailureTests(CommandMixin, TestCase):
         parameters except C{d} are ignored.
         """
         return self.assertFailure(d, RuntimeError)
+
+
+
+def binaryPacket(magic, opcode, opaque, key="", extras="", value="",
+                 status=0, cas=0):
+    """
+    Encode a binary protocol packet.
+    """
+    return struct.pack(
+        "!BBHBBHLLQ", magic, opcode, len(key), len(extras), 0, status,
+        len(extras) + len(key) + len(value), opaque, cas) + (
+        extras + key + value)
+
+
+
+def binaryRequest(opcode, opaque, key="", extras="", value="", cas=0):
+    return binaryPacket(0x80, opcode, opaque, key, extras, value, cas=cas)
+
+
+
+def binaryResponse(opcode, opaque, key="", extras="", value="", status=0,
+                   cas=0):
+    return binaryPacket(0x81, opcode, opaque, key, extras, value, status, cas)
+
+
+
+class MemCacheBinaryTests(TestCase):
+    """
+    Tests for L{MemCacheBinaryProtocol}.
+    """
+
+    def setUp(self):
+        self.proto = MemCacheBinaryProtocol()
+        self.clock = Clock()
+        self.proto.callLater = self.clock.callLater
+        self.transport = StringTransportWithDisconnection()
+        self.transport.protocol = self.proto
+        self.proto.makeConnection(self.transport)
+
+
+    def _test(self, d, send, recv, result):
+        """
+        Check that the command sends C{send}, and that upon reception of
+        C{recv} its result is C{result}.
+        """
+        self.assertEqual(self.transport.value(), send)
+        results = []
+        d.addCallback(results.append)
+        self.proto.dataReceived(recv)
+        self.assertEqual(results, [result])
+        self.assertEqual(self.proto._current, {})
+
+
+    def test_get(self):
+        """
+        L{MemCacheBinaryProtocol.get} sends a I{get} request and returns the
+        flags and value of the response matching its opaque identifier.
+        """
+        self._test(
+            self.proto.get("foo"), binaryRequest(0x00, 1, "foo"),
+            binaryResponse(0x00, 1, extras=struct.pack("!L", 3),
+                           value="bar"),
+            (3, "bar"))
+
+
+    def test_getMiss(self):
+        """
+        A missing key gives C{(0, None)}, or C{(0, "", None)} with
+        identifiers, like L{MemCacheProtocol}.
+        """
+        self._test(self.proto.get("foo"), binaryRequest(0x00, 1, "foo"),
+                   binaryResponse(0x00, 1, value="Not found", status=1),
+                   (0, None))
+        self.transport.clear()
+        self._test(self.proto.get("foo", True),
+                   binaryRequest(0x00, 2, "foo"),
+                   binaryResponse(0x00, 2, value="Not found", status=1),
+                   (0, "", None))
+
+
+    def test_getWithIdentifier(self):
+        """
+        The I{cas} value of a response is given as a decimal string, and
+        L{MemCacheBinaryProtocol.checkAndSet} sends it back.
+        """
+        self._test(
+            self.proto.get("foo", True), binaryRequest(0x00, 1, "foo"),
+            binaryResponse(0x00, 1, extras=struct.pack("!L", 0),
+                           value="bar", cas=1234),
+            (0, "1234", "bar"))
+        self.transport.clear()
+        self._test(
+            self.proto.checkAndSet("foo", "baz", "1234"),
+            binaryRequest(0x01, 2, "foo", struct.pack("!LL", 0, 0), "baz",
+                          cas=1234),
+            binaryResponse(0x01, 2, status=2), False)
+
+
+    def test_getMultiple(self):
+        """
+        L{MemCacheBinaryProtocol.getMultiple} writes a quiet I{getkq}
+        request per key and a I{noop} at once; the keys the server does not
+        answer before the I{noop} are missing.
+        """
+        d = self.proto.getMultiple(["foo", "cow", "bar"])
+        self._test(
+            d,
+            binaryRequest(0x0d, 1, "foo") + binaryRequest(0x0d, 2, "cow")
+            + binaryRequest(0x0d, 3, "bar") + binaryRequest(0x0a, 4),
+            binaryResponse(0x0d, 2, "cow", struct.pack("!L", 1), "moo")
+            + binaryResponse(0x0d, 3, "bar", struct.pack("!L", 0), "baz")
+            + binaryResponse(0x0a, 4),
+            {"foo": (0, None), "cow": (1, "moo"), "bar": (0, "baz")})
+
+
+    def test_store(self):
+        """
+        Storage commands send their flags and expiry as extras and succeed
+        with C{True}, or C{False} if the server did not store the value.
+        """
+        self._test(
+            self.proto.set("foo", "bar", 2, 10),
+            binaryRequest(0x01, 1, "foo", struct.pack("!LL", 2, 10), "bar"),
+            binaryResponse(0x01, 1), True)
+        self.transport.clear()
+        self._test(
+            self.proto.add("foo", "bar"),
+            binaryRequest(0x02, 2, "foo", struct.pack("!LL", 0, 0), "bar"),
+            binaryResponse(0x02, 2, status=2), False)
+        self.transport.clear()
+        self._test(
+            self.proto.append("foo", "bar"),
+            binaryRequest(0x0e, 3, "foo", "", "bar"),
+            binaryResponse(0x0e, 3, status=5), False)
+
+
+    def test_increment(self):
+        """
+        L{MemCacheBinaryProtocol.increment} returns the new value, or
+        C{False} if the key does not exist.
+        """
+        extras = struct.pack("!QQL", 4, 0, 0xffffffff)
+        self._test(
+            self.proto.increment("foo", 4),
+            binaryRequest(0x05, 1, "foo", extras),
+            binaryResponse(0x05, 1, value=struct.pack("!Q", 7)), 7)
+        self.transport.clear()
+        self._test(
+            self.proto.decrement("foo", 4),
+            binaryRequest(0x06, 2, "foo", extras),
+            binaryResponse(0x06, 2, status=1), False)
+
+
+    def test_stats(self):
+        """
+        L{MemCacheBinaryProtocol.stats} collects the I{stat} responses until
+        the one without a key.
+        """
+        self._test(
+            self.proto.stats(), binaryRequest(0x10, 1),
+            binaryResponse(0x10, 1, "pid", value="42")
+            + binaryResponse(0x10, 1, "uptime", value="7")
+            + binaryResponse(0x10, 1),
+            {"pid": "42", "uptime": "7"})
+
+
+    def test_outOfOrder(self):
+        """
+        Responses are matched to requests by opaque identifier, not order,
+        and may arrive in pieces.
+        """
+        first = self.proto.delete("foo")
+        second = self.proto.version()
+        results = []
+        first.addCallback(results.append)
+        second.addCallback(results.append)
+        data = binaryResponse(0x0b, 2, value="1.4.5") + binaryResponse(
+            0x04, 1)
+        for i in range(len(data)):
+            self.proto.dataReceived(data[i])
+        self.assertEqual(results, ["1.4.5", True])
+
+
+    def test_errors(self):
+        """
+        Error statuses fail the command with L{NoSuchCommand},
+        L{ClientError} or L{ServerError}.
+        """
+        first = self.proto.get("foo")
+        second = self.proto.set("foo", "x" * 10)
+        third = self.proto.delete("foo")
+        self.proto.dataReceived(
+            binaryResponse(0x00, 1, status=0x81)
+            + binaryResponse(0x01, 2, value="Too large.", status=3)
+            + binaryResponse(0x04, 3, value="Out of memory", status=0x82))
+        self.flushLoggedErrors()
+        return gatherResults([
+            self.assertFailure(first, NoSuchCommand),
+            self.assertFailure(second, ClientError),
+            self.assertFailure(third, ServerError)])
+
+
+    def test_timeOut(self):
+        """
+        The commands waiting when the connection times out fail with
+        L{TimeoutError}, and the connection is closed.
+        """
+        d = self.proto.getMultiple(["foo", "bar"])
+        self.clock.advance(self.proto.persistentTimeOut)
+        self.assertFalse(self.transport.connected)
+        return self.assertFailure(d, TimeoutError)
+
+
+    def test_connectionLost(self):
+        """
+        Losing the connection fails the waiting commands, and later commands
+        fail with C{RuntimeError}.
+        """
+        d = self.proto.get("foo")
+        self.transport.loseConnection()
+        self.assertFailure(d, ConnectionDone)
+        return self.assertFailure(self.proto.get("foo"), RuntimeError)
+
+
+    def test_invalidKey(self):
+        """
+        Keys which are not strings or are too long are refused.
+        """
+        return gatherResults([
+            self.assertFailure(self.proto.get(u"foo"), ClientError),
+            self.assertFailure(self.proto.getMultiple(["a" * 251]),
+                               ClientError)])
+
+
+
+class HashRingTests(TestCase):
+    """
+    Tests for L{HashRing}.
+    """
+
+    def test_empty(self):
+        """
+        An empty ring has no node for any key.
+        """
+        self.assertIdentical(HashRing().nodeFor("foo"), None)
+
+
+    def test_spread(self):
+        """
+        Keys are spread over every node.
+        """
+        nodes = ["10.0.0.%d:11211" % (i,) for i in range(4)]
+        ring = HashRing(nodes)
+        counts = dict([(node, 0) for node in nodes])
+        for i in range(4000):
+            counts[ring.nodeFor("key%d" % (i,))] += 1
+        for count in counts.values():
+            self.assertTrue(500 < count < 1500, counts)
+
+
+    def test_minimalRemapping(self):
+        """
+        Removing a node only moves the keys which were on that node.
+        """
+        nodes = ["10.0.0.%d:11211" % (i,) for i in range(4)]
+        ring = HashRing(nodes)
+        keys = ["key%d" % (i,) for i in range(1000)]
+        before = dict([(key, ring.nodeFor(key)) for key in keys])
+        ring.remove(nodes[0])
+        self.assertNotIn(nodes[0], ring)
+        for key in keys:
+            if before[key] != nodes[0]:
+                self.assertEqual(ring.nodeFor(key), before[key])
+            else:
+                self.assertNotEqual(ring.nodeFor(key), nodes[0])
+        ring.add(nodes[0])
+        self.assertEqual(dict([(key, ring.nodeFor(key)) for key in keys]),
+                         before)
+
+
+
+class ClockMemoryReactor(MemoryReactor, Clock):
+    """
+    A L{MemoryReactor} which is also a L{Clock}.
+    """
+    def __init__(self):
+        MemoryReactor.__init__(self)
+        Clock.__init__(self)
+
+
+
+class FakeConnector(object):
+    """
+    A connector which counts its connection attempts.
+    """
+    attempts = 0
+
+    def connect(self):
+        self.attempts += 1
+
+
+
+class MemCachePoolTests(TestCase):
+    """
+    Tests for L{MemCachePool}.
+    """
+
+    def setUp(self):
+        self.reactor = ClockMemoryReactor()
+        self.pool = MemCachePool(["cache1", "cache2:11212"],
+                                 connectionsPerServer=2, reactor=self.reactor)
+        self.started = self.pool.start()
+
+
+    def connect(self, index):
+        """
+        Complete the connection attempt at C{index} in the reactor's
+        C{tcpClients} and return the protocol and its transport.
+        """
+        factory = self.reactor.tcpClients[index][2]
+        proto = factory.buildProtocol(None)
+        transport = StringTransportWithDisconnection()
+        transport.protocol = proto
+        proto.makeConnection(transport)
+        return proto, transport
+
+
+    def connectAll(self):
+        protocols = {}
+        for i, client in enumerate(self.reactor.tcpClients):
+            proto, transport = self.connect(i)
+            protocols.setdefault(client[0], []).append((proto, transport))
+        self.reactor.advance(0)
+        return protocols
+
+
+    def test_connections(self):
+        """
+        L{MemCachePool.start} opens C{connectionsPerServer} connections to
+        each server, and fires once they are made.
+        """
+        self.assertEqual(
+            sorted([(host, port) for (host, port, f, t, b)
+                    in self.reactor.tcpClients]),
+            [("cache1", 11211), ("cache1", 11211),
+             ("cache2", 11212), ("cache2", 11212)])
+        fired = []
+        self.started.addCallback(fired.append)
+        self.connectAll()
+        self.assertEqual(fired, [self.pool])
+        self.assertIn("cache1:11211", self.pool.ring)
+        self.assertIn("cache2:11212", self.pool.ring)
+
+
+    def test_keyRouting(self):
+        """
+        Commands for a key are sent to the server the ring places it on, on
+        its least busy connection.
+        """
+        protocols = self.connectAll()
+        name = self.pool.ring.nodeFor("foo")
+        host = name.split(":")[0]
+        (first, t1), (second, t2) = protocols[host]
+        d1 = self.pool.get("foo")
+        d2 = self.pool.get("foo")
+        self.assertEqual(t1.value(), "get foo\r\n")
+        self.assertEqual(t2.value(), "get foo\r\n")
+        first.dataReceived("END\r\n")
+        second.dataReceived("END\r\n")
+        return gatherResults([d1, d2])
+
+
+    def test_getMultiple(self):
+        """
+        L{MemCachePool.getMultiple} sends one request to each server holding
+        some of the keys and merges their results.
+        """
+        protocols = self.connectAll()
+        keys = ["key%d" % (i,) for i in range(10)]
+        d = self.pool.getMultiple(keys)
+        expected = {}
+        for host, connections in protocols.items():
+            for proto, transport in connections:
+                request = transport.value()
+                if not request:
+                    continue
+                requested = request.split()[1:]
+                for key in requested:
+                    self.assertEqual(
+                        self.pool.ring.nodeFor(key).split(":")[0], host)
+                    expected[key] = (0, key + "-value")
+                proto.dataReceived("".join([
+                    "VALUE %s 0 %d\r\n%s-value\r\n" % (key, len(key) + 6, key)
+                    for key in requested]) + "END\r\n")
+        self.assertEqual(sorted(expected), sorted(keys))
+        d.addCallback(self.assertEqual, expected)
+        return d
+
+
+    def test_getMultipleServerError(self):
+        """
+        If servers fail their part of a L{MemCachePool.getMultiple}, it fails
+        with the original error of the first, and the others are not logged
+        as unhandled.
+        """
+        protocols = self.connectAll()
+        keys = ["key%d" % (i,) for i in range(10)]
+        d = self.pool.getMultiple(keys)
+        for connections in protocols.values():
+            for proto, transport in connections:
+                if transport.value():
+                    proto.dataReceived("SERVER_ERROR out of memory\r\n")
+        gc.collect()
+        self.assertEqual(self.flushLoggedErrors(ServerError), [])
+        return self.assertFailure(d, ServerError)
+
+
+    def test_noServer(self):
+        """
+        Commands fail with L{ServerError} while no server is connected.
+        """
+        return self.assertFailure(self.pool.get("foo"), ServerError)
+
+
+    def test_deadServer(self):
+        """
+        A server whose connections are all lost is taken off the ring, and
+        its connections are retried with exponential backoff.
+        """
+        protocols = self.connectAll()
+        connectors = []
+        for proto, transport in protocols["cache1"]:
+            connector = FakeConnector()
+            connectors.append(connector)
+            transport.loseConnection()
+            proto.factory.clientConnectionLost(connector, None)
+        self.assertNotIn("cache1:11211", self.pool.ring)
+        self.assertEqual(self.pool.ring.nodeFor("foo"), "cache2:11212")
+        self.reactor.advance(self.pool.retryDelay)
+        self.assertEqual([c.attempts for c in connectors], [1, 1])
+        factory = protocols["cache1"][0][0].factory
+        factory.clientConnectionFailed(connectors[0], None)
+        self.reactor.advance(self.pool.retryDelay)
+        self.assertEqual(connectors[0].attempts, 1)
+        self.reactor.advance(self.pool.retryDelay)
+        self.assertEqual(connectors[0].attempts, 2)
+
+
+    def test_stop(self):
+        """
+        L{MemCachePool.stop} closes every connection and does not reconnect.
+        """
+        protocols = self.connectAll()
+        self.pool.stop()
+        for connections in protocols.values():
+            for proto, transport in connections:
+                self.assertFalse(transport.connected)
+                proto.factory.clientConnectionLost(FakeConnector(), None)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+
+
+class FakeMemCacheClient(object):
+    """
+    A memcache client whose requests are answered by the test.
+
+    @ivar requests: A C{list} of C{(method, args, deferred)} tuples.
+    """
+    def __init__(self):
+        self.requests = []
+
+
+    def _request(self, method, *args):
+        d = Deferred()
+        self.requests.append((method, args, d))
+        return d
+
+
+    def get(self, *args):
+        return self._request("get", *args)
+
+
+    def getMultiple(self, *args):
+        return self._request("getMultiple", *args)
+
+
+    def set(self, *args):
+        return self._request("set", *args)
+
+
+    def delete(self, *args):
+        return self._request("delete", *args)
+
+
+    def increment(self, *args):
+        return self._request("increment", *args)
+
+
+
+class NearCacheTests(TestCase):
+    """
+    Tests for L{NearCache}.
+    """
+
+    def setUp(self):
+        self.clock = Clock()
+        self.client = FakeMemCacheClient()
+        self.cache = NearCache(self.client, maxEntries=2, timeToLive=10,
+                               reactor=self.clock)
+
+
+    def answer(self, result, index=-1):
+        self.client.requests[index][2].callback(result)
+
+
+    def results(self, d):
+        results = []
+        d.addCallback(results.append)
+        return results
+
+
+    def test_hit(self):
+        """
+        A value fetched by L{NearCache.get} is returned without asking the
+        client again until C{timeToLive} seconds have passed.
+        """
+        first = self.results(self.cache.get("foo"))
+        self.answer((0, "bar"))
+        second = self.results(self.cache.get("foo"))
+        self.assertEqual(first + second, [(0, "bar"), (0, "bar")])
+        self.assertEqual(len(self.client.requests), 1)
+        self.clock.advance(10)
+        self.cache.get("foo")
+        self.assertEqual(len(self.client.requests), 2)
+        self.assertEqual(
+            (self.cache.hits, self.cache.misses), (1, 2))
+
+
+    def test_coalescing(self):
+        """
+        Concurrent misses on the same key share one request.
+        """
+        first = self.results(self.cache.get("foo"))
+        second = self.results(self.cache.get("foo"))
+        self.assertEqual(len(self.client.requests), 1)
+        self.answer((0, "bar"))
+        self.assertEqual(first + second, [(0, "bar"), (0, "bar")])
+        self.assertEqual(self.cache.coalesced, 1)
+
+
+    def test_failureNotCached(self):
+        """
+        A failed request fails every waiter and is not kept.
+        """
+        d = self.cache.get("foo")
+        self.client.requests[0][2].errback(ServerError("down"))
+        self.cache.get("foo")
+        self.assertEqual(len(self.client.requests), 2)
+        return self.assertFailure(d, ServerError)
+
+
+    def test_staleWhileRevalidate(self):
+        """
+        Within C{staleTime} seconds after expiring, the old value is
+        returned while a new one is fetched.
+        """
+        self.cache.staleTime = 5
+        self.cache.get("foo")
+        self.answer((0, "old"))
+        self.clock.advance(12)
+        self.assertEqual(self.results(self.cache.get("foo")), [(0, "old")])
+        self.assertEqual(len(self.client.requests), 2)
+        self.cache.get("foo")
+        self.assertEqual(len(self.client.requests), 2)
+        self.answer((0, "new"))
+        self.assertEqual(self.results(self.cache.get("foo")), [(0, "new")])
+        self.assertEqual(self.cache.staleHits, 2)
+
+
+    def test_lru(self):
+        """
+        Beyond C{maxEntries} values, the least recently used is evicted.
+        """
+        for key in "a", "b":
+            self.cache.get(key)
+            self.answer((0, key))
+        self.cache.get("a")
+        self.cache.get("c")
+        self.answer((0, "c"))
+        self.assertEqual(sorted(self.cache._entries), ["a", "c"])
+        self.assertEqual(self.cache.evictions, 1)
+
+
+    def test_setWritesThrough(self):
+        """
+        A successful L{NearCache.set} keeps the value it stored.
+        """
+        self.cache.set("foo", "bar", 3)
+        self.answer(True)
+        self.assertEqual(self.results(self.cache.get("foo")), [(3, "bar")])
+        self.assertEqual(len(self.client.requests), 1)
+
+
+    def test_invalidation(self):
+        """
+        L{NearCache.delete} and L{NearCache.increment} drop the local copy,
+        and a request in progress when they are called does not store its
+        result.
+        """
+        self.cache.get("foo")
+        self.answer((0, "bar"))
+        self.cache.delete("foo")
+        self.cache.get("foo")
+        self.assertEqual(len(self.client.requests), 3)
+        self.cache.increment("foo")
+        self.answer((0, "stale"), 2)
+        self.cache.get("foo")
+        self.assertEqual(len(self.client.requests), 5)
+
+
+    def test_getMultiple(self):
+        """
+        L{NearCache.getMultiple} asks the client only for keys without a
+        fresh local copy, and keeps what it receives.
+        """
+        self.cache.get("a")
+        self.answer((0, "A"))
+        result = self.results(self.cache.getMultiple(["a", "b"]))
+        self.assertEqual(self.client.requests[-1][:2],
+                         ("getMultiple", (["b"],)))
+        self.answer({"b": (0, "B")})
+        self.assertEqual(result, [{"a": (0, "A"), "b": (0, "B")}])
+        self.assertEqual(self.results(self.cache.get("b")), [(0, "B")])
+
+
+    def test_getMultipleThenDelete(self):
+        """
+        A value received by L{NearCache.getMultiple} after the key was
+        deleted is returned but not kept.
+        """
+        result = self.results(self.cache.getMultiple(["foo"]))
+        self.cache.delete("foo")
+        self.answer(True)
+        self.answer({"foo": (0, "stale")}, 0)
+        self.assertEqual(result, [{"foo": (0, "stale")}])
+        self.assertNotIn("foo", self.cache._entries)
+        self.assertEqual(self.cache._generations, {})
+
+
+    def test_setThenDelete(self):
+        """
+        A value stored by L{NearCache.set} is not kept if the key was
+        deleted before the store succeeded.
+        """
+        self.cache.set("foo", "bar")
+        self.cache.delete("foo")
+        self.answer(True)
+        self.answer(True, 0)
+        self.assertNotIn("foo", self.cache._entries)
+        self.cache.get("foo")
+        self.assertEqual(self.client.requests[-1][:2], ("get", ("foo",)))
+        self.assertEqual(self.cache._generations, {})
+
+
+    def test_failedStoreForgotten(self):
+        """
+        A failed store leaves no generation behind for its key.
+        """
+        d = self.cache.set("foo", "bar")
+        self.client.requests[0][2].errback(ServerError("down"))
+        self.assertEqual(self.cache._generations, {})
+        return self.assertFailure(d, ServerError)
@@ -1135,6 +1135,8 @@ class PosixProcessBase:
         p = TrivialProcessProtocol(d)
         def buggyexecvpe(command, args, environment):
             raise RuntimeError("Ouch")
+        # Only processes started with fork() call os.execvpe.
+        self.patch(process.Process, "usePosixSpawn", False)
         oldexecvpe = os.execvpe
         os.execvpe = buggyexecvpe
         try:
@@ -1606,6 +1608,7 @@ class MockProcessTestCase(unittest.TestCase):
         self.patch(process.Process, "processReaderFactory", DumbProcessReader)
         self.patch(process.Process, "processWriterFactory", DumbProcessWriter)
         self.patch(process, "pty", self.mockos)
+        self.patch(process.Process, "usePosixSpawn", False)
 
         self.mocksig = MockSignal()
         self.patch(process, "signal", self.mocksig)
@@ -2462,6 +2465,123 @@ class ClosingPipes(unittest.TestCase):
         return d
 
 
+class PosixSpawnTests(unittest.TestCase):
+    """
+    Tests for processes started with posix_spawn().
+    """
+    if process is None or process._posixspawn is None:
+        skip = "posix_spawn() is not available"
+
+    program = "\n".join([
+        "import os",
+        "fds = sorted([int(fd) for fd in os.listdir('/proc/self/fd')])",
+        "os.write(3, '%r %s %s' % (fds, os.getcwd(), os.environ['KEY']))"])
+
+    def setUp(self):
+        def fork(*args, **kwargs):
+            raise RuntimeError("Process started with fork()")
+        self.patch(process.Process, '_fork', fork)
+        # A descriptor the child must not inherit.
+        r, w = os.pipe()
+        self.addCleanup(os.close, r)
+        self.addCleanup(os.close, w)
+
+
+    def spawn(self, **kw):
+        """
+        Run L{program} with its descriptor 3 connected to a pipe and return
+        a L{defer.Deferred} firing with what it writes there.
+        """
+        d = defer.Deferred()
+        class Protocol(protocol.ProcessProtocol):
+            output = ''
+            def childDataReceived(self, childFD, data):
+                if childFD == 3:
+                    self.output += data
+            def processEnded(self, reason):
+                reason.trap(error.ProcessDone)
+                d.callback(self.output)
+        reactor.spawnProcess(
+            Protocol(), sys.executable, [sys.executable, '-c', self.program],
+            env={'KEY': 'value'}, childFDs={0: 'w', 1: 'r', 2: 'r', 3: 'r'},
+            **kw)
+        return d
+
+
+    def test_spawn(self):
+        """
+        A process started with posix_spawn() has the descriptors and the
+        environment it was given, and no other descriptor open (4 is the
+        one listing them).
+        """
+        d = self.spawn()
+        d.addCallback(self.assertEqual,
+                      '[0, 1, 2, 3, 4] %s value' % (os.getcwd(),))
+        return d
+
+
+    def test_withoutCloseFrom(self):
+        """
+        When the C library cannot close descriptors in bulk, the descriptors
+        open in the parent are closed one by one.
+        """
+        self.patch(process._posixspawn, 'canCloseFrom', False)
+        return self.test_spawn()
+
+
+    def test_path(self):
+        """
+        A process started with posix_spawn() runs in the directory given.
+        """
+        if not process._posixspawn.canChdir:
+            raise unittest.SkipTest("posix_spawn() cannot change directory")
+        path = os.path.realpath(self.mktemp())
+        os.mkdir(path)
+        d = self.spawn(path=path)
+        d.addCallback(self.assertEqual, '[0, 1, 2, 3, 4] %s value' % (path,))
+        return d
+
+
+    def test_canSpawn(self):
+        """
+        L{process.Process} uses posix_spawn() unless C{usePosixSpawn} is
+        false, the user or group changes, or the child is set up
+        differently.
+        """
+        class SetupProcess(process.Process):
+            def _setupChild(self, fdmap):
+                pass
+        class ExecProcess(process.Process):
+            def _execChild(self, *args):
+                pass
+        proc = process.Process.__new__(process.Process)
+        self.assertTrue(proc._canSpawn(None, None))
+        self.assertFalse(proc._canSpawn(0, None))
+        self.assertFalse(proc._canSpawn(None, 0))
+        proc.usePosixSpawn = False
+        self.assertFalse(proc._canSpawn(None, None))
+        for cls in SetupProcess, ExecProcess:
+            self.assertFalse(cls.__new__(cls)._canSpawn(None, None))
+
+
+    def test_findExecutable(self):
+        """
+        L{process._posixspawn.findExecutable} searches the I{PATH} of the
+        environment given, like C{os.execvpe}, unless the executable is a
+        path.
+        """
+        findExecutable = process._posixspawn.findExecutable
+        directory = os.path.dirname(sys.executable)
+        name = os.path.basename(sys.executable)
+        self.assertEqual(
+            findExecutable(name, {'PATH': '/nonexistent:' + directory}),
+            os.path.join(directory, name))
+        self.assertEqual(findExecutable('./' + name, {}), './' + name)
+        self.assertRaises(OSError, findExecutable, name,
+                          {'PATH': '/nonexistent'})
+
+
+
 skipMessage = "wrong platform or reactor doesn't support IReactorProcess"
 if (runtime.platform.getType() != 'posix') or (not interfaces.IReactorProcess(reactor, None)):
     PosixProcessTestCase.skip = skipMessage
@@ -2477,5 +2597,6 @@ if (runtime.platform.getType() != 'win32') or (not interfaces.IReactorProcess(re
 
 if not interfaces.IReactorProcess(reactor, None):
     ProcessTestCase.skip = skipMessage
+    PosixSpawnTests.skip = skipMessage
     ClosingPipes.skip = skipMessage
 
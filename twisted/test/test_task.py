@@ -681,6 +681,144 @@ class ReactorLoopTestCase(unittest.TestCase):
 
 
 
+class PeriodicSchedulerTests(unittest.TestCase):
+    """
+    Tests for L{task.PeriodicScheduler} and L{task.PeriodicTask}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.monotonic = [0.0]
+        self.scheduler = task.PeriodicScheduler(
+            self.clock, lambda: self.monotonic[0])
+        self.calls = []
+
+
+    def advance(self, amount):
+        """
+        Advance both the reactor's clock and the monotonic clock.
+        """
+        self.monotonic[0] += amount
+        self.clock.advance(amount)
+
+
+    def test_sharedCall(self):
+        """
+        The tasks with the same interval are called by the same delayed
+        call.
+        """
+        for name in 'ab':
+            self.scheduler.add(1.0, self.calls.append, name)
+        self.scheduler.add(1.5, self.calls.append, 'c')
+        self.assertEqual(len(self.clock.getDelayedCalls()), 2)
+        self.advance(1.0)
+        self.assertEqual(self.calls, ['a', 'b'])
+        self.advance(0.5)
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+        self.assertEqual(len(self.clock.getDelayedCalls()), 2)
+        self.scheduler.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_lateAndSkipped(self):
+        """
+        A late call is made once, the iterations missed are counted as
+        skipped and the next call is made at the next multiple of the
+        interval.
+        """
+        t = self.scheduler.add(1.0, self.calls.append, None)
+        self.advance(3.25)
+        self.assertEqual((t.calls, t.skipped, t.late), (1, 2, 0.25))
+        self.advance(0.75)
+        self.assertEqual((t.calls, t.skipped, t.late), (2, 2, 0.0))
+        t.stop()
+
+
+    def test_monotonicClock(self):
+        """
+        Calls are due on the monotonic clock: if the reactor's clock moves
+        ahead, no call is made before its time.
+        """
+        t = self.scheduler.add(1.0, self.calls.append, None)
+        self.clock.advance(100)
+        self.assertEqual(self.calls, [])
+        self.advance(1.0)
+        self.assertEqual((t.calls, t.skipped), (1, 0))
+        t.stop()
+
+
+    def test_deferred(self):
+        """
+        A task whose previous call returned a L{defer.Deferred} which has not
+        fired is skipped.
+        """
+        d = defer.Deferred()
+        results = [d]
+        t = self.scheduler.add(1.0, lambda: results.pop(0))
+        self.advance(1.0)
+        self.advance(1.0)
+        self.assertEqual((t.calls, t.skipped), (1, 1))
+        d.callback(None)
+        results.append(None)
+        self.advance(1.0)
+        self.assertEqual((t.calls, t.skipped), (2, 1))
+        t.stop()
+
+
+    def test_failure(self):
+        """
+        A task whose function raises an exception stops, and its
+        C{deferred} fails with it.
+        """
+        def fail():
+            raise TestException()
+        t = self.scheduler.add(1.0, fail)
+        d = self.assertFailure(t.deferred, TestException)
+        self.advance(1.0)
+        self.assertFalse(t.running)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        return d
+
+
+    def test_stop(self):
+        """
+        Stopping a task fires its C{deferred} with it and cancels the delayed
+        call of its interval once no other task uses it.
+        """
+        first = self.scheduler.add(1.0, self.calls.append, 'first')
+        second = self.scheduler.add(1.0, self.calls.append, 'second')
+        first.stop()
+        self.advance(1.0)
+        self.assertEqual(self.calls, ['second'])
+        d = second.deferred
+        second.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertFalse(second.running)
+        return d.addCallback(self.assertIdentical, second)
+
+
+    def test_jitter(self):
+        """
+        The calls of new tasks are delayed by a random part of C{jitter}
+        times their interval, rounded to C{resolution}.
+        """
+        self.scheduler.jitter = 0.5
+        self.scheduler.resolution = 0.1
+        randoms = [0.0, 0.5, 0.52, 1.0]
+        self.scheduler._random = lambda: randoms.pop(0)
+        for name in 'abcd':
+            self.scheduler.add(1.0, self.calls.append, name)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 3)
+        self.advance(1.0)
+        self.assertEqual(self.calls, ['a'])
+        self.advance(0.3)
+        self.assertEqual(sorted(self.calls), ['a', 'b', 'c'])
+        self.advance(0.2)
+        self.assertEqual(sorted(self.calls), ['a', 'b', 'c', 'd'])
+        self.scheduler.stop()
+
+
+
 class DeferLaterTests(unittest.TestCase):
     """
     Tests for L{task.deferLater}.
@@ -0,0 +1,211 @@
+# -*- test-case-name: twisted.web.test.test_accesslog -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Access logs for L{twisted.web.http.HTTPFactory} and L{twisted.web.server.Site}
+written from a thread of their own.
+
+An L{AccessLogger} copies what it needs of each finished request into an
+L{AccessRecord} and leaves formatting and writing to its writer thread, so
+that neither slows down or stalls serving::
+
+    from twisted.python import logfile
+    from twisted.web import server, accesslog
+
+    site = server.Site(root)
+    site.accessLogger = accesslog.AccessLogger(
+        logfile.LogFile.fromFullPath('/var/log/web/access.log'),
+        format=accesslog.jsonFormat)
+"""
+
+import time
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+from twisted.python import log
+from twisted.web import http
+
+
+class AccessRecord(object):
+    """
+    What an access log needs to know about a finished request.
+
+    @ivar clientIP: The address of the client, or C{None}.
+    @ivar finishedAt: The time the request finished.
+    @ivar method: The method of the request.
+    @ivar uri: The URI requested.
+    @ivar clientproto: The version of HTTP of the request.
+    @ivar code: The status code of the response.
+    @ivar sentLength: The length of the body of the response.
+    @ivar referer: The I{Referer} header of the request, or C{None}.
+    @ivar userAgent: The I{User-Agent} header of the request, or C{None}.
+    @ivar timeToFirstByte: The number of seconds between the start of the
+        request and the start of the response, or C{None}.
+    @ivar duration: The number of seconds between the start and the end of
+        the request, or C{None}.
+    """
+    __slots__ = ('clientIP', 'finishedAt', 'method', 'uri', 'clientproto',
+                 'code', 'sentLength', 'referer', 'userAgent',
+                 'timeToFirstByte', 'duration')
+
+    def __init__(self, clientIP, finishedAt, method, uri, clientproto, code,
+                 sentLength, referer=None, userAgent=None,
+                 timeToFirstByte=None, duration=None):
+        self.clientIP = clientIP
+        self.finishedAt = finishedAt
+        self.method = method
+        self.uri = uri
+        self.clientproto = clientproto
+        self.code = code
+        self.sentLength = sentLength
+        self.referer = referer
+        self.userAgent = userAgent
+        self.timeToFirstByte = timeToFirstByte
+        self.duration = duration
+
+
+    def fromRequest(cls, request, now=None):
+        """
+        Make a record of a finished L{http.Request}.
+        """
+        if now is None:
+            now = time.time()
+        startedAt = getattr(request, '_startedAt', None)
+        firstByteAt = getattr(request, '_firstByteAt', None)
+        timeToFirstByte = duration = None
+        if startedAt is not None:
+            duration = now - startedAt
+            if firstByteAt is not None:
+                timeToFirstByte = firstByteAt - startedAt
+        return cls(request.getClientIP(), now, request.method, request.uri,
+                   request.clientproto, request.code, request.sentLength,
+                   request.getHeader('referer'),
+                   request.getHeader('user-agent'),
+                   timeToFirstByte, duration)
+    fromRequest = classmethod(fromRequest)
+
+
+
+_lastLogDateTime = (None, None)
+
+def _logDateTime(when):
+    """
+    Return L{http.datetimeToLogString} of C{when}, once per second.
+    """
+    global _lastLogDateTime
+    second = int(when)
+    lastSecond, dateTime = _lastLogDateTime
+    if second != lastSecond:
+        dateTime = http.datetimeToLogString(second)
+        _lastLogDateTime = (second, dateTime)
+    return dateTime
+
+
+
+def combinedFormat(record):
+    """
+    Format a record in the combined log format, as
+    L{http.HTTPFactory.log} does.
+    """
+    return '%s - - %s "%s %s %s" %d %s "%s" "%s"\n' % (
+        record.clientIP,
+        _logDateTime(record.finishedAt),
+        http._escape(record.method),
+        http._escape(record.uri),
+        http._escape(record.clientproto),
+        record.code,
+        record.sentLength or "-",
+        http._escape(record.referer or "-"),
+        http._escape(record.userAgent or "-"))
+
+
+
+def _milliseconds(seconds):
+    if seconds is None:
+        return "-"
+    return "%d" % (seconds * 1000,)
+
+
+
+def timedCombinedFormat(record):
+    """
+    Format a record in the combined log format followed by the time to the
+    first byte and the duration of the request, in milliseconds.
+    """
+    return '%s %s %s\n' % (combinedFormat(record)[:-1],
+                           _milliseconds(record.timeToFirstByte),
+                           _milliseconds(record.duration))
+
+
+
+def jsonFormat(record):
+    """
+    Format a record as a JSON object on a line, with times in seconds.
+    """
+    fields = {}
+    for name in AccessRecord.__slots__:
+        value = getattr(record, name)
+        if isinstance(value, str):
+            value = value.decode('utf-8', 'replace')
+        fields[name] = value
+    return json.dumps(fields, separators=(',', ':'), sort_keys=True) + '\n'
+
+
+
+class AccessLogger(log.BufferedLogObserver):
+    """
+    Write an access log from a thread of its own.
+
+    Records are queued in a ring buffer of C{bufferSize} records; the
+    writer thread formats all the queued records and writes them at once,
+    then flushes the file.  When the buffer is full, records are dropped and
+    counted in C{dropped} or, if C{block} is true, serving waits for room.
+
+    Pass a L{logfile.LogFile<twisted.python.logfile.LogFile>} to rotate the
+    log; rotation then happens in the writer thread too.
+
+    @ivar format: A callable returning the line, ending with a newline, to
+        log for an L{AccessRecord}: L{combinedFormat}, L{timedCombinedFormat},
+        L{jsonFormat} or another one.
+    """
+
+    def __init__(self, f, format=combinedFormat, bufferSize=10000,
+                 block=False, reactor=None):
+        if format is jsonFormat and json is None:
+            raise ImportError("jsonFormat requires json or simplejson")
+        log.BufferedLogObserver.__init__(
+            self, f, bufferSize=bufferSize, block=block, reactor=reactor)
+        self.format = format
+
+
+    def log(self, request):
+        """
+        Queue a record of a finished request.
+        """
+        self.emit(AccessRecord.fromRequest(request))
+
+
+    def _formatEvent(self, record):
+        return self.format(record)
+
+
+    def start(self):
+        """
+        Start writing queued records from a new thread.
+        """
+        self._startWriting()
+
+
+    def stop(self):
+        """
+        Wait for the records already queued to be written and stop the
+        writer thread.
+        """
+        self._stopWriting()
@@ -0,0 +1,234 @@
+# -*- test-case-name: twisted.web.test.test_admission -*-
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Request admission control for L{twisted.web.server.Site}.
+
+An L{AdmissionController} decides, before a request is dispatched to a
+resource, whether it may be served now, must wait for a free slot, or is
+refused with a I{503 Service Unavailable} response.  Request rates are
+metered with the token buckets of L{twisted.protocols.htb}, where each
+admitted request adds one token to its buckets::
+
+    from twisted.web import server, admission
+
+    class PerClient(admission.RequestBucket):
+        rate = 5
+        maxburst = 20
+
+    class Clients(admission.FilterByClientIP):
+        bucketFactory = PerClient
+
+    site = server.Site(root)
+    site.admissionController = admission.AdmissionController(
+        maxConcurrent=100, maxQueued=500, queueTimeout=5,
+        filters=[Clients()])
+"""
+
+from collections import deque
+
+from twisted.protocols import htb
+from twisted.web import http, resource
+
+
+class RequestBucket(htb.Bucket):
+    """
+    A bucket which meters requests rather than bytes.
+
+    @cvar maxburst: The number of requests which may be admitted in a burst.
+    @cvar rate: The sustained number of requests admitted per second.
+    """
+    maxburst = 20
+    rate = 10
+
+
+
+class FilterByClientIP(htb.HierarchicalBucketFilter):
+    """
+    A bucket filter with a bucket for each client IP address.
+
+    Requests which did not arrive over IPv4 share the bucket for C{None}.
+    """
+    bucketFactory = RequestBucket
+    sweepInterval = 60
+
+    def getBucketKey(self, request):
+        return request.getClientIP()
+
+
+
+class FilterByRoute(htb.HierarchicalBucketFilter):
+    """
+    A bucket filter with a bucket for each configured path prefix.
+
+    A request is metered by the bucket of the longest prefix of its path
+    which has a route.  Requests matching no route share an unlimited
+    L{htb.Bucket}.
+
+    @ivar routes: A C{dict} mapping path prefixes (for example C{"/api/"}) to
+        the bucket class used for requests below that prefix.
+    """
+    sweepInterval = None
+
+    def __init__(self, routes, parentFilter=None):
+        htb.HierarchicalBucketFilter.__init__(self, parentFilter)
+        self.routes = routes
+        self._prefixes = sorted(routes, key=len, reverse=True)
+
+
+    def getBucketKey(self, request):
+        for prefix in self._prefixes:
+            if request.path.startswith(prefix):
+                return prefix
+        return None
+
+
+    def makeBucket(self, key, parentBucket):
+        return self.routes.get(key, htb.Bucket)(parentBucket)
+
+
+
+def _hasRoom(bucket):
+    """
+    Return whether a token can be added to C{bucket} and each of its parents.
+    """
+    bucket.drip()
+    while bucket is not None:
+        if bucket.maxburst is not None and bucket.content >= bucket.maxburst:
+            return False
+        bucket = bucket.parentBucket
+    return True
+
+
+
+class AdmissionController(object):
+    """
+    I admit requests to a L{Site<twisted.web.server.Site>}.
+
+    A request is first checked against each of my bucket filters and refused
+    if any of its buckets is full.  It is then started if fewer than
+    C{maxConcurrent} requests are in progress, queued if fewer than
+    C{maxQueued} requests are waiting, and refused otherwise.  A queued
+    request which does not start within C{queueTimeout} seconds is refused
+    too.
+
+    @ivar maxConcurrent: The number of requests which may be in progress at
+        once, or C{None} for no limit.
+    @ivar maxQueued: The number of requests which may wait for a free slot.
+    @ivar queueTimeout: The number of seconds a request may wait for a free
+        slot, or C{None} to wait indefinitely.
+    @ivar filters: A C{list} of L{htb.IBucketFilter} providers whose
+        C{getBucketFor} accepts a request.
+    @ivar retryAfter: The value of the I{Retry-After} header sent with
+        refusals.
+    @ivar active: The number of requests in progress.
+    @ivar waiting: A L{deque} of C{[request, process, timeoutCall]} lists for
+        the requests waiting for a slot, oldest first.
+    @ivar rejected: The number of requests refused so far.
+    @ivar _reactor: An L{IReactorTime} provider used to time out queued
+        requests.
+    @ivar _draining: Whether waiting requests are being started, so that
+        requests which finish while they are started do not start more.
+    """
+    retryAfter = 1
+
+    def __init__(self, maxConcurrent=None, maxQueued=0, queueTimeout=None,
+                 filters=(), reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.maxConcurrent = maxConcurrent
+        self.maxQueued = maxQueued
+        self.queueTimeout = queueTimeout
+        self.filters = list(filters)
+        self.active = 0
+        self.waiting = deque()
+        self.rejected = 0
+        self._draining = False
+
+
+    def submit(self, request, process):
+        """
+        Decide what to do with a new request.
+
+        @param request: The L{Request<twisted.web.server.Request>} to admit.
+        @param process: A no-argument callable which serves C{request}.  It is
+            called now, later, or never, depending on the request's fate.
+        """
+        buckets = [bucketFilter.getBucketFor(request)
+                   for bucketFilter in self.filters]
+        # Check every bucket before filling any, so that a request refused
+        # by one filter is not charged to the others.
+        for bucket in buckets:
+            if not _hasRoom(bucket):
+                self.reject(request)
+                return
+        for bucket in buckets:
+            bucket.add(1)
+
+        if self.maxConcurrent is None or self.active < self.maxConcurrent:
+            self._start(request, process)
+        elif len(self.waiting) < self.maxQueued:
+            entry = [request, process, None]
+            if self.queueTimeout is not None:
+                entry[2] = self._reactor.callLater(
+                    self.queueTimeout, self._timedOut, entry)
+            self.waiting.append(entry)
+            request.notifyFinish().addErrback(self._abandoned, entry)
+        else:
+            self.reject(request)
+
+
+    def reject(self, request):
+        """
+        Refuse a request with a I{503 Service Unavailable} response.
+        """
+        self.rejected += 1
+        request.setHeader('retry-after', str(self.retryAfter))
+        request.render(resource.ErrorPage(
+                http.SERVICE_UNAVAILABLE, "Service Unavailable",
+                "The server is too busy to handle this request."))
+
+
+    def _start(self, request, process):
+        self.active += 1
+        request.notifyFinish().addBoth(self._finished)
+        process()
+
+
+    def _finished(self, ignored):
+        """
+        A request in progress has been finished or its connection was lost;
+        start as many waiting requests as there are free slots.
+        """
+        self.active -= 1
+        if self._draining:
+            # A request started by the loop below finished synchronously;
+            # the loop will fill its slot without growing the stack.
+            return
+        self._draining = True
+        try:
+            while self.waiting and (self.maxConcurrent is None or
+                                    self.active < self.maxConcurrent):
+                request, process, timeoutCall = self.waiting.popleft()
+                if timeoutCall is not None:
+                    timeoutCall.cancel()
+                self._start(request, process)
+        finally:
+            self._draining = False
+
+
+    def _timedOut(self, entry):
+        self.waiting.remove(entry)
+        self.reject(entry[0])
+
+
+    def _abandoned(self, reason, entry):
+        """
+        The client of a waiting request went away; forget about it.
+        """
+        if entry in self.waiting:
+            self.waiting.remove(entry)
+            if entry[2] is not None:
+                entry[2].cancel()
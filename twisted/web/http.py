@@ -232,6 +232,16 @@ def datetimeToLogString(msSinceEpoch=None):
         hh, mm, ss)
     return s
 
+def _escape(s):
+    """
+    Return a string like python repr, but always escaped as if surrounding
+    quotes were "", for log files.
+    """
+    r = repr(s)
+    if r[0] == "'":
+        return r[1:-1].replace('"', '\\"').replace("\\'", "'")
+    return r[1:-1]
+
 def timegm(year, month, day, hour, minute, second):
     """
     Convert time tuple in GMT to seconds since epoch, GMT
@@ -548,6 +558,10 @@ class Request:
         which this request was received is closed and which is C{True} after
         that.
     @type _disconnected: C{bool}
+
+    @ivar _startedAt: The time this request started to be received.
+    @ivar _firstByteAt: The time the response started to be written, or
+        C{None}.
     """
     implements(interfaces.IConsumer)
 
@@ -568,6 +582,7 @@ class Request:
     content = None
     _forceSSL = 0
     _disconnected = False
+    _firstByteAt = None
 
     def __init__(self, channel, queued):
         """
@@ -575,6 +590,7 @@ class Request:
         @param queued: are we in the request queue, or can we start writing to
             the transport?
         """
+        self._startedAt = time.time()
         self.notifications = []
         self.channel = channel
         self.queued = queued
@@ -899,6 +915,7 @@ class Request:
                                'Request.finish was called.')
         if not self.startedWriting:
             self.startedWriting = 1
+            self._firstByteAt = time.time()
             version = self.clientproto
             l = []
             l.append('%s %s %s\r\n' % (version, self.code,
@@ -1719,11 +1736,17 @@ class HTTPFactory(protocol.ServerFactory):
     @ivar _logDateTimeCall: A delayed call for the next update to the cached log
         datetime string.
     @type _logDateTimeCall: L{IDelayedCall} provided
+
+    @ivar accessLogger: An
+        L{AccessLogger<twisted.web.accesslog.AccessLogger>} which logs
+        finished requests, from a thread of its own, in place of C{logPath},
+        or C{None}.  It is started and stopped with the factory.
     """
 
     protocol = HTTPChannel
 
     logPath = None
+    accessLogger = None
 
     timeOut = 60 * 60 * 12
 
@@ -1761,13 +1784,18 @@ class HTTPFactory(protocol.ServerFactory):
         if self._logDateTimeCall is None:
             self._updateLogDateTime()
 
-        if self.logPath:
+        if self.accessLogger is not None:
+            self.accessLogger.start()
+        elif self.logPath:
             self.logFile = self._openLogFile(self.logPath)
         else:
             self.logFile = log.logfile
 
 
     def stopFactory(self):
+        if self.accessLogger is not None:
+            self.accessLogger.stop()
+
         if hasattr(self, "logFile"):
             if self.logFile != log.logfile:
                 self.logFile.close()
@@ -1786,18 +1814,15 @@ class HTTPFactory(protocol.ServerFactory):
         return f
 
     def _escape(self, s):
-        # pain in the ass. Return a string like python repr, but always
-        # escaped as if surrounding quotes were "".
-        r = repr(s)
-        if r[0] == "'":
-            return r[1:-1].replace('"', '\\"').replace("\\'", "'")
-        return r[1:-1]
+        return _escape(s)
 
     def log(self, request):
         """
         Log a request's result to the logfile, by default in combined log format.
         """
-        if hasattr(self, "logFile"):
+        if self.accessLogger is not None:
+            self.accessLogger.log(request)
+        elif hasattr(self, "logFile"):
             line = '%s - - %s "%s" %d %s "%s" "%s"\n' % (
                 request.getClientIP(),
                 # request.getUser() or "-", # the remote user is almost never important
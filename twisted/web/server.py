@@ -127,6 +127,18 @@ class Request(pb.Copyable, http.Request, components.Componentized):
         # Resource Identification
         self.prepath = []
         self.postpath = map(unquote, string.split(self.path[1:], '/'))
+
+        controller = self.site.admissionController
+        if controller is None:
+            self._renderResource()
+        else:
+            controller.submit(self, self._renderResource)
+
+
+    def _renderResource(self):
+        """
+        Look up the resource for this request and render it.
+        """
         try:
             resrc = self.site.getResourceFor(self)
             self.render(resrc)
@@ -473,12 +485,17 @@ class Site(http.HTTPFactory):
         rendered pages. Default to C{True}.
     @ivar sessionFactory: factory for sessions objects. Default to L{Session}.
     @ivar sessionCheckTime: Deprecated.  See L{Session.sessionTimeout} instead.
+    @ivar admissionController: An
+        L{AdmissionController<twisted.web.admission.AdmissionController>}
+        deciding whether each request is served, delayed or refused, or
+        C{None} to serve every request immediately.  Default to C{None}.
     """
     counter = 0
     requestFactory = Request
     displayTracebacks = True
     sessionFactory = Session
     sessionCheckTime = 1800
+    admissionController = None
 
     def __init__(self, resource, logPath=None, timeout=60*60*12):
         """
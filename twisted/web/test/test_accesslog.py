@@ -0,0 +1,146 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Tests for L{twisted.web.accesslog}.
+"""
+
+from cStringIO import StringIO
+
+from twisted.trial import unittest
+from twisted.web import http, server, resource, accesslog
+from twisted.web.test.test_web import DummyChannel
+from twisted.test.test_log import FakeTriggerReactor
+
+
+class AccessLogTests(unittest.TestCase):
+    """
+    Tests for L{accesslog.AccessRecord}, the formats and
+    L{accesslog.AccessLogger}.
+    """
+    when = 1000000000.0
+
+    def request(self, factory=None, path='/foo?bar=baz'):
+        """
+        Make a L{http.Request} for C{path} with a referer and a user agent,
+        received by C{factory}.
+        """
+        channel = DummyChannel()
+        if factory is not None:
+            channel.factory = factory
+        request = http.Request(channel, False)
+        request.requestHeaders.setRawHeaders('referer', ['http://example/'])
+        request.requestHeaders.setRawHeaders('user-agent', ['Agent "007"'])
+        request.gotLength(0)
+        request.method, request.uri, request.clientproto = (
+            'GET', path, 'HTTP/1.0')
+        request.client = channel.transport.getPeer()
+        return request
+
+
+    def record(self, **kw):
+        fields = dict(clientIP='10.0.0.1', finishedAt=self.when,
+                      method='GET', uri='/', clientproto='HTTP/1.1',
+                      code=200, sentLength=512, referer=None,
+                      userAgent='agent', timeToFirstByte=0.0125,
+                      duration=0.25)
+        fields.update(kw)
+        return accesslog.AccessRecord(**fields)
+
+
+    def test_combinedLikeFactory(self):
+        """
+        L{accesslog.combinedFormat} formats a record of a request as
+        L{http.HTTPFactory.log} logs the request.
+        """
+        factory = http.HTTPFactory()
+        factory.logFile = StringIO()
+        factory._logDateTime = http.datetimeToLogString(self.when)
+        request = self.request()
+        request.setResponseCode(404)
+        request.write('not found')
+        factory.log(request)
+        record = accesslog.AccessRecord.fromRequest(request, self.when)
+        self.assertEqual(accesslog.combinedFormat(record),
+                         factory.logFile.getvalue())
+
+
+    def test_timing(self):
+        """
+        A record has the time from the start of its request to the start of
+        the response and to the end of the request.
+        """
+        request = self.request()
+        self.assertIdentical(request._firstByteAt, None)
+        record = accesslog.AccessRecord.fromRequest(
+            request, request._startedAt + 2)
+        self.assertIdentical(record.timeToFirstByte, None)
+        self.assertEqual(record.duration, 2)
+        request.write('data')
+        self.assertTrue(request._firstByteAt >= request._startedAt)
+        request._startedAt, request._firstByteAt = 100.0, 100.5
+        record = accesslog.AccessRecord.fromRequest(request, 102.0)
+        self.assertEqual(record.timeToFirstByte, 0.5)
+        self.assertEqual(record.duration, 2.0)
+        self.assertEqual(record.sentLength, 4)
+
+
+    def test_timedCombinedFormat(self):
+        """
+        L{accesslog.timedCombinedFormat} adds the time to the first byte and
+        the duration, in milliseconds, to the combined log format.
+        """
+        record = self.record()
+        self.assertEqual(
+            accesslog.timedCombinedFormat(record),
+            accesslog.combinedFormat(record)[:-1] + ' 12 250\n')
+        record = self.record(timeToFirstByte=None, duration=None)
+        self.assertTrue(
+            accesslog.timedCombinedFormat(record).endswith(' - -\n'))
+
+
+    def test_jsonFormat(self):
+        """
+        L{accesslog.jsonFormat} formats every field of a record as a JSON
+        object on a line.
+        """
+        if accesslog.json is None:
+            raise unittest.SkipTest("json and simplejson are not available")
+        line = accesslog.jsonFormat(self.record(uri='/caf\xc3\xa9'))
+        self.assertTrue(line.endswith('}\n'))
+        self.assertEqual(
+            accesslog.json.loads(line),
+            {'clientIP': '10.0.0.1', 'finishedAt': self.when,
+             'method': 'GET', 'uri': u'/caf\xe9', 'clientproto': 'HTTP/1.1',
+             'code': 200, 'sentLength': 512, 'referer': None,
+             'userAgent': 'agent', 'timeToFirstByte': 0.0125,
+             'duration': 0.25})
+
+
+    def test_site(self):
+        """
+        A L{server.Site} with an C{accessLogger} starts it when started,
+        logs finished requests through it and stops it, once every record
+        is written, when stopped.
+        """
+        out = StringIO()
+        reactor = FakeTriggerReactor()
+        site = server.Site(resource.Resource())
+        site.accessLogger = accesslog.AccessLogger(
+            out, format=accesslog.timedCombinedFormat, reactor=reactor)
+        site.startFactory()
+        self.addCleanup(site.stopFactory)
+        self.assertFalse(hasattr(site, 'logFile'))
+        self.assertEqual(len(reactor.triggers), 1)
+        for i in range(3):
+            request = self.request(site, '/%d' % (i,))
+            request.write('hello')
+            request.finish()
+        site.stopFactory()
+        site.startFactory()
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        for i, line in enumerate(lines):
+            self.assertTrue(line.startswith('192.168.1.1 - - ['), line)
+            self.assertIn(' "GET /%d HTTP/1.0" 200 5 "http://example/" '
+                          '"Agent \\"007\\"" ' % (i,), line)
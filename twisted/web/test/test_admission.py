@@ -0,0 +1,244 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Tests for L{twisted.web.admission}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet.address import IPv4Address
+from twisted.internet.error import ConnectionLost
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.protocols import htb
+from twisted.web import server, resource, admission
+from twisted.web.test.test_web import DummyChannel
+
+
+class HeldResource(resource.Resource):
+    """
+    A resource which leaves every request unfinished, remembering it.
+    """
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.held = []
+
+
+    def render(self, request):
+        self.held.append(request)
+        return server.NOT_DONE_YET
+
+
+
+class SlowClientBucket(admission.RequestBucket):
+    maxburst = 2
+    rate = 1
+
+
+
+class SlowClients(admission.FilterByClientIP):
+    bucketFactory = SlowClientBucket
+
+
+
+class AdmissionControllerTests(unittest.TestCase):
+    """
+    Tests for L{admission.AdmissionController} serving a L{server.Site}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.patch(htb, 'time', self.clock.seconds)
+        self.root = HeldResource()
+        self.site = server.Site(self.root)
+
+
+    def control(self, **kw):
+        controller = admission.AdmissionController(reactor=self.clock, **kw)
+        self.site.admissionController = controller
+        return controller
+
+
+    def request(self, path='/', client='192.168.1.1'):
+        """
+        Deliver a I{GET} request for C{path} from C{client} to the site and
+        return its channel.
+        """
+        channel = DummyChannel()
+        channel.site = self.site
+        channel.transport.getPeer = lambda: IPv4Address('TCP', client, 12344)
+        request = server.Request(channel, False)
+        request.gotLength(0)
+        request.requestReceived('GET', path, 'HTTP/1.0')
+        return channel
+
+
+    def assertRefused(self, channel):
+        written = channel.transport.written.getvalue()
+        self.assertTrue(written.startswith('HTTP/1.0 503 '), written)
+        self.assertIn('\r\nRetry-After: 1\r\n', written)
+
+
+    def test_noController(self):
+        """
+        A L{server.Site} has no admission controller by default and serves
+        every request immediately.
+        """
+        self.assertIdentical(self.site.admissionController, None)
+        for i in range(10):
+            self.request()
+        self.assertEqual(len(self.root.held), 10)
+
+
+    def test_concurrencyLimit(self):
+        """
+        Requests beyond C{maxConcurrent} and C{maxQueued} are refused with a
+        I{503} response.
+        """
+        controller = self.control(maxConcurrent=2)
+        self.request()
+        self.request()
+        channel = self.request()
+        self.assertEqual(len(self.root.held), 2)
+        self.assertEqual(controller.active, 2)
+        self.assertEqual(controller.rejected, 1)
+        self.assertRefused(channel)
+
+
+    def test_queuedUntilFinished(self):
+        """
+        A request which is queued starts when a request in progress finishes.
+        """
+        controller = self.control(maxConcurrent=1, maxQueued=1)
+        self.request()
+        self.request()
+        self.assertEqual(len(self.root.held), 1)
+        self.assertEqual(len(controller.waiting), 1)
+        self.root.held[0].finish()
+        self.assertEqual(len(self.root.held), 2)
+        self.assertEqual(len(controller.waiting), 0)
+        self.assertEqual(controller.active, 1)
+
+
+    def test_queueTimeout(self):
+        """
+        A request which waits longer than C{queueTimeout} is refused.
+        """
+        controller = self.control(
+            maxConcurrent=1, maxQueued=1, queueTimeout=3)
+        self.request()
+        channel = self.request()
+        self.clock.advance(3)
+        self.assertRefused(channel)
+        self.assertEqual(len(controller.waiting), 0)
+        self.root.held[0].finish()
+        self.assertEqual(len(self.root.held), 1)
+        self.assertEqual(controller.active, 0)
+
+
+    def test_abandonedWhileQueued(self):
+        """
+        A queued request whose connection is lost is forgotten and its
+        timeout cancelled.
+        """
+        controller = self.control(
+            maxConcurrent=1, maxQueued=1, queueTimeout=3)
+        self.request()
+        self.request()
+        request = controller.waiting[0][0]
+        request.connectionLost(Failure(ConnectionLost()))
+        self.assertEqual(len(controller.waiting), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_connectionLostFreesSlot(self):
+        """
+        A request in progress whose connection is lost frees its slot.
+        """
+        controller = self.control(maxConcurrent=1)
+        self.request()
+        self.root.held[0].connectionLost(Failure(ConnectionLost()))
+        self.assertEqual(controller.active, 0)
+
+
+    def test_manyQueuedFinishSynchronously(self):
+        """
+        Queued requests which finish as soon as they are started are all
+        served, one after the other, when the request ahead of them finishes.
+        """
+        class HoldFirst(HeldResource):
+            def render(self, request):
+                if not self.held:
+                    return HeldResource.render(self, request)
+                self.held.append(request)
+                return 'done'
+        self.site.resource = self.root = HoldFirst()
+        controller = self.control(maxConcurrent=1, maxQueued=1500)
+        self.request()
+        channels = [self.request() for i in range(1500)]
+        self.root.held[0].finish()
+        self.assertEqual(len(self.root.held), 1501)
+        self.assertEqual(controller.active, 0)
+        self.assertEqual(len(controller.waiting), 0)
+        for channel in channels:
+            self.assertTrue(
+                channel.transport.written.getvalue().endswith('done'))
+
+
+    def test_refusalNotCharged(self):
+        """
+        A request refused because one of its buckets is full adds nothing to
+        the buckets of the other filters.
+        """
+        class OneAtATime(admission.RequestBucket):
+            maxburst = 1
+            rate = 1
+        routes = admission.FilterByRoute({'/slow': OneAtATime})
+        clients = SlowClients()
+        self.control(filters=[clients, routes])
+        self.request('/slow')
+        self.assertRefused(self.request('/slow'))
+        self.assertEqual(clients.getBucketFor(self.root.held[0]).content, 1)
+        self.request('/fast')
+        self.assertEqual(len(self.root.held), 2)
+
+
+    def test_perClientRate(self):
+        """
+        Each client may burst up to its bucket size and is then limited to the
+        bucket's rate, independently of other clients.
+        """
+        self.control(filters=[SlowClients()])
+        self.request()
+        self.request()
+        self.assertRefused(self.request())
+        self.request(client='192.168.1.2')
+        self.assertEqual(len(self.root.held), 3)
+        self.clock.advance(1)
+        self.request()
+        self.assertEqual(len(self.root.held), 4)
+
+
+    def test_perRoute(self):
+        """
+        L{admission.FilterByRoute} meters requests by the bucket of their
+        longest matching path prefix and leaves other paths unlimited.
+        """
+        class OnePerSecond(admission.RequestBucket):
+            maxburst = 1
+            rate = 1
+        class Three(admission.RequestBucket):
+            maxburst = 3
+            rate = 1
+        routes = admission.FilterByRoute(
+            {'/api/': Three, '/api/slow': OnePerSecond})
+        self.control(filters=[routes])
+        self.request('/api/slow')
+        self.assertRefused(self.request('/api/slow'))
+        for i in range(3):
+            self.request('/api/fast')
+        self.assertRefused(self.request('/api/fast'))
+        for i in range(5):
+            self.request('/static')
+        self.assertEqual(len(self.root.held), 9)